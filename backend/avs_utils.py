@@ -11,12 +11,33 @@ Based on: AVS Real Time Host to Host User Manual - 2023
 import os
 import uuid
 import socket
+import asyncio
+import hashlib
 from datetime import datetime
 from typing import Dict, List, Optional
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
 
+# Request fields AVS matches on; a cached result is only valid for the same values
+VERIFICATION_KEY_FIELDS = (
+    "bank_identifier", "account_number", "account_type", "sort_code",
+    "identity_number", "identity_type", "initials", "last_name",
+    "email_id", "cell_number", "tax_reference",
+)
+
+
+def verification_cache_key(verification: Dict) -> str:
+    """Hash of every request field the verification result depends on"""
+    parts = []
+    for field in VERIFICATION_KEY_FIELDS:
+        value = str(verification.get(field) or "").strip().upper()
+        if field == "account_number":
+            value = value.lstrip("0")
+        parts.append(value)
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
 class AVSService:
     """
     Nedbank Account Verification Service (AVS) integration
@@ -61,7 +82,10 @@ class AVSService:
         "00": "Unknown"
     }
     
-    def __init__(self, config: Dict):
+    # Accounts per RealTimeAcctVerificationRq
+    MAX_BATCH_SIZE = 40
+    
+    def __init__(self, config: Dict, session=None):
         """
         Initialize AVS service with configuration
         
@@ -72,13 +96,16 @@ class AVSService:
                 - profile_user_number: str (Nedbank profile user number)
                 - charge_account: str (Account to charge for verifications)
                 - use_qa: bool (True for QA environment, False for production)
+                - endpoint: str (optional override, e.g. a local mock SOAP server)
+            session: Shared aiohttp.ClientSession; a session per call when None
         """
         self.mock_mode = config.get("mock_mode", True)
         self.profile_number = config.get("profile_number", "0000000000")
         self.profile_user_number = config.get("profile_user_number", "00000")
         self.charge_account = config.get("charge_account", "0000000000")
         self.use_qa = config.get("use_qa", True)
-        self.endpoint = self.QA_ENDPOINT if self.use_qa else self.PROD_ENDPOINT
+        self.endpoint = config.get("endpoint") or (self.QA_ENDPOINT if self.use_qa else self.PROD_ENDPOINT)
+        self.session = session
     
     def build_soap_request(self, verifications: List[Dict]) -> str:
         """
@@ -298,7 +325,7 @@ class AVSService:
             elem = element.find(f'.//{tag_name}')
             if elem is None:
                 # Try with namespace
-                elem = element.find(f'.//*[local-name()="{tag_name}"]')
+                elem = element.find(f'.//{{*}}{tag_name}')
             return elem.text if elem is not None else None
         
         # Result code for this account
@@ -438,31 +465,63 @@ class AVSService:
         # Build SOAP request
         soap_request = self.build_soap_request(verifications)
         
-        # In production mode, would send HTTP request here
-        # For now, return mock data even in non-mock mode until credentials are provided
         import aiohttp
         
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": "verify"
+        }
+        timeout = aiohttp.ClientTimeout(total=50)  # 50 seconds (45s SLA + buffer)
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Content-Type": "text/xml; charset=utf-8",
-                    "SOAPAction": "verify"
-                }
-                
-                async with session.post(
-                    self.endpoint,
-                    data=soap_request,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=50)  # 50 seconds (45s SLA + buffer)
-                ) as response:
+            if self.session is not None:
+                async with self.session.post(self.endpoint, data=soap_request, headers=headers, timeout=timeout) as response:
                     response_text = await response.text()
-                    return self.parse_soap_response(response_text)
+            else:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(self.endpoint, data=soap_request, headers=headers, timeout=timeout) as response:
+                        response_text = await response.text()
+            return self.parse_soap_response(response_text)
         
         except Exception as e:
             # If connection fails, fall back to mock mode
             print(f"AVS connection failed: {str(e)}. Using mock mode.")
             return self.verify_account_mock(verifications)
     
+    async def verify_accounts(self, verifications: List[Dict], concurrency: int = 4) -> List[Optional[Dict]]:
+        """
+        Verify any number of accounts in MAX_BATCH_SIZE requests, at most
+        `concurrency` of them in flight at once
+        
+        Returns:
+            One entry per verification, in order: {"result_code", "mock_mode",
+            "verification"}, or None when the response had no item for it
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_batch(batch: List[Dict]) -> List[Optional[Dict]]:
+            async with semaphore:
+                result = await self.verify_account(batch)
+            
+            # Items carry the request SequenceNumber; fall back to response order
+            items: List[Optional[Dict]] = [None] * len(batch)
+            for position, item in enumerate(result.get("verifications", [])):
+                sequence = item.get("sequence_number")
+                idx = int(sequence) - 1 if sequence and str(sequence).isdigit() else position
+                if 0 <= idx < len(batch) and items[idx] is None:
+                    items[idx] = {
+                        "result_code": result.get("result_code", "UNKNOWN"),
+                        "mock_mode": result.get("mock_mode", False),
+                        "verification": item
+                    }
+            return items
+        
+        batches = await asyncio.gather(*(
+            run_batch(verifications[start:start + self.MAX_BATCH_SIZE])
+            for start in range(0, len(verifications), self.MAX_BATCH_SIZE)
+        ))
+        return [item for batch in batches for item in batch]
+    
     @staticmethod
     def _get_machine_ip():
         """Get machine IP address"""
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Rebuild the daily analytics rollup collections from source data"""
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+from services.rollups import RollupService
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+async def backfill_rollups():
+    # Connect to MongoDB
+    mongo_url = os.environ['MONGO_URL']
+    db_name = os.environ['DB_NAME']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    
+    print("Rebuilding daily rollups...")
+    counts = await RollupService(db).rebuild()
+    for collection, count in counts.items():
+        print(f"✓ {collection}: {count} rows")
+    
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_rollups())
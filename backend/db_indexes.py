@@ -0,0 +1,357 @@
+"""
+MongoDB Index Registry & Index Advisor
+
+Declares the indexes every hot collection needs, applies them idempotently on
+startup and reports missing / unused indexes plus collection-scan query plans.
+"""
+import logging
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+def _unique_id(field: str = "id") -> IndexModel:
+    return IndexModel([(field, ASCENDING)], name=f"{field}_unique", unique=True)
+
+
+# Collection name -> list of indexes that must exist on it.
+# Names are fixed so that re-running on startup is a no-op and the advisor can
+# match what is declared here against what the server actually has.
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "members": [
+        _unique_id(),
+        IndexModel([("norm_email", ASCENDING)], name="norm_email"),
+        IndexModel([("norm_phone", ASCENDING)], name="norm_phone"),
+        IndexModel([("norm_last_name", ASCENDING), ("norm_first_name", ASCENDING)], name="norm_name"),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("membership_status", ASCENDING), ("join_date", DESCENDING)], name="status_join_date"),
+        IndexModel([("membership_type_id", ASCENDING)], name="membership_type_id"),
+        IndexModel([("sales_consultant_id", ASCENDING), ("join_date", DESCENDING)], name="consultant_join_date"),
+        IndexModel([("membership_group_id", ASCENDING)], name="membership_group_id"),
+        IndexModel([("is_debtor", ASCENDING)], name="is_debtor"),
+        IndexModel([("join_date", DESCENDING), ("id", DESCENDING)], name="join_date_id"),
+        IndexModel([("membership_status", ASCENDING), ("geohash", ASCENDING)], name="status_geohash"),
+    ],
+    "membership_types": [_unique_id()],
+    "import_logs": [_unique_id(), IndexModel([("created_at", DESCENDING)], name="created_at")],
+    "users": [
+        _unique_id(),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("role", ASCENDING)], name="role"),
+    ],
+    "invoices": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING), ("status", ASCENDING)], name="member_status"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("status", ASCENDING), ("due_date", ASCENDING)], name="status_due_date"),
+        IndexModel([("status", ASCENDING), ("paid_date", DESCENDING)], name="status_paid_date"),
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("member_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="member_created_at_id"),
+    ],
+    "payments": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING), ("payment_date", DESCENDING)], name="member_payment_date"),
+        IndexModel([("invoice_id", ASCENDING)], name="invoice_id"),
+        IndexModel([("payment_date", DESCENDING)], name="payment_date"),
+        IndexModel([("payment_date", DESCENDING), ("id", DESCENDING)], name="payment_date_id"),
+    ],
+    "access_logs": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING), ("timestamp", DESCENDING)], name="member_timestamp"),
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING)], name="status_timestamp"),
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+        IndexModel([("timestamp", DESCENDING), ("id", DESCENDING)], name="timestamp_id"),
+    ],
+    "member_journal": [
+        IndexModel([("journal_id", ASCENDING)], name="journal_id_unique", unique=True),
+        IndexModel([("member_id", ASCENDING), ("created_at", DESCENDING)], name="member_created_at"),
+    ],
+    "member_notes": [
+        IndexModel([("member_id", ASCENDING), ("created_at", DESCENDING)], name="member_created_at"),
+    ],
+    "points_balances": [
+        IndexModel([("member_id", ASCENDING)], name="member_id_unique", unique=True),
+        IndexModel([("total_points", DESCENDING)], name="total_points"),
+    ],
+    "points_transactions": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING), ("created_at", DESCENDING)], name="member_created_at"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "bookings": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING), ("booking_date", DESCENDING)], name="member_booking_date"),
+        IndexModel([("class_id", ASCENDING), ("booking_date", ASCENDING), ("status", ASCENDING)], name="class_occurrence_status"),
+        IndexModel([("status", ASCENDING), ("booking_date", ASCENDING)], name="status_booking_date"),
+    ],
+    "classes": [_unique_id()],
+    "pos_transactions": [
+        _unique_id(),
+        IndexModel([("status", ASCENDING), ("transaction_date", DESCENDING)], name="status_transaction_date"),
+        IndexModel([("member_id", ASCENDING), ("transaction_date", DESCENDING)], name="member_transaction_date"),
+    ],
+    "tasks": [
+        IndexModel([("task_id", ASCENDING)], name="task_id_unique", unique=True),
+        IndexModel([("assigned_to_user_id", ASCENDING), ("status", ASCENDING)], name="assignee_status"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+    ],
+    "leads": [
+        _unique_id(),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("assigned_to", ASCENDING), ("status", ASCENDING)], name="assignee_status"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("assigned_to", ASCENDING), ("created_at", DESCENDING)], name="assignee_created_at"),
+    ],
+    "opportunities": [
+        IndexModel([("assigned_to", ASCENDING), ("created_at", DESCENDING)], name="assignee_created_at"),
+        IndexModel([("assigned_to", ASCENDING), ("status", ASCENDING), ("updated_at", DESCENDING)], name="assignee_status_updated_at"),
+    ],
+    "commissions": [
+        IndexModel([("consultant_id", ASCENDING), ("sale_date", DESCENDING)], name="consultant_sale_date"),
+    ],
+    "complimentary_memberships": [
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "levies": [
+        _unique_id(),
+        IndexModel([("member_id", ASCENDING)], name="member_id"),
+        IndexModel([("status", ASCENDING), ("due_date", ASCENDING)], name="status_due_date"),
+    ],
+    "eft_transaction_items": [
+        IndexModel([("payment_reference", ASCENDING)], name="payment_reference"),
+        IndexModel([("eft_transaction_id", ASCENDING)], name="eft_transaction_id"),
+    ],
+    "fti_transactions": [
+        _unique_id(),
+        IndexModel([("transaction_key", ASCENDING)], name="transaction_key"),
+        IndexModel([("is_reconciled", ASCENDING), ("imported_at", DESCENDING)], name="reconciled_imported_at"),
+    ],
+    "eft_response_runs": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "file_sequences": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "eft_transactions": [
+        IndexModel([("file_sequence", ASCENDING)], name="file_sequence"),
+    ],
+    "automations": [
+        _unique_id(),
+        IndexModel([("trigger_type", ASCENDING), ("enabled", ASCENDING)], name="trigger_enabled"),
+    ],
+    "automation_executions": [
+        IndexModel([("status", ASCENDING), ("scheduled_for", ASCENDING)], name="status_scheduled_for"),
+        IndexModel([("automation_id", ASCENDING), ("created_at", DESCENDING)], name="automation_created_at"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+        # Executions recorded before the job queue have no key
+        IndexModel(
+            [("idempotency_key", ASCENDING)],
+            name="idempotency_key_unique",
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$exists": True}}
+        ),
+    ],
+    "rollup_revenue_daily": [
+        IndexModel(
+            [("date", ASCENDING), ("membership_type_id", ASCENDING), ("payment_method", ASCENDING), ("payment_source", ASCENDING)],
+            name="rollup_key", unique=True
+        ),
+    ],
+    "rollup_checkins_daily": [
+        IndexModel(
+            [("date", ASCENDING), ("hour", ASCENDING), ("location", ASCENDING), ("status", ASCENDING)],
+            name="rollup_key", unique=True
+        ),
+    ],
+    "rollup_membership_daily": [
+        IndexModel(
+            [("date", ASCENDING), ("membership_type_id", ASCENDING), ("source", ASCENDING)],
+            name="rollup_key", unique=True
+        ),
+    ],
+    "rollup_pos_daily": [
+        IndexModel([("date", ASCENDING), ("category", ASCENDING)], name="rollup_key", unique=True),
+    ],
+    "migrations": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "rollup_meta": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "audit_logs": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_timestamp"),
+        # Retention: each record's expire_at is set by AuditLogWriter
+        IndexModel([("expire_at", ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+    ],
+    "class_occurrences": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "avs_verifications": [
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("member_id", ASCENDING), ("created_at", DESCENDING)], name="member_created_at"),
+    ],
+    "avs_cache": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+        # Cached verifications expire (AVSVerifier sets expire_at per entry)
+        IndexModel([("expire_at", ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+    ],
+    "geocode_cache": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+        # Stale entries expire (GeocodingService sets expire_at per entry)
+        IndexModel([("expire_at", ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+# Representative filters of the hottest request paths. The advisor explains
+# each one and flags any whose winning plan is still a collection scan.
+HOT_QUERIES: List[Tuple[str, str, dict]] = [
+    ("access_validate_member", "members", {"id": "__probe__"}),
+    ("duplicate_check_email", "members", {"norm_email": "__probe__"}),
+    ("duplicate_check_phone", "members", {"norm_phone": "__probe__"}),
+    ("member_debt", "invoices", {"member_id": "__probe__", "status": {"$in": ["overdue", "failed"]}, "paid_date": None}),
+    ("member_access_logs", "access_logs", {"member_id": "__probe__"}),
+    ("member_journal", "member_journal", {"member_id": "__probe__"}),
+    ("member_points", "points_transactions", {"member_id": "__probe__"}),
+    ("member_bookings", "bookings", {"member_id": "__probe__"}),
+    ("paid_invoices", "invoices", {"status": "paid"}),
+    ("user_by_email", "users", {"email": "__probe__"}),
+]
+
+
+async def ensure_indexes(db) -> dict:
+    """
+    Create every registered index. Safe to call repeatedly: an index that
+    already exists with the same spec is a no-op on the server.
+
+    Failures (e.g. duplicate values blocking a unique index) are logged per
+    collection and never abort startup.
+    """
+    created: List[str] = []
+    failed: List[dict] = []
+
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        try:
+            names = await db[collection_name].create_indexes(indexes)
+            created.extend(f"{collection_name}.{name}" for name in names)
+        except OperationFailure:
+            # Retry one by one so a single conflicting index doesn't hide the rest
+            for index in indexes:
+                name = index.document["name"]
+                try:
+                    await db[collection_name].create_indexes([index])
+                    created.append(f"{collection_name}.{name}")
+                except OperationFailure as e:
+                    logger.warning(f"Index {collection_name}.{name} not created: {e}")
+                    failed.append({"collection": collection_name, "index": name, "error": str(e)})
+
+    return {"ensured": created, "failed": failed}
+
+
+def _plan_stages(plan) -> List[str]:
+    """Flatten every stage name found in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def explain_query(db, collection_name: str, query_filter: dict) -> dict:
+    """Return the winning plan summary of a find() without executing it"""
+    result = await db.command(
+        {"explain": {"find": collection_name, "filter": query_filter}, "verbosity": "queryPlanner"}
+    )
+    winning_plan = result.get("queryPlanner", {}).get("winningPlan", {})
+    stages = _plan_stages(winning_plan)
+    return {
+        "stages": stages,
+        "collection_scan": "COLLSCAN" in stages,
+    }
+
+
+async def analyze_indexes(db, slow_ms: int = 100, profile_limit: int = 20) -> dict:
+    """
+    Index advisor report:
+    - missing: registered indexes not present on the server
+    - unused: existing indexes with zero accesses since the last restart ($indexStats)
+    - hot_query_plans: explain() of the hottest request paths, flagging collection scans
+    - slow_queries: recent entries from system.profile (only if profiling is enabled)
+    """
+    existing_collections = set(await db.list_collection_names())
+
+    missing = []
+    unused = []
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        if collection_name not in existing_collections:
+            continue
+
+        existing_names = set()
+        async for index in db[collection_name].list_indexes():
+            existing_names.add(index["name"])
+        for index in indexes:
+            if index.document["name"] not in existing_names:
+                missing.append({
+                    "collection": collection_name,
+                    "index": index.document["name"],
+                    "keys": dict(index.document["key"]),
+                })
+
+        try:
+            stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure as e:
+            logger.warning(f"$indexStats unavailable for {collection_name}: {e}")
+            continue
+        for stat in stats:
+            if stat["name"] == "_id_":
+                continue
+            ops = stat.get("accesses", {}).get("ops", 0)
+            if ops == 0:
+                since = stat.get("accesses", {}).get("since")
+                unused.append({
+                    "collection": collection_name,
+                    "index": stat["name"],
+                    "keys": dict(stat.get("key", {})),
+                    "since": since.isoformat() if since else None,
+                })
+
+    hot_query_plans = []
+    for label, collection_name, query_filter in HOT_QUERIES:
+        if collection_name not in existing_collections:
+            continue
+        try:
+            plan = await explain_query(db, collection_name, query_filter)
+        except OperationFailure as e:
+            plan = {"error": str(e)}
+        hot_query_plans.append({"query": label, "collection": collection_name, **plan})
+
+    slow_queries = []
+    if "system.profile" in existing_collections:
+        cursor = db["system.profile"].find(
+            {"millis": {"$gte": slow_ms}},
+            {"ns": 1, "op": 1, "millis": 1, "planSummary": 1, "docsExamined": 1, "nreturned": 1, "ts": 1, "_id": 0}
+        ).sort("ts", DESCENDING).limit(profile_limit)
+        async for entry in cursor:
+            if entry.get("ts"):
+                entry["ts"] = entry["ts"].isoformat()
+            slow_queries.append(entry)
+
+    return {
+        "missing": missing,
+        "unused": unused,
+        "hot_query_plans": hot_query_plans,
+        "collection_scans": [p["query"] for p in hot_query_plans if p.get("collection_scan")],
+        "slow_queries": slow_queries,
+        "profiling_enabled": "system.profile" in existing_collections,
+    }
+
@@ -4,7 +4,8 @@ Implements Nedbank CPS DebiCheck format for authenticated debit orders
 """
 
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, TextIO, Tuple
+import io
 import uuid
 import os
 
@@ -242,30 +243,42 @@ class DebiCheckMandateGenerator:
         
         filename = f"DEBICHECK_MANDATE_{file_sequence}.txt"
         
-        lines = []
+        out = io.StringIO()
+        writer = MandateFileWriter(self, out, file_sequence)
+        for mandate in mandates:
+            writer.add(mandate)
+        writer.close()
         
-        # Header record
-        lines.append(self.format_mandate_header(file_sequence))
-        
-        # Mandate records
-        for idx, mandate in enumerate(mandates, 1):
-            # Generate MRN if not provided
-            if 'mandate_reference_number' not in mandate:
-                mandate['mandate_reference_number'] = self.generate_mandate_reference_number(
-                    mandate.get('member_id', str(idx))
-                )
-            
-            lines.append(self.format_mandate_request(mandate, idx))
-        
-        # Trailer record
-        lines.append(self.format_trailer_record(len(mandates)))
-        
-        # Security record
-        lines.append(self.format_security_record())
-        
-        file_content = "".join(lines)
-        
-        return filename, file_content
+        return filename, out.getvalue()
+
+
+class MandateFileWriter:
+    """
+    Write a mandate request file record by record to an open text file:
+    header on creation, one record per add(), trailer on close().
+    """
+    
+    def __init__(self, generator: DebiCheckMandateGenerator, out: TextIO, file_sequence: str):
+        self.generator = generator
+        self.out = out
+        self.count = 0
+        out.write(generator.format_mandate_header(file_sequence))
+    
+    def add(self, mandate: Dict) -> str:
+        """Write one mandate request; returns its MRN (generated if not provided)"""
+        self.count += 1
+        if 'mandate_reference_number' not in mandate:
+            mandate['mandate_reference_number'] = self.generator.generate_mandate_reference_number(
+                mandate.get('member_id', str(self.count))
+            )
+        
+        self.out.write(self.generator.format_mandate_request(mandate, self.count))
+        return mandate['mandate_reference_number']
+    
+    def close(self):
+        """Write the trailer and security records"""
+        self.out.write(self.generator.format_trailer_record(self.count))
+        self.out.write(self.generator.format_security_record())
 
 
 class DebiCheckCollectionGenerator:
@@ -349,29 +362,46 @@ class DebiCheckCollectionGenerator:
         
         filename = f"DEBICHECK_COLLECTION_{file_sequence}.txt"
         
-        lines = []
+        out = io.StringIO()
+        writer = CollectionFileWriter(self, out, file_sequence, nominated_account, charges_account)
+        for collection in collections:
+            writer.add(collection)
+        writer.close()
         
-        # Header
-        lines.append(self.format_collection_header(file_sequence, nominated_account, charges_account))
-        
-        # Collection records
-        total_amount = 0
-        for idx, collection in enumerate(collections, 1):
-            lines.append(self.format_collection_request(collection, idx))
-            total_amount += float(collection.get('collection_amount', 0))
-        
-        # Trailer
+        return filename, out.getvalue()
+
+
+class CollectionFileWriter:
+    """
+    Write a collection request file record by record to an open text file,
+    keeping the running count and value for the trailer.
+    """
+    
+    def __init__(self, generator: DebiCheckCollectionGenerator, out: TextIO, file_sequence: str,
+                 nominated_account: str, charges_account: str):
+        self.generator = generator
+        self.out = out
+        self.count = 0
+        self.total_amount = 0
+        out.write(generator.format_collection_header(file_sequence, nominated_account, charges_account))
+    
+    def add(self, collection: Dict):
+        """Write one collection request"""
+        self.count += 1
+        self.out.write(self.generator.format_collection_request(collection, self.count))
+        self.total_amount += float(collection.get('collection_amount', 0))
+    
+    def close(self):
+        """Write the trailer and security records"""
         record = []
         record.append("03")
-        record.append(str(len(collections)).zfill(10))
-        record.append(str(int(total_amount * 100)).zfill(14))
+        record.append(str(self.count).zfill(10))
+        record.append(str(int(self.total_amount * 100)).zfill(14))
         record.append(" " * 294)
-        lines.append("".join(record) + "\n")
+        self.out.write("".join(record) + "\n")
         
         # Security
-        lines.append("04" + " " * 318 + "\n")
-        
-        return filename, "".join(lines)
+        self.out.write("04" + " " * 318 + "\n")
 
 
 class DebiCheckResponseParser:
@@ -435,6 +465,13 @@ class DebiCheckResponseParser:
         return reasons.get(reason_code, 'Unknown reason')
 
 
+def outgoing_debicheck_path(filename: str, file_type: str = "mandate") -> str:
+    """Full path of an outgoing DebiCheck file (creates the folder)"""
+    outgoing_folder = os.path.join("/app/debicheck_files", "outgoing", file_type)
+    os.makedirs(outgoing_folder, exist_ok=True)
+    return os.path.join(outgoing_folder, filename)
+
+
 def save_debicheck_file(filename: str, content: str, file_type: str = "mandate") -> str:
     """
     Save DebiCheck file to appropriate folder
@@ -3,11 +3,21 @@ EFT SDV (Same Day Value) File Format Utilities
 Implements Nedbank CPS format for debit orders and payment reconciliation
 """
 
+from contextlib import contextmanager
 from datetime import datetime, date
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, TextIO, Tuple
+import io
 import os
 
 
+def format_file_sequence(client_profile_number: str, day: date, sequence: int) -> str:
+    """
+    24-digit file sequence number
+    Format: {ClientProfileNumber (10)}{YYYYMMDD (8)}{Sequential (6)}
+    """
+    return f"{client_profile_number.zfill(10)}{day.strftime('%Y%m%d')}{str(sequence).zfill(6)}"
+
+
 class EFTFileGenerator:
     """Generate EFT files in Nedbank CPS format"""
     
@@ -26,14 +36,14 @@ class EFTFileGenerator:
     
     def generate_file_sequence_number(self) -> str:
         """
-        Generate unique file sequence number
+        Generate file sequence number
         Format: {ClientProfileNumber (10)}{YYYYMMDD (8)}{Sequential (6)}
+
+        Timestamp-based; files generated by the API take their sequence from
+        the shared per-day counter (services.file_sequence) instead.
         """
-        today = datetime.now().strftime('%Y%m%d')
-        # In production, this should increment based on files generated today
-        # For now, use timestamp-based sequence
-        sequence = datetime.now().strftime('%H%M%S')
-        return f"{self.client_profile_number}{today}{sequence}"
+        now = datetime.now()
+        return format_file_sequence(self.client_profile_number, now.date(), int(now.strftime('%H%M%S')))
     
     def format_header_record(self, file_sequence: str, file_type: str = "01", 
                             statement_narrative: str = "DEBIT ORDER") -> str:
@@ -166,43 +176,66 @@ class EFTFileGenerator:
         file_sequence = self.generate_file_sequence_number()
         filename = f"EFT_DEBIT_{file_sequence}.txt"
         
-        lines = []
-        
-        # Header record
-        lines.append(self.format_header_record(file_sequence, "01", "GYM MEMBERSHIP"))
-        
-        # Transaction records
-        total_value = 0.0
-        for idx, txn in enumerate(transactions, 1):
-            action_date = txn.get('action_date', date.today())
-            if isinstance(action_date, str):
-                action_date = datetime.strptime(action_date, '%Y-%m-%d').date()
-            
-            amount = float(txn['amount'])
-            total_value += amount
-            
-            # Generate payment reference: file_sequence + sequential
-            payment_ref = f"{file_sequence}{str(idx).zfill(10)}"
-            
-            lines.append(self.format_transaction_record(
-                payment_ref=payment_ref,
-                dest_branch=str(txn.get('member_branch', '000000')),
-                dest_account=str(txn.get('member_account', '')),
-                amount=amount,
-                action_date=action_date,
-                reference=txn.get('invoice_id', ''),
-                transaction_number=idx
-            ))
-        
-        # Trailer record
-        lines.append(self.format_trailer_record(len(transactions), total_value))
-        
-        # Security record
-        lines.append(self.format_security_record())
+        out = io.StringIO()
+        writer = DebitOrderFileWriter(self, out, file_sequence)
+        for txn in transactions:
+            writer.add(txn)
+        writer.close()
         
-        file_content = "".join(lines)
+        return filename, out.getvalue()
+
+
+class DebitOrderFileWriter:
+    """
+    Write a debit order file record by record to an open text file.
+    
+    The header is written on creation, each add() writes one transaction
+    record and close() writes the trailer from the running totals, so a file
+    of any size is produced without holding its records in memory.
+    """
+    
+    def __init__(self, generator: EFTFileGenerator, out: TextIO, file_sequence: str,
+                 statement_narrative: str = "GYM MEMBERSHIP"):
+        self.generator = generator
+        self.out = out
+        self.file_sequence = file_sequence
+        self.count = 0
+        self.total_value = 0.0
+        out.write(generator.format_header_record(file_sequence, "01", statement_narrative))
+    
+    def add(self, txn: Dict) -> str:
+        """
+        Write one transaction (same keys as generate_debit_order_file)
         
-        return filename, file_content
+        Returns:
+            The payment reference assigned to the transaction
+        """
+        self.count += 1
+        action_date = txn.get('action_date', date.today())
+        if isinstance(action_date, str):
+            action_date = datetime.strptime(action_date, '%Y-%m-%d').date()
+        
+        amount = float(txn['amount'])
+        self.total_value += amount
+        
+        # Generate payment reference: file_sequence + sequential
+        payment_ref = f"{self.file_sequence}{str(self.count).zfill(10)}"
+        
+        self.out.write(self.generator.format_transaction_record(
+            payment_ref=payment_ref,
+            dest_branch=str(txn.get('member_branch', '000000')),
+            dest_account=str(txn.get('member_account', '')),
+            amount=amount,
+            action_date=action_date,
+            reference=txn.get('invoice_id', ''),
+            transaction_number=self.count
+        ))
+        return payment_ref
+    
+    def close(self):
+        """Write the trailer and security records"""
+        self.out.write(self.generator.format_trailer_record(self.count, self.total_value))
+        self.out.write(self.generator.format_security_record())
 
 
 class EFTFileParser:
@@ -310,6 +343,31 @@ class EFTFileParser:
         }
 
 
+@contextmanager
+def atomic_file(filepath: str) -> Iterator[TextIO]:
+    """
+    Open filepath for writing via a .part file that is renamed into place on
+    success and removed on error, so a partly written file is never picked up
+    for submission.
+    """
+    partial = f"{filepath}.part"
+    try:
+        with open(partial, 'w') as f:
+            yield f
+        os.replace(partial, filepath)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def outgoing_eft_path(filename: str, folder: str = "/app/eft_files") -> str:
+    """Full path of an outgoing EFT file (creates the folder)"""
+    outgoing_folder = os.path.join(folder, "outgoing")
+    os.makedirs(outgoing_folder, exist_ok=True)
+    return os.path.join(outgoing_folder, filename)
+
+
 def save_eft_file(filename: str, content: str, folder: str = "/app/eft_files") -> str:
     """
     Save EFT file to specified folder
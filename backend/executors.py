@@ -0,0 +1,54 @@
+"""
+Bounded executors for blocking work called from async handlers.
+
+bcrypt hashing, QR/PNG encoding and geocoder HTTP calls are synchronous;
+run directly in a handler they stall the event loop and every other request
+with it (turnstile validations included). They are routed through small
+thread pools instead:
+
+    hashed = await cpu_executor.run(hash_password, password)
+
+Each executor admits at most max_workers jobs at a time; further callers wait
+on an asyncio semaphore rather than piling up in the pool's queue. bcrypt and
+PIL release the GIL while they work, so threads are enough here.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BoundedExecutor:
+    """Thread pool with an async concurrency limit"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self.waiting = 0
+        self.completed = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+            finally:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {"name": self.name, "max_workers": self.max_workers, "waiting": self.waiting, "completed": self.completed}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# CPU-bound work (bcrypt, QR encoding)
+cpu_executor = BoundedExecutor("cpu", int(os.environ.get("CPU_EXECUTOR_WORKERS", min(4, os.cpu_count() or 1))))
+
+# Blocking network calls (geocoding)
+io_executor = BoundedExecutor("io", int(os.environ.get("IO_EXECUTOR_WORKERS", "4")))
@@ -0,0 +1,113 @@
+"""
+Keyset (cursor) pagination and field projection for list endpoints.
+
+Every paginated list sorts descending on (sort_field, id). The cursor is an
+opaque token holding the last row's (sort_field, id); the next page is
+everything strictly after it in that order, so pages stay stable while new
+rows are inserted and deep pages cost the same as the first one.
+
+Sort fields are mostly ISO strings, but some older documents hold BSON dates
+or nothing at all. MongoDB sorts those by type (date > string > null), and
+the "after" filter accounts for that so mixed collections page correctly.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import DESCENDING
+
+# Largest page a list endpoint returns (the row cap the lists had before pagination)
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(sort_value: Any, id_value: str) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"$date": sort_value.isoformat()}
+    raw = json.dumps({"v": sort_value, "id": id_value}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        value = data["v"]
+        if isinstance(value, dict) and "$date" in value:
+            value = datetime.fromisoformat(value["$date"])
+        return value, data["id"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], exclude: Optional[List[str]] = None, always: Optional[List[str]] = None) -> dict:
+    """
+    Build a find() projection.
+
+    fields:  comma-separated list from the ?fields= query parameter; when
+             given, only those fields (plus `always`) are returned
+    exclude: fields dropped by default when `fields` is not given
+             (e.g. large base64 blobs like qr_code)
+    """
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip() and not f.strip().startswith("$")]
+        projection = {"_id": 0, **{f: 1 for f in wanted}}
+        for f in always or []:
+            projection[f] = 1
+        return projection
+    return {"_id": 0, **{f: 0 for f in exclude or []}}
+
+
+def _after(sort_field: str, sort_value: Any, id_value: str) -> dict:
+    """Filter for rows that come after (sort_value, id_value) in descending order"""
+    same_value = {sort_field: sort_value, "id": {"$lt": id_value}}
+    missing = {sort_field: {"$exists": False}}
+    if sort_value is None:
+        return same_value
+    if isinstance(sort_value, datetime):
+        lower_types = {sort_field: {"$type": ["string", "number", "null"]}}
+    elif isinstance(sort_value, str):
+        lower_types = {sort_field: {"$type": ["number", "null"]}}
+    else:
+        lower_types = {sort_field: {"$type": "null"}}
+    return {"$or": [{sort_field: {"$lt": sort_value}}, same_value, lower_types, missing]}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    sort_field: str,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of `collection` matching `query`, newest first.
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    limit=None returns every remaining row; otherwise it must be at least 1.
+    """
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor)
+        after = _after(sort_field, sort_value, id_value)
+        query = {"$and": [query, after]} if query else after
+
+    projection = dict(projection or {"_id": 0})
+    if any(v == 1 for k, v in projection.items() if k != "_id"):
+        # Inclusion projection: the cursor needs the sort key and id
+        projection[sort_field] = 1
+        projection["id"] = 1
+
+    find = collection.find(query, projection).sort([(sort_field, DESCENDING), ("id", DESCENDING)])
+    if limit is None:
+        return await find.to_list(None), None
+
+    docs = await find.limit(limit + 1).to_list(limit + 1)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(last.get(sort_field), last.get("id"))
@@ -1,13 +1,18 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, status, UploadFile, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 import os
+import asyncio
+import heapq
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Iterable
 import uuid
 from datetime import datetime, timezone, timedelta, date
 import qrcode
@@ -15,10 +20,29 @@ from io import BytesIO
 import base64
 import jwt
 from passlib.context import CryptContext
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from geopy.exc import GeocoderServiceError
 from services.respondio_service import RespondIOService
+from services.kpi_engine import KPIEngine, KPI_TREND_METRICS, SNAPSHOT_METRICS, metric
+from services.rollups import RollupService, payment_dimensions, REVENUE_ROLLUP, CHECKIN_ROLLUP, MEMBERSHIP_ROLLUP, POS_ROLLUP
+from services.risk_scoring import MemberRiskEngine
+from services.access_control import MemberAccessCache, AccessEventWriter
+from services.points_ledger import PointsLedger
+from services.audit_writer import AuditLogWriter, parse_sample_rules
+from services.principal_cache import PrincipalCache
+from services.batch_loader import BatchLoader, ReferenceCache
+from services.geocoding import GeocodingService, geocode_address, member_location
+from services.sales_performance import SalesPerformance, comparison_periods
+from services.class_capacity import ClassCapacity, place_of
+from services.class_scheduler import ClassScheduler
+from services.automation_queue import AutomationJobQueue, event_key
+from services.rule_index import RuleIndex, compile_conditions, compiled_template
+from services.member_import import MemberImporter, cancel_running_imports
+from services.eft_ingestion import EFTResponseIngestor
+from services.file_sequence import FileSequenceAllocator
 from normalization import normalize_email, normalize_phone, normalize_name, normalize_full_name
+from pagination import MAX_PAGE_SIZE, paginate, parse_fields
+from db_indexes import ensure_indexes, analyze_indexes
+from executors import cpu_executor, io_executor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,6 +55,72 @@ db = client[os.environ['DB_NAME']]
 # Initialize respond.io service
 respondio_service = RespondIOService()
 
+async def send_whatsapp_message(phone: str, message: str, first_name: str = None, last_name: str = None, email: str = None):
+    """Send a free-text WhatsApp message (booking confirmations, class reminders)"""
+    return await respondio_service.send_text_message(
+        contact_phone=phone,
+        text=message,
+        first_name=first_name,
+        last_name=last_name,
+        email=email
+    )
+
+# Shared dashboard KPI engine
+kpi_engine = KPIEngine(db)
+
+# Daily analytics rollups (maintained from write paths)
+rollups = RollupService(db)
+
+# Vectorized churn / at-risk scoring (scored table cached for 5 minutes)
+risk_engine = MemberRiskEngine(db)
+
+# Points ledger ($inc balances, batched history; optional periodic compaction)
+points_ledger = PointsLedger(
+    db,
+    compact_after_days=int(os.environ["POINTS_COMPACT_AFTER_DAYS"]) if os.environ.get("POINTS_COMPACT_AFTER_DAYS") else None
+)
+
+# Turnstile fast path: cached access decisions + batched side-effect writer
+member_access_cache = MemberAccessCache()
+access_event_writer = AccessEventWriter(db, rollups, points_ledger, risk_engine=risk_engine)
+
+
+def invalidate_member_state(member_id: Optional[str] = None):
+    """Drop cached access decisions and risk scores after a member or invoice write"""
+    member_access_cache.invalidate(member_id)
+    risk_engine.invalidate()
+
+# Process-wide cache of small reference tables (lead sources/statuses, loss reasons, membership types, payment sources)
+reference_cache = ReferenceCache(db)
+
+# Grouped per-consultant sales/commission figures for the commission dashboard and reports
+sales_performance = SalesPerformance(db, reference_cache)
+
+# Per-occurrence seat and waitlist counters for class bookings
+class_capacity = ClassCapacity(db)
+
+# Enabled automations, active workflow rules and templates with compiled conditions (reloaded on change / 60s TTL)
+rule_index = RuleIndex(db)
+
+# Class reminders and no-show marking, run every CLASS_SCHEDULER_INTERVAL_SECONDS (0 disables the loop)
+class_scheduler = ClassScheduler(
+    db,
+    send_message=send_whatsapp_message,
+    interval_seconds=int(os.environ.get("CLASS_SCHEDULER_INTERVAL_SECONDS", "300")),
+    max_concurrent_sends=int(os.environ.get("CLASS_REMINDER_MAX_CONCURRENT_SENDS", "10"))
+)
+
+# Authenticated users resolved by get_current_user (60s TTL)
+principal_cache = PrincipalCache()
+
+# Audit logs are queued by the middleware and written in batches
+audit_log_writer = AuditLogWriter(
+    db,
+    retention_days=int(os.environ.get("AUDIT_LOG_RETENTION_DAYS", "90")),
+    excluded_paths=[p.strip() for p in os.environ.get("AUDIT_LOG_EXCLUDE_PATHS", "").split(",") if p.strip()],
+    sample_rules=parse_sample_rules(os.environ.get("AUDIT_LOG_SAMPLE_RULES"))
+)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -72,19 +162,13 @@ def generate_qr_code(data: str) -> str:
     img.save(buffered, format="PNG")
     return base64.b64encode(buffered.getvalue()).decode()
 
-def geocode_address(address: str) -> tuple:
-    """Geocode an address and return (latitude, longitude)"""
-    if not address or len(address.strip()) < 5:
-        return None, None
-    
-    try:
-        geolocator = Nominatim(user_agent="gym_access_hub")
-        location = geolocator.geocode(address, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        return None, None
-    except (GeocoderTimedOut, GeocoderServiceError):
-        return None, None
+# Member addresses are geocoded in the background through a persistent cache
+geocoding_service = GeocodingService(
+    db,
+    geocoder=geocode_address,
+    executor=io_executor,
+    cache_ttl_days=int(os.environ.get("GEOCODE_CACHE_TTL_DAYS", "180"))
+)
 
 async def add_journal_entry(
     member_id: str,
@@ -197,6 +281,8 @@ class Member(BaseModel):
     address: Optional[str] = None
     latitude: Optional[float] = None
     longitude: Optional[float] = None
+    geohash: Optional[str] = None  # Set with latitude/longitude by the geocoder
+    geo_suburb: Optional[str] = None
     # Banking details
     bank_account_number: Optional[str] = None
     bank_name: Optional[str] = None
@@ -1017,6 +1103,8 @@ class BillingSettings(BaseModel):
     # Auto-generation for memberships
     auto_generate_membership_invoices: bool = False
     days_before_renewal_to_invoice: int = 5
+    # Dashboard sales target
+    monthly_sales_target: float = 100000.0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
 
@@ -1040,6 +1128,7 @@ class BillingSettingsUpdate(BaseModel):
     default_payment_terms_days: Optional[int] = None
     auto_generate_membership_invoices: Optional[bool] = None
     days_before_renewal_to_invoice: Optional[int] = None
+    monthly_sales_target: Optional[float] = None
 
 
 class AppSettings(BaseModel):
@@ -1262,6 +1351,7 @@ class AVSVerificationResult(BaseModel):
     # Metadata
     verification_summary: Optional[str] = None  # Human-readable summary
     mock_mode: bool = False
+    cached_result: bool = False  # Reused from a recent verification of the same account
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_by: Optional[str] = None  # User who triggered verification
 
@@ -1477,14 +1567,20 @@ class AutomationCreate(BaseModel):
     test_mode: bool = False
 
 class AutomationExecution(BaseModel):
+    """One queued automation action (written by AutomationJobQueue.enqueue)"""
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     automation_id: str
     automation_name: str
     trigger_data: dict  # Info about what triggered it
+    action: Optional[dict] = None  # The action to run
+    action_index: int = 0
+    idempotency_key: Optional[str] = None  # automation_id:action_index:event key
     scheduled_for: datetime  # When the action should execute
     executed_at: Optional[datetime] = None
-    status: str = "pending"  # pending, completed, failed
+    status: str = "pending"  # pending, running, completed, failed
+    attempts: int = 0
+    last_error: Optional[str] = None
     result: Optional[dict] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -1651,15 +1747,27 @@ class BookingUpdate(BaseModel):
     notes: Optional[str] = None
 
 # Auth dependency
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
-    payload = decode_token(token)
+    # Reuse the payload audit_logging_middleware already decoded for this request
+    if getattr(request.state, "jwt_token", None) == token:
+        payload = request.state.jwt_payload
+    else:
+        payload = decode_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = await db.users.find_one({"email": payload.get("sub")}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    
+    email = payload.get("sub")
+    user = principal_cache.get(email)
+    if user is None:
+        user_doc = await db.users.find_one({"email": email}, {"_id": 0})
+        if not user_doc:
+            raise HTTPException(status_code=401, detail="User not found")
+        user = User(**user_doc)
+        principal_cache.put(email, user)
+    
+    request.state.principal = user
+    return user
 
 # Auth Routes
 @api_router.post("/auth/register", response_model=Token)
@@ -1670,7 +1778,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_dict = user_data.model_dump()
-    user_dict["password"] = hash_password(user_dict["password"])
+    user_dict["password"] = await cpu_executor.run(hash_password, user_dict["password"])
     user = User(**user_dict)
     
     doc = user.model_dump()
@@ -1683,7 +1791,7 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await cpu_executor.run(verify_password, credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"sub": user["email"], "role": user["role"]})
@@ -1711,11 +1819,11 @@ async def change_password(
     """Change password for logged-in user"""
     # Verify old password
     user = await db.users.find_one({"id": current_user.id})
-    if not verify_password(data.old_password, user["password"]):
+    if not await cpu_executor.run(verify_password, data.old_password, user["password"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Update password
-    hashed_password = hash_password(data.new_password)
+    hashed_password = await cpu_executor.run(hash_password, data.new_password)
     await db.users.update_one(
         {"id": current_user.id},
         {"$set": {
@@ -1725,6 +1833,7 @@ async def change_password(
             "password_changed_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    principal_cache.invalidate(email=current_user.email)
     
     return {"message": "Password changed successfully"}
 
@@ -1776,7 +1885,7 @@ async def reset_password(data: PasswordResetConfirm):
             raise HTTPException(status_code=400, detail="Reset token has expired")
     
     # Update password
-    hashed_password = hash_password(data.new_password)
+    hashed_password = await cpu_executor.run(hash_password, data.new_password)
     await db.users.update_one(
         {"id": user["id"]},
         {"$set": {
@@ -1788,6 +1897,7 @@ async def reset_password(data: PasswordResetConfirm):
             "password_changed_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    principal_cache.invalidate(email=user["email"])
     
     return {"message": "Password reset successfully"}
 
@@ -1806,7 +1916,7 @@ async def set_initial_password(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Hash temporary password
-    hashed_password = hash_password(data.temporary_password)
+    hashed_password = await cpu_executor.run(hash_password, data.temporary_password)
     
     # Update user with temporary password and force change
     await db.users.update_one(
@@ -1817,6 +1927,7 @@ async def set_initial_password(
             "first_login": True
         }}
     )
+    principal_cache.invalidate(email=user["email"])
     
     # TODO: Send email with temporary password
     print(f"📧 Would send temporary password to: {user['email']}")
@@ -1882,6 +1993,7 @@ async def create_membership_type(data: MembershipTypeCreate, current_user: User
     doc = membership.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.membership_types.insert_one(doc)
+    reference_cache.invalidate("membership_types")
     return membership
 
 @api_router.get("/membership-types", response_model=List[MembershipType])
@@ -1968,6 +2080,7 @@ async def create_membership_variation(base_id: str, data: MembershipVariationCre
     doc = variation.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.membership_types.insert_one(doc)
+    reference_cache.invalidate("membership_types")
     
     return variation
 
@@ -2220,6 +2333,7 @@ async def create_payment_source(data: PaymentSourceCreate, current_user: User =
         source_dict["updated_at"] = source_dict["updated_at"].isoformat()
     
     await db.payment_sources.insert_one(source_dict)
+    reference_cache.invalidate("payment_sources")
     
     return source
 
@@ -2243,6 +2357,7 @@ async def update_payment_source(
         {"id": source_id},
         {"$set": update_data}
     )
+    reference_cache.invalidate("payment_sources")
     
     # Get updated source
     updated = await db.payment_sources.find_one({"id": source_id}, {"_id": 0})
@@ -2265,6 +2380,7 @@ async def delete_payment_source(source_id: str, current_user: User = Depends(get
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    reference_cache.invalidate("payment_sources")
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Payment source not found")
@@ -2292,10 +2408,54 @@ async def calculate_member_debt(member_id: str):
             "is_debtor": total_debt > 0
         }}
     )
+    invalidate_member_state(member_id)
     
     return total_debt
 
 
+async def recalculate_member_debts(member_ids: Iterable[str], batch_size: int = 1000) -> int:
+    """calculate_member_debt for many members: one grouped query and one bulk write per batch"""
+    ids = list({member_id for member_id in member_ids if member_id})
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        groups = await db.invoices.aggregate([
+            {"$match": {"member_id": {"$in": batch}, "status": {"$in": ["overdue", "failed"]}, "paid_date": None}},
+            {"$group": {"_id": "$member_id", "total": {"$sum": {"$ifNull": ["$amount", 0]}}}}
+        ]).to_list(None)
+        totals = {g["_id"]: g["total"] for g in groups}
+        await db.members.bulk_write([
+            UpdateOne({"id": member_id}, {"$set": {
+                "debt_amount": totals.get(member_id, 0),
+                "is_debtor": totals.get(member_id, 0) > 0
+            }})
+            for member_id in batch
+        ], ordered=False)
+        for member_id in batch:
+            invalidate_member_state(member_id)
+    return len(ids)
+
+
+def eft_payment(item: dict, payment_reference: str) -> dict:
+    """Payment recorded for an EFT transaction item paid according to a response file"""
+    payment = Payment(
+        invoice_id=item["invoice_id"],
+        member_id=item["member_id"],
+        amount=item["amount"],
+        payment_method="EFT",
+        reference=payment_reference
+    ).model_dump()
+    payment["payment_date"] = payment["payment_date"].isoformat()
+    payment["payment_gateway"] = "EFT_DEBIT_ORDER"
+    payment["notes"] = "Auto-processed from EFT response file"
+    return payment
+
+# EFT / DebiCheck file sequence numbers from an atomic per-day counter
+file_sequences = FileSequenceAllocator(db)
+
+# Bank response files are applied with bulk writes; runs are idempotent per file sequence
+eft_ingestor = EFTResponseIngestor(db, recalculate_debts=recalculate_member_debts, make_payment=eft_payment, rollups=rollups)
+
+
 
 async def calculate_commission(member_id: str, consultant_id: str, membership_price: float, membership_type_name: str):
     """Calculate and create commission for a sale"""
@@ -2415,67 +2575,61 @@ async def get_commissions(consultant_id: Optional[str] = None, current_user: Use
     return commissions
 
 @api_router.get("/commissions/dashboard")
-async def get_commission_dashboard(current_user: User = Depends(get_current_user)):
-    """Get commission dashboard with performance metrics"""
-    # Current month dates
+async def get_commission_dashboard(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get commission dashboard with performance metrics.
+    Defaults to the current month compared with the previous month; with
+    start_date (and optionally end_date) the period is compared with the
+    equally long period before it.
+    """
     now = datetime.now(timezone.utc)
-    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Previous month dates
-    if now.month == 1:
-        prev_month_start = current_month_start.replace(year=now.year - 1, month=12)
-        prev_month_end = current_month_start
+    if start_date:
+        try:
+            current_month_start, current_end, prev_month_start, prev_month_end = comparison_periods(
+                start_date, end_date, now
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="start_date and end_date must be ISO dates")
     else:
-        prev_month_start = current_month_start.replace(month=now.month - 1)
+        # Current month dates
+        current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        current_end = None
+        
+        # Previous month dates
+        if now.month == 1:
+            prev_month_start = current_month_start.replace(year=now.year - 1, month=12)
+        else:
+            prev_month_start = current_month_start.replace(month=now.month - 1)
         prev_month_end = current_month_start
     
     # Get all consultants
-    consultants = await db.consultants.find({"status": "active"}, {"_id": 0}).to_list(1000)
+    consultants = await db.consultants.find({"status": "active"}, {"_id": 0}).to_list(None)
+    consultant_ids = [c["id"] for c in consultants]
+    current_end_iso = current_end.isoformat() if current_end else None
+    
+    # One grouped query per figure for all consultants
+    current_sales, prev_sales, commission_totals = await asyncio.gather(
+        sales_performance.membership_sales(current_month_start.isoformat(), current_end_iso, consultant_ids),
+        sales_performance.membership_sales(prev_month_start.isoformat(), prev_month_end.isoformat(), consultant_ids),
+        sales_performance.commission_totals(current_month_start.isoformat(), current_end_iso, consultant_ids)
+    )
     
     dashboard_data = []
     
     for consultant in consultants:
         consultant_id = consultant["id"]
+        current = current_sales.get(consultant_id, {"sales_count": 0, "revenue": 0.0})
+        previous = prev_sales.get(consultant_id, {"sales_count": 0, "revenue": 0.0})
         
-        # Current month sales
-        current_month_members = await db.members.find({
-            "sales_consultant_id": consultant_id,
-            "join_date": {"$gte": current_month_start.isoformat()}
-        }, {"_id": 0}).to_list(1000)
-        
-        # Previous month sales
-        prev_month_members = await db.members.find({
-            "sales_consultant_id": consultant_id,
-            "join_date": {
-                "$gte": prev_month_start.isoformat(),
-                "$lt": prev_month_end.isoformat()
-            }
-        }, {"_id": 0}).to_list(1000)
-        
-        # Calculate totals
-        current_month_sales = len(current_month_members)
-        prev_month_sales = len(prev_month_members)
-        
-        # Get membership prices for revenue calculation
-        current_month_revenue = 0.0
-        for member in current_month_members:
-            membership = await db.membership_types.find_one({"id": member["membership_type_id"]}, {"_id": 0})
-            if membership:
-                current_month_revenue += membership["price"]
-        
-        prev_month_revenue = 0.0
-        for member in prev_month_members:
-            membership = await db.membership_types.find_one({"id": member["membership_type_id"]}, {"_id": 0})
-            if membership:
-                prev_month_revenue += membership["price"]
-        
-        # Get commissions
-        current_month_commissions = await db.commissions.find({
-            "consultant_id": consultant_id,
-            "sale_date": {"$gte": current_month_start.isoformat()}
-        }, {"_id": 0}).to_list(1000)
-        
-        current_month_commission_total = sum([c["commission_amount"] for c in current_month_commissions])
+        current_month_sales = current["sales_count"]
+        prev_month_sales = previous["sales_count"]
+        current_month_revenue = current["revenue"]
+        prev_month_revenue = previous["revenue"]
+        current_month_commission_total = commission_totals.get(consultant_id, 0.0)
         
         # Calculate changes
         sales_change = current_month_sales - prev_month_sales
@@ -2514,7 +2668,11 @@ async def get_commission_dashboard(current_user: User = Depends(get_current_user
         "consultants": dashboard_data,
         "period": {
             "current_month": current_month_start.strftime("%B %Y"),
-            "previous_month": prev_month_start.strftime("%B %Y")
+            "previous_month": prev_month_start.strftime("%B %Y"),
+            "current_start": current_month_start.isoformat(),
+            "current_end": current_end_iso,
+            "previous_start": prev_month_start.isoformat(),
+            "previous_end": prev_month_end.isoformat()
         }
     }
 
@@ -2639,13 +2797,7 @@ async def create_member(data: MemberCreate, current_user: User = Depends(get_cur
     
     # Generate QR code
     qr_data = f"MEMBER:{member.id}:{member.email}"
-    member.qr_code = generate_qr_code(qr_data)
-    
-    # Geocode address if provided
-    if member.address:
-        lat, lon = geocode_address(member.address)
-        member.latitude = lat
-        member.longitude = lon
+    member.qr_code = await cpu_executor.run(generate_qr_code, qr_data)
     
     # Set consultant name if consultant_id provided
     if member.sales_consultant_id:
@@ -2658,6 +2810,10 @@ async def create_member(data: MemberCreate, current_user: User = Depends(get_cur
     if doc.get("expiry_date"):
         doc["expiry_date"] = doc["expiry_date"].isoformat()
     await db.members.insert_one(doc)
+    await rollups.record_membership_event("joins", doc["join_date"], member.membership_type_id, member.source)
+    
+    # Coordinates are filled in by the background geocoder
+    geocoding_service.enqueue(member.id, member.address)
     
     # Create first invoice
     invoice = Invoice(
@@ -2693,7 +2849,7 @@ async def create_member(data: MemberCreate, current_user: User = Depends(get_cur
         "phone": member.phone,
         "membership_type": membership_type["name"],
         "join_date": member.join_date.isoformat()
-    })
+    }, idempotency_key=f"member_joined:{member.id}")
     
     return member
 
@@ -2753,15 +2909,39 @@ async def schedule_member_levies(member: Member, membership_type: dict):
     levy_doc["created_at"] = levy_doc["created_at"].isoformat()
     await db.levies.insert_one(levy_doc)
 
+def list_page(items: list, next_cursor: Optional[str], response: Response, fields: Optional[str]):
+    """
+    Return a page from a response_model=List[...] endpoint.
+    The next-page cursor goes in the X-Next-Cursor header so the body stays a
+    plain list; with ?fields= the partial documents bypass the response model.
+    """
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if fields:
+        return JSONResponse(content=jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
+
 @api_router.get("/members", response_model=List[Member])
-async def get_members(current_user: User = Depends(get_current_user)):
-    members = await db.members.find({}, {"_id": 0}).to_list(1000)
+async def get_members(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    List members newest first, paginated by cursor (see X-Next-Cursor).
+    qr_code is excluded unless requested with ?fields=; fetch it from /members/{id}.
+    """
+    members, next_cursor = await paginate(
+        db.members, {}, "join_date", limit, cursor, parse_fields(fields, exclude=["qr_code"])
+    )
     for m in members:
         if isinstance(m.get("join_date"), str):
             m["join_date"] = datetime.fromisoformat(m["join_date"])
         if m.get("expiry_date") and isinstance(m["expiry_date"], str):
             m["expiry_date"] = datetime.fromisoformat(m["expiry_date"])
-    return members
+    return list_page(members, next_cursor, response, fields)
 
 # Member Search for Override - MUST be before {member_id} endpoint
 @api_router.get("/members/search")
@@ -2822,6 +3002,7 @@ async def block_member(member_id: str, current_user: User = Depends(get_current_
         {"id": member_id},
         {"$set": {"is_debtor": True, "membership_status": "suspended"}}
     )
+    invalidate_member_state(member_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Member not found")
     return {"message": "Member blocked successfully"}
@@ -2832,6 +3013,7 @@ async def unblock_member(member_id: str, current_user: User = Depends(get_curren
         {"id": member_id},
         {"$set": {"is_debtor": False, "membership_status": "active"}}
     )
+    invalidate_member_state(member_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Member not found")
     return {"message": "Member unblocked successfully"}
@@ -2861,10 +3043,14 @@ async def update_member(member_id: str, updates: dict, current_user: User = Depe
         {"id": member_id},
         {"$set": updates}
     )
+    invalidate_member_state(member_id)
     
     if result.modified_count == 0:
         return {"message": "No changes made", "member_id": member_id}
     
+    if updates.get("address") and updates["address"] != member.get("address"):
+        geocoding_service.enqueue(member_id, updates["address"])
+    
     # Log profile update to journal
     changed_fields = list(updates.keys())
     description = f"Profile updated: {', '.join(changed_fields)}"
@@ -3835,6 +4021,8 @@ async def create_access_override(
     log_doc = access_log.model_dump()
     log_doc["timestamp"] = log_doc["timestamp"].isoformat()
     await db.access_logs.insert_one(log_doc)
+    await rollups.record_checkin(log_doc["timestamp"], log_doc.get("location"), log_doc["status"])
+    risk_engine.invalidate()
     
     # Log to member journal
     await add_journal_entry(
@@ -3886,6 +4074,7 @@ async def convert_prospect_to_member(
             "join_date": datetime.now(timezone.utc)
         }}
     )
+    invalidate_member_state(member_id)
     
     # Log to journal
     await add_journal_entry(
@@ -3904,18 +4093,55 @@ async def convert_prospect_to_member(
     return {"success": True, "message": "Prospect converted to member successfully"}
 
 # Access Control Routes
+async def get_member_access_entry(member_id: str) -> Optional[dict]:
+    """Member + membership type name for an access decision, served from member_access_cache"""
+    entry = member_access_cache.get(member_id)
+    if entry is None:
+        member = await db.members.find_one({"id": member_id}, {"_id": 0})
+        if not member:
+            return None
+        member_obj = Member(**member)
+        membership_type = await db.membership_types.find_one(
+            {"id": member_obj.membership_type_id}, {"_id": 0, "name": 1}
+        )
+        entry = {
+            "member": member_obj,
+            "membership_type_name": membership_type.get("name") if membership_type else "Unknown"
+        }
+        member_access_cache.put(member_id, entry)
+    return entry
+
+
+async def queue_access_event(access_log: AccessLog, action_type: str, description: str, metadata: dict, points: int = 0):
+    """Hand the access log, journal entry, last visit and points of one swipe to the background writer"""
+    log_doc = access_log.model_dump()
+    log_doc["timestamp"] = log_doc["timestamp"].isoformat()
+    journal_entry = MemberJournal(
+        member_id=access_log.member_id,
+        action_type=action_type,
+        description=description,
+        metadata=metadata,
+        created_by="system",
+        created_by_name="System"
+    )
+    await access_event_writer.submit({
+        "access_log": log_doc,
+        "journal": journal_entry.model_dump(),
+        "last_visit": log_doc["timestamp"] if access_log.status == "granted" else None,
+        "points": points,
+        "points_transaction_id": str(uuid.uuid4())
+    })
+
+
 @api_router.post("/access/validate")
 async def validate_access(data: AccessLogCreate):
     """Validate member access with comprehensive checks"""
-    member = await db.members.find_one({"id": data.member_id}, {"_id": 0})
-    if not member:
+    entry = await get_member_access_entry(data.member_id)
+    if not entry:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    member_obj = Member(**member)
-    
-    # Get membership type name
-    membership_type = await db.membership_types.find_one({"id": member_obj.membership_type_id}, {"_id": 0})
-    membership_type_name = membership_type.get("name") if membership_type else "Unknown"
+    member_obj = entry["member"]
+    membership_type_name = entry["membership_type_name"]
     
     # Prepare access log with enhanced data
     access_log_data = {
@@ -3937,13 +4163,8 @@ async def validate_access(data: AccessLogCreate):
     if member_obj.is_debtor:
         if not data.override_by:
             access_log = AccessLog(**access_log_data, status="denied", reason="Member has outstanding debt")
-            log_doc = access_log.model_dump()
-            log_doc["timestamp"] = log_doc["timestamp"].isoformat()
-            await db.access_logs.insert_one(log_doc)
-            
-            # Log to journal
-            await add_journal_entry(
-                member_id=member_obj.id,
+            await queue_access_event(
+                access_log,
                 action_type="access_denied",
                 description=f"Access denied: Outstanding debt (R{member_obj.debt_amount:.2f})",
                 metadata={
@@ -3965,13 +4186,8 @@ async def validate_access(data: AccessLogCreate):
     if member_obj.membership_status == "suspended":
         if not data.override_by:
             access_log = AccessLog(**access_log_data, status="denied", reason="Membership suspended")
-            log_doc = access_log.model_dump()
-            log_doc["timestamp"] = log_doc["timestamp"].isoformat()
-            await db.access_logs.insert_one(log_doc)
-            
-            # Log to journal
-            await add_journal_entry(
-                member_id=member_obj.id,
+            await queue_access_event(
+                access_log,
                 action_type="access_denied",
                 description="Access denied: Membership suspended",
                 metadata={
@@ -3986,13 +4202,8 @@ async def validate_access(data: AccessLogCreate):
     if member_obj.membership_status == "cancelled":
         if not data.override_by:
             access_log = AccessLog(**access_log_data, status="denied", reason="Membership cancelled")
-            log_doc = access_log.model_dump()
-            log_doc["timestamp"] = log_doc["timestamp"].isoformat()
-            await db.access_logs.insert_one(log_doc)
-            
-            # Log to journal
-            await add_journal_entry(
-                member_id=member_obj.id,
+            await queue_access_event(
+                access_log,
                 action_type="access_denied",
                 description="Access denied: Membership cancelled",
                 metadata={
@@ -4008,13 +4219,8 @@ async def validate_access(data: AccessLogCreate):
     if member_obj.expiry_date and member_obj.expiry_date < datetime.now(timezone.utc):
         if not data.override_by:
             access_log = AccessLog(**access_log_data, status="denied", reason="Membership expired")
-            log_doc = access_log.model_dump()
-            log_doc["timestamp"] = log_doc["timestamp"].isoformat()
-            await db.access_logs.insert_one(log_doc)
-            
-            # Log to journal
-            await add_journal_entry(
-                member_id=member_obj.id,
+            await queue_access_event(
+                access_log,
                 action_type="access_denied",
                 description=f"Access denied: Membership expired on {member_obj.expiry_date.strftime('%Y-%m-%d')}",
                 metadata={
@@ -4046,64 +4252,12 @@ async def validate_access(data: AccessLogCreate):
                 }}
             )
     
-    # Grant access
+    # Grant access. The access log, last_visit_date, check-in reward
+    # (5 points per visit) and journal entry are written by the batch writer.
     access_log = AccessLog(**access_log_data, status="granted", reason=data.reason or "Access granted")
-    log_doc = access_log.model_dump()
-    log_doc["timestamp"] = log_doc["timestamp"].isoformat()
-    await db.access_logs.insert_one(log_doc)
-    
-    # Update member's last_visit_date
-    await db.members.update_one(
-        {"id": member_obj.id},
-        {"$set": {"last_visit_date": datetime.now(timezone.utc).isoformat()}}
-    )
-    
-    # AUTO-AWARD POINTS: Check-in reward (5 points per visit)
-    import uuid
-    try:
-        # Get current balance
-        balance = await db.points_balances.find_one({"member_id": member_obj.id}, {"_id": 0})
-        
-        if not balance:
-            balance = {"member_id": member_obj.id, "total_points": 0, "lifetime_points": 0}
-        
-        # Award 5 points for check-in
-        points_to_award = 5
-        new_total = balance.get("total_points", 0) + points_to_award
-        new_lifetime = balance.get("lifetime_points", 0) + points_to_award
-        
-        await db.points_balances.update_one(
-            {"member_id": member_obj.id},
-            {
-                "$set": {
-                    "total_points": new_total,
-                    "lifetime_points": new_lifetime,
-                    "last_updated": datetime.now(timezone.utc).isoformat()
-                }
-            },
-            upsert=True
-        )
-        
-        # Record transaction
-        transaction = {
-            "id": str(uuid.uuid4()),
-            "member_id": member_obj.id,
-            "points": points_to_award,
-            "transaction_type": "earned",
-            "reason": "Check-in reward",
-            "reference_id": log_doc.get("id"),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.points_transactions.insert_one(transaction.copy())
-    except Exception as e:
-        # Don't fail the check-in if points award fails
-        print(f"Failed to award points: {e}")
-    
-    # Log to journal
     class_info = f" for {access_log_data.get('class_name')}" if access_log_data.get('class_name') else ""
-    await add_journal_entry(
-        member_id=member_obj.id,
+    await queue_access_event(
+        access_log,
         action_type="access_granted",
         description=f"Access granted{class_info} at {data.location or 'main entrance'}",
         metadata={
@@ -4111,14 +4265,18 @@ async def validate_access(data: AccessLogCreate):
             "access_method": data.access_method,
             "class_name": access_log_data.get('class_name'),
             "class_booking_id": data.class_booking_id
-        }
+        },
+        points=5
     )
     
     return {"access": "granted", "member": member_obj, "access_log": access_log}
 
 @api_router.get("/access/logs", response_model=List[AccessLog])
 async def get_access_logs(
-    limit: int = 100,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     member_id: Optional[str] = None,
     status: Optional[str] = None,
     location: Optional[str] = None,
@@ -4141,11 +4299,11 @@ async def get_access_logs(
         if date_to:
             query["timestamp"]["$lte"] = date_to
     
-    logs = await db.access_logs.find(query, {"_id": 0}).sort("timestamp", -1).to_list(limit)
+    logs, next_cursor = await paginate(db.access_logs, query, "timestamp", limit, cursor, parse_fields(fields))
     for log in logs:
         if isinstance(log.get("timestamp"), str):
             log["timestamp"] = datetime.fromisoformat(log["timestamp"])
-    return logs
+    return list_page(logs, next_cursor, response, fields)
 
 @api_router.get("/access/analytics")
 async def get_access_analytics(
@@ -4621,6 +4779,7 @@ async def freeze_membership(member_id: str, data: MemberActionRequest, current_u
         {"id": member_id},
         {"$set": freeze_data}
     )
+    invalidate_member_state(member_id)
     
     # Add journal entry
     await add_journal_entry(
@@ -4674,6 +4833,7 @@ async def unfreeze_membership(member_id: str, current_user: User = Depends(get_c
             "freeze_history": freeze_history
         }}
     )
+    invalidate_member_state(member_id)
     
     # Add journal entry
     await add_journal_entry(
@@ -4711,6 +4871,13 @@ async def cancel_membership(member_id: str, data: MemberActionRequest, current_u
         {"id": member_id},
         {"$set": cancellation_data}
     )
+    invalidate_member_state(member_id)
+    await rollups.record_membership_event(
+        "cancellations",
+        cancellation_data["cancellation_date"],
+        member.get("membership_type_id"),
+        member.get("source")
+    )
     
     # Add journal entry
     await add_journal_entry(
@@ -4786,9 +4953,16 @@ async def create_invoice(data: InvoiceCreate, current_user: User = Depends(get_c
     return invoice
 
 @api_router.get("/invoices", response_model=List[Invoice])
-async def get_invoices(member_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_invoices(
+    response: Response,
+    member_id: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     query = {"member_id": member_id} if member_id else {}
-    invoices = await db.invoices.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    invoices, next_cursor = await paginate(db.invoices, query, "created_at", limit, cursor, parse_fields(fields))
     for inv in invoices:
         if isinstance(inv.get("due_date"), str):
             inv["due_date"] = datetime.fromisoformat(inv["due_date"])
@@ -4796,7 +4970,7 @@ async def get_invoices(member_id: Optional[str] = None, current_user: User = Dep
             inv["created_at"] = datetime.fromisoformat(inv["created_at"])
         if inv.get("paid_date") and isinstance(inv["paid_date"], str):
             inv["paid_date"] = datetime.fromisoformat(inv["paid_date"])
-    return invoices
+    return list_page(invoices, next_cursor, response, fields)
 
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
 async def get_invoice_details(invoice_id: str, current_user: User = Depends(get_current_user)):
@@ -4843,44 +5017,10 @@ async def update_invoice(invoice_id: str, data: InvoiceUpdate, current_user: Use
             update_data["paid_date"] = datetime.now(timezone.utc).isoformat()
             
             # AUTO-AWARD POINTS: Payment reward (10 points per payment)
-            import uuid
             try:
                 member_id = invoice.get("member_id")
                 if member_id:
-                    balance = await db.points_balances.find_one({"member_id": member_id}, {"_id": 0})
-                    
-                    if not balance:
-                        balance = {"member_id": member_id, "total_points": 0, "lifetime_points": 0}
-                    
-                    # Award 10 points for payment
-                    points_to_award = 10
-                    new_total = balance.get("total_points", 0) + points_to_award
-                    new_lifetime = balance.get("lifetime_points", 0) + points_to_award
-                    
-                    await db.points_balances.update_one(
-                        {"member_id": member_id},
-                        {
-                            "$set": {
-                                "total_points": new_total,
-                                "lifetime_points": new_lifetime,
-                                "last_updated": datetime.now(timezone.utc).isoformat()
-                            }
-                        },
-                        upsert=True
-                    )
-                    
-                    # Record transaction
-                    transaction = {
-                        "id": str(uuid.uuid4()),
-                        "member_id": member_id,
-                        "points": points_to_award,
-                        "transaction_type": "earned",
-                        "reason": "Payment completed",
-                        "reference_id": invoice_id,
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    
-                    await db.points_transactions.insert_one(transaction.copy())
+                    await points_ledger.award(member_id, 10, "Payment completed", reference_id=invoice_id)
             except Exception as e:
                 # Don't fail the payment if points award fails
                 print(f"Failed to award points: {e}")
@@ -5121,6 +5261,8 @@ async def create_payment(data: PaymentCreate, current_user: User = Depends(get_c
     payment = Payment(**data.model_dump())
     doc = payment.model_dump()
     doc["payment_date"] = doc["payment_date"].isoformat()
+    member = await db.members.find_one({"id": data.member_id}, {"_id": 0, "membership_type_id": 1, "source": 1})
+    doc.update(payment_dimensions(member))
     await db.payments.insert_one(doc)
     
     # Update invoice status
@@ -5136,16 +5278,26 @@ async def create_payment(data: PaymentCreate, current_user: User = Depends(get_c
     # Check if member should be unblocked and recalculate debt
     await calculate_member_debt(data.member_id)
     
+    # Update revenue rollup
+    await rollups.record_payments([doc])
+    
     return payment
 
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(member_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_payments(
+    response: Response,
+    member_id: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     query = {"member_id": member_id} if member_id else {}
-    payments = await db.payments.find(query, {"_id": 0}).sort("payment_date", -1).to_list(1000)
+    payments, next_cursor = await paginate(db.payments, query, "payment_date", limit, cursor, parse_fields(fields))
     for pay in payments:
         if isinstance(pay.get("payment_date"), str):
             pay["payment_date"] = datetime.fromisoformat(pay["payment_date"])
-    return payments
+    return list_page(payments, next_cursor, response, fields)
 
 @api_router.post("/invoices/{invoice_id}/mark-failed")
 async def mark_invoice_failed(
@@ -5159,12 +5311,13 @@ async def mark_invoice_failed(
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     # Update invoice status
+    failure_date = datetime.now(timezone.utc).isoformat()
     await db.invoices.update_one(
         {"id": invoice_id},
         {"$set": {
             "status": "failed",
             "failure_reason": failure_reason,
-            "failure_date": datetime.now(timezone.utc).isoformat()
+            "failure_date": failure_date
         }}
     )
     
@@ -5184,7 +5337,7 @@ async def mark_invoice_failed(
             "invoice_number": invoice["invoice_number"],
             "amount": invoice["amount"],
             "failure_reason": failure_reason or "Payment failed"
-        })
+        }, idempotency_key=f"payment_failed:{invoice_id}:{failure_date}")
     
     return {"message": "Invoice marked as failed, debt calculated, and automations triggered"}
 
@@ -5196,6 +5349,7 @@ async def mark_invoice_overdue(invoice_id: str, current_user: User = Depends(get
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     # Update invoice status
+    overdue_at = datetime.now(timezone.utc).isoformat()
     await db.invoices.update_one(
         {"id": invoice_id},
         {"$set": {"status": "overdue"}}
@@ -5217,7 +5371,7 @@ async def mark_invoice_overdue(invoice_id: str, current_user: User = Depends(get
             "invoice_number": invoice["invoice_number"],
             "amount": invoice["amount"],
             "due_date": invoice.get("due_date", "")
-        })
+        }, idempotency_key=f"invoice_overdue:{invoice_id}:{overdue_at}")
     
     return {"message": "Invoice marked as overdue, debt calculated, and automations triggered"}
 
@@ -5226,15 +5380,17 @@ async def mark_invoice_overdue(invoice_id: str, current_user: User = Depends(get
 @api_router.get("/analytics/member-distribution")
 async def get_member_distribution(current_user: User = Depends(get_current_user)):
     """Get member distribution with geo-location for marketing analytics"""
-    members = await db.members.find({}, {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, 
-                                          "address": 1, "latitude": 1, "longitude": 1, 
-                                          "membership_status": 1}).to_list(10000)
-    
-    # Filter members with valid geo-location
-    geo_members = [m for m in members if m.get("latitude") and m.get("longitude")]
+    total_members, geo_members = await asyncio.gather(
+        db.members.count_documents({}),
+        db.members.find(
+            {"latitude": {"$type": "number"}, "longitude": {"$type": "number"}},
+            {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "address": 1, "latitude": 1,
+             "longitude": 1, "geohash": 1, "geo_suburb": 1, "membership_status": 1}
+        ).to_list(10000)
+    )
     
     return {
-        "total_members": len(members),
+        "total_members": total_members,
         "geo_located_members": len(geo_members),
         "members": geo_members
     }
@@ -5525,44 +5681,64 @@ async def geocode_member_address(member_id: str, current_user: User = Depends(ge
     if not member.get("address"):
         raise HTTPException(status_code=400, detail="Member has no address")
     
-    lat, lon = geocode_address(member["address"])
-    if lat and lon:
+    try:
+        result = await geocoding_service.geocode(member["address"])
+    except GeocoderServiceError as e:
+        raise HTTPException(status_code=503, detail=f"Geocoding service unavailable: {str(e)}")
+    if result:
+        location = member_location(result)
         await db.members.update_one(
             {"id": member_id},
-            {"$set": {"latitude": lat, "longitude": lon}}
+            {"$set": location}
         )
-        return {"message": "Geocoding successful", "latitude": lat, "longitude": lon}
+        return {"message": "Geocoding successful", **location}
     else:
         raise HTTPException(status_code=400, detail="Could not geocode address")
 
+
+@api_router.post("/admin/geocode/backfill")
+async def start_geocode_backfill(
+    limit: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Geocode members that have an address but no coordinates, and add geohashes
+    to members that have coordinates. Runs in the background at the geocoder
+    rate limit; poll GET /admin/geocode/backfill for progress.
+    """
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can run the geocode backfill")
+    
+    if not geocoding_service.start_backfill(limit):
+        raise HTTPException(status_code=409, detail="A geocode backfill is already running")
+    return {"message": "Geocode backfill started", "limit": limit}
+
+
+@api_router.get("/admin/geocode/backfill")
+async def get_geocode_backfill_status(current_user: User = Depends(get_current_user)):
+    """Progress of the last geocode backfill and geocoder counters (Admin only)"""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can view geocode backfill status")
+    
+    return geocoding_service.stats()
+
 # Dashboard Stats
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    total_members = await db.members.count_documents({})
-    active_members = await db.members.count_documents({"membership_status": "active"})
-    blocked_members = await db.members.count_documents({"is_debtor": True})
-    
-    pending_invoices = await db.invoices.count_documents({"status": "pending"})
-    overdue_invoices = await db.invoices.count_documents({"status": "overdue"})
-    
-    # Total revenue (paid invoices)
-    paid_invoices = await db.invoices.find({"status": "paid"}, {"_id": 0, "amount": 1}).to_list(10000)
-    total_revenue = sum([inv.get("amount", 0) for inv in paid_invoices])
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     
-    # Today's access count
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_access = await db.access_logs.count_documents({
-        "timestamp": {"$gte": today_start.isoformat()}
-    })
+    summary, today_series = await asyncio.gather(
+        kpi_engine.status_summary(),
+        kpi_engine.bucketed(
+            {"access_logs": [metric("today_access_count", "timestamp")]},
+            [today_start, today_start + timedelta(days=1)]
+        )
+    )
     
     return {
-        "total_members": total_members,
-        "active_members": active_members,
-        "blocked_members": blocked_members,
-        "pending_invoices": pending_invoices,
-        "overdue_invoices": overdue_invoices,
-        "total_revenue": total_revenue,
-        "today_access_count": today_access
+        **summary,
+        "today_access_count": today_series["today_access_count"][0]
     }
 
 
@@ -5571,102 +5747,87 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
 @api_router.get("/dashboard/sales-comparison")
 async def get_sales_comparison(current_user: User = Depends(get_current_user)):
     """Get sales comparison data: current month vs target vs previous month vs last year"""
-    from datetime import datetime, timedelta
+    import calendar
     
     now = datetime.now(timezone.utc)
     current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    current_month_end = (current_month_start + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
+    next_month_start = (current_month_start + timedelta(days=32)).replace(day=1)
+    days_in_month = calendar.monthrange(current_month_start.year, current_month_start.month)[1]
     
     # Previous month
-    previous_month_end = current_month_start - timedelta(seconds=1)
-    previous_month_start = previous_month_end.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    previous_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
+    days_in_previous_month = calendar.monthrange(previous_month_start.year, previous_month_start.month)[1]
     
     # Last year same month
     last_year_month_start = current_month_start.replace(year=current_month_start.year - 1)
-    last_year_month_end = current_month_end.replace(year=current_month_end.year - 1)
+    last_year_next_month_start = next_month_start.replace(year=next_month_start.year - 1)
+    days_in_last_year_month = calendar.monthrange(last_year_month_start.year, last_year_month_start.month)[1]
+    
+    def period_facet(start: datetime, end: datetime) -> list:
+        # created_at is stored as an ISO string, so the day of month is characters 8-9
+        return [
+            {"$match": {"created_at": {"$gte": start.isoformat(), "$lt": end.isoformat()}}},
+            {"$group": {
+                "_id": {"$toInt": {"$substrBytes": ["$created_at", 8, 2]}},
+                "total": {"$sum": "$amount"}
+            }}
+        ]
+    
+    # One round-trip: daily sums for all three periods
+    result = await db.invoices.aggregate([
+        {
+            "$match": {
+                "status": "paid",
+                "$or": [
+                    {"created_at": {"$gte": current_month_start.isoformat(), "$lt": next_month_start.isoformat()}},
+                    {"created_at": {"$gte": previous_month_start.isoformat(), "$lt": current_month_start.isoformat()}},
+                    {"created_at": {"$gte": last_year_month_start.isoformat(), "$lt": last_year_next_month_start.isoformat()}}
+                ]
+            }
+        },
+        {
+            "$facet": {
+                "current": period_facet(current_month_start, next_month_start),
+                "previous": period_facet(previous_month_start, current_month_start),
+                "last_year": period_facet(last_year_month_start, last_year_next_month_start)
+            }
+        }
+    ]).to_list(1)
+    facets = result[0] if result else {}
+    
+    def daily_totals(buckets: list) -> dict:
+        return {bucket["_id"]: bucket["total"] for bucket in buckets}
+    
+    current_daily = daily_totals(facets.get("current", []))
+    previous_daily = daily_totals(facets.get("previous", []))
+    last_year_daily = daily_totals(facets.get("last_year", []))
     
-    # Get daily sales for each period
-    days_in_month = (current_month_end - current_month_start).days + 1
+    # Monthly target from billing settings
+    billing_settings = await db.billing_settings.find_one({}, {"_id": 0, "monthly_sales_target": 1})
+    monthly_target = (billing_settings or {}).get("monthly_sales_target") or BillingSettings.model_fields["monthly_sales_target"].default
     
-    # Build daily data structure
+    # Build daily data structure with running totals.
+    # Shorter comparison months (e.g. Feb vs Mar) hold their final total for the remaining days.
     daily_data = []
+    current_running = 0
+    previous_running = 0
+    last_year_running = 0
     for day in range(1, days_in_month + 1):
         date_obj = current_month_start.replace(day=day)
         
-        # Current month sales up to today
-        if date_obj <= now:
-            current_sales = await db.invoices.aggregate([
-                {
-                    "$match": {
-                        "status": "paid",
-                        "created_at": {
-                            "$gte": current_month_start.isoformat(),
-                            "$lte": date_obj.replace(hour=23, minute=59, second=59).isoformat()
-                        }
-                    }
-                },
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]).to_list(1)
-            current_month_sales = current_sales[0]["total"] if current_sales else 0
-        else:
-            current_month_sales = None
-        
-        # Previous month sales (same day, handle month with fewer days)
-        try:
-            prev_month_date = previous_month_start.replace(day=day)
-        except ValueError:
-            # Handle case where previous month has fewer days (e.g., Feb 30)
-            import calendar
-            last_day_prev_month = calendar.monthrange(previous_month_start.year, previous_month_start.month)[1]
-            prev_month_date = previous_month_start.replace(day=min(day, last_day_prev_month))
-        prev_sales = await db.invoices.aggregate([
-            {
-                "$match": {
-                    "status": "paid",
-                    "created_at": {
-                        "$gte": previous_month_start.isoformat(),
-                        "$lte": prev_month_date.replace(hour=23, minute=59, second=59).isoformat()
-                    }
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]).to_list(1)
-        prev_month_sales = prev_sales[0]["total"] if prev_sales else 0
-        
-        # Last year sales (same day, handle leap year issues)
-        try:
-            last_year_date = last_year_month_start.replace(day=day)
-        except ValueError:
-            # Handle case where last year month has fewer days (e.g., Feb 29 in non-leap year)
-            import calendar
-            last_day_last_year = calendar.monthrange(last_year_month_start.year, last_year_month_start.month)[1]
-            last_year_date = last_year_month_start.replace(day=min(day, last_day_last_year))
-        last_year_sales_result = await db.invoices.aggregate([
-            {
-                "$match": {
-                    "status": "paid",
-                    "created_at": {
-                        "$gte": last_year_month_start.isoformat(),
-                        "$lte": last_year_date.replace(hour=23, minute=59, second=59).isoformat()
-                    }
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]).to_list(1)
-        last_year_sales = last_year_sales_result[0]["total"] if last_year_sales_result else 0
-        
-        # Target (linear progression throughout month)
-        # For now, using a simple calculation: get monthly target from settings or use 100k default
-        monthly_target = 100000  # This should come from settings
-        daily_target = (monthly_target / days_in_month) * day
+        current_running += current_daily.get(day, 0)
+        if day <= days_in_previous_month:
+            previous_running += previous_daily.get(day, 0)
+        if day <= days_in_last_year_month:
+            last_year_running += last_year_daily.get(day, 0)
         
         daily_data.append({
             "DisplayDate": date_obj.isoformat(),
             "day": day,
-            "MonthSales": current_month_sales,
-            "PrevMonthSales": prev_month_sales,
-            "LastYearSales": last_year_sales,
-            "Target": daily_target
+            "MonthSales": current_running if date_obj <= now else None,
+            "PrevMonthSales": previous_running,
+            "LastYearSales": last_year_running,
+            "Target": (monthly_target / days_in_month) * day
         })
     
     return {
@@ -5678,90 +5839,23 @@ async def get_sales_comparison(current_user: User = Depends(get_current_user)):
 @api_router.get("/dashboard/kpi-trends")
 async def get_kpi_trends(current_user: User = Depends(get_current_user)):
     """Get 12-week KPI trends for sparklines"""
-    from datetime import datetime, timedelta
-    
     now = datetime.now(timezone.utc)
-    weeks_data = []
+    boundaries = [now - timedelta(weeks=12 - i) for i in range(13)]
     
-    for week_offset in range(11, -1, -1):
-        week_start = now - timedelta(weeks=week_offset + 1)
-        week_end = now - timedelta(weeks=week_offset)
-        
-        # People Registered (new members)
-        new_members = await db.members.count_documents({
-            "created_at": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            }
-        })
-        
-        # Memberships Started (new active memberships)
-        memberships_started = await db.members.count_documents({
-            "membership_start_date": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            },
-            "membership_status": "active"
-        })
-        
-        # Attendance (access logs)
-        attendance = await db.access_logs.count_documents({
-            "timestamp": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            }
-        })
-        
-        # Bookings
-        bookings = await db.bookings.count_documents({
-            "booking_date": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            }
-        })
-        
-        # Booking Attendance
-        booking_attendance = await db.bookings.count_documents({
-            "booking_date": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            },
-            "status": "attended"
-        })
-        
-        # Product Sales (from POS)
-        product_sales_result = await db.pos_transactions.aggregate([
-            {
-                "$match": {
-                    "transaction_type": "product_sale",
-                    "created_at": {
-                        "$gte": week_start.isoformat(),
-                        "$lt": week_end.isoformat()
-                    }
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
-        ]).to_list(1)
-        product_sales = product_sales_result[0]["total"] if product_sales_result else 0
-        
-        # Tasks Created
-        tasks_created = await db.tasks.count_documents({
-            "created_at": {
-                "$gte": week_start.isoformat(),
-                "$lt": week_end.isoformat()
-            }
-        })
-        
+    series = await kpi_engine.bucketed(KPI_TREND_METRICS, boundaries)
+    
+    weeks_data = []
+    for i in range(12):
         weeks_data.append({
-            "week_start": week_start.strftime("%Y-%m-%d"),
-            "week_end": week_end.strftime("%Y-%m-%d"),
-            "people_registered": new_members,
-            "memberships_started": memberships_started,
-            "attendance": attendance,
-            "bookings": bookings,
-            "booking_attendance": booking_attendance,
-            "product_sales": round(product_sales, 2),
-            "tasks": tasks_created
+            "week_start": boundaries[i].strftime("%Y-%m-%d"),
+            "week_end": boundaries[i + 1].strftime("%Y-%m-%d"),
+            "people_registered": series["people_registered"][i],
+            "memberships_started": series["memberships_started"][i],
+            "attendance": series["attendance"][i],
+            "bookings": series["bookings"][i],
+            "booking_attendance": series["booking_attendance"][i],
+            "product_sales": round(series["product_sales"][i], 2),
+            "tasks": series["tasks"][i]
         })
     
     return weeks_data
@@ -5821,8 +5915,6 @@ async def get_birthdays_today(current_user: User = Depends(get_current_user)):
 @api_router.get("/dashboard/snapshot")
 async def get_dashboard_snapshot(current_user: User = Depends(get_current_user)):
     """Get Today vs Yesterday vs Growth metrics for dashboard snapshot cards"""
-    from datetime import datetime, timedelta
-    
     now = datetime.now(timezone.utc)
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday_start = today_start - timedelta(days=1)
@@ -5830,92 +5922,42 @@ async def get_dashboard_snapshot(current_user: User = Depends(get_current_user))
     last_year_30_days_start = now - timedelta(days=395)  # 365 + 30 days ago
     last_year_30_days_end = now - timedelta(days=365)
     
-    # TODAY STATS
-    # People registered today (members created today)
-    today_registered = await db.members.count_documents({
-        "created_at": {"$gte": today_start.isoformat()}
-    })
+    # Non-overlapping buckets; every window below is a sum of consecutive buckets
+    boundaries = [
+        last_year_30_days_start,      # 0: same 30 days last year
+        last_year_30_days_end,        # 1: (gap, unused)
+        last_30_days_start,           # 2: last 30 days up to yesterday
+        yesterday_start,              # 3: yesterday
+        today_start,                  # 4: today so far
+        now,                          # 5: later today (future-dated records)
+        today_start + timedelta(days=1)
+    ]
+    series = await kpi_engine.bucketed(SNAPSHOT_METRICS, boundaries)
     
-    # Memberships commenced today (join_date is today)
-    today_commenced = await db.members.count_documents({
-        "join_date": {"$gte": today_start.isoformat()}
-    })
+    def today(name):
+        return series[name][4] + series[name][5]
     
-    # Attendance today (access logs)
-    today_attendance = await db.access_logs.count_documents({
-        "timestamp": {"$gte": today_start.isoformat()},
-        "status": "granted"
-    })
+    def last_30_days(name, until_now=False):
+        buckets = series[name][2:5] if until_now else series[name][2:6]
+        return sum(buckets)
+    
+    # TODAY STATS
+    today_registered = today("registered")
+    today_commenced = today("commenced")
+    today_attendance = today("attendance")
     
     # YESTERDAY STATS
-    yesterday_registered = await db.members.count_documents({
-        "created_at": {
-            "$gte": yesterday_start.isoformat(),
-            "$lt": today_start.isoformat()
-        }
-    })
-    
-    yesterday_commenced = await db.members.count_documents({
-        "join_date": {
-            "$gte": yesterday_start.isoformat(),
-            "$lt": today_start.isoformat()
-        }
-    })
-    
-    yesterday_attendance = await db.access_logs.count_documents({
-        "timestamp": {
-            "$gte": yesterday_start.isoformat(),
-            "$lt": today_start.isoformat()
-        },
-        "status": "granted"
-    })
+    yesterday_registered = series["registered"][3]
+    yesterday_commenced = series["commenced"][3]
+    yesterday_attendance = series["attendance"][3]
     
     # GROWTH METRICS (Last 30 Days vs Same Period Last Year)
-    # Memberships sold last 30 days
-    memberships_sold_30d = await db.members.count_documents({
-        "join_date": {"$gte": last_30_days_start.isoformat()}
-    })
-    
-    # Memberships sold same period last year
-    memberships_sold_last_year = await db.members.count_documents({
-        "join_date": {
-            "$gte": last_year_30_days_start.isoformat(),
-            "$lt": last_year_30_days_end.isoformat()
-        }
-    })
-    
-    # Memberships expired last 30 days
-    memberships_expired_30d = await db.members.count_documents({
-        "expiry_date": {
-            "$gte": last_30_days_start.isoformat(),
-            "$lt": now.isoformat()
-        },
-        "membership_status": {"$in": ["expired", "cancelled"]}
-    })
-    
-    # Memberships expired same period last year
-    memberships_expired_last_year = await db.members.count_documents({
-        "expiry_date": {
-            "$gte": last_year_30_days_start.isoformat(),
-            "$lt": last_year_30_days_end.isoformat()
-        },
-        "membership_status": {"$in": ["expired", "cancelled"]}
-    })
-    
-    # Attendance last 30 days
-    attendance_30d = await db.access_logs.count_documents({
-        "timestamp": {"$gte": last_30_days_start.isoformat()},
-        "status": "granted"
-    })
-    
-    # Attendance same period last year
-    attendance_last_year = await db.access_logs.count_documents({
-        "timestamp": {
-            "$gte": last_year_30_days_start.isoformat(),
-            "$lt": last_year_30_days_end.isoformat()
-        },
-        "status": "granted"
-    })
+    memberships_sold_30d = last_30_days("commenced")
+    memberships_sold_last_year = series["commenced"][0]
+    memberships_expired_30d = last_30_days("expired", until_now=True)
+    memberships_expired_last_year = series["expired"][0]
+    attendance_30d = last_30_days("attendance")
+    attendance_last_year = series["attendance"][0]
     
     # Calculate growth percentages
     def calculate_growth(current, previous):
@@ -6009,104 +6051,14 @@ async def get_recent_members(period: str = "today", current_user: User = Depends
 # ===================== Phase 2B - Retention Intelligence Routes =====================
 
 @api_router.get("/retention/at-risk-members")
-async def get_at_risk_members(current_user: User = Depends(get_current_user)):
+async def get_at_risk_members(
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    refresh: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     """Get members at high risk of cancellation based on attendance patterns"""
-    from datetime import datetime, timedelta
-    
-    now = datetime.now(timezone.utc)
-    seven_days_ago = now - timedelta(days=7)
-    fourteen_days_ago = now - timedelta(days=14)
-    twenty_eight_days_ago = now - timedelta(days=28)
-    
-    # Get all active members
-    active_members = await db.members.find(
-        {"membership_status": "active"},
-        {"_id": 0}
-    ).to_list(None)
-    
-    at_risk_members = []
-    
-    for member in active_members:
-        risk_score = 0
-        risk_factors = []
-        
-        # Check last visit date
-        last_visit = member.get("last_visit_date")
-        if last_visit:
-            last_visit_dt = datetime.fromisoformat(last_visit) if isinstance(last_visit, str) else last_visit
-            days_since_visit = (now - last_visit_dt).days
-            
-            if days_since_visit >= 28:
-                risk_score += 40
-                risk_factors.append(f"No visit in {days_since_visit} days")
-            elif days_since_visit >= 14:
-                risk_score += 25
-                risk_factors.append(f"No visit in {days_since_visit} days")
-            elif days_since_visit >= 7:
-                risk_score += 10
-                risk_factors.append(f"No visit in {days_since_visit} days")
-        else:
-            # No last visit recorded
-            risk_score += 30
-            risk_factors.append("No attendance recorded")
-        
-        # Check if member is a debtor
-        if member.get("is_debtor"):
-            risk_score += 20
-            risk_factors.append("Outstanding payment")
-        
-        # Check missing data
-        if not member.get("phone"):
-            risk_score += 5
-            risk_factors.append("No contact phone")
-        
-        # Check membership expiry
-        expiry_date = member.get("expiry_date")
-        if expiry_date:
-            expiry_dt = datetime.fromisoformat(expiry_date) if isinstance(expiry_date, str) else expiry_date
-            days_until_expiry = (expiry_dt - now).days
-            
-            if 0 < days_until_expiry <= 30:
-                risk_score += 15
-                risk_factors.append(f"Expires in {days_until_expiry} days")
-        
-        # Categorize risk level
-        if risk_score >= 50:
-            risk_level = "critical"
-        elif risk_score >= 30:
-            risk_level = "high"
-        elif risk_score >= 15:
-            risk_level = "medium"
-        else:
-            continue  # Skip low-risk members
-        
-        at_risk_members.append({
-            "id": member.get("id"),
-            "first_name": member.get("first_name"),
-            "last_name": member.get("last_name"),
-            "full_name": f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-            "email": member.get("email"),
-            "phone": member.get("phone"),
-            "last_visit_date": last_visit,
-            "days_since_visit": days_since_visit if last_visit else None,
-            "membership_type": member.get("membership_type"),
-            "is_debtor": member.get("is_debtor", False),
-            "risk_score": risk_score,
-            "risk_level": risk_level,
-            "risk_factors": risk_factors,
-            "expiry_date": member.get("expiry_date")
-        })
-    
-    # Sort by risk score descending
-    at_risk_members.sort(key=lambda x: x["risk_score"], reverse=True)
-    
-    return {
-        "total": len(at_risk_members),
-        "critical": len([m for m in at_risk_members if m["risk_level"] == "critical"]),
-        "high": len([m for m in at_risk_members if m["risk_level"] == "high"]),
-        "medium": len([m for m in at_risk_members if m["risk_level"] == "medium"]),
-        "members": at_risk_members
-    }
+    return await risk_engine.retention_at_risk(skip=skip, limit=limit, force_refresh=refresh)
 
 
 @api_router.get("/retention/retention-alerts")
@@ -6485,44 +6437,25 @@ async def get_membership_duration(current_user: User = Depends(get_current_user)
 @api_router.get("/charts/attendance-by-day")
 async def get_attendance_by_day(current_user: User = Depends(get_current_user)):
     """Get attendance distribution by day of week"""
-    from datetime import datetime, timedelta
-    
-    # Get access logs from last 30 days
+    # Read the daily check-in rollup for the last 30 days
     now = datetime.now(timezone.utc)
     thirty_days_ago = now - timedelta(days=30)
     
-    access_logs = await db.access_logs.find(
-        {
-            "timestamp": {"$gte": thirty_days_ago.isoformat()},
-            "status": "granted"
-        },
-        {"_id": 0, "timestamp": 1}
-    ).to_list(None)
+    rows = await rollups.rows(
+        CHECKIN_ROLLUP,
+        thirty_days_ago.strftime("%Y-%m-%d"),
+        now.strftime("%Y-%m-%d"),
+        {"status": "granted"}
+    )
     
     # Count by day of week
-    day_counts = {
-        "Monday": 0,
-        "Tuesday": 0,
-        "Wednesday": 0,
-        "Thursday": 0,
-        "Friday": 0,
-        "Saturday": 0,
-        "Sunday": 0
-    }
-    
-    for log in access_logs:
-        timestamp = log.get("timestamp")
-        if timestamp:
-            try:
-                dt = datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
-                day_name = dt.strftime("%A")
-                if day_name in day_counts:
-                    day_counts[day_name] += 1
-            except:
-                continue
+    day_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    day_counts = {day: 0 for day in day_order}
+    for row in rows:
+        day_name = datetime.strptime(row["date"], "%Y-%m-%d").strftime("%A")
+        day_counts[day_name] += row.get("count", 0)
     
     # Format for chart (maintain day order)
-    day_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
     chart_data = [
         {"day": day, "count": day_counts[day]}
         for day in day_order
@@ -6942,52 +6875,31 @@ async def get_revenue_breakdown(
     """
     Advanced revenue analytics with breakdown by membership type and payment method
     """
-    from datetime import datetime, timedelta
     from collections import defaultdict
     
     # Calculate date range
     end_date = datetime.now(timezone.utc)
     start_date = end_date - timedelta(days=period_months * 30)
     
-    # Get all invoices in period
-    invoices = await db.invoices.find(
-        {
-            "status": "paid",
-            "paid_date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
-        },
-        {"_id": 0}
-    ).to_list(None)
+    # Daily revenue rollup rows for the period
+    rows = await rollups.rows(REVENUE_ROLLUP, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    membership_types = await db.membership_types.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+    type_names = {mt["id"]: mt["name"] for mt in membership_types}
     
     # Initialize aggregations
     by_membership_type = defaultdict(float)
     by_payment_method = defaultdict(float)
+    by_payment_source = defaultdict(float)
     monthly_revenue = defaultdict(float)
     total_revenue = 0.0
     
-    for invoice in invoices:
-        amount = invoice.get("total_amount", 0)
+    for row in rows:
+        amount = row.get("amount", 0)
         total_revenue += amount
-        
-        # By membership type
-        membership_type = invoice.get("membership_type", "Unknown")
-        by_membership_type[membership_type] += amount
-        
-        # By payment method
-        payment_method = invoice.get("payment_method", "Unknown")
-        by_payment_method[payment_method] += amount
-        
-        # By month
-        paid_date = invoice.get("paid_date")
-        if paid_date:
-            try:
-                if isinstance(paid_date, str):
-                    date_obj = datetime.fromisoformat(paid_date)
-                else:
-                    date_obj = paid_date
-                month_key = date_obj.strftime("%Y-%m")
-                monthly_revenue[month_key] += amount
-            except:
-                pass
+        by_membership_type[type_names.get(row["membership_type_id"], "Unknown")] += amount
+        by_payment_method[row["payment_method"]] += amount
+        by_payment_source[row["payment_source"]] += amount
+        monthly_revenue[row["date"][:7]] += amount
     
     # Get active members for ARPU calculation
     active_members = await db.members.count_documents(
@@ -7009,6 +6921,11 @@ async def get_revenue_breakdown(
         for k, v in sorted(by_payment_method.items(), key=lambda x: x[1], reverse=True)
     ]
     
+    payment_source_data = [
+        {"source": k, "revenue": round(v, 2), "percentage": round(v / total_revenue * 100, 1) if total_revenue > 0 else 0}
+        for k, v in sorted(by_payment_source.items(), key=lambda x: x[1], reverse=True)
+    ]
+    
     monthly_data = [
         {"month": k, "revenue": round(v, 2)}
         for k, v in sorted(monthly_revenue.items())
@@ -7028,6 +6945,7 @@ async def get_revenue_breakdown(
         },
         "by_membership_type": membership_type_data,
         "by_payment_method": payment_method_data,
+        "by_payment_source": payment_source_data,
         "monthly_trend": monthly_data
     }
 
@@ -7035,73 +6953,76 @@ async def get_revenue_breakdown(
 @api_router.get("/analytics/geographic-distribution")
 async def get_geographic_distribution(current_user: User = Depends(get_current_user)):
     """
-    Member distribution by postcode/location for heatmap visualization
+    Member distribution by postcode/location for heatmap visualization.
+    Grouped in one aggregation; suburb and geohash cells come from the
+    geo_suburb/geohash fields written by the geocoder.
     """
-    from collections import Counter
-    
-    # Get all active members with addresses
-    members = await db.members.find(
-        {"membership_status": {"$in": ["active", "frozen"]}},
-        {"_id": 0, "address": 1, "postcode": 1, "city": 1, "state": 1}
-    ).to_list(None)
+    def non_empty(field):
+        return {"$match": {field: {"$nin": [None, ""]}}}
+    
+    def count_by(key):
+        return [{"$group": {"_id": key, "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+    
+    # Normalize postcode (first 3-4 digits for grouping)
+    postcode_str = {"$toString": "$postcode"}
+    
+    result = await db.members.aggregate([
+        {"$match": {"membership_status": {"$in": ["active", "frozen"]}}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "by_postcode": [
+                non_empty("postcode"),
+                {"$match": {"$expr": {"$gte": [{"$strLenCP": postcode_str}, 3]}}},
+                *count_by({"$substrCP": [postcode_str, 0, 4]})
+            ],
+            "by_city": [non_empty("city"), *count_by("$city")],
+            "by_state": [non_empty("state"), *count_by("$state")],
+            "by_suburb": [non_empty("geo_suburb"), *count_by("$geo_suburb")],
+            # Precision-5 geohash cells are roughly 5km x 5km
+            "by_geohash": [non_empty("geohash"), *count_by({"$substrCP": ["$geohash", 0, 5]})]
+        }}
+    ]).to_list(1)
+    facets = result[0] if result else {}
     
-    # Extract postcodes and cities
-    postcodes = []
-    cities = []
-    states = []
+    total_members = facets["total"][0]["count"] if facets.get("total") else 0
     
-    for member in members:
-        postcode = member.get("postcode")
-        if postcode:
-            # Normalize postcode (first 3-4 digits for grouping)
-            postcode_str = str(postcode)
-            if len(postcode_str) >= 3:
-                postcodes.append(postcode_str[:4] if len(postcode_str) >= 4 else postcode_str[:3])
-        
-        city = member.get("city")
-        if city:
-            cities.append(city)
-        
-        state = member.get("state")
-        if state:
-            states.append(state)
-    
-    # Count occurrences
-    postcode_counts = Counter(postcodes)
-    city_counts = Counter(cities)
-    state_counts = Counter(states)
-    
-    # Format for visualization
-    postcode_data = [
-        {"postcode": k, "count": v, "percentage": round(v / len(postcodes) * 100, 1) if len(postcodes) > 0 else 0}
-        for k, v in postcode_counts.most_common(20)  # Top 20 postcodes
-    ]
+    def distribution(name, label, top=None):
+        groups = facets.get(name, [])
+        total = sum(g["count"] for g in groups)
+        return total, [
+            {label: g["_id"], "count": g["count"], "percentage": round(g["count"] / total * 100, 1) if total > 0 else 0}
+            for g in (groups[:top] if top else groups)
+        ]
     
-    city_data = [
-        {"city": k, "count": v, "percentage": round(v / len(cities) * 100, 1) if len(cities) > 0 else 0}
-        for k, v in city_counts.most_common(10)  # Top 10 cities
-    ]
+    with_postcode, postcode_data = distribution("by_postcode", "postcode", 20)  # Top 20 postcodes
+    with_city, city_data = distribution("by_city", "city", 10)  # Top 10 cities
+    with_state, state_data = distribution("by_state", "state")
+    with_suburb, suburb_data = distribution("by_suburb", "suburb", 20)
+    with_geohash, geohash_data = distribution("by_geohash", "geohash", 50)
     
-    state_data = [
-        {"state": k, "count": v, "percentage": round(v / len(states) * 100, 1) if len(states) > 0 else 0}
-        for k, v in state_counts.most_common()
-    ]
+    def coverage(count):
+        return round(count / total_members * 100, 1) if total_members > 0 else 0
     
     return {
         "summary": {
-            "total_members": len(members),
-            "with_postcode": len(postcodes),
-            "with_city": len(cities),
-            "with_state": len(states),
+            "total_members": total_members,
+            "with_postcode": with_postcode,
+            "with_city": with_city,
+            "with_state": with_state,
+            "with_suburb": with_suburb,
+            "with_geohash": with_geohash,
             "coverage": {
-                "postcode": round(len(postcodes) / len(members) * 100, 1) if len(members) > 0 else 0,
-                "city": round(len(cities) / len(members) * 100, 1) if len(members) > 0 else 0,
-                "state": round(len(states) / len(members) * 100, 1) if len(members) > 0 else 0
+                "postcode": coverage(with_postcode),
+                "city": coverage(with_city),
+                "state": coverage(with_state),
+                "geohash": coverage(with_geohash)
             }
         },
         "by_postcode": postcode_data,
         "by_city": city_data,
-        "by_state": state_data
+        "by_state": state_data,
+        "by_suburb": suburb_data,
+        "by_geohash": geohash_data
     }
 
 
@@ -7113,58 +7034,42 @@ async def get_attendance_deep_dive(
     """
     Deep-dive attendance analytics: peak hours, frequency distribution, patterns
     """
-    from datetime import datetime, timedelta
-    from collections import defaultdict, Counter
+    from collections import defaultdict
     
     # Calculate date range
     end_date = datetime.now(timezone.utc)
     start_date = end_date - timedelta(days=days_back)
     
-    # Get all access logs in period
-    access_logs = await db.access_logs.find(
-        {
-            "access_time": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
-            "access_granted": True
-        },
-        {"_id": 0}
-    ).to_list(None)
+    # Hour, weekday and week counts from the daily check-in rollup
+    rows = await rollups.rows(
+        CHECKIN_ROLLUP,
+        start_date.strftime("%Y-%m-%d"),
+        end_date.strftime("%Y-%m-%d"),
+        {"status": "granted"}
+    )
     
     # Initialize analytics
     hourly_distribution = defaultdict(int)
     daily_distribution = defaultdict(int)
-    member_frequency = defaultdict(int)
     weekly_pattern = defaultdict(int)
     
-    for log in access_logs:
-        access_time_str = log.get("access_time")
-        member_id = log.get("member_id")
-        
-        if access_time_str:
-            try:
-                if isinstance(access_time_str, str):
-                    access_dt = datetime.fromisoformat(access_time_str)
-                else:
-                    access_dt = access_time_str
-                
-                # Hour of day (0-23)
-                hour = access_dt.hour
-                hourly_distribution[hour] += 1
-                
-                # Day of week (0=Monday, 6=Sunday)
-                day_of_week = access_dt.weekday()
-                day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-                daily_distribution[day_names[day_of_week]] += 1
-                
-                # Week number for trends
-                week_key = access_dt.strftime("%Y-W%U")
-                weekly_pattern[week_key] += 1
-                
-                # Member frequency
-                if member_id:
-                    member_frequency[member_id] += 1
-                    
-            except:
-                pass
+    for row in rows:
+        count = row.get("count", 0)
+        day = datetime.strptime(row["date"], "%Y-%m-%d")
+        hourly_distribution[row["hour"]] += count
+        daily_distribution[day.strftime("%A")] += count
+        weekly_pattern[day.strftime("%Y-W%U")] += count
+    total_visits = sum(hourly_distribution.values())
+    
+    # Visits per member, grouped server-side
+    member_counts = await db.access_logs.aggregate([
+        {"$match": {
+            "timestamp": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
+            "status": "granted"
+        }},
+        {"$group": {"_id": "$member_id", "visits": {"$sum": 1}}}
+    ]).to_list(None)
+    member_frequency = {row["_id"]: row["visits"] for row in member_counts if row["_id"]}
     
     # Find peak hours (top 5)
     peak_hours = sorted(hourly_distribution.items(), key=lambda x: x[1], reverse=True)[:5]
@@ -7172,7 +7077,7 @@ async def get_attendance_deep_dive(
         {
             "hour": f"{h:02d}:00", 
             "count": count,
-            "percentage": round(count / len(access_logs) * 100, 1) if len(access_logs) > 0 else 0
+            "percentage": round(count / total_visits * 100, 1) if total_visits > 0 else 0
         }
         for h, count in peak_hours
     ]
@@ -7217,7 +7122,7 @@ async def get_attendance_deep_dive(
     
     # Calculate average visits per member
     total_unique_members = len(member_frequency)
-    avg_visits = len(access_logs) / total_unique_members if total_unique_members > 0 else 0
+    avg_visits = total_visits / total_unique_members if total_unique_members > 0 else 0
     
     # Weekly trend
     weekly_trend_data = [
@@ -7227,7 +7132,7 @@ async def get_attendance_deep_dive(
     
     return {
         "summary": {
-            "total_visits": len(access_logs),
+            "total_visits": total_visits,
             "unique_members": total_unique_members,
             "avg_visits_per_member": round(avg_visits, 1),
             "period_days": days_back,
@@ -7244,58 +7149,89 @@ async def get_attendance_deep_dive(
     }
 
 
+async def paid_revenue_by_member(statuses: List[str], amount_field: str) -> Dict[str, dict]:
+    """
+    Revenue (sum of amount_field) and invoice count per member from a single
+    $group over invoices
+    """
+    rows = await db.invoices.aggregate([
+        {"$match": {"status": {"$in": statuses}}},
+        {"$group": {
+            "_id": "$member_id",
+            "revenue": {"$sum": f"${amount_field}"},
+            "invoices": {"$sum": 1}
+        }}
+    ]).to_list(None)
+    return {row["_id"]: row for row in rows}
+
+def push_top_n(heap: list, n: int, score: float, seq: int, item: dict):
+    """Keep the n highest-scoring items in a min-heap"""
+    if n < 1:
+        return
+    if len(heap) < n:
+        heapq.heappush(heap, (score, seq, item))
+    elif score > heap[0][0]:
+        heapq.heapreplace(heap, (score, seq, item))
+
+def sorted_top_n(heap: list) -> list:
+    return [item for _, _, item in sorted(heap, key=lambda x: (x[0], -x[1]), reverse=True)]
+
+LTV_MEMBER_PROJECTION = {
+    "_id": 0, "id": 1, "first_name": 1, "last_name": 1, "full_name": 1,
+    "membership_type": 1, "membership_type_id": 1, "membership_status": 1, "status": 1, "join_date": 1
+}
+
 @api_router.get("/analytics/member-lifetime-value")
-async def get_member_lifetime_value(current_user: User = Depends(get_current_user)):
+async def get_member_lifetime_value(
+    top_n: int = Query(10, ge=1),
+    current_user: User = Depends(get_current_user)
+):
     """
     Calculate and analyze member lifetime value by membership type
     """
-    from datetime import datetime
-    from collections import defaultdict
+    revenue_by_member = await paid_revenue_by_member(["paid"], "total_amount")
+    membership_types = await db.membership_types.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+    type_names = {mt["id"]: mt["name"] for mt in membership_types}
+    
+    # Per-type running totals and a bounded top-N heap; members are streamed, not materialized
+    type_totals = {}
+    top_heap = []
+    total_ltv = 0.0
+    members_analyzed = 0
+    now = datetime.now(timezone.utc)
     
-    # Get all members with their invoices
-    members = await db.members.find(
+    cursor = db.members.find(
         {"membership_status": {"$in": ["active", "frozen", "cancelled"]}},
-        {"_id": 0}
-    ).to_list(None)
-    
-    # Initialize LTV tracking
-    ltv_by_type = defaultdict(list)
-    ltv_by_status = defaultdict(list)
-    
-    for member in members:
+        LTV_MEMBER_PROJECTION
+    )
+    async for member in cursor:
         member_id = member.get("id")
-        membership_type = member.get("membership_type", "Unknown")
+        membership_type = member.get("membership_type") or type_names.get(member.get("membership_type_id"), "Unknown")
         membership_status = member.get("membership_status", "active")
         join_date = member.get("join_date")
         
         # Calculate membership duration in months
+        duration_months = 1
         if join_date:
             try:
-                if isinstance(join_date, str):
-                    join_dt = datetime.fromisoformat(join_date)
-                else:
-                    join_dt = join_date
-                
-                duration_days = (datetime.now(timezone.utc) - join_dt).days
-                duration_months = max(1, duration_days / 30)
+                join_dt = datetime.fromisoformat(join_date) if isinstance(join_date, str) else join_date
+                duration_months = max(1, (now - join_dt).days / 30)
             except:
                 duration_months = 1
-        else:
-            duration_months = 1
         
-        # Get total revenue from this member
-        invoices = await db.invoices.find(
-            {"member_id": member_id, "status": "paid"},
-            {"_id": 0, "total_amount": 1}
-        ).to_list(None)
+        revenue = revenue_by_member.get(member_id, {})
+        ltv = revenue.get("revenue", 0)
+        monthly_value = ltv / duration_months if duration_months > 0 else 0
         
-        total_revenue = sum(inv.get("total_amount", 0) for inv in invoices)
+        totals = type_totals.setdefault(membership_type, {"count": 0, "ltv": 0.0, "monthly": 0.0, "duration": 0.0})
+        totals["count"] += 1
+        totals["ltv"] += ltv
+        totals["monthly"] += monthly_value
+        totals["duration"] += duration_months
+        total_ltv += ltv
+        members_analyzed += 1
         
-        # Calculate LTV metrics
-        ltv = total_revenue
-        monthly_value = total_revenue / duration_months if duration_months > 0 else 0
-        
-        ltv_data = {
+        push_top_n(top_heap, top_n, ltv, members_analyzed, {
             "member_id": member_id,
             "member_name": f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
             "membership_type": membership_type,
@@ -7303,225 +7239,47 @@ async def get_member_lifetime_value(current_user: User = Depends(get_current_use
             "ltv": round(ltv, 2),
             "monthly_value": round(monthly_value, 2),
             "duration_months": round(duration_months, 1),
-            "total_invoices": len(invoices)
-        }
-        
-        ltv_by_type[membership_type].append(ltv_data)
-        ltv_by_status[membership_status].append(ltv_data)
+            "total_invoices": revenue.get("invoices", 0)
+        })
     
     # Calculate averages by membership type
-    type_summary = []
-    for mtype, members_data in ltv_by_type.items():
-        if members_data:
-            avg_ltv = sum(m["ltv"] for m in members_data) / len(members_data)
-            avg_monthly = sum(m["monthly_value"] for m in members_data) / len(members_data)
-            avg_duration = sum(m["duration_months"] for m in members_data) / len(members_data)
-            
-            type_summary.append({
-                "membership_type": mtype,
-                "member_count": len(members_data),
-                "avg_ltv": round(avg_ltv, 2),
-                "avg_monthly_value": round(avg_monthly, 2),
-                "avg_duration_months": round(avg_duration, 1),
-                "total_ltv": round(sum(m["ltv"] for m in members_data), 2)
-            })
-    
-    # Sort by avg LTV
+    type_summary = [
+        {
+            "membership_type": mtype,
+            "member_count": totals["count"],
+            "avg_ltv": round(totals["ltv"] / totals["count"], 2),
+            "avg_monthly_value": round(totals["monthly"] / totals["count"], 2),
+            "avg_duration_months": round(totals["duration"] / totals["count"], 1),
+            "total_ltv": round(totals["ltv"], 2)
+        }
+        for mtype, totals in type_totals.items()
+    ]
     type_summary.sort(key=lambda x: x["avg_ltv"], reverse=True)
     
-    # Top 10 highest LTV members
-    all_members_ltv = []
-    for members_data in ltv_by_type.values():
-        all_members_ltv.extend(members_data)
-    
-    all_members_ltv.sort(key=lambda x: x["ltv"], reverse=True)
-    top_members = all_members_ltv[:10]
-    
-    # Calculate overall metrics
-    total_ltv = sum(m["ltv"] for m in all_members_ltv)
-    avg_ltv_overall = total_ltv / len(all_members_ltv) if all_members_ltv else 0
+    avg_ltv_overall = total_ltv / members_analyzed if members_analyzed else 0
     
     return {
         "summary": {
-            "total_members_analyzed": len(all_members_ltv),
+            "total_members_analyzed": members_analyzed,
             "total_lifetime_value": round(total_ltv, 2),
             "avg_ltv_per_member": round(avg_ltv_overall, 2)
         },
         "by_membership_type": type_summary,
-        "top_members": top_members
+        "top_members": sorted_top_n(top_heap)
     }
 
 
 @api_router.get("/analytics/churn-prediction")
-async def get_churn_prediction(current_user: User = Depends(get_current_user)):
+async def get_churn_prediction(
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    refresh: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     """
     Churn prediction and risk scoring for members
     """
-    from datetime import datetime, timedelta
-    from collections import defaultdict
-    
-    # Get all active and frozen members
-    members = await db.members.find(
-        {"membership_status": {"$in": ["active", "frozen"]}},
-        {"_id": 0}
-    ).to_list(None)
-    
-    at_risk_members = []
-    risk_factors = defaultdict(int)
-    
-    today = datetime.now(timezone.utc)
-    thirty_days_ago = today - timedelta(days=30)
-    sixty_days_ago = today - timedelta(days=60)
-    
-    for member in members:
-        member_id = member.get("id")
-        risk_score = 0
-        risk_reasons = []
-        
-        # Factor 1: Last visit date (HIGH IMPACT)
-        last_visit = member.get("last_visit_date")
-        if last_visit:
-            try:
-                if isinstance(last_visit, str):
-                    last_visit_dt = datetime.fromisoformat(last_visit)
-                else:
-                    last_visit_dt = last_visit
-                
-                days_since_visit = (today - last_visit_dt).days
-                
-                if days_since_visit > 60:
-                    risk_score += 30
-                    risk_reasons.append(f"No visit in {days_since_visit} days")
-                    risk_factors["No recent visits (60+ days)"] += 1
-                elif days_since_visit > 30:
-                    risk_score += 15
-                    risk_reasons.append(f"Last visit {days_since_visit} days ago")
-                    risk_factors["Declining attendance (30+ days)"] += 1
-            except:
-                risk_score += 20
-                risk_reasons.append("No visit history")
-                risk_factors["No visit history"] += 1
-        else:
-            risk_score += 20
-            risk_reasons.append("No visit history")
-            risk_factors["No visit history"] += 1
-        
-        # Factor 2: Payment issues (HIGH IMPACT)
-        overdue_invoices = await db.invoices.count_documents({
-            "member_id": member_id,
-            "status": "overdue"
-        })
-        
-        if overdue_invoices > 0:
-            risk_score += 25
-            risk_reasons.append(f"{overdue_invoices} overdue invoice(s)")
-            risk_factors["Payment issues"] += 1
-        
-        # Factor 3: Frozen status (MEDIUM IMPACT)
-        if member.get("membership_status") == "frozen":
-            risk_score += 20
-            risk_reasons.append("Membership frozen")
-            risk_factors["Frozen membership"] += 1
-        
-        # Factor 4: Missing contact information (LOW IMPACT)
-        if not member.get("email") or not member.get("phone"):
-            risk_score += 5
-            risk_reasons.append("Incomplete contact info")
-            risk_factors["Missing contact info"] += 1
-        
-        # Factor 5: Recent attendance decline
-        recent_visits = await db.access_logs.count_documents({
-            "member_id": member_id,
-            "access_granted": True,
-            "access_time": {"$gte": thirty_days_ago.isoformat()}
-        })
-        
-        previous_visits = await db.access_logs.count_documents({
-            "member_id": member_id,
-            "access_granted": True,
-            "access_time": {
-                "$gte": sixty_days_ago.isoformat(),
-                "$lt": thirty_days_ago.isoformat()
-            }
-        })
-        
-        if previous_visits > 0 and recent_visits < previous_visits * 0.5:
-            risk_score += 15
-            risk_reasons.append("Attendance declining 50%+")
-            risk_factors["Attendance decline"] += 1
-        
-        # Classify risk level
-        if risk_score >= 50:
-            risk_level = "Critical"
-            at_risk_members.append({
-                "member_id": member_id,
-                "member_name": f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-                "email": member.get("email"),
-                "phone": member.get("phone"),
-                "membership_type": member.get("membership_type"),
-                "membership_status": member.get("membership_status"),
-                "risk_score": risk_score,
-                "risk_level": risk_level,
-                "risk_reasons": risk_reasons,
-                "last_visit": last_visit
-            })
-        elif risk_score >= 30:
-            risk_level = "High"
-            at_risk_members.append({
-                "member_id": member_id,
-                "member_name": f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-                "email": member.get("email"),
-                "phone": member.get("phone"),
-                "membership_type": member.get("membership_type"),
-                "membership_status": member.get("membership_status"),
-                "risk_score": risk_score,
-                "risk_level": risk_level,
-                "risk_reasons": risk_reasons,
-                "last_visit": last_visit
-            })
-        elif risk_score >= 15:
-            risk_level = "Medium"
-            at_risk_members.append({
-                "member_id": member_id,
-                "member_name": f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-                "email": member.get("email"),
-                "phone": member.get("phone"),
-                "membership_type": member.get("membership_type"),
-                "membership_status": member.get("membership_status"),
-                "risk_score": risk_score,
-                "risk_level": risk_level,
-                "risk_reasons": risk_reasons,
-                "last_visit": last_visit
-            })
-    
-    # Sort by risk score
-    at_risk_members.sort(key=lambda x: x["risk_score"], reverse=True)
-    
-    # Count by risk level
-    critical_count = sum(1 for m in at_risk_members if m["risk_level"] == "Critical")
-    high_count = sum(1 for m in at_risk_members if m["risk_level"] == "High")
-    medium_count = sum(1 for m in at_risk_members if m["risk_level"] == "Medium")
-    
-    # Format risk factors
-    risk_factors_data = [
-        {"factor": k, "count": v}
-        for k, v in sorted(risk_factors.items(), key=lambda x: x[1], reverse=True)
-    ]
-    
-    return {
-        "summary": {
-            "total_members_analyzed": len(members),
-            "at_risk_count": len(at_risk_members),
-            "risk_percentage": round(len(at_risk_members) / len(members) * 100, 1) if len(members) > 0 else 0,
-            "by_risk_level": {
-                "critical": critical_count,
-                "high": high_count,
-                "medium": medium_count
-            }
-        },
-        "at_risk_members": at_risk_members,
-        "common_risk_factors": risk_factors_data
-    }
+    return await risk_engine.churn_prediction(skip=skip, limit=limit, force_refresh=refresh)
 
 
 
@@ -7553,19 +7311,7 @@ async def get_member_points_balance(
     Get points balance for a specific member
     """
     # Get or create points balance
-    balance = await db.points_balances.find_one({"member_id": member_id}, {"_id": 0})
-    
-    if not balance:
-        # Initialize balance
-        balance = {
-            "member_id": member_id,
-            "total_points": 0,
-            "lifetime_points": 0,
-            "last_updated": datetime.now(timezone.utc).isoformat()
-        }
-        await db.points_balances.insert_one(balance.copy())
-    
-    return balance
+    return await points_ledger.get_balance(member_id)
 
 
 @api_router.post("/engagement/points/award")
@@ -7579,53 +7325,13 @@ async def award_points(
     """
     Award points to a member
     """
-    from datetime import datetime
-    import uuid
-    
-    # Get current balance
-    balance = await db.points_balances.find_one({"member_id": member_id}, {"_id": 0})
-    
-    if not balance:
-        balance = {
-            "member_id": member_id,
-            "total_points": 0,
-            "lifetime_points": 0
-        }
-    
-    # Update balance
-    new_total = balance.get("total_points", 0) + points
-    new_lifetime = balance.get("lifetime_points", 0) + points
-    
-    await db.points_balances.update_one(
-        {"member_id": member_id},
-        {
-            "$set": {
-                "total_points": new_total,
-                "lifetime_points": new_lifetime,
-                "last_updated": datetime.now(timezone.utc).isoformat()
-            }
-        },
-        upsert=True
-    )
-    
-    # Record transaction
-    transaction = {
-        "id": str(uuid.uuid4()),
-        "member_id": member_id,
-        "points": points,
-        "transaction_type": "earned",
-        "reason": reason,
-        "reference_id": reference_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.points_transactions.insert_one(transaction.copy())
+    result = await points_ledger.award(member_id, points, reason, reference_id=reference_id)
     
     return {
         "success": True,
-        "new_balance": new_total,
+        "new_balance": result["balance"]["total_points"],
         "points_awarded": points,
-        "transaction_id": transaction["id"]
+        "transaction_id": result["transaction"]["id"]
     }
 
 
@@ -7659,18 +7365,19 @@ async def get_points_leaderboard(
     """
     Get points leaderboard
     """
-    from datetime import datetime, timedelta
+    # Top balances come pre-sorted from the total_points index
+    balances = await points_ledger.leaderboard(limit)
     
-    # Get all balances
-    balances = await db.points_balances.find({}, {"_id": 0}).to_list(None)
+    # Get member details in one query
+    members = await db.members.find(
+        {"id": {"$in": [b["member_id"] for b in balances]}},
+        {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "email": 1, "membership_type": 1}
+    ).to_list(None)
+    members_by_id = {m["id"]: m for m in members}
     
-    # Get member details
     leaderboard = []
     for balance in balances:
-        member = await db.members.find_one(
-            {"id": balance["member_id"]},
-            {"_id": 0, "first_name": 1, "last_name": 1, "email": 1, "membership_type": 1}
-        )
+        member = members_by_id.get(balance["member_id"])
         
         if member:
             leaderboard.append({
@@ -7682,16 +7389,30 @@ async def get_points_leaderboard(
                 "lifetime_points": balance.get("lifetime_points", 0)
             })
     
-    # Sort by total points
-    leaderboard.sort(key=lambda x: x["total_points"], reverse=True)
-    
     return {
         "period": period,
-        "leaderboard": leaderboard[:limit],
-        "total_members": len(leaderboard)
+        "leaderboard": leaderboard,
+        "total_members": await db.points_balances.count_documents({})
     }
 
 
+@api_router.post("/admin/points/compact")
+async def compact_points_transactions(
+    older_than_days: int = 365,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Fold points transactions older than N days into per-member balance
+    snapshots and delete them. Balances are not changed.
+    """
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can compact points history")
+    if older_than_days < 30:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 30")
+    
+    return await points_ledger.compact(older_than_days)
+
+
 @api_router.get("/engagement/search")
 async def global_search(
     query: str,
@@ -7987,7 +7708,7 @@ async def get_member_engagement_score(
     })
     
     # Factor 5: Rewards engagement (0-10 points)
-    points_balance = await db.points_balances.find_one({"member_id": member_id}, {"_id": 0})
+    points_balance = await db.points_balances.find_one({"member_id": member_id}, {"_id": 0, "lifetime_points": 1})
     points_score = 0
     
     if points_balance:
@@ -8347,6 +8068,7 @@ async def create_lead_source(
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     await db.lead_sources.insert_one(source)
+    reference_cache.invalidate("lead_sources")
     # Remove MongoDB's _id before returning
     source.pop("_id", None)
     return {"success": True, "source": source}
@@ -8366,6 +8088,7 @@ async def update_lead_source(
         {"id": source_id},
         {"$set": update_data}
     )
+    reference_cache.invalidate("lead_sources")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Lead source not found")
     return {"success": True, "message": "Lead source updated"}
@@ -8377,6 +8100,7 @@ async def delete_lead_source(
 ):
     """Delete a lead source"""
     result = await db.lead_sources.delete_one({"id": source_id})
+    reference_cache.invalidate("lead_sources")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Lead source not found")
     return {"success": True, "message": "Lead source deleted"}
@@ -8402,6 +8126,7 @@ async def create_lead_status(
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     await db.lead_statuses.insert_one(status)
+    reference_cache.invalidate("lead_statuses")
     # Remove MongoDB's _id before returning
     status.pop("_id", None)
     return {"success": True, "status": status}
@@ -8421,6 +8146,7 @@ async def update_lead_status(
         {"id": status_id},
         {"$set": update_data}
     )
+    reference_cache.invalidate("lead_statuses")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Lead status not found")
     return {"success": True, "message": "Lead status updated"}
@@ -8432,6 +8158,7 @@ async def delete_lead_status(
 ):
     """Delete a lead status"""
     result = await db.lead_statuses.delete_one({"id": status_id})
+    reference_cache.invalidate("lead_statuses")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Lead status not found")
     return {"success": True, "message": "Lead status deleted"}
@@ -8457,6 +8184,7 @@ async def create_loss_reason(
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     await db.loss_reasons.insert_one(reason)
+    reference_cache.invalidate("loss_reasons")
     # Remove MongoDB's _id before returning
     reason.pop("_id", None)
     return {"success": True, "reason": reason}
@@ -8476,6 +8204,7 @@ async def update_loss_reason(
         {"id": reason_id},
         {"$set": update_data}
     )
+    reference_cache.invalidate("loss_reasons")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Loss reason not found")
     return {"success": True, "message": "Loss reason updated"}
@@ -8487,6 +8216,7 @@ async def delete_loss_reason(
 ):
     """Delete a loss reason"""
     result = await db.loss_reasons.delete_one({"id": reason_id})
+    reference_cache.invalidate("loss_reasons")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Loss reason not found")
     return {"success": True, "message": "Loss reason deleted"}
@@ -8610,15 +8340,60 @@ async def search_members_for_referral(
 
 # ==================== LEADS/CONTACTS ENDPOINTS ====================
 
+async def enrich_leads(leads: List[dict], include_assignee: bool = True, include_assigner: bool = True):
+    """Add assignee/assigner names and source/status display fields with one batched lookup per collection"""
+    loader = BatchLoader(db, reference_cache)
+    user_ids = []
+    if include_assignee:
+        user_ids += [lead.get("assigned_to") for lead in leads]
+    if include_assigner:
+        user_ids += [lead.get("assigned_by") for lead in leads]
+    users = await loader.load_many("users", user_ids, {"email": 1, "full_name": 1, "role": 1})
+    sources = await loader.load_many("lead_sources", [lead.get("source_id") for lead in leads])
+    statuses = await loader.load_many("lead_statuses", [lead.get("status_id") for lead in leads])
+    
+    for lead in leads:
+        # Get assigned to info
+        assignee = users.get(lead.get("assigned_to")) if include_assignee else None
+        if assignee:
+            lead["assigned_to_name"] = assignee.get("full_name") or assignee.get("email")
+            lead["assigned_to_role"] = assignee.get("role")
+        
+        # Get assigned by info
+        assigner = users.get(lead.get("assigned_by")) if include_assigner else None
+        if assigner:
+            lead["assigned_by_name"] = assigner.get("full_name") or assigner.get("email")
+        
+        # Get source info
+        source = sources.get(lead.get("source_id"))
+        if source:
+            lead["source_name"] = source.get("name")
+            lead["source_icon"] = source.get("icon")
+        
+        # Get status info
+        status_obj = statuses.get(lead.get("status_id"))
+        if status_obj:
+            lead["status_name"] = status_obj.get("name")
+            lead["status_color"] = status_obj.get("color")
+            lead["status_category"] = status_obj.get("category")
+    
+    return leads
+
 @api_router.get("/sales/leads")
 async def get_leads(
     status: Optional[str] = None,
     assigned_to: Optional[str] = None,
     source: Optional[str] = None,
     filter_type: Optional[str] = None,  # NEW: "all", "my_leads", "unassigned"
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Get all leads with optional filters and role-based visibility"""
+    """
+    Get all leads with optional filters and role-based visibility.
+    Pass limit to page through results; the response's next_cursor fetches the next page.
+    """
     query = {}
     
     # Role-based filtering
@@ -8644,41 +8419,15 @@ async def get_leads(
     if source:
         query["source"] = source
     
-    leads = await db.leads.find(query, {"_id": 0}).sort("created_at", -1).to_list(None)
+    leads, next_cursor = await paginate(db.leads, query, "created_at", limit, cursor, parse_fields(fields))
     
-    # Enrich leads with assignment info
-    for lead in leads:
-        # Get assigned to info
-        if lead.get("assigned_to"):
-            assignee = await db.users.find_one({"id": lead["assigned_to"]}, {"_id": 0, "email": 1, "full_name": 1, "role": 1})
-            if assignee:
-                lead["assigned_to_name"] = assignee.get("full_name") or assignee.get("email")
-                lead["assigned_to_role"] = assignee.get("role")
-        
-        # Get assigned by info
-        if lead.get("assigned_by"):
-            assigner = await db.users.find_one({"id": lead["assigned_by"]}, {"_id": 0, "email": 1, "name": 1})
-            if assigner:
-                lead["assigned_by_name"] = assigner.get("name") or assigner.get("email")
-        
-        # Get source info
-        if lead.get("source_id"):
-            source = await db.lead_sources.find_one({"id": lead["source_id"]}, {"_id": 0, "name": 1, "icon": 1})
-            if source:
-                lead["source_name"] = source.get("name")
-                lead["source_icon"] = source.get("icon")
-        
-        # Get status info
-        if lead.get("status_id"):
-            status_obj = await db.lead_statuses.find_one({"id": lead["status_id"]}, {"_id": 0, "name": 1, "color": 1, "category": 1})
-            if status_obj:
-                lead["status_name"] = status_obj.get("name")
-                lead["status_color"] = status_obj.get("color")
-                lead["status_category"] = status_obj.get("category")
+    # Enrich leads with assignment, source and status info
+    await enrich_leads(leads)
     
     return {
         "leads": leads,
-        "total": len(leads),
+        "total": len(leads) if limit is None else await db.leads.count_documents(query),
+        "next_cursor": next_cursor,
         "is_manager": is_manager,
         "filter_type": filter_type or "all"
     }
@@ -8788,21 +8537,7 @@ async def get_unassigned_leads(current_user: User = Depends(get_current_user)):
     ).sort("created_at", -1).to_list(None)
     
     # Enrich with source and status info
-    for lead in leads:
-        # Get source info
-        if lead.get("source_id"):
-            source = await db.lead_sources.find_one({"id": lead["source_id"]}, {"_id": 0, "name": 1, "icon": 1})
-            if source:
-                lead["source_name"] = source.get("name")
-                lead["source_icon"] = source.get("icon")
-        
-        # Get status info
-        if lead.get("status_id"):
-            status = await db.lead_statuses.find_one({"id": lead["status_id"]}, {"_id": 0, "name": 1, "color": 1, "category": 1})
-            if status:
-                lead["status_name"] = status.get("name")
-                lead["status_color"] = status.get("color")
-                lead["status_category"] = status.get("category")
+    await enrich_leads(leads, include_assignee=False, include_assigner=False)
     
     return {
         "total": len(leads),
@@ -8819,28 +8554,8 @@ async def get_my_assigned_leads(current_user: User = Depends(get_current_user)):
         {"_id": 0}
     ).sort("created_at", -1).to_list(None)
     
-    # Enrich with source and status info
-    for lead in leads:
-        # Get source info
-        if lead.get("source_id"):
-            source = await db.lead_sources.find_one({"id": lead["source_id"]}, {"_id": 0, "name": 1, "icon": 1})
-            if source:
-                lead["source_name"] = source.get("name")
-                lead["source_icon"] = source.get("icon")
-        
-        # Get status info
-        if lead.get("status_id"):
-            status = await db.lead_statuses.find_one({"id": lead["status_id"]}, {"_id": 0, "name": 1, "color": 1, "category": 1})
-            if status:
-                lead["status_name"] = status.get("name")
-                lead["status_color"] = status.get("color")
-                lead["status_category"] = status.get("category")
-        
-        # Get assigned by info
-        if lead.get("assigned_by"):
-            assigner = await db.users.find_one({"id": lead["assigned_by"]}, {"_id": 0, "email": 1, "full_name": 1})
-            if assigner:
-                lead["assigned_by_name"] = assigner.get("full_name") or assigner.get("email")
+    # Enrich with source, status and assigned by info
+    await enrich_leads(leads, include_assignee=False)
     
     return {
         "total": len(leads),
@@ -8855,6 +8570,7 @@ async def get_lead(lead_id: str, current_user: User = Depends(get_current_user))
     
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
+    await enrich_leads([lead])
     
     # Get related opportunities
     opportunities = await db.opportunities.find(
@@ -9389,9 +9105,12 @@ async def get_complimentary_memberships(
     status: Optional[str] = None,
     complimentary_type_id: Optional[str] = None,
     assigned_consultant_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Get complimentary memberships with filters"""
+    """Get complimentary memberships with filters (cursor-paginated when limit is given)"""
     query = {}
     
     if status:
@@ -9401,14 +9120,14 @@ async def get_complimentary_memberships(
     if assigned_consultant_id:
         query["assigned_consultant_id"] = assigned_consultant_id
     
-    memberships = await db.complimentary_memberships.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(None)
+    memberships, next_cursor = await paginate(
+        db.complimentary_memberships, query, "created_at", limit, cursor, parse_fields(fields)
+    )
     
     return {
-        "total": len(memberships),
-        "memberships": memberships
+        "total": len(memberships) if limit is None else await db.complimentary_memberships.count_documents(query),
+        "memberships": memberships,
+        "next_cursor": next_cursor
     }
 
 
@@ -9773,40 +9492,30 @@ async def get_commissions_report(
             "role": {"$in": ["sales_head", "sales_manager", "business_owner"]}
         }, {"_id": 0, "id": 1, "full_name": 1, "email": 1, "role": 1}).to_list(None)
         
+        # Converted leads and won opportunities for every consultant in two grouped queries
+        conversions = await sales_performance.conversions([c["id"] for c in consultants], start_iso, end_iso)
+        commission_rate = 0.10  # 10%
+        
         commission_data = []
         
         for consultant in consultants:
             consultant_id = consultant["id"]
-            
-            # Get leads converted by this consultant
-            converted_leads = await db.leads.find({
-                "assigned_to": consultant_id,
-                "status": "converted",
-                "updated_at": {"$gte": start_iso, "$lte": end_iso}
-            }, {"_id": 0}).to_list(None)
-            
-            # Get opportunities closed/won by this consultant
-            won_opportunities = await db.opportunities.find({
-                "assigned_to": consultant_id,
-                "status": "closed_won",
-                "updated_at": {"$gte": start_iso, "$lte": end_iso}
-            }, {"_id": 0}).to_list(None)
+            stats = conversions.get(consultant_id, {"leads_converted": 0, "opportunities_won": 0, "won_value": 0.0})
             
             # Calculate commission (assume 10% of deal value)
-            total_deal_value = sum(opp.get("value", 0) for opp in won_opportunities)
-            commission_rate = 0.10  # 10%
+            total_deal_value = stats["won_value"]
             calculated_commission = total_deal_value * commission_rate
             
             # Count conversions
-            conversion_count = len(converted_leads) + len(won_opportunities)
+            conversion_count = stats["leads_converted"] + stats["opportunities_won"]
             
             commission_data.append({
                 "consultant_id": consultant_id,
                 "consultant_name": consultant.get("full_name") or consultant.get("email"),
                 "email": consultant.get("email"),
                 "role": consultant.get("role"),
-                "leads_converted": len(converted_leads),
-                "opportunities_won": len(won_opportunities),
+                "leads_converted": stats["leads_converted"],
+                "opportunities_won": stats["opportunities_won"],
                 "total_conversions": conversion_count,
                 "total_deal_value": round(total_deal_value, 2),
                 "commission_earned": round(calculated_commission, 2),
@@ -10201,32 +9910,34 @@ async def get_retention_dashboard(
 
 @api_router.get("/reports/member-ltv")
 async def get_member_ltv_report(
+    top_n: int = Query(20, ge=1),
+    include_all_members: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
     Calculate member lifetime value (LTV) metrics
+    Set include_all_members=true to also return the full per-member list
     """
     try:
         now = datetime.now(timezone.utc)
         
-        # Get all members with their payment history
-        all_members = await db.members.find({}, {"_id": 0}).to_list(None)
+        # Revenue per member from one grouped query over paid invoices
+        revenue_by_member = await paid_revenue_by_member(["paid", "partial"], "amount")
         
-        # Get all paid invoices
-        all_invoices = await db.invoices.find({
-            "status": {"$in": ["paid", "partial"]}
-        }, {"_id": 0}).to_list(None)
-        
-        # Calculate LTV per member
-        member_ltv_data = []
+        # Stream members, keeping only running totals and the top-N
+        top_heap = []
+        all_members_ltv = []
+        ltv_by_type = {}
         total_ltv = 0
+        total_members = 0
+        active_revenue = 0
+        active_count = 0
+        highest_ltv = None
+        lowest_ltv = None
         
-        for member in all_members:
+        async for member in db.members.find({}, LTV_MEMBER_PROJECTION):
             member_id = member.get("id")
-            
-            # Get member's invoices
-            member_invoices = [inv for inv in all_invoices if inv.get("member_id") == member_id]
-            member_revenue = sum(inv.get("amount", 0) for inv in member_invoices)
+            member_revenue = revenue_by_member.get(member_id, {}).get("revenue", 0)
             
             # Calculate tenure
             join_date_str = member.get("join_date")
@@ -10242,7 +9953,7 @@ async def get_member_ltv_report(
             # Monthly average
             monthly_avg = round(member_revenue / tenure_months, 2) if tenure_months > 0 else 0
             
-            member_ltv_data.append({
+            member_ltv = {
                 "member_id": member_id,
                 "member_name": member.get("full_name", "Unknown"),
                 "status": member.get("status", "unknown"),
@@ -10251,33 +9962,32 @@ async def get_member_ltv_report(
                 "total_revenue": round(member_revenue, 2),
                 "monthly_avg_revenue": monthly_avg,
                 "membership_type": member.get("membership_type", "Unknown")
-            })
+            }
             
+            total_members += 1
             total_ltv += member_revenue
-        
-        # Sort by total revenue (highest LTV first)
-        member_ltv_data.sort(key=lambda x: x["total_revenue"], reverse=True)
+            if member_ltv["status"] == "active":
+                active_revenue += member_ltv["total_revenue"]
+                active_count += 1
+            highest_ltv = member_ltv["total_revenue"] if highest_ltv is None else max(highest_ltv, member_ltv["total_revenue"])
+            lowest_ltv = member_ltv["total_revenue"] if lowest_ltv is None else min(lowest_ltv, member_ltv["total_revenue"])
+            
+            # LTV by membership type
+            type_data = ltv_by_type.setdefault(member_ltv["membership_type"], {
+                "total_revenue": 0,
+                "member_count": 0,
+                "avg_ltv": 0
+            })
+            type_data["total_revenue"] += member_ltv["total_revenue"]
+            type_data["member_count"] += 1
+            
+            push_top_n(top_heap, top_n, member_ltv["total_revenue"], total_members, member_ltv)
+            if include_all_members:
+                all_members_ltv.append(member_ltv)
         
         # Calculate averages
-        total_members = len(all_members)
         avg_ltv = round(total_ltv / total_members, 2) if total_members > 0 else 0
-        
-        # Active members only
-        active_members = [m for m in member_ltv_data if m["status"] == "active"]
-        avg_ltv_active = round(sum(m["total_revenue"] for m in active_members) / len(active_members), 2) if active_members else 0
-        
-        # LTV by membership type
-        ltv_by_type = {}
-        for member in member_ltv_data:
-            mem_type = member["membership_type"]
-            if mem_type not in ltv_by_type:
-                ltv_by_type[mem_type] = {
-                    "total_revenue": 0,
-                    "member_count": 0,
-                    "avg_ltv": 0
-                }
-            ltv_by_type[mem_type]["total_revenue"] += member["total_revenue"]
-            ltv_by_type[mem_type]["member_count"] += 1
+        avg_ltv_active = round(active_revenue / active_count, 2) if active_count else 0
         
         # Calculate averages per type
         for type_data in ltv_by_type.values():
@@ -10285,19 +9995,22 @@ async def get_member_ltv_report(
             type_data["avg_ltv"] = round(type_data["total_revenue"] / count, 2) if count > 0 else 0
             type_data["total_revenue"] = round(type_data["total_revenue"], 2)
         
-        return {
+        result = {
             "summary": {
                 "total_members": total_members,
                 "total_ltv": round(total_ltv, 2),
                 "average_ltv": avg_ltv,
                 "average_ltv_active_members": avg_ltv_active,
-                "highest_ltv": member_ltv_data[0]["total_revenue"] if member_ltv_data else 0,
-                "lowest_ltv": member_ltv_data[-1]["total_revenue"] if member_ltv_data else 0
+                "highest_ltv": highest_ltv or 0,
+                "lowest_ltv": lowest_ltv or 0
             },
             "ltv_by_membership_type": ltv_by_type,
-            "top_members": member_ltv_data[:20],  # Top 20 by LTV
-            "all_members_ltv": member_ltv_data
+            "top_members": sorted_top_n(top_heap)
         }
+        if include_all_members:
+            all_members_ltv.sort(key=lambda x: x["total_revenue"], reverse=True)
+            result["all_members_ltv"] = all_members_ltv
+        return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating member LTV: {str(e)}")
@@ -10414,6 +10127,9 @@ async def get_retention_report(
 @api_router.get("/reports/at-risk-members")
 async def get_at_risk_members(
     risk_threshold: Optional[int] = 60,  # Risk score threshold
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    refresh: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -10421,117 +10137,9 @@ async def get_at_risk_members(
     Risk factors: low attendance, payment issues, long time since last visit
     """
     try:
-        now = datetime.now(timezone.utc)
-        
-        # Get active members
-        active_members = await db.members.find({
-            "status": "active"
-        }, {"_id": 0}).to_list(None)
-        
-        at_risk_members = []
-        
-        for member in active_members:
-            member_id = member.get("id")
-            risk_score = 0
-            risk_factors = []
-            
-            # Factor 1: Last visit (0-40 points)
-            last_visit = member.get("last_visit")
-            if last_visit:
-                try:
-                    last_visit_dt = datetime.fromisoformat(last_visit.replace('Z', '+00:00'))
-                    days_since_visit = (now - last_visit_dt).days
-                    
-                    if days_since_visit > 30:
-                        risk_score += 40
-                        risk_factors.append(f"No visit in {days_since_visit} days")
-                    elif days_since_visit > 14:
-                        risk_score += 20
-                        risk_factors.append(f"Last visit {days_since_visit} days ago")
-                    elif days_since_visit > 7:
-                        risk_score += 10
-                except:
-                    risk_score += 30
-                    risk_factors.append("Last visit date unavailable")
-            else:
-                risk_score += 30
-                risk_factors.append("Never visited")
-            
-            # Factor 2: Payment issues (0-30 points)
-            unpaid_invoices = await db.invoices.count_documents({
-                "member_id": member_id,
-                "status": {"$in": ["pending", "overdue", "failed"]}
-            })
-            
-            if unpaid_invoices > 2:
-                risk_score += 30
-                risk_factors.append(f"{unpaid_invoices} unpaid invoices")
-            elif unpaid_invoices > 0:
-                risk_score += 15
-                risk_factors.append(f"{unpaid_invoices} unpaid invoice(s)")
-            
-            # Factor 3: Membership duration (0-15 points - new members at higher risk)
-            join_date_str = member.get("join_date")
-            if join_date_str:
-                try:
-                    join_date = datetime.fromisoformat(join_date_str.replace('Z', '+00:00'))
-                    days_member = (now - join_date).days
-                    
-                    if days_member < 30:
-                        risk_score += 15
-                        risk_factors.append("New member (< 30 days)")
-                    elif days_member < 90:
-                        risk_score += 5
-                except:
-                    pass
-            
-            # Factor 4: Failed payment history (0-15 points)
-            failed_payments = await db.invoices.count_documents({
-                "member_id": member_id,
-                "status": "failed"
-            })
-            
-            if failed_payments > 1:
-                risk_score += 15
-                risk_factors.append(f"{failed_payments} failed payments")
-            elif failed_payments > 0:
-                risk_score += 7
-            
-            # Only include if risk score meets threshold
-            if risk_score >= risk_threshold:
-                at_risk_members.append({
-                    "member_id": member_id,
-                    "member_name": member.get("full_name", "Unknown"),
-                    "email": member.get("email"),
-                    "phone": member.get("phone"),
-                    "join_date": join_date_str,
-                    "last_visit": last_visit,
-                    "membership_type": member.get("membership_type"),
-                    "risk_score": risk_score,
-                    "risk_level": "critical" if risk_score >= 80 else "high" if risk_score >= 60 else "medium",
-                    "risk_factors": risk_factors,
-                    "unpaid_invoices": unpaid_invoices
-                })
-        
-        # Sort by risk score (highest first)
-        at_risk_members.sort(key=lambda x: x["risk_score"], reverse=True)
-        
-        # Calculate summary stats
-        critical_count = len([m for m in at_risk_members if m["risk_score"] >= 80])
-        high_count = len([m for m in at_risk_members if 60 <= m["risk_score"] < 80])
-        medium_count = len([m for m in at_risk_members if 40 <= m["risk_score"] < 60])
-        
-        return {
-            "summary": {
-                "total_at_risk": len(at_risk_members),
-                "critical_risk": critical_count,
-                "high_risk": high_count,
-                "medium_risk": medium_count,
-                "risk_threshold": risk_threshold
-            },
-            "at_risk_members": at_risk_members
-        }
-        
+        return await risk_engine.report_at_risk(
+            risk_threshold=risk_threshold, skip=skip, limit=limit, force_refresh=refresh
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error identifying at-risk members: {str(e)}")
 
@@ -11250,38 +10858,26 @@ async def get_salesperson_performance_detailed(
         if salesperson_id:
             sales_users = [u for u in sales_users if u.get("id") == salesperson_id]
         
+        # Lead and opportunity counts/values for every salesperson in two grouped queries
+        activity = await sales_performance.pipeline_activity([u["id"] for u in sales_users], start_iso, end_iso)
+        
         performance_data = []
         
         for user in sales_users:
             user_id = user["id"]
+            stats = activity.get(user_id) or {}
             
-            # Get leads assigned to this person
-            leads = await db.leads.find({
-                "assigned_to": user_id,
-                "created_at": {"$gte": start_iso, "$lte": end_iso}
-            }, {"_id": 0}).to_list(None)
-            
-            # Get opportunities assigned to this person
-            opportunities = await db.opportunities.find({
-                "assigned_to": user_id,
-                "created_at": {"$gte": start_iso, "$lte": end_iso}
-            }, {"_id": 0}).to_list(None)
-            
-            # Calculate metrics
-            total_leads = len(leads)
-            qualified_leads = len([l for l in leads if l.get("status") == "qualified"])
-            converted_leads = len([l for l in leads if l.get("status") == "converted"])
+            total_leads = stats.get("total_leads", 0)
+            qualified_leads = stats.get("qualified_leads", 0)
+            converted_leads = stats.get("converted_leads", 0)
             
-            total_opportunities = len(opportunities)
-            won_opportunities = len([o for o in opportunities if o.get("stage") == "closed_won"])
-            lost_opportunities = len([o for o in opportunities if o.get("stage") == "closed_lost"])
+            total_opportunities = stats.get("total_opportunities", 0)
+            won_opportunities = stats.get("won_opportunities", 0)
+            lost_opportunities = stats.get("lost_opportunities", 0)
+            open_opportunities = stats.get("open_opportunities", 0)
             
-            # Revenue
-            won_revenue = sum(o.get("value", 0) for o in opportunities if o.get("stage") == "closed_won")
-            
-            # Pipeline value (open opportunities)
-            open_opportunities = [o for o in opportunities if o.get("stage") not in ["closed_won", "closed_lost"]]
-            pipeline_value = sum(o.get("value", 0) for o in open_opportunities)
+            won_revenue = stats.get("won_revenue", 0)
+            pipeline_value = stats.get("pipeline_value", 0)
             
             # Rates
             lead_conversion_rate = round((converted_leads / total_leads) * 100, 2) if total_leads > 0 else 0
@@ -11303,7 +10899,7 @@ async def get_salesperson_performance_detailed(
                 "won_opportunities": won_opportunities,
                 "lost_opportunities": lost_opportunities,
                 "opp_win_rate": opp_win_rate,
-                "open_opportunities": len(open_opportunities),
+                "open_opportunities": open_opportunities,
                 "pipeline_value": round(pipeline_value, 2),
                 "won_revenue": round(won_revenue, 2),
                 "avg_deal_size": avg_deal_size
@@ -12643,6 +12239,7 @@ async def create_workflow(
     }
     
     await db.workflow_rules.insert_one(workflow.copy())
+    rule_index.invalidate("workflows")
     
     return {"success": True, "workflow": workflow}
 
@@ -12666,6 +12263,7 @@ async def update_workflow(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Workflow not found")
+    rule_index.invalidate("workflows")
     
     return {"success": True, "workflow_id": workflow_id}
 
@@ -12677,6 +12275,7 @@ async def delete_workflow(workflow_id: str, current_user: User = Depends(get_cur
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Workflow not found")
+    rule_index.invalidate("workflows")
     
     return {"success": True, "message": "Workflow deleted"}
 
@@ -12695,24 +12294,13 @@ async def execute_workflow_rules(
     """
     import uuid
     
-    # Find matching active workflows
-    workflows = await db.workflow_rules.find({
-        "trigger_object": trigger_object,
-        "trigger_event": trigger_event,
-        "is_active": True
-    }, {"_id": 0}).to_list(None)
+    # Active workflows for this trigger, with their conditions compiled
+    workflows = await rule_index.workflows(trigger_object, trigger_event)
     
     executed_actions = []
     
-    for workflow in workflows:
-        # Check if conditions match
-        conditions_met = True
-        for field, expected_value in workflow.get("conditions", {}).items():
-            if object_data.get(field) != expected_value:
-                conditions_met = False
-                break
-        
-        if conditions_met:
+    for workflow, conditions_met in workflows:
+        if conditions_met(object_data):
             # Execute actions
             for action in workflow.get("actions", []):
                 action_type = action.get("type")
@@ -13558,10 +13146,20 @@ async def approve_cancellation_admin(data: ApprovalAction, current_user: User =
     )
     
     # Update member status
+    member = await db.members.find_one(
+        {"id": request["member_id"]},
+        {"_id": 0, "membership_status": 1, "membership_type_id": 1, "source": 1}
+    )
+    cancellation_date = datetime.now(timezone.utc).isoformat()
     await db.members.update_one(
         {"id": request["member_id"]},
-        {"$set": {"membership_status": "cancelled"}}
+        {"$set": {"membership_status": "cancelled", "cancellation_date": cancellation_date}}
     )
+    invalidate_member_state(request["member_id"])
+    if member and member.get("membership_status") != "cancelled":
+        await rollups.record_membership_event(
+            "cancellations", cancellation_date, member.get("membership_type_id"), member.get("source")
+        )
     
     return {"message": "Cancellation approved and completed. Member status updated."}
 
@@ -13595,6 +13193,7 @@ async def create_automation(automation: AutomationCreate, current_user: User = D
         automation_dict["last_triggered"] = automation_dict["last_triggered"].isoformat()
     
     await db.automations.insert_one(automation_dict)
+    rule_index.invalidate("automations")
     return new_automation
 
 @api_router.put("/automations/{automation_id}")
@@ -13613,6 +13212,7 @@ async def update_automation(
         {"id": automation_id},
         {"$set": update_data}
     )
+    rule_index.invalidate("automations")
     
     updated = await db.automations.find_one({"id": automation_id}, {"_id": 0})
     return updated
@@ -13623,6 +13223,7 @@ async def delete_automation(automation_id: str, current_user: User = Depends(get
     result = await db.automations.delete_one({"id": automation_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Automation not found")
+    rule_index.invalidate("automations")
     return {"message": "Automation deleted successfully"}
 
 @api_router.post("/automations/{automation_id}/toggle")
@@ -13637,6 +13238,7 @@ async def toggle_automation(automation_id: str, current_user: User = Depends(get
         {"id": automation_id},
         {"$set": {"enabled": new_status}}
     )
+    rule_index.invalidate("automations")
     
     return {"message": f"Automation {'enabled' if new_status else 'disabled'}", "enabled": new_status}
 
@@ -13654,6 +13256,18 @@ async def get_automation_executions(
     executions = await db.automation_executions.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(length=None)
     return executions
 
+@api_router.get("/automation-queue/stats")
+async def get_automation_queue_stats(current_user: User = Depends(get_current_user)):
+    """Pending/running/failed job counts and worker counters of the automation job queue"""
+    return await automation_queue.stats()
+
+@api_router.post("/automation-executions/{execution_id}/retry")
+async def retry_automation_execution(execution_id: str, current_user: User = Depends(get_current_user)):
+    """Re-queue a failed automation action"""
+    if not await automation_queue.retry(execution_id):
+        raise HTTPException(status_code=404, detail="Failed execution not found")
+    return {"message": "Execution re-queued", "execution_id": execution_id}
+
 @api_router.post("/automations/test/{automation_id}")
 async def test_automation(
     automation_id: str,
@@ -13682,118 +13296,68 @@ async def test_automation(
 
 # ============= AUTOMATION TRIGGER EXECUTION LOGIC =============
 
-async def execute_automation(automation: dict, trigger_data: dict, is_test: bool = False):
-    """Execute an automation rule"""
+async def execute_automation(
+    automation: dict,
+    trigger_data: dict,
+    is_test: bool = False,
+    idempotency_key: Optional[str] = None,
+    conditions_checked: bool = False
+):
+    """
+    Queue an automation rule's actions on the automation job queue.
+    With is_test the actions are only previewed, nothing is queued.
+    conditions_checked skips the condition check (already matched by the rule index).
+    """
     try:
         # Check conditions
-        if automation.get("conditions"):
+        if automation.get("conditions") and not conditions_checked:
             conditions_met = check_automation_conditions(automation["conditions"], trigger_data)
             if not conditions_met:
                 return {"skipped": True, "reason": "Conditions not met"}
         
-        results = []
+        if is_test:
+            now = datetime.now(timezone.utc)
+            results = [
+                {
+                    "action_type": action.get("type"),
+                    "scheduled_for": (now + timedelta(minutes=action.get("delay_minutes", 0) or 0)).isoformat(),
+                    "status": "pending" if action.get("delay_minutes", 0) else "completed"
+                }
+                for action in automation.get("actions", [])
+            ]
+            return {"executed": True, "actions_executed": len(results), "results": results}
         
-        # Execute each action
-        for action in automation.get("actions", []):
-            action_type = action.get("type")
-            delay_minutes = action.get("delay_minutes", 0)
-            
-            # Calculate scheduled time
-            scheduled_for = datetime.now(timezone.utc)
-            if delay_minutes > 0:
-                from datetime import timedelta
-                scheduled_for = scheduled_for + timedelta(minutes=delay_minutes)
-            
-            # Create execution record
-            execution = AutomationExecution(
-                automation_id=automation["id"],
-                automation_name=automation["name"],
-                trigger_data=trigger_data,
-                scheduled_for=scheduled_for,
-                status="pending" if delay_minutes > 0 else "completed",
-                executed_at=datetime.now(timezone.utc) if delay_minutes == 0 else None
-            )
-            
-            execution_dict = execution.dict()
-            execution_dict["created_at"] = execution_dict["created_at"].isoformat()
-            execution_dict["scheduled_for"] = execution_dict["scheduled_for"].isoformat()
-            if execution_dict.get("executed_at"):
-                execution_dict["executed_at"] = execution_dict["executed_at"].isoformat()
-            
-            # If no delay and not test, execute immediately
-            if delay_minutes == 0 and not is_test:
-                action_result = await execute_action(action, trigger_data)
-                execution_dict["result"] = action_result
-                execution_dict["status"] = "completed"
-            
-            if not is_test:
-                await db.automation_executions.insert_one(execution_dict)
-            
-            results.append({
-                "action_type": action_type,
-                "scheduled_for": execution_dict["scheduled_for"],
-                "status": execution_dict["status"]
-            })
+        results = await automation_queue.enqueue(
+            automation,
+            trigger_data,
+            idempotency_key or event_key(automation.get("trigger_type", ""), trigger_data)
+        )
         
         # Update automation stats
-        if not is_test:
-            await db.automations.update_one(
-                {"id": automation["id"]},
-                {
-                    "$set": {"last_triggered": datetime.now(timezone.utc).isoformat()},
-                    "$inc": {"execution_count": 1}
-                }
-            )
+        await db.automations.update_one(
+            {"id": automation["id"]},
+            {
+                "$set": {"last_triggered": datetime.now(timezone.utc).isoformat()},
+                "$inc": {"execution_count": 1}
+            }
+        )
         
         return {
-            "executed": True,
-            "actions_executed": len(results),
+            "queued": True,
+            "actions_queued": len(results),
             "results": results
         }
         
     except Exception as e:
-        logger.error(f"Error executing automation {automation.get('id')}: {str(e)}")
+        logger.error(f"Error queueing automation {automation.get('id')}: {str(e)}")
         return {
-            "executed": False,
+            "queued": False,
             "error": str(e)
         }
 
 def check_automation_conditions(conditions: dict, trigger_data: dict) -> bool:
     """Check if automation conditions are met"""
-    # Simple condition checking - can be extended
-    for key, expected_value in conditions.items():
-        actual_value = trigger_data.get(key)
-        
-        # Handle different condition types
-        if isinstance(expected_value, dict):
-            # Complex conditions like {"operator": ">=", "value": 100}
-            operator = expected_value.get("operator", "==")
-            value = expected_value.get("value")
-            
-            if operator == "==":
-                if actual_value != value:
-                    return False
-            elif operator == ">":
-                if not (actual_value and actual_value > value):
-                    return False
-            elif operator == ">=":
-                if not (actual_value and actual_value >= value):
-                    return False
-            elif operator == "<":
-                if not (actual_value and actual_value < value):
-                    return False
-            elif operator == "<=":
-                if not (actual_value and actual_value <= value):
-                    return False
-            elif operator == "contains":
-                if not (actual_value and value in str(actual_value)):
-                    return False
-        else:
-            # Simple equality check
-            if actual_value != expected_value:
-                return False
-    
-    return True
+    return compile_conditions(conditions)(trigger_data)
 
 async def execute_action(action: dict, trigger_data: dict):
     """Execute a specific automation action with support for notification templates"""
@@ -13805,19 +13369,19 @@ async def execute_action(action: dict, trigger_data: dict):
         template_id = action.get("template_id")
         
         if template_id:
-            # Fetch template from database
-            template = await db.notification_templates.find_one({"id": template_id, "is_active": True})
+            # Active templates are held by the rule index
+            template = await rule_index.template(template_id)
             if not template:
                 logger.warning(f"Template {template_id} not found or inactive, falling back to inline message")
                 return {
-                    "message": action.get("message", "").format(**trigger_data),
-                    "subject": action.get("subject", "").format(**trigger_data) if action.get("subject") else None
+                    "message": compiled_template(action.get("message", "")).render(trigger_data),
+                    "subject": compiled_template(action["subject"]).render(trigger_data) if action.get("subject") else None
                 }
             
             # Format template message with trigger_data
             try:
-                message = template["message"].format(**trigger_data)
-                subject = template.get("subject", "").format(**trigger_data) if template.get("subject") else None
+                message = compiled_template(template["message"]).render(trigger_data)
+                subject = compiled_template(template["subject"]).render(trigger_data) if template.get("subject") else None
                 return {"message": message, "subject": subject}
             except KeyError as e:
                 logger.warning(f"Missing placeholder {e} in trigger_data, using template as-is")
@@ -13825,8 +13389,8 @@ async def execute_action(action: dict, trigger_data: dict):
         else:
             # Use inline message (backward compatibility)
             return {
-                "message": action.get("message", "").format(**trigger_data),
-                "subject": action.get("subject", "").format(**trigger_data) if action.get("subject") else None
+                "message": compiled_template(action.get("message", "")).render(trigger_data),
+                "subject": compiled_template(action["subject"]).render(trigger_data) if action.get("subject") else None
             }
     
     if action_type == "send_sms":
@@ -13990,6 +13554,7 @@ async def execute_action(action: dict, trigger_data: dict):
                 {"id": member_id},
                 {"$set": {"membership_status": new_status}}
             )
+            invalidate_member_state(member_id)
             return {"type": "update_status", "status": "completed", "member_id": member_id}
     
     elif action_type == "create_task":
@@ -14011,19 +13576,32 @@ async def execute_action(action: dict, trigger_data: dict):
         logger.warning(f"Unknown action type: {action_type}")
         return {"type": action_type, "status": "unknown_action"}
 
+# Automation actions run from a MongoDB-backed job queue (workers start on startup)
+automation_queue = AutomationJobQueue(
+    db,
+    execute_action=execute_action,
+    concurrency=int(os.environ.get("AUTOMATION_WORKERS", "4")),
+    max_attempts=int(os.environ.get("AUTOMATION_MAX_ATTEMPTS", "5"))
+)
+
 # ============= TRIGGER HELPERS =============
 
-async def trigger_automation(trigger_type: str, trigger_data: dict):
-    """Trigger all enabled automations for a specific event type (excludes test_mode automations)"""
-    automations = await db.automations.find({
-        "trigger_type": trigger_type,
-        "enabled": True,
-        "test_mode": {"$ne": True}  # Exclude automations in test mode
-    }).to_list(length=None)
+async def trigger_automation(trigger_type: str, trigger_data: dict, idempotency_key: Optional[str] = None):
+    """
+    Queue all enabled automations for a specific event type (excludes test_mode automations).
+    Actions run on the automation job queue; the same event (same idempotency_key) is
+    only queued once. Callers pass the event's identity; without one, the same trigger
+    data is only deduplicated within the event_key window.
+    """
+    # Enabled, non-test automations whose compiled conditions match this event
+    automations = await rule_index.match_automations(trigger_type, trigger_data)
     
+    idempotency_key = idempotency_key or event_key(trigger_type, trigger_data)
     results = []
     for automation in automations:
-        result = await execute_automation(automation, trigger_data)
+        result = await execute_automation(
+            automation, trigger_data, idempotency_key=idempotency_key, conditions_checked=True
+        )
         results.append({
             "automation_id": automation["id"],
             "automation_name": automation["name"],
@@ -14133,6 +13711,7 @@ async def create_class(class_data: ClassCreate, current_user: User = Depends(get
         doc["class_date"] = doc["class_date"].isoformat()
     
     await db.classes.insert_one(doc)
+    class_scheduler.invalidate_classes()
     return new_class
 
 @api_router.get("/classes/{class_id}", response_model=Class)
@@ -14155,6 +13734,7 @@ async def update_class(class_id: str, class_update: ClassUpdate, current_user: U
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.classes.update_one({"id": class_id}, {"$set": update_data})
+    class_scheduler.invalidate_classes()
     
     # Fetch updated class
     updated_class = await db.classes.find_one({"id": class_id}, {"_id": 0})
@@ -14166,6 +13746,7 @@ async def delete_class(class_id: str, current_user: User = Depends(get_current_u
     result = await db.classes.delete_one({"id": class_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Class not found")
+    class_scheduler.invalidate_classes()
     return {"message": "Class deleted successfully"}
 
 # ===== BOOKINGS ENDPOINTS =====
@@ -14218,11 +13799,8 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
     if class_obj.membership_types_allowed and member_obj.membership_type_id not in class_obj.membership_types_allowed:
         raise HTTPException(status_code=403, detail="Your membership type is not allowed for this class")
     
-    # Check member's no-show count
-    no_show_count = await db.bookings.count_documents({
-        "member_id": booking_data.member_id,
-        "no_show": True
-    })
+    # Check member's no-show count (maintained on the member by the no-show endpoints)
+    no_show_count = member_doc.get("no_show_count", 0)
     
     no_show_threshold = class_obj.no_show_threshold
     if no_show_count >= no_show_threshold:
@@ -14240,33 +13818,21 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
     if days_advance > class_obj.booking_window_days:
         raise HTTPException(status_code=400, detail=f"Cannot book more than {class_obj.booking_window_days} days in advance")
     
-    # Check capacity
-    existing_bookings = await db.bookings.count_documents({
-        "class_id": booking_data.class_id,
-        "booking_date": booking_data.booking_date.isoformat(),
-        "status": {"$in": ["confirmed", "attended"]}
-    })
-    
-    # Determine if booking is confirmed or waitlist
-    is_waitlist = False
-    waitlist_position = None
-    booking_status = "confirmed"
-    
-    if existing_bookings >= class_obj.capacity:
+    # Take a seat or waitlist place atomically on the occurrence's counters
+    place = await class_capacity.reserve(
+        booking_data.class_id,
+        booking_data.booking_date.isoformat(),
+        class_obj.capacity,
+        class_obj.waitlist_capacity if class_obj.allow_waitlist else None
+    )
+    if place["status"] == "full":
         if class_obj.allow_waitlist:
-            # Add to waitlist
-            is_waitlist = True
-            booking_status = "waitlist"
-            waitlist_count = await db.bookings.count_documents({
-                "class_id": booking_data.class_id,
-                "booking_date": booking_data.booking_date.isoformat(),
-                "status": "waitlist"
-            })
-            if waitlist_count >= class_obj.waitlist_capacity:
-                raise HTTPException(status_code=400, detail="Class and waitlist are full")
-            waitlist_position = waitlist_count + 1
-        else:
-            raise HTTPException(status_code=400, detail="Class is full and waitlist is not available")
+            raise HTTPException(status_code=400, detail="Class and waitlist are full")
+        raise HTTPException(status_code=400, detail="Class is full and waitlist is not available")
+    
+    booking_status = place["status"]
+    is_waitlist = booking_status == "waitlist"
+    waitlist_position = place["waitlist_position"]
     
     # Create booking
     new_booking = Booking(
@@ -14293,10 +13859,14 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
     if doc.get("checked_in_at"):
         doc["checked_in_at"] = doc["checked_in_at"].isoformat()
     
-    await db.bookings.insert_one(doc)
+    try:
+        await db.bookings.insert_one(doc)
+    except Exception:
+        await class_capacity.undo(doc["class_id"], doc["booking_date"], booking_status)
+        raise
     
     # Send WhatsApp booking confirmation if enabled
-    if class_obj.get("send_booking_confirmation", True):
+    if class_doc.get("send_booking_confirmation", True):
         try:
             # Format booking date/time
             booking_datetime = new_booking.booking_date
@@ -14306,34 +13876,34 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
             # Create confirmation message
             confirmation_message = f"""🎉 *Booking Confirmed!*
 
-Hi {member.get('first_name', 'Member')}!
+Hi {member_doc.get('first_name', 'Member')}!
 
 Your class booking has been confirmed:
 
-📋 *Class:* {class_obj['name']}
+📋 *Class:* {class_doc['name']}
 📅 *Date:* {formatted_date}
 ⏰ *Time:* {formatted_time}
-📍 *Location:* {class_obj.get('room', 'Main Studio')}
-👤 *Instructor:* {class_obj.get('instructor_name', 'TBA')}
+📍 *Location:* {class_doc.get('room', 'Main Studio')}
+👤 *Instructor:* {class_doc.get('instructor_name', 'TBA')}
 
 {"⚠️ You are on the WAITLIST (Position #" + str(waitlist_position) + ")" if is_waitlist else "✅ Your spot is confirmed!"}
 
 💡 *Important:*
 • Please arrive 10 minutes early
 • Remember to check-in at reception
-• Cancellations must be made at least {class_obj.get('cancel_window_hours', 2)} hours before class
+• Cancellations must be made at least {class_doc.get('cancel_window_hours', 2)} hours before class
 
 See you there! 💪"""
 
             # Send via respond.io
-            member_phone = member.get('phone') or member.get('phone_number')
+            member_phone = member_doc.get('phone') or member_doc.get('phone_number')
             if member_phone:
                 await send_whatsapp_message(
                     phone=member_phone,
                     message=confirmation_message,
-                    first_name=member.get('first_name', 'Member'),
-                    last_name=member.get('last_name', ''),
-                    email=member.get('email', '')
+                    first_name=member_doc.get('first_name', 'Member'),
+                    last_name=member_doc.get('last_name', ''),
+                    email=member_doc.get('email', '')
                 )
                 logger.info(f"Booking confirmation sent to {member_phone} for booking {new_booking.id}")
         except Exception as e:
@@ -14359,47 +13929,54 @@ async def update_booking(booking_id: str, booking_update: BookingUpdate, current
     
     booking_obj = Booking(**booking_doc)
     update_data = booking_update.model_dump(exclude_unset=True)
+    new_status = update_data.get("status") or booking_obj.status
     
     # Handle cancellation
-    if update_data.get("status") == "cancelled" and booking_obj.status != "cancelled":
+    if new_status == "cancelled" and booking_obj.status != "cancelled":
         update_data["cancelled_at"] = datetime.now(timezone.utc).isoformat()
-        
-        # If this was a confirmed booking, promote waitlist
-        if booking_obj.status == "confirmed":
-            # Find next waitlist booking
-            next_waitlist = await db.bookings.find_one(
-                {
-                    "class_id": booking_obj.class_id,
-                    "booking_date": booking_obj.booking_date.isoformat(),
-                    "status": "waitlist"
-                },
-                {"_id": 0},
-                sort=[("waitlist_position", 1)]
-            )
-            
-            if next_waitlist:
-                # Promote from waitlist to confirmed
-                await db.bookings.update_one(
-                    {"id": next_waitlist["id"]},
-                    {"$set": {
-                        "status": "confirmed",
-                        "is_waitlist": False,
-                        "waitlist_position": None
-                    }}
-                )
-                
-                # Update remaining waitlist positions
-                await db.bookings.update_many(
-                    {
-                        "class_id": booking_obj.class_id,
-                        "booking_date": booking_obj.booking_date.isoformat(),
-                        "status": "waitlist",
-                        "waitlist_position": {"$gt": next_waitlist["waitlist_position"]}
-                    },
-                    {"$inc": {"waitlist_position": -1}}
-                )
     
-    await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
+    old_place = place_of(booking_obj.status)
+    new_place = place_of(new_status)
+    if new_place != old_place:
+        # The booking moves between a seat, the waitlist and no place: keep the occurrence counters in step
+        if old_place == "confirmed" and new_place == "waitlist":
+            raise HTTPException(status_code=400, detail="A confirmed booking cannot be moved to the waitlist")
+        
+        booking_date = booking_doc["booking_date"]
+        if isinstance(booking_date, datetime):
+            booking_date = booking_date.isoformat()
+        taken = None
+        if new_place:
+            class_doc = await db.classes.find_one({"id": booking_obj.class_id}, {"_id": 0})
+            if not class_doc:
+                raise HTTPException(status_code=404, detail="Class not found")
+            class_obj = Class(**class_doc)
+            taken = await class_capacity.take(
+                booking_obj.class_id,
+                booking_date,
+                new_place,
+                class_obj.capacity,
+                class_obj.waitlist_capacity if class_obj.allow_waitlist else None
+            )
+            if not taken:
+                detail = "Class is full" if new_place == "confirmed" else "Waitlist is full or not available"
+                raise HTTPException(status_code=400, detail=detail)
+            update_data["is_waitlist"] = new_place == "waitlist"
+            update_data["waitlist_position"] = taken["waitlist_position"]
+        
+        # Only the request that actually changes the status moves the place
+        result = await db.bookings.update_one(
+            {"id": booking_id, "status": booking_obj.status},
+            {"$set": update_data}
+        )
+        if not result.modified_count:
+            if taken:
+                await class_capacity.undo(booking_obj.class_id, booking_date, new_place)
+        elif old_place:
+            # Frees the seat (promoting the first waitlisted booking) or the waitlist place
+            await class_capacity.release(booking_doc)
+    else:
+        await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
     
     # Fetch updated booking
     updated_booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
@@ -14408,9 +13985,11 @@ async def update_booking(booking_id: str, booking_update: BookingUpdate, current
 @api_router.delete("/bookings/{booking_id}")
 async def delete_booking(booking_id: str, current_user: User = Depends(get_current_user)):
     """Delete a booking"""
-    result = await db.bookings.delete_one({"id": booking_id})
-    if result.deleted_count == 0:
+    booking_doc = await db.bookings.find_one_and_delete({"id": booking_id}, projection={"_id": 0})
+    if not booking_doc:
         raise HTTPException(status_code=404, detail="Booking not found")
+    await class_capacity.release(booking_doc)
+    await class_capacity.forget_no_show(booking_doc)
     return {"message": "Booking deleted successfully"}
 
 @api_router.post("/bookings/{booking_id}/check-in")
@@ -14444,6 +14023,8 @@ class ImportLog(BaseModel):
     total_rows: int
     successful_rows: int
     failed_rows: int
+    skipped_rows: int = 0
+    updated_rows: int = 0
     field_mapping: dict
     status: str  # processing, completed, failed
     error_log: List[dict] = []
@@ -14742,6 +14323,33 @@ async def check_member_duplicate(
         }
     }
 
+def import_blocked_attempt(member_data: dict, keys: dict, duplicate: dict, field: str, user: User) -> dict:
+    """blocked_member_attempts document for an import row skipped as a duplicate"""
+    blocked_attempt = BlockedMemberAttempt(
+        attempted_first_name=member_data.get("first_name", ""),
+        attempted_last_name=member_data.get("last_name", ""),
+        attempted_email=member_data.get("email", ""),
+        attempted_phone=member_data.get("phone", ""),
+        norm_email=keys["norm_email"],
+        norm_phone=keys["norm_phone"],
+        norm_first_name=keys["norm_first_name"],
+        norm_last_name=keys["norm_last_name"],
+        duplicate_fields=[field],
+        match_types=[f"normalized_{field}"],
+        existing_members=[{
+            "id": duplicate["id"],
+            "name": f"{duplicate['first_name']} {duplicate['last_name']}",
+            "email": duplicate.get("email"),
+            "phone": duplicate.get("phone")
+        }],
+        attempted_by_user_id=user.id,
+        attempted_by_email=user.email,
+        source="import"
+    )
+    blocked_doc = blocked_attempt.model_dump()
+    blocked_doc["timestamp"] = blocked_doc["timestamp"].isoformat()
+    return blocked_doc
+
 @api_router.post("/import/members")
 async def import_members(
     file: UploadFile,
@@ -14749,188 +14357,60 @@ async def import_members(
     duplicate_action: str = "skip",  # skip, update, create
     current_user: User = Depends(get_current_user)
 ):
-    """Import members from CSV with field mapping and duplicate handling"""
+    """
+    Import members from CSV with field mapping and duplicate handling.
+    The upload is copied to a temporary file and imported in the background,
+    in chunks; the response carries the import log id straight away. Poll
+    GET /import/logs/{import_id} for progress until its status is completed
+    or failed.
+    """
+    import json
+    import tempfile
+    
     try:
-        import csv
-        import io
-        import json
-        
-        # Parse field mapping
         mapping = json.loads(field_mapping)
-        
-        # Read and parse CSV
-        content = await file.read()
-        decoded_content = content.decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(decoded_content))
-        
-        successful = 0
-        failed = 0
-        skipped = 0
-        updated = 0
-        error_log = []
-        
-        for row_num, row in enumerate(csv_reader, start=2):
-            try:
-                # Map CSV columns to Member fields
-                member_data = {
-                    "id": str(uuid.uuid4()),
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                for db_field, csv_column in mapping.items():
-                    if csv_column and csv_column in row:
-                        value = row[csv_column].strip()
-                        if value:
-                            member_data[db_field] = value
-                
-                # Auto-split full name into first_name and last_name if needed
-                if "first_name" in member_data and "last_name" not in member_data:
-                    full_name = member_data["first_name"]
-                    # Remove common titles
-                    titles = ["MR", "MRS", "MS", "MISS", "DR", "PROF"]
-                    name_parts = full_name.split()
-                    
-                    # Remove title if present
-                    if name_parts and name_parts[0].upper().rstrip('.') in titles:
-                        name_parts = name_parts[1:]
-                    
-                    # Split into first and last name
-                    if len(name_parts) >= 2:
-                        member_data["first_name"] = name_parts[0]
-                        member_data["last_name"] = " ".join(name_parts[1:])
-                    elif len(name_parts) == 1:
-                        member_data["first_name"] = name_parts[0]
-                        member_data["last_name"] = name_parts[0]  # Use same as first name
-                    else:
-                        # Empty or invalid full name - set both to empty string
-                        member_data["first_name"] = full_name
-                        member_data["last_name"] = full_name
-                
-                # Ensure last_name is always present (required field)
-                if "first_name" in member_data and "last_name" not in member_data:
-                    member_data["last_name"] = member_data["first_name"]
-                
-                # Check for duplicates
-                duplicate_found = None
-                
-                # Check email
-                if "email" in member_data and member_data["email"]:
-                    existing = await db.members.find_one({"email": member_data["email"].lower()}, {"_id": 0})
-                    if existing:
-                        duplicate_found = existing
-                
-                # Check phone if no email duplicate
-                if not duplicate_found and "phone" in member_data and member_data["phone"]:
-                    existing = await db.members.find_one({"phone": member_data["phone"]}, {"_id": 0})
-                    if existing:
-                        duplicate_found = existing
-                
-                # Check name if no other duplicates
-                if not duplicate_found and "first_name" in member_data and "last_name" in member_data:
-                    name_regex = {"$regex": f"^{member_data['first_name']}$", "$options": "i"}
-                    lastname_regex = {"$regex": f"^{member_data['last_name']}$", "$options": "i"}
-                    existing = await db.members.find_one({
-                        "first_name": name_regex,
-                        "last_name": lastname_regex
-                    }, {"_id": 0})
-                    if existing:
-                        duplicate_found = existing
-                
-                # Handle duplicate based on action
-                if duplicate_found:
-                    if duplicate_action == "skip":
-                        skipped += 1
-                        
-                        # Log as blocked attempt for staff review
-                        try:
-                            blocked_attempt = BlockedMemberAttempt(
-                                attempted_first_name=member_data.get("first_name", ""),
-                                attempted_last_name=member_data.get("last_name", ""),
-                                attempted_email=member_data.get("email", ""),
-                                attempted_phone=member_data.get("phone", ""),
-                                duplicate_fields=["detected_during_import"],
-                                match_types=["import_duplicate"],
-                                existing_members=[{
-                                    "id": duplicate_found["id"],
-                                    "name": f"{duplicate_found['first_name']} {duplicate_found['last_name']}",
-                                    "email": duplicate_found.get("email"),
-                                    "phone": duplicate_found.get("phone")
-                                }],
-                                attempted_by_user_id=current_user.id,
-                                attempted_by_email=current_user.email,
-                                source="import"
-                            )
-                            blocked_doc = blocked_attempt.model_dump()
-                            blocked_doc["timestamp"] = blocked_doc["timestamp"].isoformat()
-                            await db.blocked_member_attempts.insert_one(blocked_doc)
-                        except Exception as e:
-                            logger.error(f"Failed to log blocked import attempt: {str(e)}")
-                        
-                        error_log.append({
-                            "row": row_num,
-                            "action": "skipped",
-                            "reason": f"Duplicate found: {duplicate_found['first_name']} {duplicate_found['last_name']}",
-                            "data": row
-                        })
-                        continue
-                    elif duplicate_action == "update":
-                        # Update existing member
-                        update_data = {k: v for k, v in member_data.items() if k not in ["id", "created_at"]}
-                        await db.members.update_one({"id": duplicate_found["id"]}, {"$set": update_data})
-                        updated += 1
-                        continue
-                    # else: create anyway
-                
-                # Set defaults for required fields
-                if "membership_status" not in member_data:
-                    member_data["membership_status"] = "active"
-                if "membership_type_id" not in member_data:
-                    # Get default membership type
-                    default_type = await db.membership_types.find_one({}, {"_id": 0})
-                    if default_type:
-                        member_data["membership_type_id"] = default_type["id"]
-                
-                # Insert member
-                await db.members.insert_one(member_data)
-                successful += 1
-                
-            except Exception as e:
-                failed += 1
-                error_log.append({
-                    "row": row_num,
-                    "error": str(e),
-                    "data": row
-                })
-        
-        # Create import log
-        import_log = ImportLog(
-            import_type="members",
-            filename=file.filename,
-            total_rows=successful + failed + skipped + updated,
-            successful_rows=successful,
-            failed_rows=failed,
-            field_mapping=mapping,
-            status="completed",
-            error_log=error_log,
-            created_by=current_user.id
-        )
-        
-        log_doc = import_log.model_dump()
-        log_doc["created_at"] = log_doc["created_at"].isoformat()
-        await db.import_logs.insert_one(log_doc)
-        
-        return {
-            "success": True,
-            "total_rows": successful + failed + skipped + updated,
-            "successful": successful,
-            "failed": failed,
-            "skipped": skipped,
-            "updated": updated,
-            "error_log": error_log[:20]  # Return first 20 errors
-        }
-        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
+    
+    # The upload is closed when this request ends, so the background import reads a copy
+    spool = tempfile.TemporaryFile()
+    try:
+        await file.seek(0)
+        while chunk := await file.read(1024 * 1024):
+            spool.write(chunk)
+        spool.seek(0)
     except Exception as e:
+        spool.close()
         raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
+    
+    import_log = ImportLog(
+        import_type="members",
+        filename=file.filename,
+        total_rows=0,
+        successful_rows=0,
+        failed_rows=0,
+        field_mapping=mapping,
+        status="processing",
+        created_by=current_user.id
+    )
+    log_doc = import_log.model_dump()
+    log_doc["created_at"] = log_doc["created_at"].isoformat()
+    await db.import_logs.insert_one(log_doc)
+    
+    importer = MemberImporter(
+        db,
+        blocked_attempt=lambda member_data, keys, duplicate, field: import_blocked_attempt(
+            member_data, keys, duplicate, field, current_user
+        ),
+        rollups=rollups
+    )
+    importer.start(spool, mapping, duplicate_action, import_log.id)
+    
+    return {
+        "success": True,
+        "import_id": import_log.id,
+        "status": "processing"
+    }
 
 @api_router.post("/import/leads")
 async def import_leads(
@@ -15014,6 +14494,14 @@ async def get_import_logs(current_user: User = Depends(get_current_user)):
             log["created_at"] = datetime.fromisoformat(log["created_at"])
     return logs
 
+@api_router.get("/import/logs/{log_id}")
+async def get_import_log(log_id: str, current_user: User = Depends(get_current_user)):
+    """Get one import, e.g. to poll the progress of a running import"""
+    log = await db.import_logs.find_one({"id": log_id}, {"_id": 0})
+    if not log:
+        raise HTTPException(status_code=404, detail="Import log not found")
+    return log
+
 # Blocked Members Report Endpoints
 @api_router.get("/reports/blocked-members")
 async def get_blocked_members(
@@ -15246,16 +14734,11 @@ async def get_summary_report(current_user: User = Depends(get_current_user)):
     pending_invoices = await db.invoices.count_documents({"status": "pending"})
     overdue_invoices = await db.invoices.count_documents({"status": "overdue"})
     
-    # Calculate total revenue (paid invoices)
-    paid_invoices_list = await db.invoices.find({"status": "paid"}, {"amount": 1}).to_list(None)
-    total_revenue = sum(inv.get("amount", 0) for inv in paid_invoices_list)
-    
-    # Revenue last 30 days
-    recent_paid = await db.invoices.find({
-        "status": "paid",
-        "created_at": {"$gte": thirty_days_ago.isoformat()}
-    }, {"amount": 1}).to_list(None)
-    revenue_30d = sum(inv.get("amount", 0) for inv in recent_paid)
+    # Revenue (all time and last 30 days) from the daily revenue rollup
+    total_revenue = (await rollups.totals(REVENUE_ROLLUP, ["amount"]))["amount"]
+    revenue_30d = (await rollups.totals(
+        REVENUE_ROLLUP, ["amount"], start_date=thirty_days_ago.strftime("%Y-%m-%d")
+    ))["amount"]
     
     # Classes statistics
     total_classes = await db.classes.count_documents({})
@@ -15272,16 +14755,15 @@ async def get_summary_report(current_user: User = Depends(get_current_user)):
         "created_at": {"$gte": thirty_days_ago.isoformat()}
     })
     
-    # Access logs (check-ins)
-    total_checkins = await db.access_logs.count_documents({"access_granted": True})
-    checkins_30d = await db.access_logs.count_documents({
-        "timestamp": {"$gte": thirty_days_ago.isoformat()},
-        "access_granted": True
-    })
-    checkins_7d = await db.access_logs.count_documents({
-        "timestamp": {"$gte": seven_days_ago.isoformat()},
-        "access_granted": True
-    })
+    # Access logs (check-ins) from the daily check-in rollup
+    granted = {"status": "granted"}
+    total_checkins = (await rollups.totals(CHECKIN_ROLLUP, ["count"], filters=granted))["count"]
+    checkins_30d = (await rollups.totals(
+        CHECKIN_ROLLUP, ["count"], start_date=thirty_days_ago.strftime("%Y-%m-%d"), filters=granted
+    ))["count"]
+    checkins_7d = (await rollups.totals(
+        CHECKIN_ROLLUP, ["count"], start_date=seven_days_ago.strftime("%Y-%m-%d"), filters=granted
+    ))["count"]
     
     # Automations statistics
     total_automations = await db.automations.count_documents({})
@@ -15503,6 +14985,7 @@ async def update_permission_matrix(
         role_perm_data["id"] = str(uuid.uuid4())
         await db.role_permissions.insert_one(role_perm_data)
         message = f"Custom permissions created for role: {ROLES[data.role]}"
+    principal_cache.clear()
     
     return {
         "success": True,
@@ -15525,6 +15008,7 @@ async def reset_role_permissions(
     
     # Delete custom permissions (will fall back to defaults)
     result = await db.role_permissions.delete_one({"role": role})
+    principal_cache.clear()
     
     default_perms = DEFAULT_ROLE_PERMISSIONS.get(role, [])
     
@@ -15601,6 +15085,7 @@ async def update_user_role(
         {"id": user_id},
         {"$set": {"role": data.role}}
     )
+    principal_cache.invalidate(email=user.get("email"), user_id=user_id)
     
     # Get permissions for this role
     custom_perms = await db.role_permissions.find_one({"role": data.role})
@@ -15637,7 +15122,7 @@ async def create_staff_user(
         raise HTTPException(status_code=400, detail="User with this email already exists")
     
     # Hash password using existing pwd_context
-    hashed_password = hash_password(user_data['password'])
+    hashed_password = await cpu_executor.run(hash_password, user_data['password'])
     
     # Create user
     new_user = {
@@ -16168,6 +15653,9 @@ async def create_pos_transaction(
     transaction_data["member_name"] = member_name
     transaction_data["status"] = "completed"
     
+    # Rollup lines: product sales by category, other payments by transaction type
+    rollup_lines = []
+    
     # Process based on transaction type
     if transaction.transaction_type == "product_sale":
         # Deduct stock for each product
@@ -16175,6 +15663,11 @@ async def create_pos_transaction(
             product = await db.products.find_one({"id": item.product_id})
             if not product:
                 raise HTTPException(status_code=400, detail=f"Product {item.product_id} not found")
+            rollup_lines.append({
+                "category": product.get("category_name"),
+                "amount": item.total,
+                "quantity": item.quantity
+            })
             
             new_stock = product["stock_quantity"] - item.quantity
             if new_stock < 0:
@@ -16251,13 +15744,24 @@ async def create_pos_transaction(
                         "is_debtor": new_debt > 0
                     }}
                 )
+                invalidate_member_state(transaction.member_id)
         
         # Save payment record
+        member = await db.members.find_one({"id": transaction.member_id}, {"_id": 0, "membership_type_id": 1, "source": 1})
+        payment_data.update(payment_dimensions(member))
         await db.payments.insert_one(payment_data)
         transaction_data["payment_id"] = payment_data["id"]
+        rollup_lines.append({
+            "category": transaction.transaction_type,
+            "amount": transaction.total_amount,
+            "quantity": 1
+        })
+        
+        await rollups.record_payments([payment_data])
     
     # Save transaction
     await db.pos_transactions.insert_one(transaction_data)
+    await rollups.record_pos_sale(transaction_data["transaction_date"], rollup_lines)
     
     # Remove MongoDB's _id before returning
     if "_id" in transaction_data:
@@ -16325,6 +15829,21 @@ async def void_pos_transaction(
                 {"$inc": {"stock_quantity": item["quantity"]}}
             )
     
+    # Reverse the POS rollup (the linked payment record is kept, so the revenue rollup is unchanged)
+    if transaction["transaction_type"] == "product_sale":
+        products = await db.products.find(
+            {"id": {"$in": [item["product_id"] for item in transaction["items"]]}},
+            {"_id": 0, "id": 1, "category_name": 1}
+        ).to_list(None)
+        category_by_product = {p["id"]: p.get("category_name") for p in products}
+        rollup_lines = [
+            {"category": category_by_product.get(item["product_id"]), "amount": item.get("total", 0), "quantity": item["quantity"]}
+            for item in transaction["items"]
+        ]
+    else:
+        rollup_lines = [{"category": transaction["transaction_type"], "amount": transaction.get("total_amount", 0), "quantity": 1}]
+    await rollups.record_pos_sale(transaction["transaction_date"], rollup_lines, sign=-1)
+    
     # Update transaction status
     await db.pos_transactions.update_one(
         {"id": transaction_id},
@@ -16402,14 +15921,36 @@ async def get_daily_pos_summary(date: Optional[str] = None, current_user: User =
 # EFT SDV Integration Endpoints
 # ============================================================================
 
-from eft_utils import EFTFileGenerator, EFTFileParser, save_eft_file, setup_eft_folders
+from eft_utils import (
+    EFTFileGenerator,
+    EFTFileParser,
+    DebitOrderFileWriter,
+    atomic_file,
+    outgoing_eft_path,
+    setup_eft_folders
+)
 from debicheck_utils import (
     DebiCheckMandateGenerator, 
     DebiCheckCollectionGenerator,
     DebiCheckResponseParser,
-    save_debicheck_file
+    MandateFileWriter,
+    CollectionFileWriter,
+    outgoing_debicheck_path
 )
 
+EFT_ITEM_INSERT_BATCH = 1000
+
+# Bank fields of the member joined to each invoice / levy of a debit order run
+DEBIT_ORDER_MEMBER_LOOKUP = [
+    {"$lookup": {"from": "members", "localField": "member_id", "foreignField": "id", "as": "member"}},
+    {"$set": {"member": {"$arrayElemAt": ["$member", 0]}}},
+    {"$project": {
+        "_id": 0, "id": 1, "amount": 1, "member_name": 1,
+        "member.id": 1, "member.first_name": 1, "member.last_name": 1,
+        "member.bank_account_number": 1, "member.bank_branch_code": 1
+    }},
+]
+
 # Setup EFT folders on startup
 EFT_FOLDERS = setup_eft_folders()
 
@@ -16560,113 +16101,120 @@ async def create_or_update_eft_settings(
         return settings_data
 
 
-@api_router.post("/eft/generate/billing")
-async def generate_billing_eft_file(
-    invoice_ids: List[str],
-    action_date: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Generate EFT file for billing/membership invoices"""
-    # Get EFT settings
-    settings = await db.eft_settings.find_one({})
-    if not settings:
-        raise HTTPException(
-            status_code=400,
-            detail="EFT settings not configured. Please configure EFT settings first."
-        )
-    
-    # Get invoices
-    invoices = await db.invoices.find({"id": {"$in": invoice_ids}}).to_list(length=None)
-    if not invoices:
-        raise HTTPException(status_code=404, detail="No invoices found")
-    
-    # Build transactions list
-    transactions = []
-    for invoice in invoices:
-        # Get member details
-        member = await db.members.find_one({"id": invoice["member_id"]})
-        if not member:
-            continue
-        
-        # Check if member has bank details
-        if not member.get("bank_account_number") or not member.get("bank_branch_code"):
-            continue
-        
-        transactions.append({
-            "member_name": f"{member['first_name']} {member['last_name']}",
-            "member_id": member["id"],
-            "member_account": member.get("bank_account_number"),
-            "member_branch": member.get("bank_branch_code"),
-            "amount": invoice["amount"],
-            "invoice_id": invoice["id"],
-            "action_date": action_date or date.today().isoformat()
-        })
-    
-    if not transactions:
-        raise HTTPException(
-            status_code=400,
-            detail="No valid transactions found. Members must have bank account details."
-        )
-    
-    # Generate EFT file
+async def write_debit_order_run(
+    settings: dict,
+    rows,
+    transaction_type: str,
+    source_field: str,
+    action_date: Optional[str],
+    not_found: str
+) -> dict:
+    """
+    Stream a debit order file for rows (invoices or levies joined to their
+    member) straight to the outgoing folder while the cursor is consumed.
+    Transaction items are inserted in batches; memory use does not grow
+    with the size of the run.
+    """
     generator = EFTFileGenerator(
         client_profile_number=settings["client_profile_number"],
         nominated_account=settings["nominated_account"],
         charges_account=settings["charges_account"]
     )
+    file_sequence = await file_sequences.next(generator.client_profile_number)
+    filename = f"EFT_DEBIT_{file_sequence}.txt"
+    filepath = outgoing_eft_path(filename)
     
-    filename, content = generator.generate_debit_order_file(transactions)
-    
-    # Save file
-    filepath = save_eft_file(filename, content)
-    
-    # Create EFT transaction record
     eft_txn = EFTTransaction(
         file_type="outgoing_debit",
         file_name=filename,
-        file_sequence=generator.generate_file_sequence_number(),
-        transaction_type="billing",
-        total_transactions=len(transactions),
-        total_amount=sum(t["amount"] for t in transactions),
-        status="generated"
+        file_sequence=file_sequence,
+        transaction_type=transaction_type,
+        status="generating"
     ).dict()
-    
     await db.eft_transactions.insert_one(eft_txn)
     
-    # Create individual transaction items
-    for idx, txn in enumerate(transactions):
-        item = EFTTransactionItem(
-            eft_transaction_id=eft_txn["id"],
-            member_id=txn.get("member_id", ""),
-            member_name=txn["member_name"],
-            member_account=txn["member_account"],
-            member_branch=txn["member_branch"],
-            invoice_id=txn["invoice_id"],
-            amount=txn["amount"],
-            action_date=datetime.now(timezone.utc),
-            payment_reference=f"{eft_txn['file_sequence']}{str(idx+1).zfill(10)}",
-            status="pending"
-        ).dict()
-        
-        await db.eft_transaction_items.insert_one(item)
+    rows_seen = 0
+    items = []
+    try:
+        with atomic_file(filepath) as out:
+            writer = DebitOrderFileWriter(generator, out, file_sequence)
+            async for row in rows:
+                rows_seen += 1
+                member = row.get("member") or {}
+                
+                # Check if member has bank details
+                if not member.get("bank_account_number") or not member.get("bank_branch_code"):
+                    continue
+                
+                txn = {
+                    "member_name": row.get("member_name") or f"{member['first_name']} {member['last_name']}",
+                    "member_id": member["id"],
+                    "member_account": member["bank_account_number"],
+                    "member_branch": member["bank_branch_code"],
+                    "amount": row["amount"],
+                    source_field: row["id"],
+                    "action_date": action_date or date.today().isoformat()
+                }
+                payment_reference = writer.add(txn)
+                
+                items.append(EFTTransactionItem(
+                    eft_transaction_id=eft_txn["id"],
+                    member_id=txn["member_id"],
+                    member_name=txn["member_name"],
+                    member_account=txn["member_account"],
+                    member_branch=txn["member_branch"],
+                    amount=txn["amount"],
+                    action_date=datetime.now(timezone.utc),
+                    payment_reference=payment_reference,
+                    status="pending",
+                    **{source_field: row["id"]}
+                ).dict())
+                if len(items) >= EFT_ITEM_INSERT_BATCH:
+                    await db.eft_transaction_items.insert_many(items)
+                    items = []
+            
+            if not rows_seen:
+                raise HTTPException(status_code=404, detail=not_found)
+            if not writer.count:
+                raise HTTPException(
+                    status_code=400,
+                    detail="No valid transactions found. Members must have bank account details."
+                )
+            writer.close()
+            if items:
+                await db.eft_transaction_items.insert_many(items)
+    except BaseException:
+        # No file was written; drop the run's records
+        await db.eft_transaction_items.delete_many({"eft_transaction_id": eft_txn["id"]})
+        await db.eft_transactions.delete_one({"id": eft_txn["id"]})
+        raise
+    
+    await db.eft_transactions.update_one(
+        {"id": eft_txn["id"]},
+        {"$set": {
+            "status": "generated",
+            "total_transactions": writer.count,
+            "total_amount": writer.total_value
+        }}
+    )
     
     return {
         "success": True,
         "file_name": filename,
         "file_path": filepath,
         "transaction_id": eft_txn["id"],
-        "total_transactions": len(transactions),
-        "total_amount": sum(t["amount"] for t in transactions)
+        "total_transactions": writer.count,
+        "total_amount": writer.total_value
     }
 
 
-@api_router.post("/eft/generate/levies")
-async def generate_levies_eft_file(
-    levy_ids: List[str],
+@api_router.post("/eft/generate/billing")
+async def generate_billing_eft_file(
+    invoice_ids: List[str],
     action_date: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Generate EFT file for levies"""
+    """Generate EFT file for billing/membership invoices"""
     # Get EFT settings
     settings = await db.eft_settings.find_one({})
     if not settings:
@@ -16675,89 +16223,41 @@ async def generate_levies_eft_file(
             detail="EFT settings not configured. Please configure EFT settings first."
         )
     
-    # Get levies
-    levies = await db.levies.find({"id": {"$in": levy_ids}}).to_list(length=None)
-    if not levies:
-        raise HTTPException(status_code=404, detail="No levies found")
-    
-    # Build transactions list
-    transactions = []
-    for levy in levies:
-        # Get member details
-        member = await db.members.find_one({"id": levy["member_id"]})
-        if not member:
-            continue
-        
-        # Check if member has bank details
-        if not member.get("bank_account_number") or not member.get("bank_branch_code"):
-            continue
-        
-        transactions.append({
-            "member_name": levy["member_name"],
-            "member_id": member["id"],
-            "member_account": member.get("bank_account_number"),
-            "member_branch": member.get("bank_branch_code"),
-            "amount": levy["amount"],
-            "levy_id": levy["id"],
-            "action_date": action_date or date.today().isoformat()
-        })
-    
-    if not transactions:
+    rows = db.invoices.aggregate([{"$match": {"id": {"$in": invoice_ids}}}, *DEBIT_ORDER_MEMBER_LOOKUP])
+    return await write_debit_order_run(
+        settings,
+        rows,
+        transaction_type="billing",
+        source_field="invoice_id",
+        action_date=action_date,
+        not_found="No invoices found"
+    )
+
+
+@api_router.post("/eft/generate/levies")
+async def generate_levies_eft_file(
+    levy_ids: List[str],
+    action_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Generate EFT file for levies"""
+    # Get EFT settings
+    settings = await db.eft_settings.find_one({})
+    if not settings:
         raise HTTPException(
             status_code=400,
-            detail="No valid transactions found. Members must have bank account details."
+            detail="EFT settings not configured. Please configure EFT settings first."
         )
     
-    # Generate EFT file
-    generator = EFTFileGenerator(
-        client_profile_number=settings["client_profile_number"],
-        nominated_account=settings["nominated_account"],
-        charges_account=settings["charges_account"]
-    )
-    
-    filename, content = generator.generate_debit_order_file(transactions)
-    
-    # Save file
-    filepath = save_eft_file(filename, content)
-    
-    # Create EFT transaction record
-    eft_txn = EFTTransaction(
-        file_type="outgoing_debit",
-        file_name=filename,
-        file_sequence=generator.generate_file_sequence_number(),
+    rows = db.levies.aggregate([{"$match": {"id": {"$in": levy_ids}}}, *DEBIT_ORDER_MEMBER_LOOKUP])
+    return await write_debit_order_run(
+        settings,
+        rows,
         transaction_type="levy",
-        total_transactions=len(transactions),
-        total_amount=sum(t["amount"] for t in transactions),
-        status="generated"
-    ).dict()
-    
-    await db.eft_transactions.insert_one(eft_txn)
-    
-    # Create individual transaction items
-    for idx, txn in enumerate(transactions):
-        item = EFTTransactionItem(
-            eft_transaction_id=eft_txn["id"],
-            member_id=txn.get("member_id", ""),
-            member_name=txn["member_name"],
-            member_account=txn["member_account"],
-            member_branch=txn["member_branch"],
-            levy_id=txn["levy_id"],
-            amount=txn["amount"],
-            action_date=datetime.now(timezone.utc),
-            payment_reference=f"{eft_txn['file_sequence']}{str(idx+1).zfill(10)}",
-            status="pending"
-        ).dict()
-        
-        await db.eft_transaction_items.insert_one(item)
-    
-    return {
-        "success": True,
-        "file_name": filename,
-        "file_path": filepath,
-        "transaction_id": eft_txn["id"],
-        "total_transactions": len(transactions),
-        "total_amount": sum(t["amount"] for t in transactions)
-    }
+        source_field="levy_id",
+        action_date=action_date,
+        not_found="No levies found"
+    )
 
 
 @api_router.get("/eft/transactions")
@@ -16934,45 +16434,55 @@ async def generate_due_collections(
         "levies": None
     }
     
-    # Generate billing file
-    if collection_type in ["billing", "both"]:
+    async def billing_file():
         # Get invoices due
         invoices_response = await get_invoices_due_for_collection(days_advance, current_user)
-        
         if invoices_response["total_invoices"] > 0:
             invoice_ids = [inv["invoice_id"] for inv in invoices_response["invoices"]]
-            
-            # Generate file
-            billing_result = await generate_billing_eft_file(
+            results["billing"] = await generate_billing_eft_file(
                 invoice_ids=invoice_ids,
                 action_date=action_date,
                 current_user=current_user
             )
-            
-            results["billing"] = billing_result
     
-    # Generate levies file
-    if collection_type in ["levies", "both"]:
+    async def levies_file():
         # Get levies due
         levies_response = await get_levies_due_for_collection(days_advance, current_user)
-        
         if levies_response["total_levies"] > 0:
             levy_ids = [lev["levy_id"] for lev in levies_response["levies"]]
-            
-            # Generate file
-            levies_result = await generate_levies_eft_file(
+            results["levies"] = await generate_levies_eft_file(
                 levy_ids=levy_ids,
                 action_date=action_date,
                 current_user=current_user
             )
-            
-            results["levies"] = levies_result
+    
+    # Each file takes its own sequence number, so both can be generated at once
+    jobs = {}
+    if collection_type in ["billing", "both"]:
+        jobs["billing"] = billing_file()
+    if collection_type in ["levies", "both"]:
+        jobs["levies"] = levies_file()
+    outcomes = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    
+    # Wait for both before reporting: a file that was written must be reported even
+    # if the other failed, or a retry would generate (and debit) it a second time
+    errors = {}
+    for kind, outcome in zip(jobs, outcomes):
+        if isinstance(outcome, BaseException):
+            errors[kind] = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            logger.error(f"Due {kind} collection file failed: {errors[kind]}")
+    if errors and len(errors) == len(jobs):
+        failure = outcomes[0]
+        if isinstance(failure, HTTPException):
+            raise failure
+        raise HTTPException(status_code=500, detail=f"Collection file generation failed: {errors}")
     
     return {
-        "success": True,
+        "success": not errors,
         "advance_days": days_advance,
         "collection_type": collection_type,
-        "results": results
+        "results": results,
+        "errors": errors
     }
 
 
@@ -17066,6 +16576,13 @@ async def webhook_eft_response(
         # Parse the response file
         parsed_data = EFTFileParser.parse_response_file(file_content)
         
+        # Apply the item responses (a redelivered file is not applied twice)
+        result = await eft_ingestor.ingest(
+            f"{file_sequence}:{response_type}",
+            parsed_data["transactions"],
+            succeeded=lambda txn: response_type == "ack"
+        )
+        
         # Update transaction status
         status_map = {
             "ack": "acknowledged",
@@ -17083,43 +16600,13 @@ async def webhook_eft_response(
             }}
         )
         
-        # Process individual transaction items
-        for txn_response in parsed_data["transactions"]:
-            payment_ref = txn_response["payment_reference"]
-            
-            item = await db.eft_transaction_items.find_one({"payment_reference": payment_ref})
-            
-            if item:
-                await db.eft_transaction_items.update_one(
-                    {"id": item["id"]},
-                    {"$set": {
-                        "status": "processed" if response_type == "ack" else "failed",
-                        "processed_at": datetime.now(timezone.utc).isoformat(),
-                        "response_code": txn_response.get("response_code"),
-                        "response_message": txn_response.get("response_message")
-                    }}
-                )
-                
-                # Update invoice/levy if successful
-                if response_type == "ack":
-                    if item.get("invoice_id"):
-                        await db.invoices.update_one(
-                            {"id": item["invoice_id"]},
-                            {"$set": {"status": "paid", "paid_date": datetime.now(timezone.utc).isoformat()}}
-                        )
-                        await calculate_member_debt(item["member_id"])
-                    
-                    if item.get("levy_id"):
-                        await db.levies.update_one(
-                            {"id": item["levy_id"]},
-                            {"$set": {"status": "paid", "paid_date": datetime.now(timezone.utc).isoformat()}}
-                        )
-        
         return {
             "success": True,
             "message": "Webhook processed successfully",
             "transaction_id": transaction["id"],
-            "items_processed": len(parsed_data["transactions"])
+            "items_processed": len(parsed_data["transactions"]),
+            "items_applied": result.get("applied", 0),
+            "already_processed": result.get("already_processed", False)
         }
         
     except Exception as e:
@@ -17247,83 +16734,34 @@ async def process_incoming_eft_file(
         # Parse the file
         parsed_data = EFTFileParser.parse_response_file(file_content)
         
+        file_sequence = parsed_data["header"]["file_sequence"]
+        
         # Get EFT settings for notification preference
         settings = await db.eft_settings.find_one({})
         enable_notifications = settings.get("enable_notifications", False) if settings else False
         
-        # Process each transaction
-        for txn_response in parsed_data["transactions"]:
-            payment_ref = txn_response["payment_reference"]
-            
-            # Find the original transaction item
-            item = await db.eft_transaction_items.find_one({"payment_reference": payment_ref})
-            
-            if item:
-                # Update item status
-                update_data = {
-                    "status": "processed" if txn_response.get("status") == "processed" else "failed",
-                    "processed_at": datetime.now(timezone.utc).isoformat(),
-                    "response_code": txn_response.get("response_code"),
-                    "response_message": txn_response.get("response_message")
-                }
-                
-                await db.eft_transaction_items.update_one(
-                    {"id": item["id"]},
-                    {"$set": update_data}
-                )
-                
-                # If processed successfully, update invoice/levy and member balance
-                if txn_response.get("status") == "processed":
-                    # Update invoice if exists
-                    if item.get("invoice_id"):
-                        invoice = await db.invoices.find_one({"id": item["invoice_id"]})
-                        if invoice:
-                            await db.invoices.update_one(
-                                {"id": item["invoice_id"]},
-                                {"$set": {
-                                    "status": "paid",
-                                    "paid_date": datetime.now(timezone.utc).isoformat()
-                                }}
-                            )
-                            
-                            # Create payment record
-                            payment = PaymentCreate(
-                                member_id=item["member_id"],
-                                invoice_id=item["invoice_id"],
-                                amount=item["amount"],
-                                payment_method="EFT",
-                                payment_gateway="EFT_DEBIT_ORDER",
-                                reference_number=payment_ref,
-                                notes="Auto-processed from EFT response file"
-                            ).dict()
-                            payment["id"] = str(uuid.uuid4())
-                            payment["payment_date"] = datetime.now(timezone.utc).isoformat()
-                            
-                            await db.payments.insert_one(payment)
-                            
-                            # Update member debt
-                            await calculate_member_debt(item["member_id"])
-                    
-                    # Update levy if exists
-                    if item.get("levy_id"):
-                        await db.levies.update_one(
-                            {"id": item["levy_id"]},
-                            {"$set": {
-                                "status": "paid",
-                                "paid_date": datetime.now(timezone.utc).isoformat()
-                            }}
-                        )
-                    
-                    # Send notification if enabled
-                    if enable_notifications:
-                        member = await db.members.find_one({"id": item["member_id"]})
-                        if member and member.get("email"):
-                            # Here you would integrate with email service
-                            # For now, we'll just log it
-                            print(f"Notification: Payment confirmed for {member.get('first_name')} {member.get('last_name')} - Amount: R{item['amount']}")
+        # Apply all records: items, invoices, levies and payments in bulk, debts once per member
+        result = await eft_ingestor.ingest(
+            f"{file_sequence}:{file_name}",
+            parsed_data["transactions"],
+            succeeded=lambda txn: txn.get("status") == "processed",
+            record_payments=True
+        )
+        
+        # Send notification if enabled
+        paid_items = result.get("paid_items", [])
+        if enable_notifications and paid_items:
+            members = await BatchLoader(db).load_many(
+                "members", [item["member_id"] for item in paid_items], {"first_name": 1, "last_name": 1, "email": 1}
+            )
+            for item in paid_items:
+                member = members.get(item["member_id"])
+                if member and member.get("email"):
+                    # Here you would integrate with email service
+                    # For now, we'll just log it
+                    logger.info(f"Notification: Payment confirmed for {member.get('first_name')} {member.get('last_name')} - Amount: R{item['amount']}")
         
         # Update parent EFT transaction
-        file_sequence = parsed_data["header"]["file_sequence"]
         eft_txn = await db.eft_transactions.find_one({"file_sequence": file_sequence})
         
         if eft_txn:
@@ -17339,7 +16777,9 @@ async def process_incoming_eft_file(
         return {
             "success": True,
             "message": "EFT response file processed successfully",
-            "transactions_processed": len(parsed_data["transactions"])
+            "transactions_processed": len(parsed_data["transactions"]),
+            "items_applied": result.get("applied", 0),
+            "already_processed": result.get("already_processed", False)
         }
         
     except Exception as e:
@@ -17476,59 +16916,55 @@ async def generate_debicheck_mandate_file(
             detail="EFT settings not configured"
         )
     
-    # Get mandates
-    mandates = await db.debicheck_mandates.find({"id": {"$in": mandate_ids}}).to_list(length=None)
-    if not mandates:
-        raise HTTPException(status_code=404, detail="No mandates found")
-    
-    # Build mandate data list
-    mandate_data_list = []
-    for mandate in mandates:
-        mandate_data_list.append({
-            'mandate_reference_number': mandate['mandate_reference_number'],
-            'mandate_type': mandate['mandate_type'],
-            'transaction_type': mandate['transaction_type'],
-            'contract_reference': mandate['contract_reference'],
-            'debtor_name': mandate['member_name'],
-            'debtor_id_number': mandate['debtor_id_number'],
-            'debtor_bank_account': mandate['debtor_bank_account'],
-            'debtor_branch_code': mandate['debtor_branch_code'],
-            'account_type': mandate.get('account_type', '1'),
-            'first_collection_date': mandate['first_collection_date'],
-            'collection_day': mandate['collection_day'],
-            'frequency': mandate['frequency'],
-            'installment_amount': mandate['installment_amount'],
-            'maximum_amount': mandate['maximum_amount'],
-            'adjustment_category': mandate['adjustment_category'],
-            'adjustment_rate': mandate['adjustment_rate'],
-            'action': 'A',  # A=Add new mandate
-            'member_id': mandate['member_id']
-        })
-    
-    # Generate file
     generator = DebiCheckMandateGenerator(
         client_profile_number=settings["client_profile_number"],
         creditor_name=settings.get("bank_name", "GYM"),
         creditor_abbr="GYM"
     )
     
-    filename, content = generator.generate_mandate_file(mandate_data_list)
-    
-    # Save file
-    filepath = save_debicheck_file(filename, content, "mandate")
+    file_sequence = await file_sequences.next(generator.client_profile_number)
+    filename = f"DEBICHECK_MANDATE_{file_sequence}.txt"
+    filepath = outgoing_debicheck_path(filename, "mandate")
+    
+    # Stream mandate records to the file as the cursor is read
+    with atomic_file(filepath) as out:
+        writer = MandateFileWriter(generator, out, file_sequence)
+        async for mandate in db.debicheck_mandates.find({"id": {"$in": mandate_ids}}, {"_id": 0}):
+            writer.add({
+                'mandate_reference_number': mandate['mandate_reference_number'],
+                'mandate_type': mandate['mandate_type'],
+                'transaction_type': mandate['transaction_type'],
+                'contract_reference': mandate['contract_reference'],
+                'debtor_name': mandate['member_name'],
+                'debtor_id_number': mandate['debtor_id_number'],
+                'debtor_bank_account': mandate['debtor_bank_account'],
+                'debtor_branch_code': mandate['debtor_branch_code'],
+                'account_type': mandate.get('account_type', '1'),
+                'first_collection_date': mandate['first_collection_date'],
+                'collection_day': mandate['collection_day'],
+                'frequency': mandate['frequency'],
+                'installment_amount': mandate['installment_amount'],
+                'maximum_amount': mandate['maximum_amount'],
+                'adjustment_category': mandate['adjustment_category'],
+                'adjustment_rate': mandate['adjustment_rate'],
+                'action': 'A',  # A=Add new mandate
+                'member_id': mandate['member_id']
+            })
+        if not writer.count:
+            raise HTTPException(status_code=404, detail="No mandates found")
+        writer.close()
     
     # Update mandate status
-    for mandate_id in mandate_ids:
-        await db.debicheck_mandates.update_one(
-            {"id": mandate_id},
-            {"$set": {"status": "submitted"}}
-        )
+    await db.debicheck_mandates.update_many(
+        {"id": {"$in": mandate_ids}},
+        {"$set": {"status": "submitted"}}
+    )
     
     return {
         "success": True,
         "file_name": filename,
         "file_path": filepath,
-        "total_mandates": len(mandates)
+        "total_mandates": writer.count
     }
 
 
@@ -17611,49 +17047,43 @@ async def generate_debicheck_collection_file(
     if not settings:
         raise HTTPException(status_code=400, detail="EFT settings not configured")
     
-    # Get collections
-    collections = await db.debicheck_collections.find({"id": {"$in": collection_ids}}).to_list(length=None)
-    if not collections:
-        raise HTTPException(status_code=404, detail="No collections found")
-    
-    # Build collection data list
-    collection_data_list = []
-    for coll in collections:
-        collection_data_list.append({
-            'mandate_reference_number': coll['mandate_reference_number'],
-            'contract_reference': coll['contract_reference'],
-            'collection_amount': coll['collection_amount'],
-            'action_date': coll['action_date'],
-            'collection_type': coll['collection_type']
-        })
-    
-    # Generate file
     generator = DebiCheckCollectionGenerator(
         client_profile_number=settings["client_profile_number"],
         creditor_abbr="GYM"
     )
     
-    filename, content = generator.generate_collection_file(
-        collection_data_list,
-        settings["nominated_account"],
-        settings["charges_account"]
-    )
+    file_sequence = await file_sequences.next(generator.client_profile_number)
+    filename = f"DEBICHECK_COLLECTION_{file_sequence}.txt"
+    filepath = outgoing_debicheck_path(filename, "collection")
     
-    # Save file
-    filepath = save_debicheck_file(filename, content, "collection")
+    # Stream collection records to the file as the cursor is read
+    with atomic_file(filepath) as out:
+        writer = CollectionFileWriter(
+            generator, out, file_sequence, settings["nominated_account"], settings["charges_account"]
+        )
+        async for coll in db.debicheck_collections.find({"id": {"$in": collection_ids}}, {"_id": 0}):
+            writer.add({
+                'mandate_reference_number': coll['mandate_reference_number'],
+                'contract_reference': coll['contract_reference'],
+                'collection_amount': coll['collection_amount'],
+                'action_date': coll['action_date'],
+                'collection_type': coll['collection_type']
+            })
+        if not writer.count:
+            raise HTTPException(status_code=404, detail="No collections found")
+        writer.close()
     
     # Update collection status
-    for coll_id in collection_ids:
-        await db.debicheck_collections.update_one(
-            {"id": coll_id},
-            {"$set": {"status": "submitted"}}
-        )
+    await db.debicheck_collections.update_many(
+        {"id": {"$in": collection_ids}},
+        {"$set": {"status": "submitted"}}
+    )
     
     return {
         "success": True,
         "file_name": filename,
         "file_path": filepath,
-        "total_collections": len(collections)
+        "total_collections": writer.count
     }
 
 
@@ -17761,10 +17191,13 @@ async def export_payments_report(
     # Get payments
     payments = await db.payments.find(query, {"_id": 0}).to_list(length=None)
     
-    # Get member details for each payment
+    # Get member details for all payments in one query
+    members = await BatchLoader(db).load_many(
+        "members", [p["member_id"] for p in payments], {"first_name": 1, "last_name": 1, "email": 1}
+    )
     report_data = []
     for payment in payments:
-        member = await db.members.find_one({"id": payment["member_id"]}, {"_id": 0})
+        member = members.get(payment["member_id"])
         if member:
             report_data.append({
                 "Payment ID": payment["id"],
@@ -17830,9 +17263,13 @@ async def export_unpaid_report(
     
     report_data = []
     
+    members = await BatchLoader(db).load_many(
+        "members", [i["member_id"] for i in unpaid_invoices], {"first_name": 1, "last_name": 1, "email": 1}
+    )
+    
     # Process invoices
     for invoice in unpaid_invoices:
-        member = await db.members.find_one({"id": invoice["member_id"]}, {"_id": 0})
+        member = members.get(invoice["member_id"])
         if member:
             report_data.append({
                 "Type": "Invoice",
@@ -17928,12 +17365,21 @@ async def export_monthly_billing_report(
     
     report_data = []
     
+    members = await BatchLoader(db).load_many(
+        "members", [i["member_id"] for i in invoices],
+        {"first_name": 1, "last_name": 1, "email": 1, "membership_type": 1}
+    )
+    # First payment per invoice
+    payments_by_invoice = {}
+    for p in payments:
+        payments_by_invoice.setdefault(p.get("invoice_id"), p)
+    
     # Process invoices
     for invoice in invoices:
-        member = await db.members.find_one({"id": invoice["member_id"]}, {"_id": 0})
+        member = members.get(invoice["member_id"])
         if member:
             # Find payment for this invoice
-            payment = next((p for p in payments if p.get("invoice_id") == invoice["id"]), None)
+            payment = payments_by_invoice.get(invoice["id"])
             
             report_data.append({
                 "Month": f"{year}-{str(month).zfill(2)}",
@@ -18125,6 +17571,76 @@ app.add_middleware(
 # ============================================================================
 
 from avs_utils import AVSService
+from services.avs_verification import AVSVerifier
+
+# Account verifications share one pooled AVS connection and a result cache
+avs_verifier = AVSVerifier(
+    db,
+    concurrency=int(os.environ.get("AVS_CONCURRENCY", "4")),
+    cache_ttl_days=int(os.environ.get("AVS_CACHE_TTL_DAYS", "30")),
+    # Test deployments only (e.g. a local mock SOAP server); never set from the API
+    endpoint=os.environ.get("AVS_ENDPOINT") or None
+)
+
+# avs_verifications documents per insert_many
+AVS_RESULT_INSERT_BATCH = 1000
+
+
+def avs_verification_record(
+    request: dict,
+    outcome: dict,
+    verification_type: str,
+    created_by: str,
+    member_id: Optional[str] = None
+) -> AVSVerificationResult:
+    """AVSVerificationResult for one AVSVerifier.verify outcome"""
+    verification_result = outcome["verification"]
+    results = verification_result.get("verification_results", {})
+    bank_identifier = request.get("bank_identifier") or verification_result.get("bank_identifier") or "21"
+    return AVSVerificationResult(
+        member_id=member_id,
+        verification_type=verification_type,
+        bank_identifier=bank_identifier,
+        bank_name=AVSService.get_bank_name(bank_identifier),
+        account_number=request.get("account_number") or verification_result.get("account_number") or "",
+        sort_code=request.get("sort_code") or verification_result.get("sort_code") or "",
+        identity_number=request.get("identity_number") or verification_result.get("identity_number") or "",
+        identity_type=request.get("identity_type") or verification_result.get("identity_type") or "SID",
+        initials=request.get("initials") or verification_result.get("initials"),
+        last_name=request.get("last_name") or verification_result.get("last_name"),
+        result_code=outcome.get("result_code", "UNKNOWN"),
+        result_code_acct=verification_result.get("result_code_acct", "UNKNOWN"),
+        account_exists=results.get("account_exists", "U"),
+        identification_number_matched=results.get("identification_number_matched", "U"),
+        initials_matched=results.get("initials_matched", "U"),
+        last_name_matched=results.get("last_name_matched", "U"),
+        account_active=results.get("account_active", "U"),
+        account_dormant=results.get("account_dormant", "U"),
+        account_active_3months=results.get("account_active3_months", "U"),
+        can_debit_account=results.get("can_debit_account", "U"),
+        can_credit_account=results.get("can_credit_account", "U"),
+        tax_ref_match=results.get("tax_ref_match", "U"),
+        account_type_match=results.get("account_type_match", "U"),
+        email_id_matched=results.get("email_id_matched", "U"),
+        cell_number_matched=results.get("cell_number_matched", "U"),
+        verification_summary=AVSService.format_verification_summary(verification_result),
+        mock_mode=outcome.get("mock_mode", False),
+        cached_result=outcome.get("cached", False),
+        created_by=created_by
+    )
+
+
+async def store_avs_results(records: List[AVSVerificationResult]) -> List[dict]:
+    """Insert verification results in batches; returns them as dicts"""
+    docs = []
+    for record in records:
+        doc = record.dict()
+        doc["created_at"] = doc["created_at"].isoformat()
+        docs.append(doc)
+    for start in range(0, len(docs), AVS_RESULT_INSERT_BATCH):
+        await db.avs_verifications.insert_many(docs[start:start + AVS_RESULT_INSERT_BATCH], ordered=False)
+    return [record.dict() for record in records]
+
 
 @api_router.get("/avs/config")
 async def get_avs_config(current_user: User = Depends(get_current_user)):
@@ -18186,13 +17702,15 @@ async def create_or_update_avs_config(
 @api_router.post("/avs/verify")
 async def verify_account(
     request: AVSVerificationRequest,
+    force: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
     Verify a single bank account using Nedbank AVS service
     
     Returns verification results including account existence, ownership match,
-    account status, and ability to accept debits/credits.
+    account status, and ability to accept debits/credits. A recent result for
+    the same account is reused unless force=true.
     """
     # Get AVS config
     config = await db.avs_config.find_one({})
@@ -18202,78 +17720,27 @@ async def verify_account(
             detail="AVS not configured. Please configure AVS settings first."
         )
     
-    # Initialize AVS service
-    avs_config = {
-        "mock_mode": config.get("mock_mode", True),
-        "profile_number": config.get("profile_number", "0000000000"),
-        "profile_user_number": config.get("profile_user_number", "00000"),
-        "charge_account": config.get("charge_account", "0000000000"),
-        "use_qa": config.get("use_qa", True)
-    }
-    
-    avs_service = AVSService(avs_config)
-    
     # Prepare verification request
     verification_data = request.dict()
     
     # Perform verification
     try:
-        result = await avs_service.verify_account([verification_data])
+        outcome = (await avs_verifier.verify(config, [verification_data], use_cache=not force))[0]
         
-        if not result.get("verifications"):
+        if not outcome:
             raise HTTPException(
                 status_code=500,
                 detail="No verification results received"
             )
         
-        verification_result = result["verifications"][0]
-        
-        # Get bank name
-        bank_name = AVSService.get_bank_name(request.bank_identifier)
-        
-        # Format summary
-        summary = AVSService.format_verification_summary(verification_result)
-        
         # Store verification result in database
-        avs_result = AVSVerificationResult(
-            verification_type="manual",
-            bank_identifier=request.bank_identifier,
-            bank_name=bank_name,
-            account_number=request.account_number,
-            sort_code=request.sort_code,
-            identity_number=request.identity_number,
-            identity_type=request.identity_type,
-            initials=request.initials,
-            last_name=request.last_name,
-            result_code=result.get("result_code", "UNKNOWN"),
-            result_code_acct=verification_result.get("result_code_acct", "UNKNOWN"),
-            account_exists=verification_result["verification_results"].get("account_exists", "U"),
-            identification_number_matched=verification_result["verification_results"].get("identification_number_matched", "U"),
-            initials_matched=verification_result["verification_results"].get("initials_matched", "U"),
-            last_name_matched=verification_result["verification_results"].get("last_name_matched", "U"),
-            account_active=verification_result["verification_results"].get("account_active", "U"),
-            account_dormant=verification_result["verification_results"].get("account_dormant", "U"),
-            account_active_3months=verification_result["verification_results"].get("account_active3_months", "U"),
-            can_debit_account=verification_result["verification_results"].get("can_debit_account", "U"),
-            can_credit_account=verification_result["verification_results"].get("can_credit_account", "U"),
-            tax_ref_match=verification_result["verification_results"].get("tax_ref_match", "U"),
-            account_type_match=verification_result["verification_results"].get("account_type_match", "U"),
-            email_id_matched=verification_result["verification_results"].get("email_id_matched", "U"),
-            cell_number_matched=verification_result["verification_results"].get("cell_number_matched", "U"),
-            verification_summary=summary,
-            mock_mode=result.get("mock_mode", False),
-            created_by=current_user.id
-        )
-        
-        # Save to database
-        avs_result_dict = avs_result.dict()
-        avs_result_dict["created_at"] = avs_result_dict["created_at"].isoformat()
-        await db.avs_verifications.insert_one(avs_result_dict)
+        avs_result = avs_verification_record(verification_data, outcome, "manual", current_user.id)
+        stored = await store_avs_results([avs_result])
         
         return {
             "success": True,
-            "result": avs_result.dict(),
-            "summary": summary
+            "result": stored[0],
+            "summary": avs_result.verification_summary
         }
         
     except Exception as e:
@@ -18286,12 +17753,14 @@ async def verify_account(
 @api_router.post("/avs/verify-member/{member_id}")
 async def verify_member_account(
     member_id: str,
+    force: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
     Verify a member's bank account details using AVS
     
-    Uses the banking details stored in the member's profile.
+    Uses the banking details stored in the member's profile. A recent result
+    for the same account, ID number and name is reused unless force=true.
     """
     # Get member
     member = await db.members.find_one({"id": member_id})
@@ -18346,78 +17815,30 @@ async def verify_member_account(
             detail="AVS not configured. Please configure AVS settings first."
         )
     
-    # Initialize AVS service
-    avs_config = {
-        "mock_mode": config.get("mock_mode", True),
-        "profile_number": config.get("profile_number", "0000000000"),
-        "profile_user_number": config.get("profile_user_number", "00000"),
-        "charge_account": config.get("charge_account", "0000000000"),
-        "use_qa": config.get("use_qa", True)
-    }
-    
-    avs_service = AVSService(avs_config)
+    verification_data = verification_request.dict()
     
     # Perform verification
     try:
-        result = await avs_service.verify_account([verification_request.dict()])
+        outcome = (await avs_verifier.verify(config, [verification_data], use_cache=not force))[0]
         
-        if not result.get("verifications"):
+        if not outcome:
             raise HTTPException(
                 status_code=500,
                 detail="No verification results received"
             )
         
-        verification_result = result["verifications"][0]
-        
-        # Get bank name
-        bank_name = AVSService.get_bank_name(bank_identifier)
-        
-        # Format summary
-        summary = AVSService.format_verification_summary(verification_result)
-        
         # Store verification result
-        avs_result = AVSVerificationResult(
-            member_id=member_id,
-            verification_type="member_verification",
-            bank_identifier=bank_identifier,
-            bank_name=bank_name,
-            account_number=verification_request.account_number,
-            sort_code=verification_request.sort_code,
-            identity_number=verification_request.identity_number,
-            identity_type=verification_request.identity_type,
-            initials=verification_request.initials,
-            last_name=verification_request.last_name,
-            result_code=result.get("result_code", "UNKNOWN"),
-            result_code_acct=verification_result.get("result_code_acct", "UNKNOWN"),
-            account_exists=verification_result["verification_results"].get("account_exists", "U"),
-            identification_number_matched=verification_result["verification_results"].get("identification_number_matched", "U"),
-            initials_matched=verification_result["verification_results"].get("initials_matched", "U"),
-            last_name_matched=verification_result["verification_results"].get("last_name_matched", "U"),
-            account_active=verification_result["verification_results"].get("account_active", "U"),
-            account_dormant=verification_result["verification_results"].get("account_dormant", "U"),
-            account_active_3months=verification_result["verification_results"].get("account_active3_months", "U"),
-            can_debit_account=verification_result["verification_results"].get("can_debit_account", "U"),
-            can_credit_account=verification_result["verification_results"].get("can_credit_account", "U"),
-            tax_ref_match=verification_result["verification_results"].get("tax_ref_match", "U"),
-            account_type_match=verification_result["verification_results"].get("account_type_match", "U"),
-            email_id_matched=verification_result["verification_results"].get("email_id_matched", "U"),
-            cell_number_matched=verification_result["verification_results"].get("cell_number_matched", "U"),
-            verification_summary=summary,
-            mock_mode=result.get("mock_mode", False),
-            created_by=current_user.id
+        avs_result = avs_verification_record(
+            verification_data, outcome, "member_verification", current_user.id, member_id=member_id
         )
-        
-        # Save to database
-        avs_result_dict = avs_result.dict()
-        avs_result_dict["created_at"] = avs_result_dict["created_at"].isoformat()
-        await db.avs_verifications.insert_one(avs_result_dict)
+        stored = await store_avs_results([avs_result])
         
         return {
             "success": True,
             "member_id": member_id,
             "member_name": f"{member.get('first_name', '')} {member.get('last_name', '')}",
-            "result": avs_result.dict(),
-            "summary": summary
+            "result": stored[0],
+            "summary": avs_result.verification_summary
         }
         
     except Exception as e:
@@ -18430,19 +17851,16 @@ async def verify_member_account(
 @api_router.post("/avs/batch-verify")
 async def batch_verify_accounts(
     request: AVSBatchVerificationRequest,
+    force: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
-    Verify multiple bank accounts in a single batch (up to 40 accounts)
+    Verify multiple bank accounts
     
-    Useful for bulk verification or CSV imports.
+    Any number of accounts: they are sent in 40-account AVS requests, a few
+    at a time, and recently verified accounts are answered from the cache
+    unless force=true. Useful for bulk verification or CSV imports.
     """
-    if len(request.verifications) > 40:
-        raise HTTPException(
-            status_code=400,
-            detail="Maximum 40 accounts can be verified in a single batch"
-        )
-    
     # Get AVS config
     config = await db.avs_config.find_one({})
     if not config:
@@ -18451,76 +17869,31 @@ async def batch_verify_accounts(
             detail="AVS not configured. Please configure AVS settings first."
         )
     
-    # Initialize AVS service
-    avs_config = {
-        "mock_mode": config.get("mock_mode", True),
-        "profile_number": config.get("profile_number", "0000000000"),
-        "profile_user_number": config.get("profile_user_number", "00000"),
-        "charge_account": config.get("charge_account", "0000000000"),
-        "use_qa": config.get("use_qa", True)
-    }
-    
-    avs_service = AVSService(avs_config)
-    
     # Prepare verification requests
     verification_data = [v.dict() for v in request.verifications]
     
     # Perform batch verification
     try:
-        result = await avs_service.verify_account(verification_data)
+        outcomes = await avs_verifier.verify(config, verification_data, use_cache=not force)
         
-        if not result.get("verifications"):
+        if not any(outcomes):
             raise HTTPException(
                 status_code=500,
                 detail="No verification results received"
             )
         
         # Store all verification results
-        stored_results = []
-        for verification_result in result["verifications"]:
-            bank_identifier = verification_result.get("bank_identifier", "21")
-            bank_name = AVSService.get_bank_name(bank_identifier)
-            
-            avs_result = AVSVerificationResult(
-                verification_type="batch",
-                bank_identifier=bank_identifier,
-                bank_name=bank_name,
-                account_number=verification_result.get("account_number", ""),
-                sort_code=verification_result.get("sort_code", ""),
-                identity_number=verification_result.get("identity_number", ""),
-                identity_type=verification_result.get("identity_type", "SID"),
-                initials=verification_result.get("initials"),
-                last_name=verification_result.get("last_name"),
-                result_code=result.get("result_code", "UNKNOWN"),
-                result_code_acct=verification_result.get("result_code_acct", "UNKNOWN"),
-                account_exists=verification_result["verification_results"].get("account_exists", "U"),
-                identification_number_matched=verification_result["verification_results"].get("identification_number_matched", "U"),
-                initials_matched=verification_result["verification_results"].get("initials_matched", "U"),
-                last_name_matched=verification_result["verification_results"].get("last_name_matched", "U"),
-                account_active=verification_result["verification_results"].get("account_active", "U"),
-                account_dormant=verification_result["verification_results"].get("account_dormant", "U"),
-                account_active_3months=verification_result["verification_results"].get("account_active3_months", "U"),
-                can_debit_account=verification_result["verification_results"].get("can_debit_account", "U"),
-                can_credit_account=verification_result["verification_results"].get("can_credit_account", "U"),
-                tax_ref_match=verification_result["verification_results"].get("tax_ref_match", "U"),
-                account_type_match=verification_result["verification_results"].get("account_type_match", "U"),
-                email_id_matched=verification_result["verification_results"].get("email_id_matched", "U"),
-                cell_number_matched=verification_result["verification_results"].get("cell_number_matched", "U"),
-                verification_summary=AVSService.format_verification_summary(verification_result),
-                mock_mode=result.get("mock_mode", False),
-                created_by=current_user.id
-            )
-            
-            # Save to database
-            avs_result_dict = avs_result.dict()
-            avs_result_dict["created_at"] = avs_result_dict["created_at"].isoformat()
-            await db.avs_verifications.insert_one(avs_result_dict)
-            
-            stored_results.append(avs_result.dict())
+        stored_results = await store_avs_results([
+            avs_verification_record(data, outcome, "batch", current_user.id)
+            for data, outcome in zip(verification_data, outcomes)
+            if outcome
+        ])
         
         return {
             "success": True,
             "total_verified": len(stored_results),
+            "from_cache": sum(1 for outcome in outcomes if outcome and outcome["cached"]),
+            "failed": sum(1 for outcome in outcomes if not outcome),
             "results": stored_results
         }
         
@@ -18740,6 +18113,10 @@ async def get_fti_transactions(
     }
 
 
+# Reconciliation writes per bulk_write batch
+FTI_RECONCILE_WRITE_BATCH = 1000
+
+
 @api_router.post("/ti/fti/reconcile")
 async def reconcile_fti_transactions(current_user: User = Depends(get_current_user)):
     """
@@ -18756,7 +18133,10 @@ async def reconcile_fti_transactions(current_user: User = Depends(get_current_us
         )
     
     # Get unreconciled FTI transactions
-    fti_transactions = await db.fti_transactions.find({"is_reconciled": False}).to_list(length=None)
+    fti_transactions = await db.fti_transactions.find(
+        {"is_reconciled": False},
+        {"_id": 0, "id": 1, "date": 1, "amount": 1, "reference": 1, "description": 1, "is_debit": 1}
+    ).to_list(length=None)
     
     if not fti_transactions:
         return {
@@ -18765,49 +18145,65 @@ async def reconcile_fti_transactions(current_user: User = Depends(get_current_us
         }
     
     # Get outstanding invoices
-    outstanding_invoices = await db.invoices.find({"status": {"$in": ["pending", "overdue"]}}).to_list(length=None)
+    outstanding_invoices = await db.invoices.find(
+        {"status": {"$in": ["pending", "overdue"]}},
+        {"_id": 0, "id": 1, "member_id": 1, "member_name": 1, "amount": 1, "due_date": 1}
+    ).to_list(length=None)
     
     # Initialize TI service
     ti_service = TIService(config)
     
-    # Perform reconciliation
-    reconciliation_result = ti_service.reconcile_transactions(fti_transactions, outstanding_invoices)
+    # Perform reconciliation (index build and matching off the event loop)
+    reconciliation_result = await cpu_executor.run(
+        ti_service.reconcile_transactions, fti_transactions, outstanding_invoices
+    )
     
     # Update matched transactions and invoices
-    updated_invoices = 0
-    updated_transactions = 0
+    reconciled_at = datetime.now(timezone.utc).isoformat()
+    auto_reconcile = config.get("auto_reconcile")
+    transaction_ops = []
+    invoice_ops = []
     
     for match in reconciliation_result["matched"]:
         transaction = match["transaction"]
         invoice = match["invoice"]
         
-        # Update FTI transaction
-        await db.fti_transactions.update_one(
-            {"id": transaction["id"]},
+        transaction_ops.append(UpdateOne(
+            {"id": transaction["id"], "is_reconciled": False},
             {"$set": {
                 "is_reconciled": True,
                 "matched_invoice_id": invoice["id"],
                 "matched_member_id": invoice.get("member_id"),
                 "match_confidence": match["match_confidence"],
                 "match_reason": match["match_reason"],
-                "reconciled_at": datetime.now(timezone.utc).isoformat(),
+                "reconciled_at": reconciled_at,
                 "reconciled_by": current_user.id
             }}
-        )
-        updated_transactions += 1
+        ))
         
         # Update invoice if auto_reconcile is enabled and high confidence
-        if config.get("auto_reconcile") and match["match_confidence"] == "high":
-            await db.invoices.update_one(
-                {"id": invoice["id"]},
+        if auto_reconcile and match["match_confidence"] == "high":
+            invoice_ops.append(UpdateOne(
+                {"id": invoice["id"], "status": {"$in": ["pending", "overdue"]}},
                 {"$set": {
                     "status": "paid",
                     "paid_date": transaction["date"],
                     "payment_method": "bank_transfer",
                     "payment_reference": transaction["reference"]
                 }}
-            )
-            updated_invoices += 1
+            ))
+    
+    updated_transactions = 0
+    updated_invoices = 0
+    for start in range(0, max(len(transaction_ops), len(invoice_ops)), FTI_RECONCILE_WRITE_BATCH):
+        transaction_batch = transaction_ops[start:start + FTI_RECONCILE_WRITE_BATCH]
+        invoice_batch = invoice_ops[start:start + FTI_RECONCILE_WRITE_BATCH]
+        if transaction_batch:
+            result = await db.fti_transactions.bulk_write(transaction_batch, ordered=False)
+            updated_transactions += result.modified_count
+        if invoice_batch:
+            result = await db.invoices.bulk_write(invoice_batch, ordered=False)
+            updated_invoices += result.modified_count
     
     # Store reconciliation result
     recon_result = ReconciliationResult(
@@ -19150,10 +18546,12 @@ async def mark_booking_no_show(
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    await db.bookings.update_one(
-        {"id": booking_id},
+    result = await db.bookings.update_one(
+        {"id": booking_id, "no_show": {"$ne": True}},
         {"$set": {"no_show": True}}
     )
+    if result.modified_count:
+        await db.members.update_one({"id": booking["member_id"]}, {"$inc": {"no_show_count": 1}})
     
     return {
         "success": True,
@@ -19163,40 +18561,11 @@ async def mark_booking_no_show(
 
 @api_router.post("/bookings/process-no-shows")
 async def process_no_shows(current_user: User = Depends(get_current_user)):
-    """Process all past bookings and mark no-shows"""
-    now = datetime.now(timezone.utc)
-    
-    # Get all confirmed bookings that have passed
-    past_bookings = await db.bookings.find({
-        "status": "confirmed",
-        "no_show": False
-    }).to_list(length=None)
-    
-    no_shows_marked = 0
-    
-    for booking in past_bookings:
-        booking_date = booking["booking_date"]
-        if isinstance(booking_date, str):
-            booking_date = datetime.fromisoformat(booking_date.replace('Z', '+00:00'))
-        if booking_date.tzinfo is None:
-            booking_date = booking_date.replace(tzinfo=timezone.utc)
-        
-        # Get class to check check-in window
-        class_obj = await db.classes.find_one({"id": booking["class_id"]})
-        if not class_obj:
-            continue
-        
-        check_in_window_minutes = class_obj.get("check_in_window_minutes", 15)
-        
-        # If booking time + check-in window has passed, mark as no-show
-        window_end = booking_date + timedelta(minutes=check_in_window_minutes)
-        
-        if now > window_end:
-            await db.bookings.update_one(
-                {"id": booking["id"]},
-                {"$set": {"no_show": True, "status": "no-show"}}
-            )
-            no_shows_marked += 1
+    """
+    Mark confirmed bookings past their check-in window as no-shows.
+    Also runs periodically in-process (see ClassScheduler).
+    """
+    no_shows_marked = await class_scheduler.process_no_shows()
     
     return {
         "success": True,
@@ -19218,6 +18587,7 @@ async def clear_member_no_shows(
         {"member_id": member_id, "no_show": True},
         {"$set": {"no_show": False}}
     )
+    await db.members.update_one({"id": member_id}, {"$set": {"no_show_count": 0}})
     
     return {
         "success": True,
@@ -19226,110 +18596,38 @@ async def clear_member_no_shows(
     }
 
 
-@api_router.post("/bookings/send-class-reminders")
-async def send_class_reminders(current_user: User = Depends(get_current_user)):
-    """Send WhatsApp reminders to members with upcoming classes (called by cron/scheduler)"""
-    now = datetime.now(timezone.utc)
-    reminders_sent = 0
-    errors = []
-    
-    # Get all confirmed bookings
-    bookings = await db.bookings.find({
-        "status": "confirmed"
-    }).to_list(length=None)
+@api_router.post("/admin/bookings/rebuild-no-show-counts")
+async def rebuild_no_show_counts(current_user: User = Depends(get_current_user)):
+    """Recompute every member's no_show_count from bookings (Admin only)"""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild no-show counts")
     
-    for booking in bookings:
-        try:
-            # Get class details
-            class_obj = await db.classes.find_one({"id": booking["class_id"]})
-            if not class_obj:
-                continue
-            
-            # Check if reminders are enabled for this class
-            if not class_obj.get("send_class_reminder", True):
-                continue
-            
-            reminder_minutes = class_obj.get("reminder_minutes_before", 60)
-            
-            # Parse booking date
-            booking_date = booking["booking_date"]
-            if isinstance(booking_date, str):
-                booking_date = datetime.fromisoformat(booking_date.replace('Z', '+00:00'))
-            if booking_date.tzinfo is None:
-                booking_date = booking_date.replace(tzinfo=timezone.utc)
-            
-            # Calculate time until class
-            time_until_class_minutes = (booking_date - now).total_seconds() / 60
-            
-            # Check if we should send reminder (within a 5-minute window)
-            if reminder_minutes - 5 <= time_until_class_minutes <= reminder_minutes + 5:
-                # Check if reminder already sent (add a flag to prevent duplicate sends)
-                if booking.get("reminder_sent"):
-                    continue
-                
-                # Get member details
-                member = await db.members.find_one({"id": booking["member_id"]})
-                if not member:
-                    continue
-                
-                member_phone = member.get('phone') or member.get('phone_number')
-                if not member_phone:
-                    continue
-                
-                # Format times
-                formatted_date = booking_date.strftime("%A, %B %d, %Y")
-                formatted_time = booking_date.strftime("%I:%M %p")
-                
-                # Create reminder message
-                reminder_message = f"""⏰ *Class Reminder*
-
-Hi {member.get('first_name', 'Member')}!
-
-Your class starts in {reminder_minutes} minutes:
-
-📋 *Class:* {class_obj['name']}
-📅 *Date:* {formatted_date}
-⏰ *Time:* {formatted_time}
-📍 *Location:* {class_obj.get('room', 'Main Studio')}
-👤 *Instructor:* {class_obj.get('instructor_name', 'TBA')}
-
-🏃 Get ready and we'll see you soon!
-
-💡 Remember to check-in at reception when you arrive.
+    updated = await class_capacity.rebuild_no_show_counts()
+    return {"success": True, "members_updated": updated}
 
-Need to cancel? Please do so at least {class_obj.get('cancel_window_hours', 2)} hours before class to avoid a no-show."""
 
-                # Send reminder
-                await send_whatsapp_message(
-                    phone=member_phone,
-                    message=reminder_message,
-                    first_name=member.get('first_name', 'Member'),
-                    last_name=member.get('last_name', ''),
-                    email=member.get('email', '')
-                )
-                
-                # Mark reminder as sent
-                await db.bookings.update_one(
-                    {"id": booking["id"]},
-                    {"$set": {"reminder_sent": True}}
-                )
-                
-                reminders_sent += 1
-                logger.info(f"Reminder sent to {member_phone} for booking {booking['id']}")
-                
-        except Exception as e:
-            error_msg = f"Failed to send reminder for booking {booking.get('id')}: {str(e)}"
-            logger.error(error_msg)
-            errors.append(error_msg)
+@api_router.post("/bookings/send-class-reminders")
+async def send_class_reminders(current_user: User = Depends(get_current_user)):
+    """
+    Send WhatsApp reminders to members with upcoming classes.
+    Also runs periodically in-process (see ClassScheduler); this triggers a run on demand.
+    """
+    result = await class_scheduler.send_reminders()
     
     return {
         "success": True,
-        "reminders_sent": reminders_sent,
-        "errors": errors,
-        "message": f"Sent {reminders_sent} reminders"
+        "reminders_sent": result["reminders_sent"],
+        "errors": result["errors"],
+        "message": f"Sent {result['reminders_sent']} reminders"
     }
 
 
+@api_router.get("/bookings/scheduler-status")
+async def get_class_scheduler_status(current_user: User = Depends(get_current_user)):
+    """Interval and result of the last in-process reminder / no-show run"""
+    return class_scheduler.stats()
+
+
 @api_router.get("/member-access/stats")
 async def get_member_access_stats(current_user: User = Depends(get_current_user)):
     """
@@ -19518,6 +18816,7 @@ async def create_notification_template(
     template_dict["created_at"] = template_dict["created_at"].isoformat()
     
     await db.notification_templates.insert_one(template_dict)
+    rule_index.invalidate("templates")
     
     # Remove MongoDB _id for response
     template_dict.pop("_id", None)
@@ -19568,6 +18867,7 @@ async def seed_default_templates(current_user: User = Depends(get_current_user))
     # Clear existing and insert defaults
     await db.notification_templates.delete_many({})
     await db.notification_templates.insert_many(default_templates)
+    rule_index.invalidate("templates")
     
     return {
         "success": True,
@@ -19646,6 +18946,7 @@ async def send_unified_message(
         template_dict = new_template.model_dump()
         template_dict["created_at"] = template_dict["created_at"].isoformat()
         await db.notification_templates.insert_one(template_dict)
+        rule_index.invalidate("templates")
     
     # Send messages
     sent_count = 0
@@ -19775,6 +19076,7 @@ async def update_notification_template(
         {"id": template_id},
         {"$set": template_dict}
     )
+    rule_index.invalidate("templates")
     
     # Remove MongoDB _id for response
     template_dict.pop("_id", None)
@@ -19800,6 +19102,7 @@ async def delete_notification_template(
         {"id": template_id},
         {"$set": {"is_active": False}}
     )
+    rule_index.invalidate("templates")
     
     return {
         "success": True,
@@ -19960,11 +19263,125 @@ async def update_role_permissions(role: str, permissions: Dict[str, List[str]]):
             {"$set": {"permissions": permissions.get("permissions", [])}},
             upsert=True
         )
+        principal_cache.clear()
         return {"success": True, "modified": result.modified_count, "upserted": result.upserted_id is not None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update role permissions: {str(e)}")
 
 
+# ===================== Daily Rollup Reports =====================
+
+@api_router.get("/reports/membership-movement")
+async def get_membership_movement(
+    days: int = 90,
+    current_user: User = Depends(get_current_user)
+):
+    """Daily joins vs cancellations, by membership type and source (served from rollups)"""
+    from collections import defaultdict
+    
+    end_date = datetime.now(timezone.utc)
+    start_date = end_date - timedelta(days=days)
+    rows = await rollups.rows(MEMBERSHIP_ROLLUP, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    membership_types = await db.membership_types.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+    type_names = {mt["id"]: mt["name"] for mt in membership_types}
+    
+    daily = defaultdict(lambda: {"joins": 0, "cancellations": 0})
+    by_type = defaultdict(lambda: {"joins": 0, "cancellations": 0})
+    by_source = defaultdict(lambda: {"joins": 0, "cancellations": 0})
+    for row in rows:
+        for bucket in (daily[row["date"]], by_type[type_names.get(row["membership_type_id"], "Unknown")], by_source[row["source"]]):
+            bucket["joins"] += row.get("joins", 0)
+            bucket["cancellations"] += row.get("cancellations", 0)
+    
+    total_joins = sum(d["joins"] for d in daily.values())
+    total_cancellations = sum(d["cancellations"] for d in daily.values())
+    
+    return {
+        "period_days": days,
+        "summary": {
+            "joins": total_joins,
+            "cancellations": total_cancellations,
+            "net_gain": total_joins - total_cancellations
+        },
+        "daily": [{"date": k, **v} for k, v in sorted(daily.items())],
+        "by_membership_type": [{"type": k, **v} for k, v in sorted(by_type.items())],
+        "by_source": [{"source": k, **v} for k, v in sorted(by_source.items())]
+    }
+
+@api_router.get("/reports/pos-category-sales")
+async def get_pos_category_sales(
+    days: int = 30,
+    current_user: User = Depends(get_current_user)
+):
+    """POS sales by product category and day (served from rollups)"""
+    from collections import defaultdict
+    
+    end_date = datetime.now(timezone.utc)
+    start_date = end_date - timedelta(days=days)
+    rows = await rollups.rows(POS_ROLLUP, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    
+    by_category = defaultdict(lambda: {"amount": 0.0, "quantity": 0, "items": 0})
+    daily = defaultdict(float)
+    for row in rows:
+        category = by_category[row["category"]]
+        category["amount"] += row.get("amount", 0)
+        category["quantity"] += row.get("quantity", 0)
+        category["items"] += row.get("items", 0)
+        daily[row["date"]] += row.get("amount", 0)
+    
+    return {
+        "period_days": days,
+        "total_sales": round(sum(daily.values()), 2),
+        "by_category": [
+            {"category": k, "amount": round(v["amount"], 2), "quantity": v["quantity"], "items": v["items"]}
+            for k, v in sorted(by_category.items(), key=lambda x: x[1]["amount"], reverse=True)
+        ],
+        "daily": [{"date": k, "amount": round(v, 2)} for k, v in sorted(daily.items())]
+    }
+
+@api_router.post("/admin/rollups/rebuild")
+async def rebuild_rollups(current_user: User = Depends(get_current_user)):
+    """Recompute every daily rollup from source collections (Admin only)"""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild rollups")
+    
+    counts = await rollups.rebuild()
+    return {"success": True, "rows": counts}
+
+
+# ===================== Database Index Advisor =====================
+
+@api_router.get("/admin/db/index-report")
+async def get_index_report(
+    slow_ms: int = 100,
+    current_user: User = Depends(get_current_user)
+):
+    """Report missing/unused indexes, collection-scan plans on hot paths and slow queries (Admin only)"""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can view the index report")
+    
+    return await analyze_indexes(db, slow_ms=slow_ms)
+
+@api_router.post("/admin/db/ensure-indexes")
+async def ensure_indexes_endpoint(current_user: User = Depends(get_current_user)):
+    """Re-apply the index registry (Admin only). Idempotent."""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can manage indexes")
+    
+    return await ensure_indexes(db)
+
+
+# ===================== Audit Log Writer =====================
+
+@api_router.get("/admin/audit-logs/writer-stats")
+async def get_audit_writer_stats(current_user: User = Depends(get_current_user)):
+    """Queue depth, written/dropped counters and active sampling rules of the audit log writer (Admin only)"""
+    if current_user.role not in ["business_owner", "head_admin"]:
+        raise HTTPException(status_code=403, detail="Only admins can view audit writer stats")
+
+    return audit_log_writer.stats()
+
+
 # Include the router in the main app (must be after all route definitions)
 app.include_router(api_router)
 
@@ -19977,6 +19394,48 @@ async def startup_event():
     print("STARTUP EVENT TRIGGERED - Beginning seeding process")
     print("=" * 80)
     
+    try:
+        # Apply index registry first so seeding and the first requests use indexes
+        print("Ensuring database indexes...")
+        index_result = await ensure_indexes(db)
+        print(f"✓ Indexes ensured: {len(index_result['ensured'])} ok, {len(index_result['failed'])} failed")
+        for failure in index_result["failed"]:
+            print(f"  - Index {failure['collection']}.{failure['index']} failed: {failure['error']}")
+    except Exception as e:
+        print(f"ERROR ENSURING INDEXES: {type(e).__name__}: {str(e)}")
+    
+    try:
+        # First start after a deploy that changed the rollups (or never built them): build from source data
+        print("Checking analytics rollups...")
+        rollup_counts = await rollups.ensure_built()
+        print(f"✓ Rollups rebuilt: {rollup_counts}" if rollup_counts else "✓ Rollups up to date")
+    except Exception as e:
+        print(f"ERROR BUILDING ROLLUPS: {type(e).__name__}: {str(e)}")
+    
+    try:
+        # members.no_show_count is computed from bookings once, then kept up to date by the booking endpoints
+        no_shows_updated = await class_capacity.ensure_no_show_counts()
+        if no_shows_updated is not None:
+            print(f"✓ No-show counts computed for {no_shows_updated} members")
+    except Exception as e:
+        print(f"ERROR COMPUTING NO-SHOW COUNTS: {type(e).__name__}: {str(e)}")
+    
+    try:
+        # Geocode cache entries written before they carried expire_at would never expire
+        expiry_set = await geocoding_service.ensure_cache_expiry()
+        if expiry_set:
+            print(f"✓ Expiry set on {expiry_set} geocode cache entries")
+    except Exception as e:
+        print(f"ERROR SETTING GEOCODE CACHE EXPIRY: {type(e).__name__}: {str(e)}")
+    
+    # Background writers for turnstile side effects and points history
+    access_event_writer.start()
+    points_ledger.start()
+    audit_log_writer.start()
+    geocoding_service.start()
+    class_scheduler.start()
+    automation_queue.start()
+    
     try:
         # Seed default tags
         print("Seeding default tags...")
@@ -20139,9 +19598,11 @@ async def audit_logging_middleware(request, call_next):
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
             payload = decode_token(token)
+            # Shared with get_current_user so the token is decoded once per request
+            request.state.jwt_token = token
+            request.state.jwt_payload = payload
             if payload:
-                user_id = payload.get("id")
-                user_email = payload.get("email")
+                user_email = payload.get("sub")
                 user_role = payload.get("role")
     except:
         pass
@@ -20149,14 +19610,25 @@ async def audit_logging_middleware(request, call_next):
     # Process request
     response = await call_next(request)
     
+    # get_current_user leaves the resolved user on request.state
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        user_id = principal.id
+        user_email = principal.email
+        user_role = principal.role
+    
     # Calculate duration
     duration_ms = (time.time() - start_time) * 1000
     
+    # Excluded paths and sampled-out reads are not audited
+    path = str(request.url.path)
+    if not audit_log_writer.should_record(request.method, path, response.status_code):
+        return response
+    
     # Determine success
     success = 200 <= response.status_code < 400
     
     # Extract resource type and action from path
-    path = str(request.url.path)
     resource_type = None
     action = None
     
@@ -20202,14 +19674,14 @@ async def audit_logging_middleware(request, call_next):
         message=f"{request.method} {path} - {response.status_code}"
     )
     
-    # Save to database (async, non-blocking)
+    # Queue for the background writer (never blocks the response)
     try:
         audit_doc = audit_entry.model_dump()
         audit_doc["timestamp"] = audit_doc["timestamp"].isoformat()
-        await db.audit_logs.insert_one(audit_doc)
+        audit_log_writer.submit(audit_doc)
     except Exception as e:
         # Log error but don't fail the request
-        logger.error(f"Failed to save audit log: {str(e)}")
+        logger.error(f"Failed to queue audit log: {str(e)}")
     
     return response
 
@@ -20222,4 +19694,14 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await cancel_running_imports()
+    await access_event_writer.stop()
+    await points_ledger.stop()
+    await audit_log_writer.stop()
+    await geocoding_service.stop()
+    await class_scheduler.stop()
+    await automation_queue.stop()
+    await avs_verifier.stop()
+    client.close()
+    cpu_executor.shutdown()
+    io_executor.shutdown()
\ No newline at end of file
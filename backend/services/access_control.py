@@ -0,0 +1,154 @@
+"""
+Access Control Fast Path
+Keeps turnstile validation off the database on the hot path:
+
+- MemberAccessCache: member id -> the fields an access decision needs
+  (parsed member, membership type name), with a short TTL as a safety net
+  and explicit invalidation from every write path that changes them.
+- AccessEventWriter: queues the side effects of a swipe (access log, journal
+  entry, last_visit_date, check-in points, check-in rollup) and writes them
+  in batches from a background task. Points go through PointsLedger.award_many.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+
+class MemberAccessCache:
+    """TTL + LRU cache of access-decision data keyed by member id"""
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 50000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, member_id: str) -> Optional[dict]:
+        item = self._entries.get(member_id)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._entries[member_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(member_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, member_id: str, entry: dict):
+        self._entries[member_id] = (time.monotonic() + self.ttl_seconds, entry)
+        self._entries.move_to_end(member_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, member_id: Optional[str] = None):
+        """Drop one member, or everything when member_id is None"""
+        if member_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(member_id, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class AccessEventWriter(BatchWriter):
+    """
+    Batched background writer for access side effects.
+
+    Each event is a dict with:
+        access_log:  access_logs document
+        journal:     member_journal document
+        last_visit:  ISO timestamp to store as last_visit_date (granted only)
+        points:      check-in points to award (0 for none)
+        points_transaction_id: id for the points_transactions entry
+    """
+
+    def __init__(
+        self,
+        db,
+        rollups,
+        points_ledger,
+        risk_engine=None,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_queue: int = 10000
+    ):
+        super().__init__(batch_size, flush_interval, max_queue)
+        self.db = db
+        self.rollups = rollups
+        self.points_ledger = points_ledger
+        # Visits feed the risk scores; its cached table is dropped after each batch
+        self.risk_engine = risk_engine
+
+    async def submit(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Back-pressure: write this swipe inline rather than drop it
+            await self._write([event])
+        if self._task is None:
+            # Writer not running (e.g. scripts/tests); keep the old synchronous behaviour
+            await self._drain()
+
+    async def _write(self, events: List[dict]):
+        """Write one batch; failures are logged and never raised"""
+        access_logs = [e["access_log"] for e in events if e.get("access_log")]
+        journal = [e["journal"] for e in events if e.get("journal")]
+
+        last_visits: Dict[str, str] = {}
+        point_transactions = []
+        for e in events:
+            member_id = e["access_log"]["member_id"]
+            if e.get("last_visit"):
+                last_visits[member_id] = max(e["last_visit"], last_visits.get(member_id, ""))
+            if e.get("points"):
+                point_transactions.append(self.points_ledger.transaction(
+                    member_id,
+                    e["points"],
+                    "Check-in reward",
+                    reference_id=e["access_log"].get("id"),
+                    transaction_id=e["points_transaction_id"],
+                    created_at=e["access_log"]["timestamp"]
+                ))
+
+        writes = [
+            ("access_logs", self._insert_many("access_logs", access_logs)),
+            ("member_journal", self._insert_many("member_journal", journal)),
+            ("points", self.points_ledger.award_many(point_transactions)),
+        ]
+        if last_visits:
+            writes.append(("members", self.db.members.bulk_write([
+                UpdateOne({"id": member_id}, {"$set": {"last_visit_date": ts}})
+                for member_id, ts in last_visits.items()
+            ], ordered=False)))
+        writes.append(("rollups", self.rollups.record_checkins([
+            (log["timestamp"], log.get("location"), log["status"]) for log in access_logs
+        ])))
+
+        results = await asyncio.gather(*[w for _, w in writes], return_exceptions=True)
+        for (name, _), result in zip(writes, results):
+            if isinstance(result, Exception):
+                logger.error(f"Access event batch write to {name} failed ({len(events)} events): {str(result)}")
+        if self.risk_engine is not None:
+            self.risk_engine.invalidate()
+
+    async def _insert_many(self, collection: str, documents: List[dict]):
+        if not documents:
+            return
+        try:
+            await self.db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates from a retried batch are fine; anything else is reported
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                raise
@@ -0,0 +1,111 @@
+"""
+Audit Log Writer
+Takes audit records off the request path: the middleware enqueues a document
+and a background task flushes the queue to audit_logs with insert_many, by
+size or after flush_interval seconds.
+
+- Bounded queue: when full, records are dropped and counted instead of
+  slowing responses down.
+- Exclusion rules: path prefixes that are never audited.
+- Sampling rules: path prefix -> fraction of successful GETs to keep
+  (failures and writes are always kept).
+- Retention: every record carries expire_at, which the TTL index on
+  audit_logs uses to delete it after retention_days.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDED_PATHS = ["/docs", "/redoc", "/openapi.json", "/favicon.ico"]
+
+
+def parse_sample_rules(value: Optional[str]) -> Dict[str, float]:
+    """ "/api/dashboard=0.1,/api/access/logs=0.25" -> {"/api/dashboard": 0.1, ...} """
+    rules = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        prefix, rate = item.split("=", 1)
+        try:
+            rules[prefix.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logger.warning(f"Ignoring invalid audit sample rule: {item}")
+    return rules
+
+
+class AuditLogWriter(BatchWriter):
+    """Bounded, batched, background writer for audit_logs"""
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        max_queue: int = 10000,
+        retention_days: int = 90,
+        excluded_paths: Optional[List[str]] = None,
+        sample_rules: Optional[Dict[str, float]] = None
+    ):
+        super().__init__(batch_size, flush_interval, max_queue)
+        self.db = db
+        self.retention_days = retention_days
+        self.excluded_paths = DEFAULT_EXCLUDED_PATHS + (excluded_paths or [])
+        # Longest prefix first so the most specific rule wins
+        self.sample_rules = dict(sorted((sample_rules or {}).items(), key=lambda r: len(r[0]), reverse=True))
+        self.written = 0
+        self.dropped = 0
+        self.excluded = 0
+        self.sampled_out = 0
+        self.failed = 0
+
+    def should_record(self, method: str, path: str, status_code: int) -> bool:
+        """Apply exclusion and sampling rules before the record is built"""
+        if any(path.startswith(prefix) for prefix in self.excluded_paths):
+            self.excluded += 1
+            return False
+        if method == "GET" and status_code < 400:
+            for prefix, rate in self.sample_rules.items():
+                if path.startswith(prefix):
+                    if random.random() >= rate:
+                        self.sampled_out += 1
+                        return False
+                    break
+        return True
+
+    def submit(self, audit_doc: dict):
+        """Enqueue without waiting; a full queue drops the record"""
+        audit_doc["expire_at"] = datetime.now(timezone.utc) + timedelta(days=self.retention_days)
+        try:
+            self._queue.put_nowait(audit_doc)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Audit log queue full; {self.dropped} records dropped so far")
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "excluded": self.excluded,
+            "sampled_out": self.sampled_out,
+            "retention_days": self.retention_days,
+            "excluded_paths": self.excluded_paths,
+            "sample_rules": self.sample_rules,
+        }
+
+    async def _write(self, batch: List[dict]):
+        try:
+            await self.db.audit_logs.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to save {len(batch)} audit logs: {str(e)}")
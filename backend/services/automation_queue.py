@@ -0,0 +1,251 @@
+"""
+Automation Job Queue
+Durable queue for automation actions, stored in automation_executions (one
+document per action, the same records the executions history shows).
+
+- trigger_automation only enqueues: each action becomes a pending job with
+  scheduled_for = now + delay_minutes, and the request returns.
+- Worker tasks poll the (status, scheduled_for) index and claim a due job
+  with find_one_and_update, setting a lease. A job whose worker died is
+  picked up again once its lease has expired.
+- Failures (an exception, or an action result with status "failed") are
+  retried with exponential backoff until max_attempts, then marked failed.
+- Every job has an idempotency_key (unique index), so the same event
+  firing the same automation twice does not enqueue its actions twice.
+  Callers pass the event's identity (e.g. invoice id plus failure date);
+  without one, identical payloads are only treated as the same event
+  within dedup_window_seconds.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+DEDUP_WINDOW_SECONDS = 600
+
+
+def event_key(
+    trigger_type: str,
+    trigger_data: dict,
+    dedup_window_seconds: int = DEDUP_WINDOW_SECONDS,
+    now: Optional[datetime] = None
+) -> str:
+    """
+    Fallback key for an event without an identity of its own: the trigger
+    type, a hash of its data and the time window it fired in. A repeat of
+    the same payload (a retried request) within the window is the same
+    event; the same payload later on is a new one.
+    """
+    payload = json.dumps(trigger_data, sort_keys=True, default=str)
+    window = int((now or datetime.now(timezone.utc)).timestamp() // dedup_window_seconds)
+    return f"{trigger_type}:{hashlib.sha256(payload.encode()).hexdigest()[:32]}:{window}"
+
+
+class AutomationJobQueue:
+    """MongoDB-backed delayed/retrying executor for automation actions"""
+
+    def __init__(
+        self,
+        db,
+        execute_action: Callable,
+        concurrency: int = 4,
+        poll_interval: float = 5.0,
+        lease_seconds: int = 300,
+        max_attempts: int = 5,
+        backoff_seconds: int = 60
+    ):
+        self.db = db
+        self.execute_action = execute_action
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.worker_id = str(uuid.uuid4())
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.duplicates = 0
+
+    def start(self):
+        if not any(not t.done() for t in self._tasks):
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # Jobs being executed keep their lease and are retried after it expires
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def enqueue(self, automation: dict, trigger_data: dict, idempotency_key: str) -> List[dict]:
+        """Create one pending job per action; returns a summary per action"""
+        now = datetime.now(timezone.utc)
+        jobs = []
+        for index, action in enumerate(automation.get("actions", [])):
+            delay_minutes = action.get("delay_minutes", 0) or 0
+            jobs.append({
+                "id": str(uuid.uuid4()),
+                "automation_id": automation["id"],
+                "automation_name": automation["name"],
+                "action_index": index,
+                "action": action,
+                "trigger_data": trigger_data,
+                "idempotency_key": f"{automation['id']}:{index}:{idempotency_key}",
+                "scheduled_for": (now + timedelta(minutes=delay_minutes)).isoformat(),
+                "status": "pending",
+                "attempts": 0,
+                "executed_at": None,
+                "result": None,
+                "created_at": now.isoformat(),
+            })
+        if not jobs:
+            return []
+
+        try:
+            await self.db.automation_executions.insert_many(jobs, ordered=False)
+        except BulkWriteError as e:
+            # Already-enqueued actions (same idempotency key) are skipped
+            duplicates = [err for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+            if len(duplicates) != len(e.details.get("writeErrors", [])):
+                raise
+            self.duplicates += len(duplicates)
+            skipped = {err["index"] for err in duplicates}
+            jobs = [job for i, job in enumerate(jobs) if i not in skipped]
+
+        return [
+            {"action_type": job["action"].get("type"), "scheduled_for": job["scheduled_for"], "status": job["status"]}
+            for job in jobs
+        ]
+
+    async def retry(self, job_id: str) -> bool:
+        """Put a failed job back in the queue"""
+        result = await self.db.automation_executions.update_one(
+            {"id": job_id, "status": "failed"},
+            {"$set": {"status": "pending", "attempts": 0, "scheduled_for": datetime.now(timezone.utc).isoformat()}}
+        )
+        return result.modified_count > 0
+
+    async def stats(self) -> dict:
+        counts = await self.db.automation_executions.aggregate([
+            {"$match": {"status": {"$in": ["pending", "running", "failed"]}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        return {
+            "workers": sum(1 for t in self._tasks if not t.done()),
+            "queue": {c["_id"]: c["count"] for c in counts},
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "duplicates_skipped": self.duplicates,
+        }
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        return await self.db.automation_executions.find_one_and_update(
+            {"$or": [
+                # Executions recorded before the queue existed have no action to run
+                {"status": "pending", "scheduled_for": {"$lte": now_iso}, "action": {"$exists": True}},
+                # Lease expired: the worker running it died or timed out
+                {"status": "running", "lease_until": {"$lt": now_iso}},
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.worker_id,
+                    "lease_until": (now + timedelta(seconds=self.lease_seconds)).isoformat(),
+                    "started_at": now_iso
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("scheduled_for", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _process(self, job: dict):
+        error = None
+        result = None
+        try:
+            result = await asyncio.wait_for(
+                self.execute_action(job["action"], job.get("trigger_data") or {}),
+                timeout=self.lease_seconds
+            )
+            if isinstance(result, dict) and result.get("status") == "failed":
+                error = result.get("error") or "Action failed"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e)
+
+        now = datetime.now(timezone.utc)
+        owned = {"id": job["id"], "lease_owner": self.worker_id, "status": "running"}
+        if error is None:
+            update = {"status": "completed", "result": result, "executed_at": now.isoformat(), "last_error": None}
+            self.completed += 1
+        elif job.get("attempts", 1) < self.max_attempts:
+            delay = self.backoff_seconds * 2 ** (job.get("attempts", 1) - 1)
+            update = {"status": "pending", "result": result, "last_error": error,
+                      "scheduled_for": (now + timedelta(seconds=delay)).isoformat()}
+            self.retried += 1
+        else:
+            update = {"status": "failed", "result": result, "last_error": error, "executed_at": now.isoformat()}
+            self.failed += 1
+            logger.error(f"Automation job {job['id']} failed after {job.get('attempts')} attempts: {error}")
+        await self.db.automation_executions.update_one(
+            owned,
+            {"$set": update, "$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+
+    async def _record_crash(self, job: dict, error: Exception):
+        """Back off (or fail) a job whose processing raised, e.g. its result could not be stored"""
+        now = datetime.now(timezone.utc)
+        attempts = job.get("attempts", 1)
+        if attempts < self.max_attempts:
+            update = {"status": "pending", "last_error": str(error),
+                      "scheduled_for": (now + timedelta(seconds=self.backoff_seconds * 2 ** (attempts - 1))).isoformat()}
+            self.retried += 1
+        else:
+            update = {"status": "failed", "last_error": str(error), "executed_at": now.isoformat()}
+            self.failed += 1
+        try:
+            await self.db.automation_executions.update_one(
+                {"id": job["id"], "lease_owner": self.worker_id, "status": "running"},
+                {"$set": {**update, "result": None}, "$unset": {"lease_owner": "", "lease_until": ""}}
+            )
+        except Exception as e:
+            # The lease expires and the job is claimed again
+            logger.error(f"Could not record failure of automation job {job['id']}: {str(e)}")
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Automation queue poll failed: {str(e)}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Automation job {job['id']} crashed: {str(e)}")
+                await self._record_crash(job, e)
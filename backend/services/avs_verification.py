@@ -0,0 +1,184 @@
+"""
+AVS Verification
+Runs account verifications through AVSService with:
+
+- one pooled aiohttp session for all AVS calls (opened on first use, closed
+  on shutdown) instead of a session per request,
+- any number of accounts per call: AVSService.verify_accounts sends them in
+  40-account SOAP requests, `concurrency` at a time,
+- an avs_cache collection keyed by verification_cache_key (every request
+  field the bank matches on). A result younger than cache_ttl_days is
+  reused instead of asking the bank again; the TTL index on expire_at
+  removes stale entries. Technical errors (R01) and responses that fell back
+  to mock data are not cached.
+
+Duplicate accounts within one call are verified once.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import aiohttp
+from pymongo import UpdateOne
+
+from avs_utils import AVSService, verification_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Echoed request fields; a cached result takes them from the current request
+REQUEST_FIELDS = (
+    "bank_identifier", "account_number", "account_type", "sort_code",
+    "identity_number", "identity_type", "initials", "last_name",
+)
+
+
+def avs_service_config(config: dict, endpoint: Optional[str] = None) -> dict:
+    """AVSService settings from the stored avs_config document"""
+    return {
+        "mock_mode": config.get("mock_mode", True),
+        "profile_number": config.get("profile_number", "0000000000"),
+        "profile_user_number": config.get("profile_user_number", "00000"),
+        "charge_account": config.get("charge_account", "0000000000"),
+        "use_qa": config.get("use_qa", True),
+        "endpoint": endpoint,
+    }
+
+
+class AVSVerifier:
+    """Pooled, batched and cached AVS account verification"""
+
+    def __init__(
+        self,
+        db,
+        concurrency: int = 4,
+        pool_size: int = 10,
+        cache_ttl_days: int = 30,
+        endpoint: Optional[str] = None
+    ):
+        self.db = db
+        # Deployment-level override of the bank URL (e.g. a local mock SOAP server)
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.cache_ttl_days = cache_ttl_days
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        self.cache_hits = 0
+        self.verified = 0
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            async with self._session_lock:
+                if self._session is None or self._session.closed:
+                    self._session = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+                    )
+        return self._session
+
+    async def stop(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def service(self, config: dict) -> AVSService:
+        settings = avs_service_config(config, self.endpoint)
+        # Mock mode never opens a connection
+        session = None if settings["mock_mode"] else await self._get_session()
+        return AVSService(settings, session=session)
+
+    async def _cached(self, keys: List[str], mock_mode: bool) -> Dict[str, dict]:
+        if not keys:
+            return {}
+        cursor = self.db.avs_cache.find(
+            {
+                "key": {"$in": keys},
+                "mock_mode": mock_mode,
+                # The TTL monitor only runs once a minute
+                "expire_at": {"$gt": datetime.now(timezone.utc)}
+            },
+            {"_id": 0, "key": 1, "result_code": 1, "verification": 1, "verified_at": 1}
+        )
+        return {entry["key"]: entry async for entry in cursor}
+
+    async def _remember(self, results: Dict[str, dict]):
+        now = datetime.now(timezone.utc)
+        expire_at = now + timedelta(days=self.cache_ttl_days)
+        ops = [
+            UpdateOne(
+                {"key": key},
+                {"$set": {
+                    "key": key,
+                    "result_code": result["result_code"],
+                    "verification": result["verification"],
+                    "mock_mode": result["mock_mode"],
+                    "verified_at": now.isoformat(),
+                    "expire_at": expire_at
+                }},
+                upsert=True
+            )
+            for key, result in results.items()
+            if result["result_code"] != "R01" and result["verification"].get("result_code_acct") != "R01"
+        ]
+        if ops:
+            try:
+                await self.db.avs_cache.bulk_write(ops, ordered=False)
+            except Exception as e:
+                # The results are still returned; they are just verified again next time
+                logger.error(f"Failed to cache AVS results: {str(e)}")
+
+    async def verify(self, config: dict, verifications: List[dict], use_cache: bool = True) -> List[Optional[dict]]:
+        """
+        Verify accounts (AVSVerificationRequest dicts) against the AVS config.
+
+        Returns one entry per verification, in order: {"result_code",
+        "mock_mode", "verification", "cached"}, or None when the bank
+        returned no result for it.
+        """
+        service = await self.service(config)
+        keys = [verification_cache_key(v) for v in verifications]
+        cached = await self._cached(list(set(keys)), service.mock_mode) if use_cache else {}
+
+        # One request per distinct account not answered by the cache
+        pending: Dict[str, dict] = {}
+        for key, verification in zip(keys, verifications):
+            if key not in cached:
+                pending.setdefault(key, verification)
+        fresh: Dict[str, dict] = {}
+        if pending:
+            results = await service.verify_accounts(list(pending.values()), self.concurrency)
+            fresh = {key: result for key, result in zip(pending, results) if result is not None}
+            self.verified += len(pending)
+            # Responses that fell back to mock data are not cached as live results
+            await self._remember({
+                key: result for key, result in fresh.items() if result["mock_mode"] == service.mock_mode
+            })
+
+        output: List[Optional[dict]] = []
+        for key, verification in zip(keys, verifications):
+            if key in cached:
+                self.cache_hits += 1
+                entry = cached[key]
+                item = {
+                    **entry["verification"],
+                    **{field: verification.get(field) for field in REQUEST_FIELDS if verification.get(field) is not None}
+                }
+                output.append({
+                    "result_code": entry["result_code"],
+                    "mock_mode": service.mock_mode,
+                    "verification": item,
+                    "cached": True,
+                    "verified_at": entry.get("verified_at")
+                })
+            elif key in fresh:
+                output.append({**fresh[key], "cached": False})
+            else:
+                output.append(None)
+        return output
+
+    def stats(self) -> dict:
+        return {
+            "pooled_session_open": self._session is not None and not self._session.closed,
+            "verified": self.verified,
+            "cache_hits": self.cache_hits,
+        }
@@ -0,0 +1,108 @@
+"""
+Batch Loader & Reference Cache
+Replaces per-row find_one enrichment with one $in query per referenced
+collection (DataLoader style):
+
+    loader = BatchLoader(db)
+    users = await loader.load_many("users", [lead.get("assigned_to") for lead in leads])
+    for lead in leads:
+        assignee = users.get(lead.get("assigned_to"))
+
+A BatchLoader is request-scoped and memoizes what it has fetched. Small,
+rarely-changing reference tables are served from the process-wide
+ReferenceCache instead of being queried at all.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_COLLECTIONS = ["lead_sources", "lead_statuses", "loss_reasons", "membership_types", "payment_sources"]
+
+
+class ReferenceCache:
+    """Process-wide id -> document cache of whole reference tables"""
+
+    def __init__(self, db, ttl_seconds: int = 300, collections: Optional[List[str]] = None):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.collections = set(collections or REFERENCE_COLLECTIONS)
+        self._tables: Dict[str, tuple] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def handles(self, collection: str) -> bool:
+        return collection in self.collections
+
+    async def table(self, collection: str) -> Dict[str, dict]:
+        """All documents of a reference collection keyed by id"""
+        cached = self._tables.get(collection)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        lock = self._locks.setdefault(collection, asyncio.Lock())
+        async with lock:
+            cached = self._tables.get(collection)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            docs = await self.db[collection].find({}, {"_id": 0}).to_list(None)
+            table = {doc["id"]: doc for doc in docs if doc.get("id")}
+            self._tables[collection] = (time.monotonic() + self.ttl_seconds, table)
+            return table
+
+    def invalidate(self, collection: Optional[str] = None):
+        """Drop one table, or all of them when collection is None"""
+        if collection is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(collection, None)
+
+
+class BatchLoader:
+    """Request-scoped batched lookups by id with memoization"""
+
+    def __init__(self, db, reference_cache: Optional[ReferenceCache] = None):
+        self.db = db
+        self.reference_cache = reference_cache
+        self._memo: Dict[tuple, Dict[str, Optional[dict]]] = {}
+        self.queries = 0
+
+    async def load_many(
+        self,
+        collection: str,
+        ids: Iterable[Optional[str]],
+        projection: Optional[dict] = None,
+        key: str = "id"
+    ) -> Dict[str, dict]:
+        """
+        Fetch every distinct non-empty id in one query.
+
+        Returns {id: document} for the ids that exist; missing ids are absent.
+        """
+        wanted = {i for i in ids if i}
+        if not wanted:
+            return {}
+
+        if key == "id" and self.reference_cache and self.reference_cache.handles(collection):
+            table = await self.reference_cache.table(collection)
+            return {i: table[i] for i in wanted if i in table}
+
+        memo_key = (collection, key, tuple(sorted((projection or {}).items())))
+        memo = self._memo.setdefault(memo_key, {})
+        missing = [i for i in wanted if i not in memo]
+        if missing:
+            fields = {"_id": 0, **(projection or {})}
+            if projection and key not in projection:
+                fields[key] = 1
+            self.queries += 1
+            found = await self.db[collection].find({key: {"$in": missing}}, fields).to_list(None)
+            for doc in found:
+                memo[doc.get(key)] = doc
+            for i in missing:
+                memo.setdefault(i, None)
+
+        return {i: memo[i] for i in wanted if memo.get(i) is not None}
+
+    async def load(self, collection: str, id_value: Optional[str], projection: Optional[dict] = None, key: str = "id") -> Optional[dict]:
+        return (await self.load_many(collection, [id_value], projection, key)).get(id_value)
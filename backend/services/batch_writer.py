@@ -0,0 +1,98 @@
+"""
+Batch Writer
+Base class for the background writers that take side effects off the
+request path (AccessEventWriter, AuditLogWriter): items go on a bounded
+queue and a background task writes them in batches of batch_size, or after
+flush_interval seconds.
+
+stop() does not cancel the task mid-batch. It queues a stop marker, so the
+task writes the batch it is collecting and exits; whatever is still queued
+is then drained. Only if the task does not finish within stop_timeout is it
+cancelled; the batch it was collecting or writing stays on self._batch and
+is written again by the drain, ahead of the queue.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Bounded queue flushed in batches by a background task; subclasses implement _write"""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int, stop_timeout: float = 10.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stop_timeout = stop_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        # Items taken off the queue and not yet written; kept until _write
+        # returns so a cancelled task's batch is written by _drain
+        self._batch: List[Any] = []
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Let the task finish its batch, then write whatever is still queued"""
+        if self._task:
+            if not self._task.done():
+                await self._queue.put(_STOP)
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._task), self.stop_timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"{type(self).__name__} did not stop within {self.stop_timeout}s; cancelling")
+                    self._task.cancel()
+                    try:
+                        await self._task
+                    except asyncio.CancelledError:
+                        pass
+            self._task = None
+        await self._drain()
+
+    async def _write(self, batch: List[Any]):
+        """Write one batch; must log failures rather than raise"""
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            self._batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                self._batch.append(item)
+            await self._write(self._batch)
+            self._batch = []
+            if stopping:
+                return
+
+    async def _drain(self):
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _STOP:
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                await self._write(batch)
+                batch = []
+        if batch:
+            await self._write(batch)
@@ -0,0 +1,203 @@
+"""
+Class Capacity
+One document per class occurrence (class_id + booking_date) in
+class_occurrences holds the confirmed and waitlist counts. Seats and
+waitlist places are handed out with a conditional $inc
+(find_one_and_update with "count < limit" in the filter), so concurrent
+bookings for the last spot cannot both succeed and a booking needs no scan
+over bookings.
+
+Occurrence documents are created on first use and seeded from the existing
+bookings, so occurrences booked before this was introduced pick up their
+current counts.
+
+members.no_show_count mirrors the member's bookings flagged no_show. It is
+computed from bookings once (ensure_no_show_counts, on startup) and kept
+up to date by the endpoints that set, clear or delete no-show bookings.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SEAT_STATUSES = ["confirmed", "attended"]
+
+
+def occurrence_key(class_id: str, booking_date: str) -> str:
+    return f"{class_id}|{booking_date}"
+
+
+def place_of(status: Optional[str]) -> Optional[str]:
+    """The counter a booking in this status holds: "confirmed", "waitlist", or None"""
+    if status in SEAT_STATUSES:
+        return "confirmed"
+    if status == "waitlist":
+        return "waitlist"
+    return None
+
+
+class ClassCapacity:
+    """Atomic seat / waitlist accounting per class occurrence"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def _ensure(self, class_id: str, booking_date: str) -> str:
+        key = occurrence_key(class_id, booking_date)
+        if await self.db.class_occurrences.find_one({"key": key}, {"_id": 1}):
+            return key
+
+        base = {"class_id": class_id, "booking_date": booking_date}
+        confirmed = await self.db.bookings.count_documents({**base, "status": {"$in": SEAT_STATUSES}})
+        waitlist = await self.db.bookings.count_documents({**base, "status": "waitlist"})
+        try:
+            await self.db.class_occurrences.update_one(
+                {"key": key},
+                {"$setOnInsert": {
+                    "key": key,
+                    **base,
+                    "confirmed": confirmed,
+                    "waitlist": waitlist,
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another request created it first
+            pass
+        return key
+
+    async def reserve(self, class_id: str, booking_date: str, capacity: int, waitlist_capacity: Optional[int]) -> dict:
+        """
+        Take a seat, or a waitlist place when the class is full and
+        waitlist_capacity is given.
+
+        Returns {"status": "confirmed" | "waitlist" | "full", "waitlist_position"}
+        """
+        seat = await self.take(class_id, booking_date, "confirmed", capacity, waitlist_capacity)
+        if seat or waitlist_capacity is None:
+            return seat or {"status": "full", "waitlist_position": None}
+        place = await self.take(class_id, booking_date, "waitlist", capacity, waitlist_capacity)
+        return place or {"status": "full", "waitlist_position": None}
+
+    async def take(
+        self,
+        class_id: str,
+        booking_date: str,
+        place: str,
+        capacity: int,
+        waitlist_capacity: Optional[int]
+    ) -> Optional[dict]:
+        """
+        Take one place of the given kind ("confirmed" or "waitlist") and
+        nothing else; None when none is left (or the class has no waitlist).
+
+        Returns {"status", "waitlist_position"} like reserve()
+        """
+        key = await self._ensure(class_id, booking_date)
+        if place == "confirmed":
+            seat = await self.db.class_occurrences.find_one_and_update(
+                {"key": key, "confirmed": {"$lt": capacity}},
+                {"$inc": {"confirmed": 1}},
+                projection={"_id": 0, "confirmed": 1}
+            )
+            return {"status": "confirmed", "waitlist_position": None} if seat else None
+
+        if waitlist_capacity is None:
+            return None
+        taken = await self.db.class_occurrences.find_one_and_update(
+            {"key": key, "waitlist": {"$lt": waitlist_capacity}},
+            {"$inc": {"waitlist": 1}},
+            projection={"_id": 0, "waitlist": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return {"status": "waitlist", "waitlist_position": taken["waitlist"]} if taken else None
+
+    async def undo(self, class_id: str, booking_date: str, status: str):
+        """Give back a place taken by reserve() whose booking was not saved"""
+        field = "waitlist" if status == "waitlist" else "confirmed"
+        await self.db.class_occurrences.update_one(
+            {"key": occurrence_key(class_id, booking_date), field: {"$gt": 0}},
+            {"$inc": {field: -1}}
+        )
+
+    async def release(self, booking: dict) -> Optional[dict]:
+        """
+        Account for a confirmed or waitlisted booking giving up its place
+        (cancelled, deleted, or moved off the waitlist onto a seat taken with
+        take()). A freed seat goes to the first booking on the waitlist;
+        returns that promoted booking, if any.
+        """
+        class_id = booking["class_id"]
+        booking_date = booking["booking_date"]
+        if isinstance(booking_date, datetime):
+            booking_date = booking_date.isoformat()
+        key = await self._ensure(class_id, booking_date)
+        base = {"class_id": class_id, "booking_date": booking_date}
+
+        if booking.get("status") == "waitlist":
+            await self.db.class_occurrences.update_one({"key": key, "waitlist": {"$gt": 0}}, {"$inc": {"waitlist": -1}})
+            if booking.get("waitlist_position"):
+                await self._shift_waitlist(base, booking["waitlist_position"])
+            return None
+
+        if booking.get("status") not in SEAT_STATUSES:
+            return None
+
+        # Atomically claim the next waitlisted booking so two cancellations cannot promote the same one
+        promoted = await self.db.bookings.find_one_and_update(
+            {**base, "status": "waitlist"},
+            {"$set": {"status": "confirmed", "is_waitlist": False, "waitlist_position": None}},
+            sort=[("waitlist_position", 1), ("booked_at", 1)],
+            projection={"_id": 0}
+        )
+        if promoted:
+            # The seat passes to the promoted booking; only the waitlist shrinks
+            await self.db.class_occurrences.update_one({"key": key, "waitlist": {"$gt": 0}}, {"$inc": {"waitlist": -1}})
+            if promoted.get("waitlist_position"):
+                await self._shift_waitlist(base, promoted["waitlist_position"])
+        else:
+            await self.db.class_occurrences.update_one({"key": key, "confirmed": {"$gt": 0}}, {"$inc": {"confirmed": -1}})
+        return promoted
+
+    async def _shift_waitlist(self, base: dict, position: int):
+        await self.db.bookings.update_many(
+            {**base, "status": "waitlist", "waitlist_position": {"$gt": position}},
+            {"$inc": {"waitlist_position": -1}}
+        )
+
+    async def rebuild_no_show_counts(self) -> int:
+        """Recompute members.no_show_count from bookings; returns members updated"""
+        counts = await self.db.bookings.aggregate([
+            {"$match": {"no_show": True}},
+            {"$group": {"_id": "$member_id", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        await self.db.members.update_many({"no_show_count": {"$gt": 0}}, {"$set": {"no_show_count": 0}})
+        ops = [UpdateOne({"id": c["_id"]}, {"$set": {"no_show_count": c["count"]}}) for c in counts if c["_id"]]
+        for i in range(0, len(ops), 1000):
+            await self.db.members.bulk_write(ops[i:i + 1000], ordered=False)
+        return len(ops)
+
+    async def ensure_no_show_counts(self) -> Optional[int]:
+        """Run rebuild_no_show_counts once per database; None when it already ran"""
+        if await self.db.migrations.find_one({"key": "no_show_counts"}, {"_id": 1}):
+            return None
+        updated = await self.rebuild_no_show_counts()
+        await self.db.migrations.update_one(
+            {"key": "no_show_counts"},
+            {"$set": {"key": "no_show_counts", "completed_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        return updated
+
+    async def forget_no_show(self, booking: dict):
+        """Take a deleted no-show booking off the member's no_show_count"""
+        if booking.get("no_show") and booking.get("member_id"):
+            await self.db.members.update_one(
+                {"id": booking["member_id"], "no_show_count": {"$gt": 0}},
+                {"$inc": {"no_show_count": -1}}
+            )
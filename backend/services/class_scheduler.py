@@ -0,0 +1,249 @@
+"""
+Class Scheduler
+Sends class reminders and marks no-shows from an in-process periodic loop
+(the /bookings/send-class-reminders and /bookings/process-no-shows endpoints
+run the same code on demand).
+
+- Only bookings whose start falls in a reminder window or is past a
+  check-in window are read, using the (status, booking_date) index.
+- Class settings come from a short-TTL cache of the classes table.
+- Members are fetched in one $in query per run.
+- Reminders are sent concurrently, at most max_concurrent_sends at a time.
+  Each booking is claimed (reminder_sent) before its message goes out, so
+  overlapping runs or several app processes do not send twice.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from services.batch_loader import BatchLoader
+
+logger = logging.getLogger(__name__)
+
+REMINDER_WINDOW_MINUTES = 5
+
+
+def _parse_booking_date(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def reminder_message(member: dict, class_doc: dict, booking_date: datetime, reminder_minutes: int) -> str:
+    formatted_date = booking_date.strftime("%A, %B %d, %Y")
+    formatted_time = booking_date.strftime("%I:%M %p")
+    return f"""⏰ *Class Reminder*
+
+Hi {member.get('first_name', 'Member')}!
+
+Your class starts in {reminder_minutes} minutes:
+
+📋 *Class:* {class_doc['name']}
+📅 *Date:* {formatted_date}
+⏰ *Time:* {formatted_time}
+📍 *Location:* {class_doc.get('room', 'Main Studio')}
+👤 *Instructor:* {class_doc.get('instructor_name', 'TBA')}
+
+🏃 Get ready and we'll see you soon!
+
+💡 Remember to check-in at reception when you arrive.
+
+Need to cancel? Please do so at least {class_doc.get('cancel_window_hours', 2)} hours before class to avoid a no-show."""
+
+
+class ClassScheduler:
+    """Windowed reminder and no-show processing for class bookings"""
+
+    def __init__(
+        self,
+        db,
+        send_message: Callable,
+        interval_seconds: int = 300,
+        max_concurrent_sends: int = 10,
+        class_cache_ttl: int = 300
+    ):
+        self.db = db
+        self.send_message = send_message
+        self.interval_seconds = interval_seconds
+        self.max_concurrent_sends = max_concurrent_sends
+        self.class_cache_ttl = class_cache_ttl
+        self._classes: Optional[Dict[str, dict]] = None
+        self._classes_expire = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: dict = {}
+
+    def start(self):
+        if self.interval_seconds and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval_seconds,
+            "max_concurrent_sends": self.max_concurrent_sends,
+            "last_run": self.last_run,
+        }
+
+    def invalidate_classes(self):
+        self._classes = None
+
+    async def classes(self) -> Dict[str, dict]:
+        """All classes keyed by id (cached for class_cache_ttl seconds)"""
+        if self._classes is None or self._classes_expire < time.monotonic():
+            docs = await self.db.classes.find({}, {"_id": 0}).to_list(None)
+            self._classes = {c["id"]: c for c in docs if c.get("id")}
+            self._classes_expire = time.monotonic() + self.class_cache_ttl
+        return self._classes
+
+    async def send_reminders(self, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.now(timezone.utc)
+        classes = await self.classes()
+        reminder_minutes = [
+            c.get("reminder_minutes_before", 60) for c in classes.values() if c.get("send_class_reminder", True)
+        ]
+        if not reminder_minutes:
+            return {"reminders_sent": 0, "errors": []}
+
+        # Union of every class's reminder window; each booking is then checked against its own class
+        window_start = now + timedelta(minutes=min(reminder_minutes) - REMINDER_WINDOW_MINUTES)
+        window_end = now + timedelta(minutes=max(reminder_minutes) + REMINDER_WINDOW_MINUTES)
+        bookings = await self.db.bookings.find(
+            {
+                "status": "confirmed",
+                "booking_date": {"$gte": window_start.isoformat(), "$lte": window_end.isoformat()},
+                "reminder_sent": {"$ne": True}
+            },
+            {"_id": 0, "id": 1, "class_id": 1, "member_id": 1, "booking_date": 1}
+        ).to_list(None)
+
+        due = []
+        for booking in bookings:
+            class_doc = classes.get(booking["class_id"])
+            if not class_doc or not class_doc.get("send_class_reminder", True):
+                continue
+            minutes = class_doc.get("reminder_minutes_before", 60)
+            booking_date = _parse_booking_date(booking["booking_date"])
+            time_until_class_minutes = (booking_date - now).total_seconds() / 60
+            if minutes - REMINDER_WINDOW_MINUTES <= time_until_class_minutes <= minutes + REMINDER_WINDOW_MINUTES:
+                due.append((booking, class_doc, booking_date, minutes))
+
+        members = await BatchLoader(self.db).load_many(
+            "members",
+            [b["member_id"] for b, _, _, _ in due],
+            {"first_name": 1, "last_name": 1, "email": 1, "phone": 1, "phone_number": 1}
+        )
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_sends)
+        errors: List[str] = []
+
+        async def send(booking, class_doc, booking_date, minutes) -> bool:
+            member = members.get(booking["member_id"])
+            member_phone = member and (member.get('phone') or member.get('phone_number'))
+            if not member_phone:
+                return False
+            async with semaphore:
+                claimed = await self.db.bookings.update_one(
+                    {"id": booking["id"], "reminder_sent": {"$ne": True}},
+                    {"$set": {"reminder_sent": True}}
+                )
+                if not claimed.modified_count:
+                    return False
+                try:
+                    await self.send_message(
+                        phone=member_phone,
+                        message=reminder_message(member, class_doc, booking_date, minutes),
+                        first_name=member.get('first_name', 'Member'),
+                        last_name=member.get('last_name', ''),
+                        email=member.get('email', '')
+                    )
+                except Exception as e:
+                    # Release the claim so the next run retries while still in the window
+                    await self.db.bookings.update_one({"id": booking["id"]}, {"$set": {"reminder_sent": False}})
+                    error_msg = f"Failed to send reminder for booking {booking['id']}: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                    return False
+                logger.info(f"Reminder sent to {member_phone} for booking {booking['id']}")
+                return True
+
+        results = await asyncio.gather(*(send(*item) for item in due))
+        return {"reminders_sent": sum(results), "errors": errors}
+
+    async def process_no_shows(self, now: Optional[datetime] = None) -> int:
+        """Mark confirmed bookings past their class's check-in window as no-shows"""
+        now = now or datetime.now(timezone.utc)
+        classes = await self.classes()
+        shortest_window = min((c.get("check_in_window_minutes", 15) for c in classes.values()), default=15)
+
+        # Nothing can be a no-show before now - shortest check-in window
+        bookings = await self.db.bookings.find(
+            {
+                "status": "confirmed",
+                "no_show": False,
+                "booking_date": {"$lt": (now - timedelta(minutes=shortest_window)).isoformat()}
+            },
+            {"_id": 0, "id": 1, "class_id": 1, "member_id": 1, "booking_date": 1}
+        ).to_list(None)
+
+        # Tag this run's updates so the per-member counts reflect only bookings it actually changed
+        run_id = str(uuid.uuid4())
+        ops = []
+        for booking in bookings:
+            class_doc = classes.get(booking["class_id"])
+            if not class_doc:
+                continue
+            window_end = _parse_booking_date(booking["booking_date"]) + timedelta(
+                minutes=class_doc.get("check_in_window_minutes", 15)
+            )
+            if now > window_end:
+                ops.append(UpdateOne(
+                    {"id": booking["id"], "status": "confirmed", "no_show": False},
+                    {"$set": {"no_show": True, "status": "no-show", "no_show_run": run_id}}
+                ))
+
+        if not ops:
+            return 0
+        result = await self.db.bookings.bulk_write(ops, ordered=False)
+        if not result.modified_count:
+            return 0
+
+        counts = await self.db.bookings.aggregate([
+            {"$match": {"no_show_run": run_id}},
+            {"$group": {"_id": "$member_id", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        await self.db.members.bulk_write(
+            [UpdateOne({"id": c["_id"]}, {"$inc": {"no_show_count": c["count"]}}) for c in counts],
+            ordered=False
+        )
+        return result.modified_count
+
+    async def _run(self):
+        while True:
+            try:
+                reminders = await self.send_reminders()
+                no_shows = await self.process_no_shows()
+                self.last_run = {
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "reminders_sent": reminders["reminders_sent"],
+                    "reminder_errors": len(reminders["errors"]),
+                    "no_shows_marked": no_shows,
+                }
+            except Exception as e:
+                logger.error(f"Class scheduler run failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
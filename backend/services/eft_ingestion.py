@@ -0,0 +1,186 @@
+"""
+EFT Response Ingestion
+Applies the records of a bank response file (ACK / NACK / unpaid) parsed by
+EFTFileParser.parse_response_file to eft_transaction_items and the invoices,
+levies and payments they settle.
+
+- All referenced items are fetched with one $in query per file.
+- Item, invoice, levy and payment writes go out as bulk_write batches.
+- Member debt is recalculated once per affected member after the file.
+- Payments that were actually inserted (not ones a re-run found already
+  recorded) are added to the revenue rollup with the same batch.
+
+A run is keyed by file sequence (plus response type or file name) in
+eft_response_runs. Every write is idempotent: invoices and levies are only
+moved to paid once, payments are upserted by invoice and reference, and
+each applied item is stamped with the run key. Re-sending a file, or
+re-running one that was interrupted, picks up where it stopped and does
+not pay or record anything twice.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from services.rollups import payment_dimensions
+
+logger = logging.getLogger(__name__)
+
+ITEM_FIELDS = {"_id": 0, "id": 1, "payment_reference": 1, "member_id": 1, "invoice_id": 1, "levy_id": 1, "amount": 1, "response_key": 1}
+
+
+class EFTResponseIngestor:
+    """Bulk, idempotent application of EFT response records"""
+
+    def __init__(
+        self,
+        db,
+        recalculate_debts: Callable[[Iterable[str]], Awaitable],
+        make_payment: Callable[[dict, str], dict],
+        rollups=None,
+        batch_size: int = 1000
+    ):
+        self.db = db
+        self.recalculate_debts = recalculate_debts
+        # (item, payment_reference) -> payments document
+        self.make_payment = make_payment
+        self.rollups = rollups
+        self.batch_size = batch_size
+
+    async def _start_run(self, run_key: str, total: int) -> Optional[dict]:
+        """Register the run; returns the stored run when it already completed"""
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            run = await self.db.eft_response_runs.find_one_and_update(
+                {"key": run_key},
+                {
+                    "$setOnInsert": {"key": run_key, "started_at": now, "status": "running"},
+                    "$set": {"records": total, "last_attempt_at": now}
+                },
+                upsert=True,
+                projection={"_id": 0}
+            )
+        except DuplicateKeyError:
+            # Concurrent delivery of the same file: the other request created the run
+            run = await self.db.eft_response_runs.find_one({"key": run_key}, {"_id": 0})
+        return run if run and run.get("status") == "completed" else None
+
+    async def ingest(
+        self,
+        run_key: str,
+        transactions: List[dict],
+        succeeded: Callable[[dict], bool],
+        record_payments: bool = False
+    ) -> dict:
+        """
+        Apply parsed response records. succeeded(record) decides whether an
+        item was paid; with record_payments a payment is recorded for each
+        paid item whose invoice exists.
+        """
+        completed = await self._start_run(run_key, len(transactions))
+        if completed:
+            return {**completed.get("summary", {}), "already_processed": True}
+
+        refs = list({t["payment_reference"] for t in transactions if t.get("payment_reference")})
+        items: Dict[str, dict] = {}
+        if refs:
+            async for item in self.db.eft_transaction_items.find({"payment_reference": {"$in": refs}}, ITEM_FIELDS):
+                items.setdefault(item["payment_reference"], item)
+
+        existing_invoices = set()
+        members: Dict[str, dict] = {}
+        if record_payments:
+            invoice_ids = list({item["invoice_id"] for item in items.values() if item.get("invoice_id")})
+            if invoice_ids:
+                async for invoice in self.db.invoices.find({"id": {"$in": invoice_ids}}, {"_id": 0, "id": 1}):
+                    existing_invoices.add(invoice["id"])
+            member_ids = list({item["member_id"] for item in items.values() if item.get("member_id")})
+            if member_ids:
+                async for member in self.db.members.find(
+                    {"id": {"$in": member_ids}}, {"_id": 0, "id": 1, "membership_type_id": 1, "source": 1}
+                ):
+                    members[member["id"]] = member
+
+        summary = {"records": len(transactions), "matched": 0, "applied": 0, "already_applied": 0, "paid": 0, "failed": 0}
+        debtors = set()
+        paid_items: List[dict] = []
+
+        for start in range(0, len(transactions), self.batch_size):
+            now = datetime.now(timezone.utc).isoformat()
+            item_ops, invoice_ops, levy_ops, payment_ops = [], [], [], []
+            payments: List[dict] = []  # Parallel to payment_ops
+
+            for txn in transactions[start:start + self.batch_size]:
+                item = items.get(txn.get("payment_reference"))
+                if not item:
+                    continue
+                summary["matched"] += 1
+                paid = succeeded(txn)
+
+                if paid and item.get("invoice_id") and (not record_payments or item["invoice_id"] in existing_invoices):
+                    # Recalculated even when already applied: an interrupted run may have stopped before it
+                    debtors.add(item["member_id"])
+
+                if item.get("response_key") == run_key:
+                    summary["already_applied"] += 1
+                    continue
+
+                item_ops.append(UpdateOne(
+                    {"id": item["id"]},
+                    {"$set": {
+                        "status": "processed" if paid else "failed",
+                        "processed_at": now,
+                        "response_code": txn.get("response_code"),
+                        "response_message": txn.get("response_message"),
+                        "response_key": run_key
+                    }}
+                ))
+                if not paid:
+                    summary["failed"] += 1
+                    continue
+
+                summary["paid"] += 1
+                paid_items.append(item)
+                if item.get("invoice_id"):
+                    invoice_ops.append(UpdateOne(
+                        {"id": item["invoice_id"], "status": {"$ne": "paid"}},
+                        {"$set": {"status": "paid", "paid_date": now}}
+                    ))
+                    if record_payments and item["invoice_id"] in existing_invoices:
+                        payment = self.make_payment(item, txn["payment_reference"])
+                        payment.update(payment_dimensions(members.get(item.get("member_id"))))
+                        payments.append(payment)
+                        payment_ops.append(UpdateOne(
+                            {"invoice_id": item["invoice_id"], "reference": txn["payment_reference"], "payment_method": payment["payment_method"]},
+                            {"$setOnInsert": payment},
+                            upsert=True
+                        ))
+                if item.get("levy_id"):
+                    levy_ops.append(UpdateOne(
+                        {"id": item["levy_id"], "status": {"$ne": "paid"}},
+                        {"$set": {"status": "paid", "paid_date": now}}
+                    ))
+
+            # Invoices, levies and payments first; the item stamp marks the record as applied
+            writes = [(collection, ops) for collection, ops in
+                      (("invoices", invoice_ops), ("levies", levy_ops), ("payments", payment_ops)) if ops]
+            results = await asyncio.gather(*(self.db[collection].bulk_write(ops, ordered=False) for collection, ops in writes))
+            for (collection, _), result in zip(writes, results):
+                if collection == "payments" and self.rollups:
+                    # Only upserted payments are new revenue; matched ones were counted by an earlier run
+                    await self.rollups.record_payments([payments[i] for i in result.upserted_ids])
+            if item_ops:
+                await self.db.eft_transaction_items.bulk_write(item_ops, ordered=False)
+                summary["applied"] += len(item_ops)
+
+        await self.recalculate_debts(debtors)
+        summary["debts_recalculated"] = len(debtors)
+
+        await self.db.eft_response_runs.update_one(
+            {"key": run_key},
+            {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat(), "summary": summary}}
+        )
+        return {**summary, "paid_items": paid_items}
@@ -0,0 +1,87 @@
+"""
+File Sequence Allocator
+Bank file sequence numbers ({ClientProfileNumber(10)}{YYYYMMDD(8)}{Sequential(6)})
+from an atomic per-profile, per-day counter in file_sequences. EFT and
+DebiCheck files share the counter, so files generated in the same second,
+or by several workers at once, never get the same sequence.
+
+The first allocation for a day in each process raises the counter ($max) to
+the highest sequence already recorded in eft_transactions for that profile
+and day, so on the deploy day new files still follow the ones stamped with
+HHMMSS before the counter existed. DebiCheck files were never recorded
+there; deploy after the day's DebiCheck submissions, or on a quiet day.
+"""
+import logging
+import re
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from eft_utils import format_file_sequence
+
+logger = logging.getLogger(__name__)
+
+MAX_DAILY_SEQUENCE = 999999
+
+
+async def _retry_upsert_race(write, *args):
+    try:
+        return await write(*args)
+    except DuplicateKeyError:
+        # Two first writes of the day raced on the upsert; the counter exists now
+        return await write(*args)
+
+
+class FileSequenceAllocator:
+    """Monotonic file sequence numbers per client profile and day"""
+
+    def __init__(self, db):
+        self.db = db
+        # Counter keys this process has already seeded from eft_transactions
+        self._seeded = set()
+
+    async def _seed(self, key: str, prefix: str):
+        """Raise the counter to the highest file_sequence already recorded with this prefix"""
+        latest = await self.db.eft_transactions.find_one(
+            {"file_sequence": {"$regex": f"^{re.escape(prefix)}"}},
+            {"_id": 0, "file_sequence": 1},
+            sort=[("file_sequence", -1)]
+        )
+        recorded = latest["file_sequence"][len(prefix):] if latest else ""
+        if not recorded.isdigit():
+            return
+        await self.db.file_sequences.update_one(
+            {"key": key},
+            {
+                "$max": {"sequence": int(recorded)},
+                "$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}
+            },
+            upsert=True
+        )
+
+    async def _increment(self, key: str) -> dict:
+        return await self.db.file_sequences.find_one_and_update(
+            {"key": key},
+            {
+                "$inc": {"sequence": 1},
+                "$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}
+            },
+            upsert=True,
+            projection={"_id": 0, "sequence": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def next(self, client_profile_number: str) -> str:
+        """Allocate the next 24-digit file sequence for today"""
+        client_profile_number = client_profile_number.zfill(10)
+        day = datetime.now().date()
+        key = f"{client_profile_number}:{day.strftime('%Y%m%d')}"
+        if key not in self._seeded:
+            await _retry_upsert_race(self._seed, key, f"{client_profile_number}{day.strftime('%Y%m%d')}")
+            self._seeded.add(key)
+        counter = await _retry_upsert_race(self._increment, key)
+
+        if counter["sequence"] > MAX_DAILY_SEQUENCE:
+            raise ValueError(f"File sequence limit reached for {day.isoformat()}")
+        return format_file_sequence(client_profile_number, day, counter["sequence"])
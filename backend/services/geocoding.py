@@ -0,0 +1,352 @@
+"""
+Geocoding Service
+Member addresses are geocoded off the request path:
+
+- create_member / update_member call enqueue(); a background worker geocodes
+  the address and writes latitude/longitude back to the member.
+- Results (including "not found") are kept in the geocode_cache collection
+  keyed by normalized address, so each distinct address reaches the geocoder
+  once per cache_ttl_days (not_found_ttl_days for misses); the TTL index on
+  expire_at removes stale entries. A geocoder that raises (timeout, service
+  error) is a transient failure: nothing is cached and the address is tried
+  again next time. ensure_cache_expiry() gives entries cached before expiry
+  existed an expire_at.
+- Geocoder calls run in the io executor and are spaced at least
+  min_interval seconds apart (Nominatim allows one request per second).
+- Members also get a precomputed geohash and geo_suburb so geographic reports
+  can $group on them; backfill() fills in members that are missing any of
+  latitude/longitude/geohash.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from geopy.geocoders import Nominatim
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_address(address: Optional[str]) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    if not address:
+        return ""
+    address = re.sub(r"[^\w\s]", " ", address.lower())
+    return re.sub(r"\s+", " ", address).strip()
+
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    """Standard base32 geohash (precision 5 is ~5km cells, 7 is ~150m)"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geocode_address(address: str) -> tuple:
+    """
+    Geocode an address and return (latitude, longitude, suburb), or
+    (None, None, None) when it is not found.
+    NOMINATIM_DOMAIN / NOMINATIM_SCHEME point this at another Nominatim-compatible
+    server (e.g. a local stub geocoder for tests).
+
+    Timeouts and service errors raise GeocoderServiceError rather than
+    returning "not found", so GeocodingService does not cache them.
+    """
+    if not address or len(address.strip()) < 5:
+        return None, None, None
+    geolocator = Nominatim(
+        user_agent="gym_access_hub",
+        domain=os.environ.get("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org"),
+        scheme=os.environ.get("NOMINATIM_SCHEME", "https")
+    )
+    location = geolocator.geocode(address, timeout=10, addressdetails=True)
+    if location:
+        details = (location.raw or {}).get("address", {})
+        suburb = details.get("suburb") or details.get("neighbourhood") or details.get("town") or details.get("city")
+        return location.latitude, location.longitude, suburb
+    return None, None, None
+
+
+def member_location(result: dict) -> dict:
+    """Member fields to $set from a geocode result"""
+    return {
+        "latitude": result["latitude"],
+        "longitude": result["longitude"],
+        "geohash": geohash_encode(result["latitude"], result["longitude"]),
+        "geo_suburb": result.get("suburb"),
+    }
+
+
+class GeocodingService:
+    """Cached, rate-limited geocoding with a background enrichment queue"""
+
+    def __init__(
+        self,
+        db,
+        geocoder: Callable,
+        executor,
+        min_interval: float = 1.0,
+        max_queue: int = 10000,
+        cache_ttl_days: int = 180,
+        not_found_ttl_days: int = 7
+    ):
+        self.db = db
+        self.geocoder = geocoder
+        self.executor = executor
+        self.min_interval = min_interval
+        self.cache_ttl_days = cache_ttl_days
+        self.not_found_ttl_days = not_found_ttl_days
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        self.backfill_progress: dict = {}
+        self._rate_lock = asyncio.Lock()
+        self._last_call = 0.0
+        self.cache_hits = 0
+        self.geocoder_calls = 0
+        self.geocoded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Pending addresses are not drained: that would mean network calls during shutdown.
+        # Members left without coordinates can be geocoded again later.
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._backfill_task:
+            self._backfill_task.cancel()
+            self._backfill_task = None
+
+    def enqueue(self, member_id: str, address: Optional[str]):
+        """Queue a member's address for geocoding without waiting"""
+        if not normalize_address(address):
+            return
+        try:
+            self._queue.put_nowait((member_id, address))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Geocode queue full; member {member_id} not queued")
+
+    async def geocode(self, address: Optional[str]) -> Optional[dict]:
+        """
+        {"latitude", "longitude", "suburb"} for an address, from the cache when
+        possible. None if the address could not be geocoded; geocoder
+        exceptions propagate and are not cached.
+        """
+        key = normalize_address(address)
+        if len(key) < 5:
+            return None
+
+        cached = await self.db.geocode_cache.find_one(
+            {"key": key},
+            {"_id": 0, "found": 1, "latitude": 1, "longitude": 1, "suburb": 1}
+        )
+        if cached:
+            self.cache_hits += 1
+            return cached if cached.get("found") else None
+
+        lat, lon, suburb = await self._call_geocoder(address)
+        found = lat is not None and lon is not None
+        now = datetime.now(timezone.utc)
+        await self.db.geocode_cache.update_one(
+            {"key": key},
+            {"$set": {
+                "key": key,
+                "address": address,
+                "latitude": lat,
+                "longitude": lon,
+                "suburb": suburb,
+                "found": found,
+                "updated_at": now,
+                "expire_at": now + timedelta(days=self.cache_ttl_days if found else self.not_found_ttl_days)
+            }},
+            upsert=True
+        )
+        return {"latitude": lat, "longitude": lon, "suburb": suburb} if found else None
+
+    async def ensure_cache_expiry(self, batch_size: int = 1000) -> int:
+        """
+        Set expire_at on cache entries written without one, counted from
+        updated_at, so the TTL index removes them. Returns the number updated.
+        """
+        now = datetime.now(timezone.utc)
+        updated, ops = 0, []
+        cursor = self.db.geocode_cache.find(
+            {"expire_at": {"$exists": False}},
+            {"_id": 0, "key": 1, "found": 1, "updated_at": 1}
+        )
+        async for entry in cursor:
+            written = entry.get("updated_at")
+            if not isinstance(written, datetime):
+                written = now
+            elif written.tzinfo is None:
+                written = written.replace(tzinfo=timezone.utc)
+            ttl = self.cache_ttl_days if entry.get("found") else self.not_found_ttl_days
+            ops.append(UpdateOne(
+                {"key": entry["key"], "expire_at": {"$exists": False}},
+                {"$set": {"expire_at": written + timedelta(days=ttl)}}
+            ))
+            if len(ops) >= batch_size:
+                await self.db.geocode_cache.bulk_write(ops, ordered=False)
+                updated += len(ops)
+                ops = []
+        if ops:
+            await self.db.geocode_cache.bulk_write(ops, ordered=False)
+            updated += len(ops)
+        return updated
+
+    def start_backfill(self, limit: Optional[int] = None) -> bool:
+        """Start the bulk backfill in the background; False if one is already running"""
+        if self._backfill_task and not self._backfill_task.done():
+            return False
+        self._backfill_task = asyncio.create_task(self.backfill(limit))
+        return True
+
+    async def backfill(self, limit: Optional[int] = None, batch_size: int = 100) -> dict:
+        """
+        Complete location fields for members that lack them.
+
+        Members with coordinates but no geohash are updated without calling
+        the geocoder. The rest are geocoded through the cache at the geocoder
+        rate limit, up to `limit` of them.
+        """
+        progress = self.backfill_progress = {
+            "status": "running",
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "geohashed": 0,
+            "geocoded": 0,
+            "not_found": 0,
+            "failed": 0,
+            "processed": 0,
+        }
+        try:
+            # 1. Coordinates known: geohash only
+            ops = []
+            cursor = self.db.members.find(
+                {"latitude": {"$type": "number"}, "longitude": {"$type": "number"}, "geohash": None},
+                {"_id": 0, "id": 1, "latitude": 1, "longitude": 1}
+            )
+            async for member in cursor:
+                ops.append(UpdateOne(
+                    {"id": member["id"]},
+                    {"$set": {"geohash": geohash_encode(member["latitude"], member["longitude"])}}
+                ))
+                if len(ops) >= batch_size:
+                    await self.db.members.bulk_write(ops, ordered=False)
+                    progress["geohashed"] += len(ops)
+                    ops = []
+            if ops:
+                await self.db.members.bulk_write(ops, ordered=False)
+                progress["geohashed"] += len(ops)
+
+            # 2. No coordinates: geocode
+            ops = []
+            cursor = self.db.members.find(
+                {"address": {"$nin": [None, ""]}, "latitude": None},
+                {"_id": 0, "id": 1, "address": 1}
+            )
+            if limit:
+                cursor = cursor.limit(limit)
+            async for member in cursor:
+                progress["processed"] += 1
+                try:
+                    result = await self.geocode(member["address"])
+                except Exception as e:
+                    # Transient geocoder failure: the member keeps no coordinates and is retried next backfill
+                    progress["failed"] += 1
+                    logger.warning(f"Geocoding failed for member {member['id']}: {str(e)}")
+                    continue
+                if result:
+                    ops.append(UpdateOne(
+                        {"id": member["id"], "address": member["address"]},
+                        {"$set": member_location(result)}
+                    ))
+                    progress["geocoded"] += 1
+                else:
+                    progress["not_found"] += 1
+                if len(ops) >= batch_size:
+                    await self.db.members.bulk_write(ops, ordered=False)
+                    ops = []
+            if ops:
+                await self.db.members.bulk_write(ops, ordered=False)
+
+            progress["status"] = "completed"
+        except asyncio.CancelledError:
+            progress["status"] = "cancelled"
+            raise
+        except Exception as e:
+            progress["status"] = "failed"
+            progress["error"] = str(e)
+            logger.error(f"Geocode backfill failed: {str(e)}")
+        finally:
+            progress["finished_at"] = datetime.now(timezone.utc).isoformat()
+        return progress
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queued": self._queue.qsize(),
+            "cache_hits": self.cache_hits,
+            "geocoder_calls": self.geocoder_calls,
+            "geocoded": self.geocoded,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "backfill": self.backfill_progress,
+        }
+
+    async def _call_geocoder(self, address: str) -> tuple:
+        async with self._rate_lock:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                self.geocoder_calls += 1
+                return await self.executor.run(self.geocoder, address)
+            finally:
+                self._last_call = time.monotonic()
+
+    async def _run(self):
+        while True:
+            member_id, address = await self._queue.get()
+            try:
+                result = await self.geocode(address)
+                if result:
+                    # Only apply if the address has not changed since it was queued
+                    await self.db.members.update_one(
+                        {"id": member_id, "address": address},
+                        {"$set": member_location(result)}
+                    )
+                    self.geocoded += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Geocoding failed for member {member_id}: {str(e)}")
@@ -0,0 +1,150 @@
+"""
+Dashboard KPI Engine
+Computes time-bucketed counts and sums with one aggregation per collection,
+run concurrently. Shared by /dashboard/stats, /dashboard/snapshot and
+/dashboard/kpi-trends so all three use the same computation path.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def metric(name: str, date_field: str, match: Optional[dict] = None, sum_field: Optional[str] = None) -> dict:
+    """
+    Describe one KPI series.
+
+    Args:
+        name: Key the bucketed values are returned under
+        date_field: ISO-string date field the documents are bucketed on
+        match: Extra filter applied before bucketing (e.g. {"status": "granted"})
+        sum_field: Field to sum; counts documents when omitted
+    """
+    return {
+        "name": name,
+        "date_field": date_field,
+        "match": match or {},
+        "sum_field": sum_field,
+    }
+
+
+class KPIEngine:
+    """Bucketed KPI aggregation over ISO-string date fields"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def _bucket_collection(self, collection: str, metrics: List[dict], boundaries: List[str]) -> Dict[str, List[float]]:
+        """One $facet aggregation per collection, one $bucket facet per metric"""
+        range_filters = []
+        facets = {}
+        for m in metrics:
+            date_range = {m["date_field"]: {"$gte": boundaries[0], "$lt": boundaries[-1]}}
+            range_filters.append({**date_range, **m["match"]})
+            facets[m["name"]] = [
+                {"$match": {**date_range, **m["match"]}},
+                {"$bucket": {
+                    "groupBy": f"${m['date_field']}",
+                    "boundaries": boundaries,
+                    "default": "outside",
+                    "output": {"value": {"$sum": f"${m['sum_field']}" if m["sum_field"] else 1}}
+                }}
+            ]
+
+        pipeline = [
+            {"$match": range_filters[0] if len(range_filters) == 1 else {"$or": range_filters}},
+            {"$facet": facets}
+        ]
+        result = await self.db[collection].aggregate(pipeline).to_list(1)
+        facet_results = result[0] if result else {}
+
+        series = {}
+        index_of = {boundary: i for i, boundary in enumerate(boundaries[:-1])}
+        for m in metrics:
+            values = [0] * (len(boundaries) - 1)
+            for bucket in facet_results.get(m["name"], []):
+                i = index_of.get(bucket["_id"])
+                if i is not None:
+                    values[i] = bucket["value"]
+            series[m["name"]] = values
+        return series
+
+    async def bucketed(self, metrics_by_collection: Dict[str, List[dict]], boundaries: List[datetime]) -> Dict[str, List[float]]:
+        """
+        Compute every metric for every bucket [boundaries[i], boundaries[i+1]).
+
+        Returns {metric_name: [value_per_bucket, ...]}
+        """
+        iso_boundaries = [b.isoformat() for b in boundaries]
+        collections = list(metrics_by_collection.keys())
+        results = await asyncio.gather(*[
+            self._bucket_collection(collection, metrics_by_collection[collection], iso_boundaries)
+            for collection in collections
+        ])
+        series = {}
+        for result in results:
+            series.update(result)
+        return series
+
+    async def status_summary(self) -> dict:
+        """Member and invoice status counts plus paid revenue, two grouped queries in parallel"""
+        member_counts, invoice_groups = await asyncio.gather(
+            self.db.members.aggregate([
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "active": {"$sum": {"$cond": [{"$eq": ["$membership_status", "active"]}, 1, 0]}},
+                    "debtors": {"$sum": {"$cond": [{"$eq": ["$is_debtor", True]}, 1, 0]}}
+                }}
+            ]).to_list(1),
+            self.db.invoices.aggregate([
+                {"$match": {"status": {"$in": ["pending", "overdue", "paid"]}}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+            ]).to_list(None)
+        )
+        members = member_counts[0] if member_counts else {}
+        invoices = {group["_id"]: group for group in invoice_groups}
+        return {
+            "total_members": members.get("total", 0),
+            "active_members": members.get("active", 0),
+            "blocked_members": members.get("debtors", 0),
+            "pending_invoices": invoices.get("pending", {}).get("count", 0),
+            "overdue_invoices": invoices.get("overdue", {}).get("count", 0),
+            "total_revenue": invoices.get("paid", {}).get("amount", 0),
+        }
+
+
+# Weekly sparkline series, grouped by the collection they are read from
+KPI_TREND_METRICS = {
+    "members": [
+        metric("people_registered", "created_at"),
+        metric("memberships_started", "membership_start_date", {"membership_status": "active"}),
+    ],
+    "access_logs": [
+        metric("attendance", "timestamp"),
+    ],
+    "bookings": [
+        metric("bookings", "booking_date"),
+        metric("booking_attendance", "booking_date", {"status": "attended"}),
+    ],
+    "pos_transactions": [
+        metric("product_sales", "created_at", {"transaction_type": "product_sale"}, sum_field="total_amount"),
+    ],
+    "tasks": [
+        metric("tasks", "created_at"),
+    ],
+}
+
+# Today / yesterday / rolling 30-day snapshot series
+SNAPSHOT_METRICS = {
+    "members": [
+        metric("registered", "created_at"),
+        metric("commenced", "join_date"),
+        metric("expired", "expiry_date", {"membership_status": {"$in": ["expired", "cancelled"]}}),
+    ],
+    "access_logs": [
+        metric("attendance", "timestamp", {"status": "granted"}),
+    ],
+}
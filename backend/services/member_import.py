@@ -0,0 +1,361 @@
+"""
+Member Import
+Streams a CSV of members in chunks (default 1,000 rows). Per chunk:
+
+- rows are mapped to member fields and given the same normalized keys as
+  create_member (norm_email, norm_phone, norm_first_name/norm_last_name),
+- existing members are found with one $in query per key type (all indexed),
+- new members go in with one insert_many, duplicate updates with one
+  bulk_write, and skipped duplicates are logged to blocked_member_attempts
+  with one insert_many,
+- counts and errors are added to the import's import_logs document, so a
+  long import can be polled while it runs,
+- inserted members are counted as joins in the membership rollup (one
+  bulk_write per chunk).
+
+Rows earlier in the same file count as existing members, as they did when
+each row was inserted before the next was checked: earlier chunks are
+already written when a chunk looks up existing members, and rows within a
+chunk are matched against each other in memory. Only the current chunk's
+members are held in memory.
+
+start() runs the import as a background task so the upload request can
+return the import log id straight away; the log's status moves from
+processing to completed or failed.
+"""
+import asyncio
+import csv
+import io
+import logging
+import uuid
+from datetime import datetime, timezone
+from itertools import islice
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from normalization import normalize_email, normalize_phone, normalize_full_name
+
+logger = logging.getLogger(__name__)
+
+NAME_TITLES = {"MR", "MRS", "MS", "MISS", "DR", "PROF"}
+ERROR_LOG_LIMIT = 1000  # error_log entries kept on the import_logs document
+RESPONSE_ERRORS = 20
+
+MEMBER_SUMMARY = {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "email": 1, "phone": 1}
+
+# Imports started with MemberImporter.start() that have not finished yet
+_running: Set[asyncio.Task] = set()
+
+
+def map_member_row(row: dict, mapping: dict) -> dict:
+    """Map a CSV row to member fields, splitting a full name when only first_name is mapped"""
+    member_data = {
+        "id": str(uuid.uuid4()),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    for db_field, csv_column in mapping.items():
+        if csv_column and csv_column in row:
+            value = (row[csv_column] or "").strip()
+            if value:
+                member_data[db_field] = value
+
+    if "first_name" in member_data and "last_name" not in member_data:
+        full_name = member_data["first_name"]
+        name_parts = full_name.split()
+
+        # Remove title if present
+        if name_parts and name_parts[0].upper().rstrip('.') in NAME_TITLES:
+            name_parts = name_parts[1:]
+
+        if len(name_parts) >= 2:
+            member_data["first_name"] = name_parts[0]
+            member_data["last_name"] = " ".join(name_parts[1:])
+        elif len(name_parts) == 1:
+            member_data["first_name"] = name_parts[0]
+            member_data["last_name"] = name_parts[0]
+        else:
+            member_data["last_name"] = full_name
+
+    return member_data
+
+
+def normalized_keys(member_data: dict) -> dict:
+    """The norm_* fields create_member stores for duplicate checks"""
+    norm_first, norm_last = normalize_full_name(member_data.get("first_name", ""), member_data.get("last_name", ""))
+    return {
+        "norm_email": normalize_email(member_data["email"]) if member_data.get("email") else None,
+        "norm_phone": normalize_phone(member_data["phone"]) if member_data.get("phone") else None,
+        "norm_first_name": norm_first,
+        "norm_last_name": norm_last,
+    }
+
+
+def _chunks(rows: Iterable[dict], size: int) -> Iterator[List[Tuple[int, dict]]]:
+    numbered = enumerate(rows, start=2)  # row 1 is the header
+    while True:
+        chunk = list(islice(numbered, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class MemberImporter:
+    """Chunked CSV member import with batched duplicate detection"""
+
+    def __init__(self, db, blocked_attempt: Callable, rollups=None, chunk_size: int = 1000):
+        self.db = db
+        # (member_data, keys, duplicate, field) -> blocked_member_attempts document
+        self.blocked_attempt = blocked_attempt
+        self.rollups = rollups
+        self.chunk_size = chunk_size
+
+    async def backfill_keys(self) -> int:
+        """Give members stored without normalized keys (e.g. earlier imports) their norm_* fields"""
+        cursor = self.db.members.find(
+            {"norm_first_name": {"$exists": False}},
+            {"_id": 0, "id": 1, "email": 1, "phone": 1, "first_name": 1, "last_name": 1}
+        )
+        ops = []
+        count = 0
+        async for member in cursor:
+            ops.append(UpdateOne({"id": member["id"]}, {"$set": normalized_keys(member)}))
+            if len(ops) >= self.chunk_size:
+                await self.db.members.bulk_write(ops, ordered=False)
+                count += len(ops)
+                ops = []
+        if ops:
+            await self.db.members.bulk_write(ops, ordered=False)
+            count += len(ops)
+        return count
+
+    async def run(self, rows: Iterable[dict], mapping: dict, duplicate_action: str, log_id: str) -> dict:
+        """
+        Import rows (csv.DictReader) with duplicate_action skip | update | create.
+        Returns the totals plus the first errors.
+        """
+        backfilled = await self.backfill_keys()
+        if backfilled:
+            logger.info(f"Added normalized keys to {backfilled} members before import")
+        default_type = await self.db.membership_types.find_one({}, {"_id": 0, "id": 1})
+        state = {"default_type_id": default_type["id"] if default_type else None}
+        totals = {"successful": 0, "failed": 0, "skipped": 0, "updated": 0}
+        errors: List[dict] = []
+
+        for chunk in _chunks(rows, self.chunk_size):
+            counts, chunk_errors = await self._import_chunk(chunk, mapping, duplicate_action, state)
+            for key, value in counts.items():
+                totals[key] += value
+            if len(errors) < RESPONSE_ERRORS:
+                errors.extend(chunk_errors[:RESPONSE_ERRORS - len(errors)])
+
+            await self.db.import_logs.update_one(
+                {"id": log_id},
+                {
+                    "$inc": {
+                        "total_rows": len(chunk),
+                        "successful_rows": counts["successful"],
+                        "failed_rows": counts["failed"],
+                        "skipped_rows": counts["skipped"],
+                        "updated_rows": counts["updated"],
+                    },
+                    "$push": {"error_log": {"$each": chunk_errors, "$slice": ERROR_LOG_LIMIT}},
+                    "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                }
+            )
+
+        return {**totals, "total_rows": sum(totals.values()), "error_log": errors}
+
+    def start(self, file: IO[bytes], mapping: dict, duplicate_action: str, log_id: str) -> asyncio.Task:
+        """Run run_file() in the background; the caller returns log_id for polling"""
+        task = asyncio.create_task(self.run_file(file, mapping, duplicate_action, log_id))
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        return task
+
+    async def run_file(self, file: IO[bytes], mapping: dict, duplicate_action: str, log_id: str) -> Optional[dict]:
+        """
+        run() over a UTF-8 CSV file, then mark the import log completed or
+        failed (with the error). The file is closed when the import ends.
+        """
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        try:
+            result = await self.run(csv.DictReader(text), mapping, duplicate_action, log_id)
+        except asyncio.CancelledError:
+            await self._finish(log_id, "failed", "Import interrupted by shutdown")
+            raise
+        except Exception as e:
+            logger.error(f"Member import {log_id} failed: {str(e)}")
+            await self._finish(log_id, "failed", str(e))
+            return None
+        finally:
+            text.close()
+        await self._finish(log_id, "completed")
+        return result
+
+    async def _finish(self, log_id: str, status: str, error: Optional[str] = None):
+        update = {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}
+        if error:
+            update["error"] = error
+        try:
+            await self.db.import_logs.update_one({"id": log_id}, {"$set": update})
+        except Exception as e:
+            logger.error(f"Failed to mark member import {log_id} {status}: {str(e)}")
+
+    async def _existing(self, keyed: List[Tuple[int, dict, dict, dict]], known: dict):
+        """Add members matching the chunk's keys to known: one $in query per key type"""
+        emails = list({keys["norm_email"] for _, _, _, keys in keyed if keys["norm_email"]})
+        phones = list({keys["norm_phone"] for _, _, _, keys in keyed if keys["norm_phone"]})
+        names = {
+            (keys["norm_first_name"], keys["norm_last_name"])
+            for _, _, _, keys in keyed
+            if keys["norm_first_name"] and keys["norm_last_name"]
+        }
+        projection = {**MEMBER_SUMMARY, "norm_email": 1, "norm_phone": 1, "norm_first_name": 1, "norm_last_name": 1}
+
+        async def find(query: Optional[dict]) -> List[dict]:
+            if query is None:
+                return []
+            return await self.db.members.find(query, projection).to_list(None)
+
+        by_email, by_phone, by_name = await asyncio.gather(
+            find({"norm_email": {"$in": emails}} if emails else None),
+            find({"norm_phone": {"$in": phones}} if phones else None),
+            find({
+                "norm_last_name": {"$in": list({last for _, last in names})},
+                "norm_first_name": {"$in": list({first for first, _ in names})}
+            } if names else None)
+        )
+        for member in by_email:
+            known["email"].setdefault(member["norm_email"], member)
+        for member in by_phone:
+            known["phone"].setdefault(member["norm_phone"], member)
+        for member in by_name:
+            pair = (member.get("norm_first_name"), member.get("norm_last_name"))
+            if pair in names:
+                known["name"].setdefault(pair, member)
+
+    @staticmethod
+    def _remember(known: dict, keys: dict, member: dict):
+        if keys["norm_email"]:
+            known["email"].setdefault(keys["norm_email"], member)
+        if keys["norm_phone"]:
+            known["phone"].setdefault(keys["norm_phone"], member)
+        if keys["norm_first_name"] and keys["norm_last_name"]:
+            known["name"].setdefault((keys["norm_first_name"], keys["norm_last_name"]), member)
+
+    async def _import_chunk(
+        self,
+        chunk: List[Tuple[int, dict]],
+        mapping: dict,
+        duplicate_action: str,
+        state: dict
+    ) -> Tuple[Dict[str, int], List[dict]]:
+        counts = {"successful": 0, "failed": 0, "skipped": 0, "updated": 0}
+        errors: List[dict] = []
+        # Members this chunk matches or creates, by normalized key
+        known = {"email": {}, "phone": {}, "name": {}}
+
+        keyed = []
+        for row_num, row in chunk:
+            try:
+                member_data = map_member_row(row, mapping)
+                keyed.append((row_num, row, member_data, normalized_keys(member_data)))
+            except Exception as e:
+                counts["failed"] += 1
+                errors.append({"row": row_num, "error": str(e), "data": row})
+
+        await self._existing(keyed, known)
+
+        inserts: List[Tuple[int, dict, dict]] = []
+        pending: Dict[str, dict] = {}  # id -> member inserted by this chunk (not yet written)
+        updates: List[UpdateOne] = []
+        blocked: List[dict] = []
+
+        for row_num, row, member_data, keys in keyed:
+            duplicate, field = None, None
+            if keys["norm_email"] and keys["norm_email"] in known["email"]:
+                duplicate, field = known["email"][keys["norm_email"]], "email"
+            elif keys["norm_phone"] and keys["norm_phone"] in known["phone"]:
+                duplicate, field = known["phone"][keys["norm_phone"]], "phone"
+            elif (keys["norm_first_name"], keys["norm_last_name"]) in known["name"]:
+                duplicate, field = known["name"][(keys["norm_first_name"], keys["norm_last_name"])], "name"
+
+            if duplicate and duplicate_action == "skip":
+                counts["skipped"] += 1
+                blocked.append(self.blocked_attempt(member_data, keys, duplicate, field))
+                errors.append({
+                    "row": row_num,
+                    "action": "skipped",
+                    "reason": f"Duplicate found: {duplicate['first_name']} {duplicate['last_name']}",
+                    "data": row
+                })
+                continue
+
+            if duplicate and duplicate_action == "update":
+                update_data = {k: v for k, v in member_data.items() if k not in ["id", "created_at"]}
+                update_data.update(keys)
+                if duplicate["id"] in pending:
+                    pending[duplicate["id"]].update(update_data)
+                else:
+                    updates.append(UpdateOne({"id": duplicate["id"]}, {"$set": update_data}))
+                self._remember(known, keys, duplicate)
+                counts["updated"] += 1
+                continue
+
+            # New member (or duplicate_action == "create")
+            member_data.update(keys)
+            member_data.setdefault("membership_status", "active")
+            member_data.setdefault("join_date", member_data["created_at"])
+            if "membership_type_id" not in member_data and state["default_type_id"]:
+                member_data["membership_type_id"] = state["default_type_id"]
+            inserts.append((row_num, row, member_data))
+            pending[member_data["id"]] = member_data
+            self._remember(known, keys, member_data)
+
+        if inserts:
+            counts["successful"] += len(inserts)
+            failed_inserts = set()
+            try:
+                await self.db.members.insert_many([doc for _, _, doc in inserts], ordered=False)
+            except BulkWriteError as e:
+                for err in e.details.get("writeErrors", []):
+                    failed_inserts.add(err["index"])
+                    row_num, row, _ = inserts[err["index"]]
+                    counts["successful"] -= 1
+                    counts["failed"] += 1
+                    errors.append({"row": row_num, "error": err.get("errmsg", "Insert failed"), "data": row})
+            if self.rollups:
+                await self.rollups.record_membership_events("joins", [
+                    (doc["join_date"], doc.get("membership_type_id"), doc.get("source"))
+                    for i, (_, _, doc) in enumerate(inserts)
+                    if i not in failed_inserts
+                ])
+
+        if updates:
+            try:
+                await self.db.members.bulk_write(updates, ordered=False)
+            except BulkWriteError as e:
+                failed_updates = len(e.details.get("writeErrors", []))
+                counts["updated"] -= failed_updates
+                counts["failed"] += failed_updates
+                errors.extend({"error": err.get("errmsg", "Update failed")} for err in e.details.get("writeErrors", []))
+
+        if blocked:
+            # Logged for staff review; a failure here does not fail the import
+            try:
+                await self.db.blocked_member_attempts.insert_many(blocked, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to log blocked import attempts: {str(e)}")
+
+        return counts, errors
+
+
+async def cancel_running_imports():
+    """Cancel background imports (on shutdown); each marks its log failed"""
+    tasks = list(_running)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,231 @@
+"""
+Points Ledger
+points_balances is the running total, maintained only with atomic $inc, so
+concurrent awards never overwrite each other. points_transactions is the
+history; single awards are buffered and inserted in batches.
+
+award_many() is idempotent per transaction id: the id is pushed onto the
+balance's recent_transaction_ids in the same update as its $inc, and the
+update only matches while the id is absent, so a retried batch (e.g. one
+written again after a cancelled flush) does not award its points twice.
+
+compact() folds transactions older than a cutoff into a per-member snapshot
+on the balance document (compacted_points / compacted_through) and deletes
+them, keeping the history collection bounded.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Transaction ids kept per balance for award_many() retries
+RECENT_TRANSACTION_IDS = 1000
+
+BALANCE_PROJECTION = {"_id": 0, "recent_transaction_ids": 0}
+
+
+def _only_duplicate_keys(e: BulkWriteError) -> bool:
+    return not e.details.get("writeConcernErrors") and \
+        all(err.get("code") == 11000 for err in e.details.get("writeErrors", []))
+
+
+class PointsLedger:
+    """Atomic points accrual with batched transaction history"""
+
+    def __init__(self, db, batch_size: int = 500, flush_interval: float = 1.0,
+                 compact_after_days: Optional[int] = None, compact_interval_hours: int = 24):
+        """compact_after_days enables periodic compact() from the background task"""
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_after_days = compact_after_days
+        self.compact_interval = timedelta(hours=compact_interval_hours)
+        self._last_compaction: Optional[datetime] = None
+        self._pending: List[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if self.compact_after_days:
+                now = datetime.now(timezone.utc)
+                if self._last_compaction is None or now - self._last_compaction >= self.compact_interval:
+                    self._last_compaction = now
+                    try:
+                        await self.compact(self.compact_after_days)
+                    except Exception as e:
+                        logger.error(f"Points compaction failed: {str(e)}")
+
+    async def flush(self):
+        """
+        Insert buffered transactions. A batch leaves the buffer only once
+        insert_many succeeds, so a failed or cancelled flush (e.g. stop()
+        cancelling the background task) leaves it for the next one. Ids are
+        unique, so rows a failed attempt did write are skipped on retry.
+        """
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                try:
+                    await self.db.points_transactions.insert_many([t.copy() for t in batch], ordered=False)
+                except BulkWriteError as e:
+                    if not _only_duplicate_keys(e):
+                        logger.error(f"Failed to write {len(batch)} points transactions: {str(e)}")
+                        return
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} points transactions: {str(e)}")
+                    return
+                del self._pending[:len(batch)]
+
+    @staticmethod
+    def transaction(member_id: str, points: int, reason: str, reference_id: Optional[str] = None,
+                    transaction_type: str = "earned", transaction_id: Optional[str] = None,
+                    created_at: Optional[str] = None) -> dict:
+        return {
+            "id": transaction_id or str(uuid.uuid4()),
+            "member_id": member_id,
+            "points": points,
+            "transaction_type": transaction_type,
+            "reason": reason,
+            "reference_id": reference_id,
+            "created_at": created_at or datetime.now(timezone.utc).isoformat()
+        }
+
+    async def award(self, member_id: str, points: int, reason: str, reference_id: Optional[str] = None,
+                    transaction_type: str = "earned") -> dict:
+        """
+        Add points (negative to deduct) with one atomic $inc.
+
+        Returns {"balance": <updated balance doc>, "transaction": <transaction doc>}
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        balance = await self.db.points_balances.find_one_and_update(
+            {"member_id": member_id},
+            {"$inc": {"total_points": points, "lifetime_points": points}, "$set": {"last_updated": now}},
+            projection=BALANCE_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        transaction = self.transaction(member_id, points, reason, reference_id, transaction_type, created_at=now)
+        self._pending.append(transaction)
+        if self._task is None or len(self._pending) >= self.batch_size:
+            await self.flush()
+        return {"balance": balance, "transaction": transaction}
+
+    async def award_many(self, transactions: List[dict]):
+        """
+        Apply already-built transactions: one conditional $inc per transaction
+        in a single bulk_write, one insert_many for the history. Transactions
+        whose id the balance already records are skipped.
+        """
+        if not transactions:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        ops = [
+            UpdateOne(
+                {"member_id": t["member_id"], "recent_transaction_ids": {"$ne": t["id"]}},
+                {
+                    "$inc": {"total_points": t["points"], "lifetime_points": t["points"]},
+                    "$set": {"last_updated": now},
+                    "$push": {"recent_transaction_ids": {"$each": [t["id"]], "$slice": -RECENT_TRANSACTION_IDS}}
+                },
+                upsert=True
+            )
+            for t in transactions
+        ]
+        try:
+            await self.db.points_balances.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # The filter missed an existing balance, so its upsert hit the unique member_id: either the
+            # transaction was already applied, or another write created the balance first. Retry once;
+            # an applied transaction misses again.
+            if not _only_duplicate_keys(e):
+                raise
+            try:
+                await self.db.points_balances.bulk_write([ops[err["index"]] for err in e.details["writeErrors"]], ordered=False)
+            except BulkWriteError as retry:
+                if not _only_duplicate_keys(retry):
+                    raise
+        try:
+            await self.db.points_transactions.insert_many([t.copy() for t in transactions], ordered=False)
+        except BulkWriteError as e:
+            # History rows a previous attempt already wrote
+            if not _only_duplicate_keys(e):
+                raise
+
+    async def get_balance(self, member_id: str) -> dict:
+        """Balance for a member, created at zero on first read"""
+        return await self.db.points_balances.find_one_and_update(
+            {"member_id": member_id},
+            {"$setOnInsert": {
+                "total_points": 0,
+                "lifetime_points": 0,
+                "last_updated": datetime.now(timezone.utc).isoformat()
+            }},
+            projection=BALANCE_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def leaderboard(self, limit: int = 10) -> List[dict]:
+        """Top balances, read through the total_points index"""
+        return await self.db.points_balances.find(
+            {}, BALANCE_PROJECTION
+        ).sort("total_points", DESCENDING).limit(limit).to_list(limit)
+
+    async def compact(self, older_than_days: int = 365) -> dict:
+        """
+        Fold transactions created before now - older_than_days into the
+        balance snapshot and delete them. Balances are unchanged; only the
+        per-transaction history is summarised.
+        """
+        await self.flush()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+        groups = await self.db.points_transactions.aggregate([
+            {"$match": {"created_at": {"$lt": cutoff}}},
+            {"$group": {"_id": "$member_id", "points": {"$sum": "$points"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        if not groups:
+            return {"members": 0, "transactions_compacted": 0, "compacted_through": cutoff}
+
+        await self.db.points_balances.bulk_write([
+            UpdateOne(
+                {"member_id": g["_id"]},
+                {
+                    "$inc": {"compacted_points": g["points"], "compacted_transactions": g["count"]},
+                    "$set": {"compacted_through": cutoff}
+                },
+                upsert=True
+            )
+            for g in groups
+        ], ordered=False)
+        result = await self.db.points_transactions.delete_many({"created_at": {"$lt": cutoff}})
+
+        logger.info(f"Compacted {result.deleted_count} points transactions for {len(groups)} members")
+        return {
+            "members": len(groups),
+            "transactions_compacted": result.deleted_count,
+            "compacted_through": cutoff
+        }
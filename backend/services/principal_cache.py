@@ -0,0 +1,65 @@
+"""
+Principal Cache
+Short-TTL LRU cache of authenticated users keyed by the JWT subject (email),
+so get_current_user does not hit db.users on every request. Entries are
+dropped when a user's role or password changes and the whole cache is
+cleared when role permissions change.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class PrincipalCache:
+    """TTL + LRU cache of resolved users"""
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._email_by_id: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Optional[Any]:
+        item = self._entries.get(email)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                self._drop(email)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return item[1]
+
+    def put(self, email: str, user: Any):
+        self._entries[email] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(email)
+        user_id = getattr(user, "id", None)
+        if user_id:
+            self._email_by_id[user_id] = email
+        while len(self._entries) > self.max_entries:
+            oldest, _ = self._entries.popitem(last=False)
+            self._forget_id(oldest)
+
+    def invalidate(self, email: Optional[str] = None, user_id: Optional[str] = None):
+        """Drop one user by email or id"""
+        if user_id and not email:
+            email = self._email_by_id.get(user_id)
+        if email:
+            self._drop(email)
+
+    def clear(self):
+        self._entries.clear()
+        self._email_by_id.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _drop(self, email: str):
+        self._entries.pop(email, None)
+        self._forget_id(email)
+
+    def _forget_id(self, email: str):
+        for user_id in [uid for uid, e in self._email_by_id.items() if e == email]:
+            del self._email_by_id[user_id]
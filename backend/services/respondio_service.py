@@ -213,6 +213,50 @@ class RespondIOService:
             )
             raise
     
+    async def send_text_message(
+        self,
+        contact_phone: str,
+        text: str,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None,
+        email: Optional[str] = None
+    ) -> Dict:
+        """
+        Send a free-text WhatsApp message
+        
+        Only delivered inside WhatsApp's 24-hour customer service window;
+        use send_whatsapp_message with a template outside it.
+        """
+        formatted_phone = self.format_phone_number(contact_phone)
+        
+        if first_name:
+            try:
+                await self.create_or_update_contact(
+                    phone=formatted_phone,
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=email
+                )
+            except Exception as e:
+                logger.warning(f"Failed to create contact, proceeding with message: {str(e)}")
+        
+        payload = {
+            "contactId": f"phone:{formatted_phone}",
+            "channelId": self.channel_id,
+            "message": {
+                "type": "text",
+                "text": text
+            }
+        }
+        
+        try:
+            result = await self._make_request("POST", "message/send", payload)
+            logger.info(f"WhatsApp text message sent to {formatted_phone}, message ID: {result.get('messageId', 'unknown')}")
+            return result
+        except Exception as e:
+            logger.error(f"Failed to send WhatsApp text message to {formatted_phone}: {str(e)}")
+            raise
+    
     async def list_message_templates(self, channel_id: Optional[str] = None) -> List[Dict]:
         """List all approved message templates for a channel"""
         if self.is_mocked:
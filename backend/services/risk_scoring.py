@@ -0,0 +1,389 @@
+"""
+Member Risk Scoring Engine
+Loads the columns needed for churn / at-risk scoring once (members, grouped
+invoice counts, grouped visit counts), scores every member with vectorized
+pandas operations and caches the scored table for a short TTL. Member,
+invoice and access writes invalidate it (invalidate()).
+
+Shared by /analytics/churn-prediction, /retention/at-risk-members and
+/reports/at-risk-members, which become filtered, paginated lookups.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MEMBER_COLUMNS = [
+    "id", "first_name", "last_name", "full_name", "email", "phone",
+    "membership_type", "membership_status", "last_visit_date",
+    "expiry_date", "join_date", "is_debtor"
+]
+
+
+def _parse_dates(series: pd.Series) -> pd.Series:
+    """ISO strings or datetimes -> tz-aware UTC timestamps (NaT when missing or unparseable)"""
+    as_text = series.map(lambda v: v.isoformat() if isinstance(v, datetime) else v)
+    return pd.to_datetime(as_text, utc=True, errors="coerce", format="ISO8601")
+
+
+def _days(delta: pd.Series) -> pd.Series:
+    """Whole days (floored like timedelta.days), NaN where either date is missing"""
+    return delta.dt.days
+
+
+def _text(series: pd.Series) -> pd.Series:
+    return series.astype("Int64").astype(str)
+
+
+def _reason(condition, text) -> np.ndarray:
+    return np.where(condition, text, None)
+
+
+def _level(score, labels: List[str]) -> np.ndarray:
+    """Score >= 50 / 30 / 15 -> labels[0] / [1] / [2]; None below 15"""
+    return np.where(score >= 50, labels[0], np.where(score >= 30, labels[1], np.where(score >= 15, labels[2], None)))
+
+
+def _present(series: pd.Series) -> pd.Series:
+    return series.notna() & (series.astype(str) != "")
+
+
+class MemberRiskEngine:
+    """Vectorized risk scoring with a TTL-cached scored table"""
+
+    def __init__(self, db, ttl_seconds: int = 300):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self._table: Optional[pd.DataFrame] = None
+        self._scored_at: Optional[datetime] = None
+        self._loaded_monotonic = 0.0
+        self._lock = asyncio.Lock()
+        self._generation = 0
+
+    def invalidate(self):
+        """Drop the scored table after a member, invoice or visit write; the next read rescores"""
+        self._table = None
+        self._generation += 1
+
+    async def scored_table(self, force_refresh: bool = False) -> pd.DataFrame:
+        fresh = self._table is not None and (time.monotonic() - self._loaded_monotonic) < self.ttl_seconds
+        if fresh and not force_refresh:
+            return self._table
+
+        async with self._lock:
+            # Another request may have refreshed while we waited
+            fresh = self._table is not None and (time.monotonic() - self._loaded_monotonic) < self.ttl_seconds
+            if fresh and not force_refresh:
+                return self._table
+            now = datetime.now(timezone.utc)
+            generation = self._generation
+            table = await self._load(now)
+            scored = self._score(table, now)
+            self._scored_at = now
+            if generation == self._generation:
+                # Not cached when a write invalidated the table while it was loading
+                self._table = scored
+                self._loaded_monotonic = time.monotonic()
+            logger.info(f"Risk scores refreshed for {len(table)} members")
+            return scored
+
+    @property
+    def scored_at(self) -> Optional[datetime]:
+        return self._scored_at
+
+    async def _load(self, now: datetime) -> pd.DataFrame:
+        thirty_days_ago = now - timedelta(days=30)
+        sixty_days_ago = now - timedelta(days=60)
+
+        members, invoice_counts, visit_counts = await asyncio.gather(
+            self.db.members.find(
+                {"membership_status": {"$in": ["active", "frozen"]}},
+                {"_id": 0, **{c: 1 for c in MEMBER_COLUMNS}}
+            ).to_list(None),
+            self.db.invoices.aggregate([
+                {"$match": {"status": {"$in": ["pending", "overdue", "failed"]}}},
+                {"$group": {
+                    "_id": "$member_id",
+                    "overdue_invoices": {"$sum": {"$cond": [{"$eq": ["$status", "overdue"]}, 1, 0]}},
+                    "failed_invoices": {"$sum": {"$cond": [{"$eq": ["$status", "failed"]}, 1, 0]}},
+                    "unpaid_invoices": {"$sum": 1}
+                }}
+            ]).to_list(None),
+            self.db.access_logs.aggregate([
+                {"$match": {"status": "granted", "timestamp": {"$gte": sixty_days_ago.isoformat()}}},
+                {"$group": {
+                    "_id": "$member_id",
+                    "recent_visits": {"$sum": {"$cond": [{"$gte": ["$timestamp", thirty_days_ago.isoformat()]}, 1, 0]}},
+                    "previous_visits": {"$sum": {"$cond": [{"$lt": ["$timestamp", thirty_days_ago.isoformat()]}, 1, 0]}}
+                }}
+            ]).to_list(None)
+        )
+
+        df = pd.DataFrame(members, columns=MEMBER_COLUMNS)
+        for counts in (invoice_counts, visit_counts):
+            if counts:
+                df = df.merge(pd.DataFrame(counts).rename(columns={"_id": "id"}), on="id", how="left")
+        for column in ("overdue_invoices", "failed_invoices", "unpaid_invoices", "recent_visits", "previous_visits"):
+            if column not in df:
+                df[column] = 0
+            df[column] = df[column].fillna(0).astype(int)
+
+        df["is_debtor"] = df["is_debtor"].eq(True)
+        df["last_visit_dt"] = _parse_dates(df["last_visit_date"])
+        df["expiry_dt"] = _parse_dates(df["expiry_date"])
+        df["join_dt"] = _parse_dates(df["join_date"])
+        df["member_name"] = (df["first_name"].fillna("") + " " + df["last_name"].fillna("")).str.strip()
+        return df
+
+    def _score(self, df: pd.DataFrame, now: datetime) -> pd.DataFrame:
+        now_ts = pd.Timestamp(now)
+        days_since_visit = _days(now_ts - df["last_visit_dt"])
+        has_visit = df["last_visit_dt"].notna()
+        df["days_since_visit"] = days_since_visit
+        visit_text = _text(days_since_visit)
+
+        self._score_churn(df, has_visit, days_since_visit, visit_text)
+        self._score_retention(df, now_ts, has_visit, days_since_visit, visit_text)
+        self._score_report(df, now_ts, has_visit, days_since_visit, visit_text)
+        return df
+
+    # Churn prediction model (/analytics/churn-prediction)
+    def _score_churn(self, df, has_visit, days, visit_text):
+        no_visit = ~has_visit
+        over_60 = has_visit & (days > 60)
+        over_30 = has_visit & (days > 30) & ~over_60
+        overdue = df["overdue_invoices"] > 0
+        frozen = df["membership_status"] == "frozen"
+        incomplete_contact = ~_present(df["email"]) | ~_present(df["phone"])
+        declining = (df["previous_visits"] > 0) & (df["recent_visits"] < df["previous_visits"] * 0.5)
+
+        df["churn_score"] = (
+            np.where(no_visit, 20, 0)
+            + np.where(over_60, 30, 0)
+            + np.where(over_30, 15, 0)
+            + np.where(overdue, 25, 0)
+            + np.where(frozen, 20, 0)
+            + np.where(incomplete_contact, 5, 0)
+            + np.where(declining, 15, 0)
+        )
+        df["churn_level"] = _level(df["churn_score"], ["Critical", "High", "Medium"])
+        df["churn_reason_1"] = _reason(no_visit, "No visit history")
+        df["churn_reason_2"] = _reason(over_60, "No visit in " + visit_text + " days")
+        df["churn_reason_3"] = _reason(over_30, "Last visit " + visit_text + " days ago")
+        df["churn_reason_4"] = _reason(overdue, _text(df["overdue_invoices"]) + " overdue invoice(s)")
+        df["churn_reason_5"] = _reason(frozen, "Membership frozen")
+        df["churn_reason_6"] = _reason(incomplete_contact, "Incomplete contact info")
+        df["churn_reason_7"] = _reason(declining, "Attendance declining 50%+")
+
+        df.attrs["churn_factor_counts"] = {
+            "No visit history": int(no_visit.sum()),
+            "No recent visits (60+ days)": int(over_60.sum()),
+            "Declining attendance (30+ days)": int(over_30.sum()),
+            "Payment issues": int(overdue.sum()),
+            "Frozen membership": int(frozen.sum()),
+            "Missing contact info": int(incomplete_contact.sum()),
+            "Attendance decline": int(declining.sum()),
+        }
+
+    # Attendance-based retention model (/retention/at-risk-members)
+    def _score_retention(self, df, now_ts, has_visit, days, visit_text):
+        active = df["membership_status"] == "active"
+        visit_28 = has_visit & (days >= 28)
+        visit_14 = has_visit & (days >= 14) & ~visit_28
+        visit_7 = has_visit & (days >= 7) & ~visit_28 & ~visit_14
+        no_visit = ~has_visit
+        debtor = df["is_debtor"]
+        no_phone = ~_present(df["phone"])
+        days_until_expiry = _days(df["expiry_dt"] - now_ts)
+        expiring = df["expiry_dt"].notna() & (days_until_expiry > 0) & (days_until_expiry <= 30)
+
+        score = (
+            np.where(visit_28, 40, 0)
+            + np.where(visit_14, 25, 0)
+            + np.where(visit_7, 10, 0)
+            + np.where(no_visit, 30, 0)
+            + np.where(debtor, 20, 0)
+            + np.where(no_phone, 5, 0)
+            + np.where(expiring, 15, 0)
+        )
+        df["retention_score"] = score
+        df["retention_level"] = np.where(active, _level(score, ["critical", "high", "medium"]), None)
+        df["retention_reason_1"] = _reason(has_visit & (days >= 7), "No visit in " + visit_text + " days")
+        df["retention_reason_2"] = _reason(no_visit, "No attendance recorded")
+        df["retention_reason_3"] = _reason(debtor, "Outstanding payment")
+        df["retention_reason_4"] = _reason(no_phone, "No contact phone")
+        df["retention_reason_5"] = _reason(expiring, "Expires in " + _text(days_until_expiry) + " days")
+
+    # Financial risk report model (/reports/at-risk-members)
+    def _score_report(self, df, now_ts, has_visit, days, visit_text):
+        recorded = _present(df["last_visit_date"])
+        unparseable = recorded & ~has_visit
+        never = ~recorded
+        over_30 = has_visit & (days > 30)
+        over_14 = has_visit & (days > 14) & ~over_30
+        over_7 = has_visit & (days > 7) & ~over_30 & ~over_14
+        unpaid = df["unpaid_invoices"]
+        failed = df["failed_invoices"]
+        days_member = _days(now_ts - df["join_dt"])
+        has_join = df["join_dt"].notna()
+        new_member = has_join & (days_member < 30)
+        recent_member = has_join & (days_member >= 30) & (days_member < 90)
+
+        df["report_score"] = (
+            np.where(over_30, 40, 0)
+            + np.where(over_14, 20, 0)
+            + np.where(over_7, 10, 0)
+            + np.where(never | unparseable, 30, 0)
+            + np.where(unpaid > 2, 30, np.where(unpaid > 0, 15, 0))
+            + np.where(new_member, 15, 0)
+            + np.where(recent_member, 5, 0)
+            + np.where(failed > 1, 15, np.where(failed > 0, 7, 0))
+        )
+        df["report_reason_1"] = _reason(over_30, "No visit in " + visit_text + " days")
+        df["report_reason_2"] = _reason(over_14, "Last visit " + visit_text + " days ago")
+        df["report_reason_3"] = _reason(unparseable, "Last visit date unavailable")
+        df["report_reason_4"] = _reason(never, "Never visited")
+        df["report_reason_5"] = _reason(unpaid > 2, _text(unpaid) + " unpaid invoices")
+        df["report_reason_6"] = _reason((unpaid > 0) & (unpaid <= 2), _text(unpaid) + " unpaid invoice(s)")
+        df["report_reason_7"] = _reason(new_member, "New member (< 30 days)")
+        df["report_reason_8"] = _reason(failed > 1, _text(failed) + " failed payments")
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    async def churn_prediction(self, skip: int = 0, limit: Optional[int] = None, force_refresh: bool = False) -> dict:
+        df = await self.scored_table(force_refresh)
+        at_risk = _ranked(df[df["churn_level"].notna()], "churn_score")
+        factor_counts = sorted(
+            ((k, v) for k, v in df.attrs.get("churn_factor_counts", {}).items() if v > 0),
+            key=lambda x: x[1], reverse=True
+        )
+        levels = at_risk["churn_level"].value_counts()
+        total = len(df)
+
+        return {
+            "summary": {
+                "total_members_analyzed": total,
+                "at_risk_count": len(at_risk),
+                "risk_percentage": round(len(at_risk) / total * 100, 1) if total > 0 else 0,
+                "by_risk_level": {
+                    "critical": int(levels.get("Critical", 0)),
+                    "high": int(levels.get("High", 0)),
+                    "medium": int(levels.get("Medium", 0))
+                }
+            },
+            "at_risk_members": [
+                {
+                    "member_id": _value(row["id"]),
+                    "member_name": row["member_name"],
+                    "email": _value(row["email"]),
+                    "phone": _value(row["phone"]),
+                    "membership_type": _value(row["membership_type"]),
+                    "membership_status": _value(row["membership_status"]),
+                    "risk_score": int(row["churn_score"]),
+                    "risk_level": row["churn_level"],
+                    "risk_reasons": _reasons(row, "churn_reason_"),
+                    "last_visit": _value(row["last_visit_date"])
+                }
+                for _, row in _page(at_risk, skip, limit).iterrows()
+            ],
+            "common_risk_factors": [{"factor": k, "count": v} for k, v in factor_counts],
+            "scored_at": self._scored_at.isoformat() if self._scored_at else None
+        }
+
+    async def retention_at_risk(self, skip: int = 0, limit: Optional[int] = None, force_refresh: bool = False) -> dict:
+        df = await self.scored_table(force_refresh)
+        at_risk = _ranked(df[df["retention_level"].notna()], "retention_score")
+        levels = at_risk["retention_level"].value_counts()
+
+        return {
+            "total": len(at_risk),
+            "critical": int(levels.get("critical", 0)),
+            "high": int(levels.get("high", 0)),
+            "medium": int(levels.get("medium", 0)),
+            "members": [
+                {
+                    "id": _value(row["id"]),
+                    "first_name": _value(row["first_name"]),
+                    "last_name": _value(row["last_name"]),
+                    "full_name": row["member_name"],
+                    "email": _value(row["email"]),
+                    "phone": _value(row["phone"]),
+                    "last_visit_date": _value(row["last_visit_date"]),
+                    "days_since_visit": None if pd.isna(row["days_since_visit"]) else int(row["days_since_visit"]),
+                    "membership_type": _value(row["membership_type"]),
+                    "is_debtor": bool(row["is_debtor"]),
+                    "risk_score": int(row["retention_score"]),
+                    "risk_level": row["retention_level"],
+                    "risk_factors": _reasons(row, "retention_reason_"),
+                    "expiry_date": _value(row["expiry_date"])
+                }
+                for _, row in _page(at_risk, skip, limit).iterrows()
+            ]
+        }
+
+    async def report_at_risk(self, risk_threshold: int = 60, skip: int = 0, limit: Optional[int] = None, force_refresh: bool = False) -> dict:
+        df = await self.scored_table(force_refresh)
+        at_risk = _ranked(
+            df[(df["membership_status"] == "active") & (df["report_score"] >= risk_threshold)],
+            "report_score"
+        )
+        scores = at_risk["report_score"]
+
+        return {
+            "summary": {
+                "total_at_risk": len(at_risk),
+                "critical_risk": int((scores >= 80).sum()),
+                "high_risk": int(((scores >= 60) & (scores < 80)).sum()),
+                "medium_risk": int(((scores >= 40) & (scores < 60)).sum()),
+                "risk_threshold": risk_threshold
+            },
+            "at_risk_members": [
+                {
+                    "member_id": _value(row["id"]),
+                    "member_name": _value(row["full_name"]) or row["member_name"] or "Unknown",
+                    "email": _value(row["email"]),
+                    "phone": _value(row["phone"]),
+                    "join_date": _value(row["join_date"]),
+                    "last_visit": _value(row["last_visit_date"]),
+                    "membership_type": _value(row["membership_type"]),
+                    "risk_score": int(row["report_score"]),
+                    "risk_level": "critical" if row["report_score"] >= 80 else "high" if row["report_score"] >= 60 else "medium",
+                    "risk_factors": _reasons(row, "report_reason_"),
+                    "unpaid_invoices": int(row["unpaid_invoices"])
+                }
+                for _, row in _page(at_risk, skip, limit).iterrows()
+            ]
+        }
+
+
+def _ranked(df: pd.DataFrame, score_column: str) -> pd.DataFrame:
+    # Stable sort keeps member order for equal scores, like list.sort() did
+    return df.sort_values(score_column, ascending=False, kind="stable")
+
+
+def _page(df: pd.DataFrame, skip: int, limit: Optional[int]) -> pd.DataFrame:
+    return df.iloc[skip:skip + limit] if limit is not None else df.iloc[skip:]
+
+
+def _reasons(row: pd.Series, prefix: str) -> List[str]:
+    """Collect the non-empty reason columns of one scored row"""
+    return [row[c] for c in row.index if c.startswith(prefix) and row[c] is not None]
+
+
+def _value(v):
+    """Convert pandas/numpy scalars and missing values back to plain JSON types"""
+    if v is None or v is pd.NA or v is pd.NaT:
+        return None
+    if isinstance(v, float) and np.isnan(v):
+        return None
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
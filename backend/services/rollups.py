@@ -0,0 +1,427 @@
+"""
+Daily Rollup Service
+Maintains pre-aggregated per-day fact tables so analytics and reports read a
+few kilobytes instead of scanning members, invoices and access logs:
+
+- rollup_revenue_daily:    payments by membership type, payment method and member source
+- rollup_checkins_daily:   access attempts by hour, location and status
+- rollup_membership_daily: joins and cancellations by membership type and member source
+- rollup_pos_daily:        POS sales by product category (or payment type)
+
+Write paths call the record_* methods (a single upsert with $inc each, or
+one bulk_write for the batch forms). Payments carry the membership type and
+member source they were counted under (payment_dimensions), so rebuild()
+groups them the same way the increments did.
+
+rebuild() recomputes every table from the source collections. ensure_built()
+runs it on startup when the tables were never built for ROLLUP_VERSION; bump
+the version when a rollup definition changes.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+REVENUE_ROLLUP = "rollup_revenue_daily"
+CHECKIN_ROLLUP = "rollup_checkins_daily"
+MEMBERSHIP_ROLLUP = "rollup_membership_daily"
+POS_ROLLUP = "rollup_pos_daily"
+
+UNKNOWN = "Unknown"
+
+ROLLUP_VERSION = 1
+
+
+def _to_datetime(value: Union[str, datetime, None]) -> datetime:
+    if value is None:
+        return datetime.now(timezone.utc)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+
+def _day_expr(field: str) -> dict:
+    """YYYY-MM-DD of a field stored either as an ISO string or a BSON date"""
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "date"]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": f"${field}"}},
+        {"$substrBytes": [f"${field}", 0, 10]}
+    ]}
+
+
+def _hour_expr(field: str) -> dict:
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "date"]},
+        {"$hour": f"${field}"},
+        {"$toInt": {"$substrBytes": [f"${field}", 11, 2]}}
+    ]}
+
+
+def payment_dimensions(member: Optional[dict]) -> dict:
+    """Fields stored on a payment so increments and rebuild() count it under the same member type and source"""
+    member = member or {}
+    return {
+        "membership_type_id": member.get("membership_type_id") or UNKNOWN,
+        "member_source": member.get("source") or UNKNOWN
+    }
+
+
+def _lookup_one(collection: str, local_field: str, fields: List[str], as_field: str) -> dict:
+    """$lookup by business id projecting only the fields we need"""
+    return {"$lookup": {
+        "from": collection,
+        "let": {"ref_id": f"${local_field}"},
+        "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$id", "$$ref_id"]}}},
+            {"$project": {"_id": 0, **{f: 1 for f in fields}}}
+        ],
+        "as": as_field
+    }}
+
+
+class RollupService:
+    """Incremental and batch maintenance of the daily rollup collections"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def _increment(self, collection: str, key: dict, inc: dict):
+        """Upsert a rollup row; never raises into the calling write path"""
+        try:
+            try:
+                await self.db[collection].update_one(key, {"$inc": inc}, upsert=True)
+            except DuplicateKeyError:
+                # Two concurrent upserts created the same row; the retry hits the existing one
+                await self.db[collection].update_one(key, {"$inc": inc}, upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to update {collection} for {key}: {str(e)}")
+
+    async def _increment_many(self, collection: str, rows: Iterable[Tuple[dict, dict]]):
+        """Batch form of _increment: rows with the same key are summed into one upsert"""
+        merged: Dict[tuple, Tuple[dict, dict]] = {}
+        for key, inc in rows:
+            row_key = tuple(sorted(key.items()))
+            if row_key in merged:
+                totals = merged[row_key][1]
+                for field, value in inc.items():
+                    totals[field] = totals.get(field, 0) + value
+            else:
+                merged[row_key] = (key, dict(inc))
+        ops = [UpdateOne(key, {"$inc": inc}, upsert=True) for key, inc in merged.values()]
+        if not ops:
+            return
+        try:
+            try:
+                await self.db[collection].bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Rows lost a concurrent upsert race; every other op was applied
+                errors = e.details.get("writeErrors", [])
+                if any(err.get("code") != 11000 for err in errors):
+                    raise
+                await self.db[collection].bulk_write([ops[err["index"]] for err in errors], ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to update {collection} for {len(ops)} rows: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # Incremental updates (called from write paths)
+    # ------------------------------------------------------------------
+
+    async def record_payment(
+        self,
+        amount: float,
+        paid_at: Union[str, datetime, None],
+        membership_type_id: Optional[str],
+        payment_method: Optional[str],
+        payment_source: Optional[str]
+    ):
+        await self._increment(REVENUE_ROLLUP, {
+            "date": _to_datetime(paid_at).strftime("%Y-%m-%d"),
+            "membership_type_id": membership_type_id or UNKNOWN,
+            "payment_method": payment_method or UNKNOWN,
+            "payment_source": payment_source or UNKNOWN
+        }, {"amount": amount or 0, "payments": 1})
+
+    async def record_payments(self, payments: List[dict]):
+        """Batch form of record_payment for payment documents carrying payment_dimensions"""
+        await self._increment_many(REVENUE_ROLLUP, (
+            ({
+                "date": _to_datetime(payment.get("payment_date")).strftime("%Y-%m-%d"),
+                "membership_type_id": payment.get("membership_type_id") or UNKNOWN,
+                "payment_method": payment.get("payment_method") or UNKNOWN,
+                "payment_source": payment.get("member_source") or UNKNOWN
+            }, {"amount": payment.get("amount") or 0, "payments": 1})
+            for payment in payments
+        ))
+
+    async def record_checkin(self, timestamp: Union[str, datetime, None], location: Optional[str], status: str):
+        ts = _to_datetime(timestamp)
+        await self._increment(CHECKIN_ROLLUP, {
+            "date": ts.strftime("%Y-%m-%d"),
+            "hour": ts.hour,
+            "location": location or UNKNOWN,
+            "status": status
+        }, {"count": 1})
+
+    async def record_checkins(self, checkins: List[tuple]):
+        """Batch form of record_checkin: [(timestamp, location, status)], one upsert per distinct row"""
+        counts: Dict[tuple, int] = {}
+        for timestamp, location, status in checkins:
+            ts = _to_datetime(timestamp)
+            key = (ts.strftime("%Y-%m-%d"), ts.hour, location or UNKNOWN, status)
+            counts[key] = counts.get(key, 0) + 1
+        for (day, hour, location, status), count in counts.items():
+            await self._increment(CHECKIN_ROLLUP, {
+                "date": day,
+                "hour": hour,
+                "location": location,
+                "status": status
+            }, {"count": count})
+
+    async def record_membership_event(
+        self,
+        event: str,
+        at: Union[str, datetime, None],
+        membership_type_id: Optional[str],
+        source: Optional[str]
+    ):
+        """event is "joins" or "cancellations" """
+        await self._increment(MEMBERSHIP_ROLLUP, {
+            "date": _to_datetime(at).strftime("%Y-%m-%d"),
+            "membership_type_id": membership_type_id or UNKNOWN,
+            "source": source or UNKNOWN
+        }, {event: 1})
+
+    async def record_membership_events(self, event: str, events: List[tuple]):
+        """Batch form of record_membership_event: [(at, membership_type_id, source)]"""
+        await self._increment_many(MEMBERSHIP_ROLLUP, (
+            ({
+                "date": _to_datetime(at).strftime("%Y-%m-%d"),
+                "membership_type_id": membership_type_id or UNKNOWN,
+                "source": source or UNKNOWN
+            }, {event: 1})
+            for at, membership_type_id, source in events
+        ))
+
+    async def record_pos_sale(self, transaction_date: Union[str, datetime, None], lines: List[dict], sign: int = 1):
+        """
+        lines: [{"category": str, "amount": float, "quantity": int}]
+        sign=-1 reverses a voided transaction.
+        """
+        day = _to_datetime(transaction_date).strftime("%Y-%m-%d")
+        for line in lines:
+            await self._increment(POS_ROLLUP, {
+                "date": day,
+                "category": line.get("category") or UNKNOWN
+            }, {
+                "amount": sign * (line.get("amount") or 0),
+                "quantity": sign * (line.get("quantity") or 0),
+                "items": sign
+            })
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    async def rows(self, collection: str, start_date: str, end_date: str, filters: Optional[dict] = None) -> List[dict]:
+        """Rollup rows with start_date <= date <= end_date (YYYY-MM-DD)"""
+        query = {"date": {"$gte": start_date, "$lte": end_date}, **(filters or {})}
+        return await self.db[collection].find(query, {"_id": 0}).to_list(None)
+
+    async def totals(
+        self,
+        collection: str,
+        fields: List[str],
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        filters: Optional[dict] = None
+    ) -> Dict[str, float]:
+        """Sum of each field over the rollup rows in [start_date, end_date]; open-ended when a bound is None"""
+        query = dict(filters or {})
+        bounds = {}
+        if start_date:
+            bounds["$gte"] = start_date
+        if end_date:
+            bounds["$lte"] = end_date
+        if bounds:
+            query["date"] = bounds
+        rows = await self.db[collection].aggregate([
+            {"$match": query},
+            {"$group": {"_id": None, **{field: {"$sum": f"${field}"} for field in fields}}}
+        ]).to_list(1)
+        return {field: rows[0][field] if rows else 0 for field in fields}
+
+    # ------------------------------------------------------------------
+    # Backfill
+    # ------------------------------------------------------------------
+
+    async def rebuild(self) -> Dict[str, int]:
+        """
+        Recompute every rollup from the source collections with server-side
+        $group + $out. $out swaps the collection atomically and keeps its
+        indexes; increments written while a rebuild runs are overwritten, so
+        run it off-peak.
+        """
+        await self._rebuild_revenue()
+        await self._rebuild_checkins()
+        await self._rebuild_membership()
+        await self._rebuild_pos()
+
+        counts = {}
+        for collection in (REVENUE_ROLLUP, CHECKIN_ROLLUP, MEMBERSHIP_ROLLUP, POS_ROLLUP):
+            counts[collection] = await self.db[collection].count_documents({})
+        await self.db.rollup_meta.update_one(
+            {"key": "rollups"},
+            {"$set": {"version": ROLLUP_VERSION, "built_at": datetime.now(timezone.utc).isoformat(), "counts": counts}},
+            upsert=True
+        )
+        return counts
+
+    async def ensure_built(self) -> Optional[Dict[str, int]]:
+        """Rebuild when the rollups were never built for ROLLUP_VERSION; None if they were"""
+        meta = await self.db.rollup_meta.find_one({"key": "rollups"}, {"_id": 0, "version": 1})
+        if meta and meta.get("version") == ROLLUP_VERSION:
+            return None
+        return await self.rebuild()
+
+    async def _rebuild_revenue(self):
+        pipeline = [
+            {"$match": {"payment_date": {"$ne": None}}},
+            _lookup_one("members", "member_id", ["membership_type_id", "source"], "member"),
+            {"$group": {
+                "_id": {
+                    "date": _day_expr("payment_date"),
+                    # Dimensions stamped on the payment when it was counted, else the member's current ones
+                    "membership_type_id": {"$ifNull": [
+                        "$membership_type_id",
+                        {"$ifNull": [{"$arrayElemAt": ["$member.membership_type_id", 0]}, UNKNOWN]}
+                    ]},
+                    "payment_method": {"$ifNull": ["$payment_method", UNKNOWN]},
+                    "payment_source": {"$ifNull": [
+                        "$member_source",
+                        {"$ifNull": [{"$arrayElemAt": ["$member.source", 0]}, UNKNOWN]}
+                    ]}
+                },
+                "amount": {"$sum": "$amount"},
+                "payments": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "date": "$_id.date",
+                "membership_type_id": "$_id.membership_type_id",
+                "payment_method": "$_id.payment_method",
+                "payment_source": "$_id.payment_source",
+                "amount": 1,
+                "payments": 1
+            }},
+            {"$out": REVENUE_ROLLUP}
+        ]
+        await self.db.payments.aggregate(pipeline).to_list(None)
+
+    async def _rebuild_checkins(self):
+        pipeline = [
+            {"$match": {"timestamp": {"$ne": None}}},
+            {"$group": {
+                "_id": {
+                    "date": _day_expr("timestamp"),
+                    "hour": _hour_expr("timestamp"),
+                    "location": {"$ifNull": ["$location", UNKNOWN]},
+                    "status": "$status"
+                },
+                "count": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "date": "$_id.date",
+                "hour": "$_id.hour",
+                "location": "$_id.location",
+                "status": "$_id.status",
+                "count": 1
+            }},
+            {"$out": CHECKIN_ROLLUP}
+        ]
+        await self.db.access_logs.aggregate(pipeline).to_list(None)
+
+    async def _rebuild_membership(self):
+        pipeline = [
+            {"$match": {"is_prospect": {"$ne": True}}},
+            {"$project": {
+                "membership_type_id": {"$ifNull": ["$membership_type_id", UNKNOWN]},
+                "source": {"$ifNull": ["$source", UNKNOWN]},
+                "events": {"$concatArrays": [
+                    {"$cond": [
+                        {"$ifNull": ["$join_date", False]},
+                        [{"kind": "joins", "date": _day_expr("join_date")}],
+                        []
+                    ]},
+                    {"$cond": [
+                        {"$and": [
+                            {"$eq": ["$membership_status", "cancelled"]},
+                            {"$ifNull": ["$cancellation_date", False]}
+                        ]},
+                        [{"kind": "cancellations", "date": _day_expr("cancellation_date")}],
+                        []
+                    ]}
+                ]}
+            }},
+            {"$unwind": "$events"},
+            {"$group": {
+                "_id": {
+                    "date": "$events.date",
+                    "membership_type_id": "$membership_type_id",
+                    "source": "$source"
+                },
+                "joins": {"$sum": {"$cond": [{"$eq": ["$events.kind", "joins"]}, 1, 0]}},
+                "cancellations": {"$sum": {"$cond": [{"$eq": ["$events.kind", "cancellations"]}, 1, 0]}}
+            }},
+            {"$project": {
+                "_id": 0,
+                "date": "$_id.date",
+                "membership_type_id": "$_id.membership_type_id",
+                "source": "$_id.source",
+                "joins": 1,
+                "cancellations": 1
+            }},
+            {"$out": MEMBERSHIP_ROLLUP}
+        ]
+        await self.db.members.aggregate(pipeline).to_list(None)
+
+    async def _rebuild_pos(self):
+        pipeline = [
+            {"$match": {"status": "completed"}},
+            {"$project": {
+                "date": _day_expr("transaction_date"),
+                "lines": {"$cond": [
+                    {"$eq": ["$transaction_type", "product_sale"]},
+                    "$items",
+                    [{"category": "$transaction_type", "total": "$total_amount", "quantity": 1}]
+                ]}
+            }},
+            {"$unwind": "$lines"},
+            _lookup_one("products", "lines.product_id", ["category_name"], "product"),
+            {"$group": {
+                "_id": {
+                    "date": "$date",
+                    "category": {"$ifNull": [
+                        "$lines.category",
+                        {"$ifNull": [{"$arrayElemAt": ["$product.category_name", 0]}, UNKNOWN]}
+                    ]}
+                },
+                "amount": {"$sum": "$lines.total"},
+                "quantity": {"$sum": "$lines.quantity"},
+                "items": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "date": "$_id.date",
+                "category": "$_id.category",
+                "amount": 1,
+                "quantity": 1,
+                "items": 1
+            }},
+            {"$out": POS_ROLLUP}
+        ]
+        await self.db.pos_transactions.aggregate(pipeline).to_list(None)
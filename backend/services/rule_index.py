@@ -0,0 +1,187 @@
+"""
+Rule Index
+In-memory index of enabled automations (by trigger type), active workflow
+rules (by trigger object + event) and active notification templates (by id).
+
+Conditions are compiled once into predicate functions and message templates
+are parsed once, so matching an event is a dict lookup plus a few function
+calls instead of a query and a dict walk. The index is reloaded when the
+rules change (invalidate() from the create/update/delete/toggle endpoints)
+and at most ttl_seconds after a change made by another process.
+"""
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Predicate = Callable[[dict], bool]
+
+_formatter = Formatter()
+
+
+def _operator_check(field: str, operator: str, value: Any) -> Predicate:
+    # Same semantics as the original dict walk: comparisons need a truthy actual value
+    if operator == "==":
+        return lambda data: data.get(field) == value
+    if operator == ">":
+        return lambda data: bool(data.get(field)) and data.get(field) > value
+    if operator == ">=":
+        return lambda data: bool(data.get(field)) and data.get(field) >= value
+    if operator == "<":
+        return lambda data: bool(data.get(field)) and data.get(field) < value
+    if operator == "<=":
+        return lambda data: bool(data.get(field)) and data.get(field) <= value
+    if operator == "contains":
+        return lambda data: bool(data.get(field)) and value in str(data.get(field))
+    # Unknown operators never excluded an event
+    return lambda data: True
+
+
+def compile_conditions(conditions: Optional[dict]) -> Predicate:
+    """
+    Compile automation conditions into a predicate over trigger data.
+
+    {"field": value} is an equality check; {"field": {"operator": ">=", "value": 100}}
+    supports ==, >, >=, <, <= and contains. All conditions must hold.
+    """
+    checks = []
+    for field, expected in (conditions or {}).items():
+        if isinstance(expected, dict):
+            checks.append(_operator_check(field, expected.get("operator", "=="), expected.get("value")))
+        else:
+            checks.append(lambda data, field=field, expected=expected: data.get(field) == expected)
+
+    if not checks:
+        return lambda data: True
+    if len(checks) == 1:
+        return checks[0]
+
+    def predicate(data: dict) -> bool:
+        for check in checks:
+            if not check(data):
+                return False
+        return True
+    return predicate
+
+
+def compile_equality(conditions: Optional[dict]) -> Predicate:
+    """Workflow rule conditions: every field must equal its value"""
+    expected = list((conditions or {}).items())
+    return lambda data: all(data.get(field) == value for field, value in expected)
+
+
+class CompiledTemplate:
+    """A str.format template parsed once; render() behaves like text.format(**data)"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self._parts: Optional[List[Tuple[str, Optional[str], str, Optional[str]]]] = None
+        try:
+            parts = list(_formatter.parse(text))
+            # Nested replacement fields in a format spec are left to str.format
+            if not any(spec and "{" in spec for _, _, spec, _ in parts):
+                self._parts = parts
+        except ValueError:
+            pass
+
+    def render(self, data: dict) -> str:
+        if self._parts is None:
+            return self.text.format(**data)
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is not None:
+                value, _ = _formatter.get_field(field, (), data)
+                if conversion:
+                    value = _formatter.convert_field(value, conversion)
+                out.append(format(value, spec or ""))
+        return "".join(out)
+
+
+@lru_cache(maxsize=2048)
+def compiled_template(text: str) -> CompiledTemplate:
+    return CompiledTemplate(text)
+
+
+class RuleIndex:
+    """Cached, compiled automations, workflow rules and notification templates"""
+
+    def __init__(self, db, ttl_seconds: int = 60):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self._automations: Optional[Dict[str, List[Tuple[dict, Predicate]]]] = None
+        self._workflows: Optional[Dict[Tuple[str, str], List[Tuple[dict, Predicate]]]] = None
+        self._templates: Optional[Dict[str, dict]] = None
+        self._expires: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, kind: Optional[str] = None):
+        """Drop "automations", "workflows" or "templates" (all when kind is None)"""
+        if kind in (None, "automations"):
+            self._automations = None
+        if kind in (None, "workflows"):
+            self._workflows = None
+        if kind in (None, "templates"):
+            self._templates = None
+
+    def _fresh(self, kind: str, value) -> bool:
+        return value is not None and self._expires.get(kind, 0) > time.monotonic()
+
+    async def _load_automations(self):
+        async with self._lock:
+            if self._fresh("automations", self._automations):
+                return self._automations
+            docs = await self.db.automations.find(
+                {"enabled": True, "test_mode": {"$ne": True}}, {"_id": 0}
+            ).to_list(None)
+            index: Dict[str, List[Tuple[dict, Predicate]]] = {}
+            for doc in docs:
+                index.setdefault(doc.get("trigger_type"), []).append((doc, compile_conditions(doc.get("conditions"))))
+            self._automations = index
+            self._expires["automations"] = time.monotonic() + self.ttl_seconds
+            return index
+
+    async def _load_workflows(self):
+        async with self._lock:
+            if self._fresh("workflows", self._workflows):
+                return self._workflows
+            docs = await self.db.workflow_rules.find({"is_active": True}, {"_id": 0}).to_list(None)
+            index: Dict[Tuple[str, str], List[Tuple[dict, Predicate]]] = {}
+            for doc in docs:
+                index.setdefault((doc.get("trigger_object"), doc.get("trigger_event")), []).append(
+                    (doc, compile_equality(doc.get("conditions")))
+                )
+            self._workflows = index
+            self._expires["workflows"] = time.monotonic() + self.ttl_seconds
+            return index
+
+    async def _load_templates(self):
+        async with self._lock:
+            if self._fresh("templates", self._templates):
+                return self._templates
+            docs = await self.db.notification_templates.find({"is_active": True}, {"_id": 0}).to_list(None)
+            self._templates = {doc["id"]: doc for doc in docs if doc.get("id")}
+            self._expires["templates"] = time.monotonic() + self.ttl_seconds
+            return self._templates
+
+    async def automations(self, trigger_type: str) -> List[Tuple[dict, Predicate]]:
+        """Enabled, non-test automations for a trigger type with their compiled conditions"""
+        index = self._automations if self._fresh("automations", self._automations) else await self._load_automations()
+        return index.get(trigger_type, [])
+
+    async def match_automations(self, trigger_type: str, trigger_data: dict) -> List[dict]:
+        return [automation for automation, predicate in await self.automations(trigger_type) if predicate(trigger_data)]
+
+    async def workflows(self, trigger_object: str, trigger_event: str) -> List[Tuple[dict, Predicate]]:
+        """Active workflow rules for an object/event with their compiled conditions"""
+        index = self._workflows if self._fresh("workflows", self._workflows) else await self._load_workflows()
+        return index.get((trigger_object, trigger_event), [])
+
+    async def template(self, template_id: str) -> Optional[dict]:
+        """An active notification template, or None"""
+        templates = self._templates if self._fresh("templates", self._templates) else await self._load_templates()
+        return templates.get(template_id)
@@ -0,0 +1,189 @@
+"""
+Sales Performance Aggregates
+Per-consultant / per-salesperson totals for the commission dashboard and the
+commission and salesperson-performance reports. Each figure is one grouped
+query over the whole period, keyed by consultant or user id, instead of a
+query per person; membership prices come from the reference cache.
+
+All date bounds are ISO strings, matching how join_date, sale_date,
+created_at and updated_at are stored.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_period_date(value: str) -> datetime:
+    """Parse an ISO date or datetime; date-only and naive values are taken as UTC"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def comparison_periods(
+    start_date: str,
+    end_date: Optional[str],
+    now: datetime
+) -> Tuple[datetime, Optional[datetime], datetime, datetime]:
+    """
+    (current_start, current_end, previous_start, previous_end) for a period
+    from start_date to end_date (default now) and the equally long period
+    before it. Raises ValueError for a malformed date.
+    """
+    current_start = parse_period_date(start_date)
+    current_end = parse_period_date(end_date) if end_date else now
+    return current_start, current_end, current_start - (current_end - current_start), current_start
+
+
+def _date_range(field: str, start: str, end: Optional[str], inclusive_end: bool = False) -> dict:
+    bounds = {"$gte": start}
+    if end:
+        bounds["$lte" if inclusive_end else "$lt"] = end
+    return {field: bounds}
+
+
+def _count_if(condition: dict) -> dict:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+
+def _sum_if(condition: dict, field: str) -> dict:
+    return {"$sum": {"$cond": [condition, {"$ifNull": [f"${field}", 0]}, 0]}}
+
+
+class SalesPerformance:
+    """Grouped sales, revenue and commission figures"""
+
+    def __init__(self, db, reference_cache):
+        self.db = db
+        self.reference_cache = reference_cache
+
+    async def membership_sales(
+        self,
+        start: str,
+        end: Optional[str] = None,
+        consultant_ids: Optional[List[str]] = None
+    ) -> Dict[str, dict]:
+        """
+        {consultant_id: {"sales_count", "revenue"}} for members who joined in
+        [start, end). Revenue is the membership type price of each sale.
+        """
+        match = {**_date_range("join_date", start, end), "sales_consultant_id": {"$ne": None}}
+        if consultant_ids is not None:
+            match["sales_consultant_id"] = {"$in": consultant_ids}
+
+        groups, prices = await asyncio.gather(
+            self.db.members.aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": {"consultant": "$sales_consultant_id", "type": "$membership_type_id"},
+                    "count": {"$sum": 1}
+                }}
+            ]).to_list(None),
+            self.reference_cache.table("membership_types")
+        )
+
+        totals = defaultdict(lambda: {"sales_count": 0, "revenue": 0.0})
+        for group in groups:
+            entry = totals[group["_id"]["consultant"]]
+            entry["sales_count"] += group["count"]
+            membership_type = prices.get(group["_id"].get("type"))
+            if membership_type:
+                entry["revenue"] += (membership_type.get("price") or 0) * group["count"]
+        return dict(totals)
+
+    async def commission_totals(
+        self,
+        start: str,
+        end: Optional[str] = None,
+        consultant_ids: Optional[List[str]] = None
+    ) -> Dict[str, float]:
+        """{consultant_id: sum of commission_amount} for sales in [start, end)"""
+        match = _date_range("sale_date", start, end)
+        if consultant_ids is not None:
+            match["consultant_id"] = {"$in": consultant_ids}
+        groups = await self.db.commissions.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$consultant_id", "total": {"$sum": "$commission_amount"}}}
+        ]).to_list(None)
+        return {g["_id"]: g["total"] for g in groups}
+
+    async def conversions(self, user_ids: List[str], start: str, end: str) -> Dict[str, dict]:
+        """
+        {user_id: {"leads_converted", "opportunities_won", "won_value"}} for
+        leads converted and opportunities closed/won (by updated_at) in [start, end].
+        """
+        leads, opportunities = await asyncio.gather(
+            self.db.leads.aggregate([
+                {"$match": {
+                    "assigned_to": {"$in": user_ids},
+                    "status": "converted",
+                    **_date_range("updated_at", start, end, inclusive_end=True)
+                }},
+                {"$group": {"_id": "$assigned_to", "count": {"$sum": 1}}}
+            ]).to_list(None),
+            self.db.opportunities.aggregate([
+                {"$match": {
+                    "assigned_to": {"$in": user_ids},
+                    "status": "closed_won",
+                    **_date_range("updated_at", start, end, inclusive_end=True)
+                }},
+                {"$group": {"_id": "$assigned_to", "count": {"$sum": 1}, "value": {"$sum": {"$ifNull": ["$value", 0]}}}}
+            ]).to_list(None)
+        )
+
+        results = defaultdict(lambda: {"leads_converted": 0, "opportunities_won": 0, "won_value": 0.0})
+        for g in leads:
+            results[g["_id"]]["leads_converted"] = g["count"]
+        for g in opportunities:
+            results[g["_id"]]["opportunities_won"] = g["count"]
+            results[g["_id"]]["won_value"] = g["value"]
+        return dict(results)
+
+    async def pipeline_activity(self, user_ids: List[str], start: str, end: str) -> Dict[str, dict]:
+        """
+        {user_id: lead and opportunity counts by status/stage plus won and open
+        pipeline value} for records created in [start, end].
+        """
+        created = _date_range("created_at", start, end, inclusive_end=True)
+        is_won = {"$eq": ["$stage", "closed_won"]}
+        is_lost = {"$eq": ["$stage", "closed_lost"]}
+        is_open = {"$not": [{"$in": ["$stage", ["closed_won", "closed_lost"]]}]}
+
+        leads, opportunities = await asyncio.gather(
+            self.db.leads.aggregate([
+                {"$match": {"assigned_to": {"$in": user_ids}, **created}},
+                {"$group": {
+                    "_id": "$assigned_to",
+                    "total_leads": {"$sum": 1},
+                    "qualified_leads": _count_if({"$eq": ["$status", "qualified"]}),
+                    "converted_leads": _count_if({"$eq": ["$status", "converted"]})
+                }}
+            ]).to_list(None),
+            self.db.opportunities.aggregate([
+                {"$match": {"assigned_to": {"$in": user_ids}, **created}},
+                {"$group": {
+                    "_id": "$assigned_to",
+                    "total_opportunities": {"$sum": 1},
+                    "won_opportunities": _count_if(is_won),
+                    "lost_opportunities": _count_if(is_lost),
+                    "open_opportunities": _count_if(is_open),
+                    "won_revenue": _sum_if(is_won, "value"),
+                    "pipeline_value": _sum_if(is_open, "value")
+                }}
+            ]).to_list(None)
+        )
+
+        empty = {
+            "total_leads": 0, "qualified_leads": 0, "converted_leads": 0,
+            "total_opportunities": 0, "won_opportunities": 0, "lost_opportunities": 0,
+            "open_opportunities": 0, "won_revenue": 0.0, "pipeline_value": 0.0,
+        }
+        results = defaultdict(lambda: dict(empty))
+        for g in leads + opportunities:
+            results[g.pop("_id")].update(g)
+        return dict(results)
@@ -10,13 +10,159 @@ Based on: TI Host to Host User Manual CLIENT
 import os
 import uuid
 import json
-from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 import xml.etree.ElementTree as ET
 import csv
 from io import StringIO
 
 
+def _parse_due_date(value) -> Optional[datetime]:
+    """Invoice due date as a naive UTC datetime (ISO string or datetime)"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class InvoiceMatchIndex:
+    """
+    Indexes over outstanding invoices for matching bank credits, built once
+    per reconciliation run:
+    
+    - invoice ids and member ids in hash maps, looked up with every window
+      of the transaction reference of an indexed id length (the same
+      "id appears in the reference" test as a substring scan),
+    - invoices bucketed by amount in cents, buckets sorted by amount, each
+      bucket sorted by due date (parsed once) for the +/- 3 day window.
+    
+    Every invoice can be consumed once, so two transactions never match the
+    same invoice.
+    """
+    
+    AMOUNT_TOLERANCE = 0.01
+    DATE_WINDOW_DAYS = 3
+    
+    def __init__(self, invoices: List[Dict]):
+        self.invoices = []
+        self.consumed: List[bool] = []
+        self.by_invoice_id: Dict[str, int] = {}
+        self.by_member_id: Dict[str, List[int]] = {}
+        self.id_lengths = set()
+        buckets: Dict[int, List[int]] = {}
+        self.due: List[datetime] = []
+        
+        for invoice in invoices:
+            amount = invoice.get("amount") or 0
+            if amount <= 0:
+                continue  # Cannot be matched on amount
+            i = len(self.invoices)
+            self.invoices.append(invoice)
+            self.consumed.append(False)
+            self.due.append(_parse_due_date(invoice.get("due_date")) or datetime.max)
+            
+            invoice_id = str(invoice.get("id") or "").upper()
+            if invoice_id:
+                self.by_invoice_id.setdefault(invoice_id, i)
+                self.id_lengths.add(len(invoice_id))
+            member_id = str(invoice.get("member_id") or "").upper()
+            if member_id:
+                self.by_member_id.setdefault(member_id, []).append(i)
+                self.id_lengths.add(len(member_id))
+            buckets.setdefault(round(amount * 100), []).append(i)
+        
+        # Oldest due first within every amount bucket / member
+        for members in self.by_member_id.values():
+            members.sort(key=lambda i: self.due[i])
+        self.amounts = sorted(buckets)
+        self.buckets = [sorted(buckets[cents], key=lambda i: self.due[i]) for cents in self.amounts]
+        self.bucket_dues = [[self.due[i] for i in bucket] for bucket in self.buckets]
+        self.position = {}
+        for b, bucket in enumerate(self.buckets):
+            for pos, i in enumerate(bucket):
+                self.position[i] = (b, pos)
+        # Skip pointers past consumed invoices (union-find with path halving):
+        # after[b][pos] leads to the first unconsumed position >= pos (len = none),
+        # before[b][pos + 1] to the last unconsumed position <= pos, plus one (0 = none)
+        self.after = [list(range(len(bucket) + 1)) for bucket in self.buckets]
+        self.before = [list(range(len(bucket) + 1)) for bucket in self.buckets]
+    
+    @staticmethod
+    def _find(parent: List[int], x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    
+    def _amount_matches(self, trans_amount: float, i: int) -> bool:
+        invoice_amount = self.invoices[i]["amount"]
+        return abs(trans_amount - invoice_amount) / invoice_amount < self.AMOUNT_TOLERANCE
+    
+    def _buckets_for(self, trans_amount: float) -> List[int]:
+        """Amount buckets within tolerance of trans_amount, closest first"""
+        low = bisect_right(self.amounts, int(trans_amount / (1 + self.AMOUNT_TOLERANCE) * 100))
+        high = bisect_left(self.amounts, int(trans_amount / (1 - self.AMOUNT_TOLERANCE) * 100) + 2)
+        return sorted(range(max(low - 1, 0), high), key=lambda b: abs(self.amounts[b] - trans_amount * 100))
+    
+    def consume(self, i: int) -> Dict:
+        self.consumed[i] = True
+        b, pos = self.position[i]
+        self.after[b][pos] = pos + 1
+        self.before[b][pos + 1] = pos
+        return self.invoices[i]
+    
+    def by_reference(self, trans_amount: float, trans_ref: str) -> Optional[int]:
+        """Unconsumed invoice whose id (or member id) appears in the reference and amount matches"""
+        candidates = []
+        for length in self.id_lengths:
+            for start in range(0, len(trans_ref) - length + 1):
+                token = trans_ref[start:start + length]
+                if token in self.by_invoice_id:
+                    candidates.append(self.by_invoice_id[token])
+        for length in self.id_lengths:
+            for start in range(0, len(trans_ref) - length + 1):
+                candidates.extend(self.by_member_id.get(trans_ref[start:start + length], ()))
+        for i in candidates:
+            if not self.consumed[i] and self._amount_matches(trans_amount, i):
+                return i
+        return None
+    
+    def by_amount_and_date(self, trans_amount: float, trans_date: datetime) -> Optional[int]:
+        """Unconsumed invoice with matching amount due within the date window, closest first"""
+        for b in self._buckets_for(trans_amount):
+            bucket = self.buckets[b]
+            if not self._amount_matches(trans_amount, bucket[0]):
+                continue
+            # The nearest unconsumed invoice due on or after / before the
+            # transaction date are the only candidates in this bucket
+            pos = bisect_left(self.bucket_dues[b], trans_date)
+            best = None
+            for candidate in (self._find(self.before[b], pos) - 1, self._find(self.after[b], pos)):
+                if 0 <= candidate < len(bucket):
+                    days_diff = abs((trans_date - self.due[bucket[candidate]]).days)
+                    if days_diff <= self.DATE_WINDOW_DAYS and (best is None or days_diff < best[0]):
+                        best = (days_diff, bucket[candidate])
+            if best is not None:
+                return best[1]
+        return None
+    
+    def by_amount(self, trans_amount: float) -> Optional[int]:
+        """Oldest unconsumed invoice with a matching amount"""
+        for b in self._buckets_for(trans_amount):
+            bucket = self.buckets[b]
+            pos = self._find(self.after[b], 0)
+            if pos < len(bucket) and self._amount_matches(trans_amount, bucket[pos]):
+                return bucket[pos]
+        return None
+
+
 class TIService:
     """
     Nedbank Transactional Information (TI) service integration
@@ -275,22 +421,43 @@ class TIService:
                 - unmatched: List of transactions that couldn't be matched
                 - summary: Reconciliation statistics
         """
-        matched = []
-        unmatched = []
-        
         # Filter for credit transactions (payments received)
         credit_transactions = [t for t in transactions if not t.get("is_debit", False) and t["amount"] > 0]
         
-        for transaction in credit_transactions:
-            match_result = self.match_transaction_to_invoice(transaction, invoices)
-            
-            if match_result:
+        # One-to-one assignment: every transaction gets a chance at a reference
+        # match before any invoice is taken by a weaker amount-based match
+        index = InvoiceMatchIndex(invoices)
+        assigned: Dict[int, Tuple[int, str, str]] = {}
+        parsed = [
+            (abs(t["amount"]), datetime.strptime(t["date"], "%Y-%m-%d"), (t.get("reference") or "").upper())
+            for t in credit_transactions
+        ]
+        passes = [
+            (lambda amount, when, ref: index.by_reference(amount, ref), "high", "reference_and_amount"),
+            (lambda amount, when, ref: index.by_amount_and_date(amount, when), "medium", "amount_and_date"),
+            (lambda amount, when, ref: index.by_amount(amount), "low", "amount_only"),
+        ]
+        for find, confidence, reason in passes:
+            for t, (amount, when, ref) in enumerate(parsed):
+                if t in assigned:
+                    continue
+                i = find(amount, when, ref)
+                if i is not None:
+                    index.consume(i)
+                    assigned[t] = (i, confidence, reason)
+        
+        matched = []
+        unmatched = []
+        reconciled_at = datetime.utcnow().isoformat()
+        for t, transaction in enumerate(credit_transactions):
+            if t in assigned:
+                i, confidence, reason = assigned[t]
                 matched.append({
                     "transaction": transaction,
-                    "invoice": match_result["invoice"],
-                    "match_confidence": match_result["match_confidence"],
-                    "match_reason": match_result["match_reason"],
-                    "reconciled_at": datetime.utcnow().isoformat()
+                    "invoice": index.invoices[i],
+                    "match_confidence": confidence,
+                    "match_reason": reason,
+                    "reconciled_at": reconciled_at
                 })
             else:
                 unmatched.append(transaction)
@@ -148,6 +148,34 @@ function DataImport() {
     setFieldMapping(newMapping);
   };
 
+  // Member imports run in the background: poll the import log until it finishes
+  const waitForImport = async (importId, token) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      const response = await fetch(`${BACKEND_URL}/api/import/logs/${importId}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      if (!response.ok) {
+        throw new Error('Failed to fetch import progress');
+      }
+      const log = await response.json();
+      if (log.status === 'failed') {
+        throw new Error(log.error || 'Import failed');
+      }
+      if (log.status !== 'processing') {
+        return {
+          import_id: importId,
+          total_rows: log.total_rows,
+          successful: log.successful_rows,
+          failed: log.failed_rows,
+          skipped: log.skipped_rows || 0,
+          updated: log.updated_rows || 0,
+          error_log: (log.error_log || []).slice(0, 20)
+        };
+      }
+    }
+  };
+
   const handleImport = async () => {
     setImporting(true);
     try {
@@ -172,7 +200,10 @@ function DataImport() {
       });
 
       if (response.ok) {
-        const result = await response.json();
+        let result = await response.json();
+        if (result.status === 'processing') {
+          result = await waitForImport(result.import_id, token);
+        }
         setImportResult(result);
         setStep(4);
       } else {
@@ -181,7 +212,7 @@ function DataImport() {
       }
     } catch (error) {
       console.error('Import failed:', error);
-      alert('Import failed');
+      alert(`Import failed: ${error.message}`);
     } finally {
       setImporting(false);
     }
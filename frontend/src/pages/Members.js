@@ -364,9 +364,18 @@ export default function Members() {
     }
   };
 
-  const showQRCode = (member) => {
+  const showQRCode = async (member) => {
     setSelectedMember(member);
     setQrDialogOpen(true);
+    // The member list omits qr_code; load it on demand
+    if (!member.qr_code) {
+      try {
+        const response = await axios.get(`${API}/members/${member.id}`);
+        setSelectedMember(response.data);
+      } catch (error) {
+        toast.error('Failed to load QR code');
+      }
+    }
   };
 
   // Profile dialog functions
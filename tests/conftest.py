@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from tests.fakes import FakeDB  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
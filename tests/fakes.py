@@ -0,0 +1,663 @@
+"""
+In-memory stand-ins for the Motor database used by the service tests.
+
+FakeDB supports the query, update and aggregation operators the services
+use. Unique indexes, including partial ones, are taken from
+db_indexes.INDEX_REGISTRY, so duplicate keys raise the same pymongo errors
+as a real server. Unsupported operators raise NotImplementedError instead of
+being silently ignored.
+"""
+import copy
+import re
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.operations import DeleteMany, DeleteOne, ReplaceOne, UpdateMany, UpdateOne
+
+from db_indexes import INDEX_REGISTRY
+
+MISSING = object()
+
+
+# ---------- matching ----------
+
+def get_path(doc: Any, path: str) -> Any:
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def _type_rank(value: Any) -> int:
+    if value is MISSING or value is None:
+        return 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, bool):
+        return 5
+    return 6
+
+
+def sort_key(value: Any):
+    return (_type_rank(value), None if value is MISSING or value is None else value)
+
+
+def _equals(value: Any, expected: Any) -> bool:
+    if expected is None:
+        return value is MISSING or value is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not MISSING and value == expected
+
+
+def _compare(value: Any, op: str, arg: Any) -> bool:
+    candidates = value if isinstance(value, list) else [value]
+    for candidate in candidates:
+        if candidate is MISSING or candidate is None or _type_rank(candidate) != _type_rank(arg):
+            continue
+        if (op == "$gt" and candidate > arg) or (op == "$gte" and candidate >= arg) or \
+                (op == "$lt" and candidate < arg) or (op == "$lte" and candidate <= arg):
+            return True
+    return False
+
+
+_TYPES = {
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "bool": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _operator(value: Any, op: str, arg: Any, cond: dict) -> bool:
+    if op == "$eq":
+        return _equals(value, arg)
+    if op == "$ne":
+        return not _equals(value, arg)
+    if op == "$in":
+        return any(_equals(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_equals(value, a) for a in arg)
+    if op == "$exists":
+        return (value is not MISSING) == bool(arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return _compare(value, op, arg)
+    if op == "$type":
+        return value is not MISSING and any(_TYPES[t](value) for t in (arg if isinstance(arg, list) else [arg]))
+    if op == "$regex":
+        flags = re.IGNORECASE if "i" in cond.get("$options", "") else 0
+        return isinstance(value, str) and re.search(arg, value, flags) is not None
+    if op == "$options":
+        return True
+    if op == "$not":
+        return not _condition(value, arg)
+    if op == "$size":
+        return isinstance(value, list) and len(value) == arg
+    if op == "$elemMatch":
+        return isinstance(value, list) and any(
+            matches(item, arg) if isinstance(item, dict) else _condition(item, arg) for item in value
+        )
+    raise NotImplementedError(f"FakeDB does not support query operator {op}")
+
+
+def _is_operator_dict(cond: Any) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _condition(value: Any, cond: Any) -> bool:
+    if _is_operator_dict(cond):
+        return all(_operator(value, op, arg, cond) for op, arg in cond.items())
+    return _equals(value, cond)
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in cond):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"FakeDB does not support query operator {key}")
+        elif not _condition(get_path(doc, key), cond):
+            return False
+    return True
+
+
+# ---------- updates ----------
+
+def set_path(doc: dict, path: str, value: Any):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    if not any(k.startswith("$") for k in update):
+        _id = doc.get("_id")
+        doc.clear()
+        doc.update(copy.deepcopy(update))
+        if _id is not None:
+            doc.setdefault("_id", _id)
+        return
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            current = get_path(doc, path)
+            if op == "$set":
+                set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$setOnInsert":
+                if inserting:
+                    set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$inc":
+                set_path(doc, path, (0 if current is MISSING or current is None else current) + arg)
+            elif op == "$min":
+                if current is MISSING or sort_key(arg) < sort_key(current):
+                    set_path(doc, path, arg)
+            elif op == "$max":
+                if current is MISSING or sort_key(arg) > sort_key(current):
+                    set_path(doc, path, arg)
+            elif op in ("$push", "$addToSet"):
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                values = list(current) if isinstance(current, list) else []
+                for item in items:
+                    if op == "$push" or item not in values:
+                        values.append(copy.deepcopy(item))
+                if op == "$push" and isinstance(arg, dict) and "$slice" in arg:
+                    limit = arg["$slice"]
+                    values = values[limit:] if limit < 0 else values[:limit]
+                set_path(doc, path, values)
+            elif op == "$pull":
+                if isinstance(current, list):
+                    set_path(doc, path, [
+                        item for item in current
+                        if not (matches(item, arg) if isinstance(item, dict) and isinstance(arg, dict) else _condition(item, arg))
+                    ])
+            else:
+                raise NotImplementedError(f"FakeDB does not support update operator {op}")
+
+
+def _upsert_seed(query: dict) -> dict:
+    """Fields an upsert copies from the filter"""
+    doc: dict = {}
+    for key, cond in query.items():
+        if key == "$and":
+            for q in cond:
+                doc.update(_upsert_seed(q))
+        elif not key.startswith("$"):
+            if _is_operator_dict(cond):
+                if "$eq" in cond:
+                    set_path(doc, key, copy.deepcopy(cond["$eq"]))
+            else:
+                set_path(doc, key, copy.deepcopy(cond))
+    return doc
+
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(fields.values()):
+        out: dict = {}
+        for path, flag in fields.items():
+            if flag:
+                value = get_path(doc, path)
+                if value is not MISSING:
+                    set_path(out, path, value)
+        if include_id and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    for path in fields:
+        unset_path(doc, path)
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+
+# ---------- aggregation ----------
+
+def evaluate(expr: Any, doc: dict) -> Any:
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = get_path(doc, expr[1:])
+        return None if value is MISSING else value
+    if isinstance(expr, dict):
+        if len(expr) == 1 and next(iter(expr)).startswith("$"):
+            op, args = next(iter(expr.items()))
+            if op == "$ifNull":
+                for arg in args:
+                    value = evaluate(arg, doc)
+                    if value is not None:
+                        return value
+                return None
+            values = [evaluate(a, doc) for a in (args if isinstance(args, list) else [args])]
+            if op == "$add":
+                return sum(values)
+            if op == "$subtract":
+                return values[0] - values[1]
+            if op == "$multiply":
+                result = 1
+                for v in values:
+                    result *= v
+                return result
+            if op == "$substr":
+                return str(values[0])[values[1]:values[1] + values[2]]
+            if op == "$cond":
+                return values[1] if values[0] else values[2]
+            if op == "$eq":
+                return values[0] == values[1]
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                # Aggregation comparisons order across types (null lowest), unlike query matching
+                left, right = sort_key(values[0]), sort_key(values[1])
+                return {"$gt": left > right, "$gte": left >= right, "$lt": left < right, "$lte": left <= right}[op]
+            raise NotImplementedError(f"FakeDB does not support expression {op}")
+        return {k: evaluate(v, doc) for k, v in expr.items()}
+    return expr
+
+
+def _hashable(value: Any):
+    if isinstance(value, dict):
+        return tuple((k, _hashable(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    members: Dict[Any, List[dict]] = {}
+    for doc in docs:
+        key = evaluate(spec["_id"], doc)
+        hkey = _hashable(key)
+        if hkey not in groups:
+            groups[hkey] = {"_id": key}
+            members[hkey] = []
+        members[hkey].append(doc)
+    out = []
+    for hkey, group in groups.items():
+        rows = members[hkey]
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            (op, arg), = acc.items()
+            values = [evaluate(arg, d) for d in rows]
+            if op == "$sum":
+                group[field] = sum(v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool))
+            elif op == "$avg":
+                numbers = [v for v in values if isinstance(v, (int, float))]
+                group[field] = sum(numbers) / len(numbers) if numbers else None
+            elif op == "$min":
+                present = [v for v in values if v is not None]
+                group[field] = min(present, key=sort_key) if present else None
+            elif op == "$max":
+                present = [v for v in values if v is not None]
+                group[field] = max(present, key=sort_key) if present else None
+            elif op == "$first":
+                group[field] = values[0]
+            elif op == "$last":
+                group[field] = values[-1]
+            elif op == "$push":
+                group[field] = values
+            elif op == "$addToSet":
+                group[field] = list({_hashable(v): v for v in values}.values())
+            else:
+                raise NotImplementedError(f"FakeDB does not support accumulator {op}")
+        out.append(group)
+    return out
+
+
+def _sorted(docs: List[dict], spec) -> List[dict]:
+    items = list(spec.items()) if isinstance(spec, dict) else list(spec)
+    for field, direction in reversed(items):
+        docs = sorted(docs, key=lambda d: sort_key(get_path(d, field)), reverse=direction < 0)
+    return docs
+
+
+def run_pipeline(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$sort":
+            docs = _sorted(docs, spec)
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$project":
+            if all(v in (0, 1, True, False) for v in spec.values()):
+                docs = [project(d, spec) for d in docs]
+            else:
+                docs = [
+                    {**({"_id": d.get("_id")} if spec.get("_id", 1) else {}),
+                     **{k: (get_path(d, k) if v in (1, True) else evaluate(v, d))
+                        for k, v in spec.items() if k != "_id" and v not in (0, False)}}
+                    for d in docs
+                ]
+        elif name == "$unwind":
+            path = (spec if isinstance(spec, str) else spec["path"])[1:]
+            unwound = []
+            for d in docs:
+                for item in get_path(d, path) or []:
+                    row = copy.deepcopy(d)
+                    set_path(row, path, item)
+                    unwound.append(row)
+            docs = unwound
+        else:
+            raise NotImplementedError(f"FakeDB does not support pipeline stage {name}")
+    return docs
+
+
+# ---------- cursor, collection, database ----------
+
+class FakeCursor:
+    def __init__(self, docs: List[dict], projection: Optional[dict] = None):
+        self._docs = docs
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        self._sort = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _results(self) -> List[dict]:
+        docs = _sorted(self._docs, self._sort) if self._sort else self._docs
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [project(d, self._projection) for d in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: List[dict] = []
+        self.unique = [
+            ([field for field, _ in index.document["key"].items()], index.document.get("partialFilterExpression"))
+            for index in INDEX_REGISTRY.get(name, [])
+            if index.document.get("unique")
+        ]
+
+    # -- helpers --
+
+    def _find(self, query: Optional[dict]) -> List[dict]:
+        return [d for d in self.docs if matches(d, query)]
+
+    def _check_unique(self, doc: dict, ignore: Optional[dict] = None):
+        for fields, partial in self.unique:
+            if partial and not matches(doc, partial):
+                continue
+            key = [get_path(doc, f) for f in fields]
+            key = [None if v is MISSING else v for v in key]
+            for other in self.docs:
+                if other is ignore or (partial and not matches(other, partial)):
+                    continue
+                if [None if v is MISSING else v for v in (get_path(other, f) for f in fields)] == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: {fields} dup key: {key}",
+                        11000
+                    )
+
+    def _insert(self, doc: dict):
+        doc.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(doc)
+        self._check_unique(stored)
+        self.docs.append(stored)
+        return stored["_id"]
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool):
+        targets = self._find(query)
+        if not many:
+            targets = targets[:1]
+        modified = 0
+        for doc in targets:
+            updated = copy.deepcopy(doc)
+            apply_update(updated, update)
+            self._check_unique(updated, ignore=doc)
+            if updated != doc:
+                modified += 1
+                doc.clear()
+                doc.update(updated)
+        upserted_id = None
+        if not targets and upsert:
+            doc = _upsert_seed(query)
+            apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return SimpleNamespace(
+            matched_count=len(targets), modified_count=modified, upserted_id=upserted_id, acknowledged=True
+        )
+
+    # -- motor API --
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> FakeCursor:
+        cursor = FakeCursor(self._find(query), projection or kwargs.get("projection"))
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs):
+        cursor = self.find(query, projection, sort=sort)
+        results = await cursor.limit(1).to_list(1)
+        return results[0] if results else None
+
+    async def count_documents(self, query: dict, **kwargs) -> int:
+        count = len(self._find(query))
+        if kwargs.get("limit"):
+            count = min(count, kwargs["limit"])
+        return count
+
+    async def estimated_document_count(self) -> int:
+        return len(self.docs)
+
+    async def distinct(self, field: str, query: Optional[dict] = None) -> list:
+        values = []
+        for doc in self._find(query):
+            value = get_path(doc, field)
+            for v in value if isinstance(value, list) else [value]:
+                if v is not MISSING and v not in values:
+                    values.append(v)
+        return values
+
+    async def insert_one(self, doc: dict, **kwargs):
+        return SimpleNamespace(inserted_id=self._insert(doc), acknowledged=True)
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True, **kwargs):
+        inserted, errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                inserted.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+            })
+        return SimpleNamespace(inserted_ids=inserted, acknowledged=True)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False, **kwargs):
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False, **kwargs):
+        return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False, **kwargs):
+        return self._update(query, replacement, upsert, many=False)
+
+    async def delete_one(self, query: dict, **kwargs):
+        targets = self._find(query)[:1]
+        for doc in targets:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=len(targets), acknowledged=True)
+
+    async def delete_many(self, query: dict, **kwargs):
+        targets = self._find(query)
+        self.docs = [d for d in self.docs if d not in targets]
+        return SimpleNamespace(deleted_count=len(targets), acknowledged=True)
+
+    async def find_one_and_update(
+        self, query: dict, update: dict, projection: Optional[dict] = None, sort=None,
+        upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **kwargs
+    ):
+        targets = self._find(query)
+        if sort:
+            targets = _sorted(targets, sort)
+        if targets:
+            doc = targets[0]
+            before = copy.deepcopy(doc)
+            updated = copy.deepcopy(doc)
+            apply_update(updated, update)
+            self._check_unique(updated, ignore=doc)
+            doc.clear()
+            doc.update(updated)
+            return project(doc if return_document == ReturnDocument.AFTER else before, projection)
+        if not upsert:
+            return None
+        doc = _upsert_seed(query)
+        apply_update(doc, update, inserting=True)
+        self._insert(doc)
+        return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+
+    async def find_one_and_delete(self, query: dict, projection: Optional[dict] = None, sort=None, **kwargs):
+        targets = self._find(query)
+        if sort:
+            targets = _sorted(targets, sort)
+        if not targets:
+            return None
+        self.docs.remove(targets[0])
+        return project(targets[0], projection)
+
+    async def bulk_write(self, ops: list, ordered: bool = True, **kwargs):
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0}
+        upserted, errors = [], []
+        for index, op in enumerate(ops):
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert(op._doc)
+                    counts["nInserted"] += 1
+                elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                    result = self._update(op._filter, op._doc, op._upsert, many=isinstance(op, UpdateMany))
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+                    if result.upserted_id is not None:
+                        counts["nUpserted"] += 1
+                        upserted.append({"index": index, "_id": result.upserted_id})
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    targets = self._find(op._filter)
+                    if isinstance(op, DeleteOne):
+                        targets = targets[:1]
+                    self.docs = [d for d in self.docs if d not in targets]
+                    counts["nRemoved"] += len(targets)
+                else:
+                    raise NotImplementedError(f"FakeDB does not support bulk op {type(op).__name__}")
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({**counts, "upserted": upserted, "writeErrors": errors, "writeConcernErrors": []})
+        return SimpleNamespace(
+            inserted_count=counts["nInserted"],
+            matched_count=counts["nMatched"],
+            modified_count=counts["nModified"],
+            deleted_count=counts["nRemoved"],
+            upserted_count=counts["nUpserted"],
+            upserted_ids={u["index"]: u["_id"] for u in upserted},
+            acknowledged=True
+        )
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> FakeCursor:
+        return FakeCursor(run_pipeline(copy.deepcopy(self.docs), pipeline))
+
+    async def create_index(self, *args, **kwargs):
+        return kwargs.get("name")
+
+    async def create_indexes(self, indexes, **kwargs):
+        return [index.document["name"] for index in indexes]
+
+
+class FakeDB:
+    """Collections are created on first access, like Motor's attribute access"""
+
+    def __init__(self):
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name)
+        return self._collections[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, c in self._collections.items() if c.docs]
@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from services.automation_queue import AutomationJobQueue, event_key
+
+AUTOMATION = {
+    "id": "auto-1",
+    "name": "Welcome",
+    "actions": [{"type": "send_email"}, {"type": "send_sms", "delay_minutes": 30}],
+}
+
+
+class Actions:
+    """execute_action stand-in; results are taken from `script` in order, then succeed"""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    async def __call__(self, action, trigger_data):
+        self.calls.append((action["type"], trigger_data))
+        outcome = self.script.pop(0) if self.script else {"status": "sent"}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def jobs(db):
+    return {job["action"]["type"]: job for job in db.automation_executions.docs}
+
+
+def test_event_key_is_stable_within_the_window_only():
+    at = datetime(2026, 3, 2, 10, 0, 5, tzinfo=timezone.utc)
+    key = event_key("member_joined", {"a": 1, "b": 2}, 600, at)
+
+    assert event_key("member_joined", {"b": 2, "a": 1}, 600, at + timedelta(seconds=60)) == key
+    assert event_key("member_joined", {"a": 1, "b": 2}, 600, at + timedelta(seconds=600)) != key
+    assert event_key("member_joined", {"a": 1, "b": 3}, 600, at) != key
+    assert event_key("payment_failed", {"a": 1, "b": 2}, 600, at) != key
+
+
+def test_enqueue_skips_actions_already_enqueued_for_the_event(db):
+    queue = AutomationJobQueue(db, Actions())
+
+    first = asyncio.run(queue.enqueue(AUTOMATION, {"member_id": "m1"}, "member_joined:m1"))
+    again = asyncio.run(queue.enqueue(AUTOMATION, {"member_id": "m1"}, "member_joined:m1"))
+    other = asyncio.run(queue.enqueue(AUTOMATION, {"member_id": "m2"}, "member_joined:m2"))
+
+    assert [j["action_type"] for j in first] == ["send_email", "send_sms"]
+    assert again == []
+    assert len(other) == 2
+    assert queue.duplicates == 2
+    assert len(db.automation_executions.docs) == 4
+
+
+def test_only_due_jobs_are_claimed_and_completed(db):
+    actions = Actions()
+    queue = AutomationJobQueue(db, actions)
+    asyncio.run(queue.enqueue(AUTOMATION, {"member_id": "m1"}, "member_joined:m1"))
+
+    job = asyncio.run(queue._claim())
+    assert job["action"]["type"] == "send_email"
+    assert asyncio.run(queue._claim()) is None  # send_sms is delayed 30 minutes
+
+    asyncio.run(queue._process(job))
+    email = jobs(db)["send_email"]
+    assert email["status"] == "completed"
+    assert email["result"] == {"status": "sent"}
+    assert "lease_owner" not in email
+    assert actions.calls == [("send_email", {"member_id": "m1"})]
+
+
+def test_failures_back_off_then_fail_after_max_attempts(db):
+    queue = AutomationJobQueue(db, Actions(RuntimeError("smtp down"), {"status": "failed", "error": "bounced"}),
+                               max_attempts=2, backoff_seconds=60)
+    asyncio.run(queue.enqueue({**AUTOMATION, "actions": AUTOMATION["actions"][:1]}, {}, "e1"))
+
+    before = datetime.now(timezone.utc)
+    asyncio.run(queue._process(asyncio.run(queue._claim())))
+    email = jobs(db)["send_email"]
+    assert (email["status"], email["attempts"], email["last_error"]) == ("pending", 1, "smtp down")
+    assert email["scheduled_for"] >= (before + timedelta(seconds=60)).isoformat()
+
+    email["scheduled_for"] = before.isoformat()
+    asyncio.run(queue._process(asyncio.run(queue._claim())))
+    email = jobs(db)["send_email"]
+    assert (email["status"], email["attempts"], email["last_error"]) == ("failed", 2, "bounced")
+    assert (queue.retried, queue.failed) == (1, 1)
+
+    assert asyncio.run(queue.retry(email["id"])) is True
+    assert jobs(db)["send_email"]["status"] == "pending"
+
+
+def test_expired_lease_is_claimed_again(db):
+    queue = AutomationJobQueue(db, Actions())
+    asyncio.run(queue.enqueue({**AUTOMATION, "actions": AUTOMATION["actions"][:1]}, {}, "e1"))
+    asyncio.run(queue._claim())
+    assert asyncio.run(queue._claim()) is None
+
+    jobs(db)["send_email"]["lease_until"] = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    reclaimed = asyncio.run(queue._claim())
+    assert reclaimed["attempts"] == 2
+
+
+def test_worker_survives_a_job_whose_result_cannot_be_stored(db):
+    queue = AutomationJobQueue(db, Actions(), poll_interval=0.01, max_attempts=3)
+    asyncio.run(queue.enqueue({**AUTOMATION, "actions": AUTOMATION["actions"][:1]}, {}, "e1"))
+    collection = db.automation_executions
+    store = collection.update_one
+    failures = [RuntimeError("write failed")]
+
+    async def flaky_update_one(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await store(*args, **kwargs)
+
+    collection.update_one = flaky_update_one
+
+    async def run():
+        queue.start()
+        while jobs(db)["send_email"]["status"] == "running" or "last_error" not in jobs(db)["send_email"]:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    email = jobs(db)["send_email"]
+    assert (email["status"], email["last_error"]) == ("pending", "write failed")
+    assert "lease_owner" not in email
+    assert queue.retried == 1
@@ -0,0 +1,135 @@
+import asyncio
+import re
+
+from aiohttp import web
+
+from avs_utils import AVSService, verification_cache_key
+from services.avs_verification import AVSVerifier
+
+LIVE = {"mock_mode": False}
+
+
+def account(number, **fields):
+    return {"bank_identifier": "21", "account_number": str(number), "identity_number": "8001015009087",
+            "initials": "A", "last_name": "Smith", **fields}
+
+
+class SoapBank:
+    """Mock AVS SOAP endpoint: every account exists (R00) unless listed in `technical_errors` (R01)"""
+
+    def __init__(self, technical_errors=()):
+        self.technical_errors = set(technical_errors)
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        body = await request.text()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        accounts = re.findall(r"AccountNumber>(\d+)<", body)
+        sequences = re.findall(r"SequenceNumber>(\d+)<", body)
+        # Items come back out of order; the verifier aligns them on SequenceNumber
+        items = "".join(
+            f"<RealTimeAccVerifRsItem><SequenceNumber>{seq}</SequenceNumber><AccountNumber>{acct}</AccountNumber>"
+            f"<ResultCodeAcct>{'R01' if acct in self.technical_errors else 'R00'}</ResultCodeAcct>"
+            f"<AccountExists>Y</AccountExists></RealTimeAccVerifRsItem>"
+            for seq, acct in reversed(list(zip(sequences, accounts)))
+        )
+        return web.Response(content_type="text/xml", text=(
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+            f"<RealTimeAcctVerificationRs><ResultCode>R00</ResultCode>{items}</RealTimeAcctVerificationRs>"
+            "</soapenv:Body></soapenv:Envelope>"
+        ))
+
+
+async def with_bank(bank, run):
+    app = web.Application()
+    app.router.add_post("/", bank.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        return await run(f"http://127.0.0.1:{port}/")
+    finally:
+        await runner.cleanup()
+
+
+def test_cache_key_covers_every_matched_field():
+    base = account("0012345")
+    key = verification_cache_key(base)
+
+    assert verification_cache_key(account("12345", last_name=" smith ")) == key
+    for field, value in [("account_type", "02"), ("identity_type", "02"), ("email_id", "a@example.com"),
+                         ("cell_number", "0821234567"), ("tax_reference", "9001"), ("sort_code", "198765"),
+                         ("initials", "B"), ("bank_identifier", "16")]:
+        assert verification_cache_key({**base, field: value}) != key, field
+
+
+def test_accounts_are_batched_aligned_and_cached(db):
+    bank = SoapBank()
+    requests = [account(1000000 + i) for i in range(2 * AVSService.MAX_BATCH_SIZE + 5)]
+    requests.append(dict(requests[0], initials="a"))  # the same account again
+
+    async def run(endpoint):
+        verifier = AVSVerifier(db, concurrency=2, endpoint=endpoint)
+        first = await verifier.verify(LIVE, requests)
+        calls = bank.requests
+        second = await verifier.verify(LIVE, [dict(r, last_name="SMITH") for r in requests[:10]])
+        await verifier.stop()
+        return verifier, first, calls, second
+
+    verifier, first, calls, second = asyncio.run(with_bank(bank, run))
+
+    assert calls == 3  # 85 distinct accounts, MAX_BATCH_SIZE per request
+    assert bank.max_in_flight <= 2
+    assert all(r and r["mock_mode"] is False and r["cached"] is False for r in first)
+    assert [r["verification"]["account_number"] for r in first] == [q["account_number"] for q in requests]
+    assert bank.requests == calls  # answered from avs_cache
+    assert all(r["cached"] for r in second)
+    assert second[0]["verification"]["last_name"] == "SMITH"  # request fields come from the current request
+    assert verifier.stats()["cache_hits"] == 10
+    assert len(db.avs_cache.docs) == len(requests) - 1
+
+
+def test_technical_errors_and_fallback_results_are_not_cached(db):
+    bank = SoapBank(technical_errors={"2000001"})
+
+    async def run(endpoint):
+        verifier = AVSVerifier(db, endpoint=endpoint)
+        results = await verifier.verify(LIVE, [account(2000000), account(2000001)])
+        await verifier.stop()
+        return results
+
+    results = asyncio.run(with_bank(bank, run))
+    assert [r["verification"]["result_code_acct"] for r in results] == ["R00", "R01"]
+    assert len(db.avs_cache.docs) == 1
+
+    async def unreachable():
+        # Nothing listens here: AVSService falls back to mock data
+        verifier = AVSVerifier(db, endpoint="http://127.0.0.1:9/")
+        results = await verifier.verify(LIVE, [account(3000000)])
+        await verifier.stop()
+        return results
+
+    fallback, = asyncio.run(unreachable())
+    assert fallback["mock_mode"] is True
+    assert len(db.avs_cache.docs) == 1
+
+
+def test_mock_mode_opens_no_session_and_keeps_its_own_cache(db):
+    async def run():
+        verifier = AVSVerifier(db)
+        results = await verifier.verify({"mock_mode": True}, [account(4000000)])
+        again = await verifier.verify({"mock_mode": True}, [account(4000000)])
+        return verifier, results, again
+
+    verifier, results, again = asyncio.run(run())
+    assert results[0]["mock_mode"] is True and again[0]["cached"] is True
+    assert verifier.stats()["pooled_session_open"] is False
+    assert db.avs_cache.docs[0]["mock_mode"] is True
@@ -0,0 +1,143 @@
+import asyncio
+
+from services.class_capacity import ClassCapacity, occurrence_key, place_of
+
+CLASS_ID = "yoga"
+DATE = "2026-03-02T07:00:00"
+
+
+def occurrence(db):
+    return next(o for o in db.class_occurrences.docs if o["key"] == occurrence_key(CLASS_ID, DATE))
+
+
+def test_seats_then_waitlist_then_full(db):
+    capacity = ClassCapacity(db)
+
+    async def book_all():
+        return await asyncio.gather(*(capacity.reserve(CLASS_ID, DATE, 3, 2) for _ in range(7)))
+
+    results = asyncio.run(book_all())
+
+    assert [r["status"] for r in results] == ["confirmed"] * 3 + ["waitlist"] * 2 + ["full"] * 2
+    assert [r["waitlist_position"] for r in results if r["status"] == "waitlist"] == [1, 2]
+    assert (occurrence(db)["confirmed"], occurrence(db)["waitlist"]) == (3, 2)
+
+
+def test_no_waitlist_capacity_means_full(db):
+    capacity = ClassCapacity(db)
+    asyncio.run(capacity.reserve(CLASS_ID, DATE, 1, None))
+    assert asyncio.run(capacity.reserve(CLASS_ID, DATE, 1, None))["status"] == "full"
+
+
+def test_occurrence_is_seeded_from_existing_bookings(db):
+    db.bookings.docs.extend([
+        {"id": "b1", "class_id": CLASS_ID, "booking_date": DATE, "status": "confirmed"},
+        {"id": "b2", "class_id": CLASS_ID, "booking_date": DATE, "status": "attended"},
+        {"id": "b3", "class_id": CLASS_ID, "booking_date": DATE, "status": "cancelled"},
+        {"id": "b4", "class_id": CLASS_ID, "booking_date": "2026-03-03T07:00:00", "status": "confirmed"},
+    ])
+    capacity = ClassCapacity(db)
+
+    assert asyncio.run(capacity.reserve(CLASS_ID, DATE, 3, None))["status"] == "confirmed"
+    assert asyncio.run(capacity.reserve(CLASS_ID, DATE, 3, None))["status"] == "full"
+
+
+def test_release_promotes_the_first_waitlisted_booking(db):
+    capacity = ClassCapacity(db)
+    base = {"class_id": CLASS_ID, "booking_date": DATE}
+    db.bookings.docs.extend([
+        {"id": "seat", **base, "status": "confirmed"},
+        {"id": "w2", **base, "status": "waitlist", "waitlist_position": 2, "booked_at": "2026-03-01T10:00:00"},
+        {"id": "w1", **base, "status": "waitlist", "waitlist_position": 1, "booked_at": "2026-03-01T11:00:00"},
+        {"id": "w3", **base, "status": "waitlist", "waitlist_position": 3, "booked_at": "2026-03-01T09:00:00"},
+    ])
+
+    promoted = asyncio.run(capacity.release(db.bookings.docs[0]))
+
+    assert promoted["id"] == "w1"
+    bookings = {b["id"]: b for b in db.bookings.docs}
+    assert bookings["w1"]["status"] == "confirmed"
+    assert (bookings["w2"]["waitlist_position"], bookings["w3"]["waitlist_position"]) == (1, 2)
+    # The seat passed to w1: confirmed unchanged, waitlist one shorter
+    assert (occurrence(db)["confirmed"], occurrence(db)["waitlist"]) == (1, 2)
+
+
+def test_releasing_a_waitlisted_booking_shifts_the_ones_behind_it(db):
+    capacity = ClassCapacity(db)
+    base = {"class_id": CLASS_ID, "booking_date": DATE}
+    db.bookings.docs.extend([
+        {"id": "w1", **base, "status": "waitlist", "waitlist_position": 1},
+        {"id": "w2", **base, "status": "waitlist", "waitlist_position": 2},
+    ])
+    asyncio.run(capacity._ensure(CLASS_ID, DATE))
+    leaving = dict(db.bookings.docs[0], status="waitlist")
+    db.bookings.docs[0]["status"] = "cancelled"
+
+    assert asyncio.run(capacity.release(leaving)) is None
+    assert db.bookings.docs[1]["waitlist_position"] == 1
+    assert occurrence(db)["waitlist"] == 1
+
+
+def test_release_without_waitlist_frees_the_seat(db):
+    capacity = ClassCapacity(db)
+    asyncio.run(capacity.reserve(CLASS_ID, DATE, 1, 1))
+
+    assert asyncio.run(capacity.release({"class_id": CLASS_ID, "booking_date": DATE, "status": "confirmed"})) is None
+    assert asyncio.run(capacity.reserve(CLASS_ID, DATE, 1, 1))["status"] == "confirmed"
+
+
+def test_place_of_status():
+    assert [place_of(s) for s in ("confirmed", "attended", "waitlist", "cancelled", "no-show", None)] == [
+        "confirmed", "confirmed", "waitlist", None, None, None
+    ]
+
+
+def test_take_only_takes_the_requested_place(db):
+    capacity = ClassCapacity(db)
+    asyncio.run(capacity.reserve(CLASS_ID, DATE, 1, 1))
+
+    assert asyncio.run(capacity.take(CLASS_ID, DATE, "confirmed", 1, 1)) is None
+    assert asyncio.run(capacity.take(CLASS_ID, DATE, "waitlist", 1, None)) is None
+    assert asyncio.run(capacity.take(CLASS_ID, DATE, "waitlist", 1, 1)) == {"status": "waitlist", "waitlist_position": 1}
+    assert asyncio.run(capacity.take(CLASS_ID, DATE, "waitlist", 1, 1)) is None
+    assert (occurrence(db)["confirmed"], occurrence(db)["waitlist"]) == (1, 1)
+
+
+def test_moving_a_waitlisted_booking_onto_a_seat(db):
+    capacity = ClassCapacity(db)
+    base = {"class_id": CLASS_ID, "booking_date": DATE}
+    db.bookings.docs.extend([
+        {"id": "seat", **base, "status": "confirmed"},
+        {"id": "w1", **base, "status": "waitlist", "waitlist_position": 1},
+        {"id": "w2", **base, "status": "waitlist", "waitlist_position": 2},
+    ])
+    moving = dict(db.bookings.docs[1])
+
+    # As PATCH /bookings does: take the seat, update the booking, release the waitlist place
+    assert asyncio.run(capacity.take(CLASS_ID, DATE, "confirmed", 3, 5))["status"] == "confirmed"
+    db.bookings.docs[1].update(status="confirmed", is_waitlist=False, waitlist_position=None)
+    assert asyncio.run(capacity.release(moving)) is None
+
+    assert db.bookings.docs[2]["waitlist_position"] == 1
+    assert (occurrence(db)["confirmed"], occurrence(db)["waitlist"]) == (2, 1)
+
+
+def test_no_show_counts_are_built_once_and_decremented_on_delete(db):
+    db.members.docs.extend([{"id": "m1", "no_show_count": 7}, {"id": "m2"}, {"id": "m3", "no_show_count": 1}])
+    db.bookings.docs.extend([
+        {"id": "b1", "member_id": "m1", "no_show": True},
+        {"id": "b2", "member_id": "m1", "no_show": True},
+        {"id": "b3", "member_id": "m2", "no_show": True},
+        {"id": "b4", "member_id": "m2", "no_show": False},
+    ])
+    capacity = ClassCapacity(db)
+
+    assert asyncio.run(capacity.ensure_no_show_counts()) == 2
+    assert asyncio.run(capacity.ensure_no_show_counts()) is None
+    counts = {m["id"]: m.get("no_show_count") for m in db.members.docs}
+    assert counts == {"m1": 2, "m2": 1, "m3": 0}
+
+    asyncio.run(capacity.forget_no_show(db.bookings.docs[2]))
+    asyncio.run(capacity.forget_no_show(db.bookings.docs[2]))
+    asyncio.run(capacity.forget_no_show(db.bookings.docs[3]))
+    assert next(m for m in db.members.docs if m["id"] == "m2")["no_show_count"] == 0
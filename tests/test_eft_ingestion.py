@@ -0,0 +1,135 @@
+import asyncio
+import uuid
+
+import pytest
+
+from services.eft_ingestion import EFTResponseIngestor
+from services.rollups import UNKNOWN
+
+
+def make_payment(item, payment_reference):
+    return {
+        "id": str(uuid.uuid4()),
+        "invoice_id": item["invoice_id"],
+        "member_id": item["member_id"],
+        "amount": item["amount"],
+        "payment_method": "EFT",
+        "reference": payment_reference,
+        "payment_date": "2026-03-02T08:00:00",
+    }
+
+
+class RecordingRollups:
+    def __init__(self):
+        self.payments = []
+
+    async def record_payments(self, payments):
+        self.payments.extend(payments)
+
+
+@pytest.fixture
+def setup(db):
+    db.members.docs.extend([
+        {"id": "m1", "membership_type_id": "gold", "source": "walk_in"},
+        {"id": "m2"},
+    ])
+    db.invoices.docs.extend([
+        {"id": "inv-1", "member_id": "m1", "status": "pending"},
+        {"id": "inv-2", "member_id": "m2", "status": "pending"},
+        {"id": "inv-3", "member_id": "m2", "status": "pending"},
+    ])
+    db.levies.docs.append({"id": "levy-1", "member_id": "m1", "status": "pending"})
+    db.eft_transaction_items.docs.extend([
+        {"id": "i1", "payment_reference": "REF1", "member_id": "m1", "invoice_id": "inv-1", "amount": 500},
+        {"id": "i2", "payment_reference": "REF2", "member_id": "m2", "invoice_id": "inv-2", "amount": 300},
+        {"id": "i3", "payment_reference": "REF3", "member_id": "m2", "invoice_id": "inv-3", "amount": 300},
+        {"id": "i4", "payment_reference": "REF4", "member_id": "m1", "levy_id": "levy-1", "amount": 50},
+    ])
+    debtors = []
+    rollups = RecordingRollups()
+
+    async def recalculate_debts(member_ids):
+        debtors.append(sorted(member_ids))
+
+    ingestor = EFTResponseIngestor(db, recalculate_debts, make_payment, rollups=rollups, batch_size=2)
+    return ingestor, rollups, debtors
+
+
+RECORDS = [
+    {"payment_reference": "REF1", "response_code": "00", "response_message": "Paid"},
+    {"payment_reference": "REF2", "response_code": "00", "response_message": "Paid"},
+    {"payment_reference": "REF3", "response_code": "02", "response_message": "Not provided for"},
+    {"payment_reference": "REF4", "response_code": "00", "response_message": "Paid"},
+    {"payment_reference": "UNKNOWN", "response_code": "00"},
+]
+
+
+def paid(record):
+    return record["response_code"] == "00"
+
+
+def by_id(collection):
+    return {doc["id"]: doc for doc in collection.docs}
+
+
+def test_response_file_settles_invoices_levies_and_records_payments(db, setup):
+    ingestor, rollups, debtors = setup
+
+    summary = asyncio.run(ingestor.ingest("SEQ1:unpaid", RECORDS, paid, record_payments=True))
+
+    assert {k: summary[k] for k in ("records", "matched", "applied", "paid", "failed")} == {
+        "records": 5, "matched": 4, "applied": 4, "paid": 3, "failed": 1
+    }
+    invoices = by_id(db.invoices)
+    assert [invoices[i]["status"] for i in ("inv-1", "inv-2", "inv-3")] == ["paid", "paid", "pending"]
+    assert by_id(db.levies)["levy-1"]["status"] == "paid"
+    items = by_id(db.eft_transaction_items)
+    assert (items["i1"]["status"], items["i3"]["status"]) == ("processed", "failed")
+    assert all(item["response_key"] == "SEQ1:unpaid" for item in items.values())
+
+    payments = {p["invoice_id"]: p for p in db.payments.docs}
+    assert sorted(payments) == ["inv-1", "inv-2"]
+    assert (payments["inv-1"]["membership_type_id"], payments["inv-1"]["member_source"]) == ("gold", "walk_in")
+    assert (payments["inv-2"]["membership_type_id"], payments["inv-2"]["member_source"]) == (UNKNOWN, UNKNOWN)
+    assert sorted(p["invoice_id"] for p in rollups.payments) == ["inv-1", "inv-2"]
+    assert debtors == [["m1", "m2"]]
+
+
+def test_resending_a_completed_file_changes_nothing(db, setup):
+    ingestor, rollups, debtors = setup
+    asyncio.run(ingestor.ingest("SEQ1:unpaid", RECORDS, paid, record_payments=True))
+
+    again = asyncio.run(ingestor.ingest("SEQ1:unpaid", RECORDS, paid, record_payments=True))
+
+    assert again["already_processed"] is True
+    assert len(db.payments.docs) == 2
+    assert len(rollups.payments) == 2
+    assert len(debtors) == 1
+
+
+def test_interrupted_run_only_records_payments_it_had_not_written(db, setup):
+    ingestor, rollups, debtors = setup
+    # An earlier attempt wrote REF1's payment and stopped before stamping the items or finishing the run
+    db.payments.docs.append({**make_payment(db.eft_transaction_items.docs[0], "REF1"), "id": "earlier"})
+    db.eft_response_runs.docs.append({"key": "SEQ1:unpaid", "status": "running"})
+
+    summary = asyncio.run(ingestor.ingest("SEQ1:unpaid", RECORDS, paid, record_payments=True))
+
+    assert summary["paid"] == 3
+    assert sorted(p["invoice_id"] for p in db.payments.docs) == ["inv-1", "inv-2"]
+    assert [p["invoice_id"] for p in rollups.payments] == ["inv-2"]
+    run, = db.eft_response_runs.docs
+    assert run["status"] == "completed"
+
+
+def test_items_already_stamped_by_the_run_are_skipped(db, setup):
+    ingestor, rollups, debtors = setup
+    db.eft_transaction_items.docs[0]["response_key"] = "SEQ1:unpaid"
+
+    summary = asyncio.run(ingestor.ingest("SEQ1:unpaid", RECORDS, paid))
+
+    assert (summary["already_applied"], summary["applied"]) == (1, 3)
+    assert by_id(db.invoices)["inv-1"]["status"] == "pending"
+    # Debts are recalculated for it anyway, in case the interrupted run stopped first
+    assert debtors == [["m1", "m2"]]
+    assert db.payments.docs == []
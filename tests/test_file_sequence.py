@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from services.file_sequence import MAX_DAILY_SEQUENCE, FileSequenceAllocator
+
+
+def test_concurrent_allocations_get_consecutive_sequences(db):
+    allocator = FileSequenceAllocator(db)
+
+    async def allocate():
+        return await asyncio.gather(*(allocator.next("12345") for _ in range(5)))
+
+    sequences = asyncio.run(allocate())
+
+    today = datetime.now().strftime("%Y%m%d")
+    assert sorted(sequences) == [f"0000012345{today}{n:06d}" for n in range(1, 6)]
+    assert all(len(s) == 24 for s in sequences)
+
+
+def test_profiles_have_separate_counters(db):
+    allocator = FileSequenceAllocator(db)
+    asyncio.run(allocator.next("111"))
+    assert asyncio.run(allocator.next("222")).endswith("000001")
+    assert asyncio.run(allocator.next("111")).endswith("000002")
+
+
+def test_racing_first_allocation_retries_the_increment(db):
+    allocator = FileSequenceAllocator(db)
+    increment = allocator._increment
+    raced = []
+
+    async def racing_increment(key):
+        if not raced:
+            raced.append(key)
+            await increment(key)  # the other worker's upsert wins
+            raise DuplicateKeyError("E11000 duplicate key error", 11000)
+        return await increment(key)
+
+    allocator._increment = racing_increment
+    assert asyncio.run(allocator.next("12345")).endswith("000002")
+
+
+def test_daily_limit(db):
+    allocator = FileSequenceAllocator(db)
+    asyncio.run(allocator.next("12345"))
+    db.file_sequences.docs[0]["sequence"] = MAX_DAILY_SEQUENCE
+
+    with pytest.raises(ValueError):
+        asyncio.run(allocator.next("12345"))
+
+
+def test_first_allocation_follows_files_already_recorded_today(db):
+    today = datetime.now().strftime("%Y%m%d")
+    db.eft_transactions.docs.extend([
+        {"file_sequence": f"0000012345{today}093015"},
+        {"file_sequence": f"0000012345{today}141502"},
+        {"file_sequence": "000001234520200101235959"},
+        {"file_sequence": f"0000099999{today}235959"},
+    ])
+    allocator = FileSequenceAllocator(db)
+
+    assert asyncio.run(allocator.next("12345")) == f"0000012345{today}141503"
+    assert asyncio.run(allocator.next("12345")) == f"0000012345{today}141504"
+    # Seeding never lowers a counter that has moved past the recorded files
+    assert asyncio.run(FileSequenceAllocator(db).next("12345")) == f"0000012345{today}141505"
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+
+from executors import BoundedExecutor
+from services.geocoding import GeocodingService, geocode_address, geohash_encode, normalize_address
+
+PLACES = {
+    "12 main road claremont cape town": {
+        "lat": "-33.9806", "lon": "18.4653", "address": {"suburb": "Claremont", "city": "Cape Town"}
+    },
+}
+
+
+class StubNominatim(BaseHTTPRequestHandler):
+    """Nominatim /search: PLACES hits, [] misses, 503 for addresses containing "outage" """
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["q"][0]
+        if "outage" in query.lower():
+            self.send_response(503)
+            self.end_headers()
+            return
+        place = PLACES.get(normalize_address(query))
+        body = json.dumps([{**place, "display_name": query}] if place else []).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_nominatim(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubNominatim)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("NOMINATIM_DOMAIN", f"127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("NOMINATIM_SCHEME", "http")
+    yield
+    server.shutdown()
+
+
+class StubGeocoder:
+    """Geocoder callable with canned answers; raises for addresses in `failing`"""
+
+    def __init__(self, answers=None, failing=()):
+        self.answers = answers or {}
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, address):
+        self.calls.append(address)
+        if address in self.failing:
+            raise GeocoderTimedOut("stub timeout")
+        return self.answers.get(address, (None, None, None))
+
+
+def service(db, geocoder):
+    return GeocodingService(db, geocoder=geocoder, executor=BoundedExecutor("geocode-test", 2), min_interval=0)
+
+
+def test_geocode_address_against_stub_server(stub_nominatim):
+    assert geocode_address("12 Main Road, Claremont, Cape Town") == (-33.9806, 18.4653, "Claremont")
+    assert geocode_address("1 Nowhere Lane, Atlantis") == (None, None, None)
+    with pytest.raises(GeocoderServiceError):
+        geocode_address("5 Outage Street, Cape Town")
+
+
+def test_transient_failure_through_stub_server_is_not_cached(db, stub_nominatim):
+    geocoding = service(db, geocode_address)
+
+    with pytest.raises(GeocoderServiceError):
+        asyncio.run(geocoding.geocode("5 Outage Street, Cape Town"))
+    assert db.geocode_cache.docs == []
+
+    assert asyncio.run(geocoding.geocode("12 Main Road, Claremont, Cape Town"))["suburb"] == "Claremont"
+    assert asyncio.run(geocoding.geocode("1 Nowhere Lane, Atlantis")) is None
+    assert sorted(e["found"] for e in db.geocode_cache.docs) == [False, True]
+
+
+def test_results_are_cached_by_normalized_address(db):
+    geocoder = StubGeocoder({"12 Main Road, Claremont": (-33.98, 18.46, "Claremont")})
+    geocoding = service(db, geocoder)
+
+    first = asyncio.run(geocoding.geocode("12 Main Road, Claremont"))
+    second = asyncio.run(geocoding.geocode("12  MAIN road claremont!"))
+
+    assert first == {"latitude": -33.98, "longitude": 18.46, "suburb": "Claremont"}
+    assert second["latitude"] == -33.98
+    assert geocoder.calls == ["12 Main Road, Claremont"]
+    assert geocoding.cache_hits == 1
+
+
+def test_not_found_is_cached_for_the_shorter_ttl(db):
+    geocoding = service(db, StubGeocoder())
+
+    assert asyncio.run(geocoding.geocode("1 Nowhere Lane, Atlantis")) is None
+
+    entry, = db.geocode_cache.docs
+    assert entry["found"] is False
+    ttl = entry["expire_at"] - entry["updated_at"]
+    assert ttl == timedelta(days=geocoding.not_found_ttl_days)
+
+
+def test_geocoder_errors_are_not_cached(db):
+    geocoder = StubGeocoder({"12 Main Road, Claremont": (-33.98, 18.46, "Claremont")}, failing={"12 Main Road, Claremont"})
+    geocoding = service(db, geocoder)
+
+    with pytest.raises(GeocoderTimedOut):
+        asyncio.run(geocoding.geocode("12 Main Road, Claremont"))
+    assert db.geocode_cache.docs == []
+
+    # The geocoder recovers: the address is looked up again, not answered "not found" from the cache
+    geocoder.failing.clear()
+    assert asyncio.run(geocoding.geocode("12 Main Road, Claremont"))["suburb"] == "Claremont"
+    assert len(geocoder.calls) == 2
+
+
+def test_backfill_skips_failures_and_fills_location_fields(db):
+    db.members.docs.extend([
+        {"id": "m1", "address": "12 Main Road, Claremont", "latitude": None},
+        {"id": "m2", "address": "5 Outage Street, Cape Town", "latitude": None},
+        {"id": "m3", "address": "1 Nowhere Lane, Atlantis", "latitude": None},
+        {"id": "m4", "address": "7 Known Road", "latitude": -33.9, "longitude": 18.4},
+    ])
+    geocoder = StubGeocoder(
+        {"12 Main Road, Claremont": (-33.98, 18.46, "Claremont")},
+        failing={"5 Outage Street, Cape Town"}
+    )
+    geocoding = service(db, geocoder)
+
+    progress = asyncio.run(geocoding.backfill())
+
+    assert progress["status"] == "completed"
+    assert (progress["geohashed"], progress["geocoded"], progress["not_found"], progress["failed"]) == (1, 1, 1, 1)
+    members = {m["id"]: m for m in db.members.docs}
+    assert members["m1"]["geohash"] == geohash_encode(-33.98, 18.46)
+    assert members["m1"]["geo_suburb"] == "Claremont"
+    assert members["m2"]["latitude"] is None
+    assert members["m4"]["geohash"] == geohash_encode(-33.9, 18.4)
+    assert [e["key"] for e in db.geocode_cache.docs] == [
+        normalize_address("12 Main Road, Claremont"), normalize_address("1 Nowhere Lane, Atlantis")
+    ]
+
+
+def test_worker_writes_coordinates_back_to_the_member(db):
+    db.members.docs.append({"id": "m1", "address": "12 Main Road, Claremont"})
+    geocoding = service(db, StubGeocoder({"12 Main Road, Claremont": (-33.98, 18.46, "Claremont")}))
+
+    async def run():
+        geocoding.start()
+        geocoding.enqueue("m1", "12 Main Road, Claremont")
+        while geocoding.geocoded == 0:
+            await asyncio.sleep(0.01)
+        await geocoding.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    member = db.members.docs[0]
+    assert (member["latitude"], member["longitude"], member["geo_suburb"]) == (-33.98, 18.46, "Claremont")
+
+
+def test_ensure_cache_expiry_backfills_entries_without_expire_at(db):
+    written = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db.geocode_cache.docs.extend([
+        {"key": "found", "found": True, "updated_at": written},
+        {"key": "missing", "found": False, "updated_at": written},
+        {"key": "current", "found": True, "updated_at": written, "expire_at": written},
+    ])
+    geocoding = service(db, StubGeocoder())
+
+    assert asyncio.run(geocoding.ensure_cache_expiry()) == 2
+    assert asyncio.run(geocoding.ensure_cache_expiry()) == 0
+
+    expiry = {e["key"]: e["expire_at"] for e in db.geocode_cache.docs}
+    assert expiry == {
+        "found": written + timedelta(days=geocoding.cache_ttl_days),
+        "missing": written + timedelta(days=geocoding.not_found_ttl_days),
+        "current": written,
+    }
@@ -0,0 +1,106 @@
+import random
+from datetime import datetime, timedelta
+
+from ti_utils import InvoiceMatchIndex, TIService
+
+DAY = datetime(2026, 3, 10)
+
+
+def invoice(invoice_id, amount, due, member_id=None):
+    return {"id": invoice_id, "member_id": member_id or f"M-{invoice_id}", "amount": amount, "due_date": due.isoformat()}
+
+
+def test_reference_match_needs_the_amount_too():
+    index = InvoiceMatchIndex([invoice("INV-1001", 500, DAY), invoice("INV-1002", 500, DAY, member_id="MEM-77")])
+
+    assert index.by_reference(500, "PAYMENT INV-1001 THANKS") == 0
+    assert index.by_reference(400, "PAYMENT INV-1001 THANKS") is None
+    assert index.by_reference(502, "DEBIT MEM-77") == 1  # member id, within 1%
+    assert index.by_reference(500, "NO IDS HERE") is None
+
+
+def test_closest_due_date_within_the_window():
+    index = InvoiceMatchIndex([
+        invoice("A", 300, DAY - timedelta(days=3)),
+        invoice("B", 300, DAY + timedelta(days=1)),
+        invoice("C", 300, DAY + timedelta(days=5)),
+        invoice("D", 301, DAY),
+    ])
+
+    # D is on the day but its bucket is further from the amount: closest amount bucket first
+    assert index.by_amount_and_date(300, DAY) == 1
+    index.consume(1)
+    assert index.by_amount_and_date(300, DAY) == 0
+    index.consume(0)
+    # C is 5 days out, outside the window; D (within 1%) is next
+    assert index.by_amount_and_date(300, DAY) == 3
+    index.consume(3)
+    assert index.by_amount_and_date(300, DAY) is None
+    assert index.by_amount(300) == 2
+
+
+def test_amount_only_takes_the_oldest_unconsumed():
+    index = InvoiceMatchIndex([
+        invoice("A", 100, DAY + timedelta(days=20)),
+        invoice("B", 100, DAY),
+        invoice("C", 100, DAY + timedelta(days=10)),
+        {"id": "Z", "amount": 0},
+    ])
+
+    order = []
+    while (i := index.by_amount(100)) is not None:
+        order.append(index.consume(i)["id"])
+    assert order == ["B", "C", "A"]
+
+
+def brute_force_by_date(invoices, consumed, amount, when):
+    best = None
+    for i, inv in enumerate(invoices):
+        if consumed[i] or abs(amount - inv["amount"]) / inv["amount"] >= 0.01:
+            continue
+        days = abs((when - datetime.fromisoformat(inv["due_date"])).days)
+        if days <= 3:
+            key = (abs(inv["amount"] * 100 - amount * 100), days)
+            if best is None or key < best[0]:
+                best = (key, i)
+    return best
+
+
+def test_date_search_agrees_with_a_scan_as_invoices_are_consumed():
+    rng = random.Random(7)
+    invoices = [
+        invoice(f"I{i}", rng.choice([100, 150, 200]), DAY + timedelta(days=rng.randint(-15, 15), hours=rng.randint(0, 23)))
+        for i in range(300)
+    ]
+    index = InvoiceMatchIndex(invoices)
+
+    for _ in range(400):
+        amount = rng.choice([100, 150, 200])
+        when = DAY + timedelta(days=rng.randint(-15, 15))
+        expected = brute_force_by_date(invoices, index.consumed, amount, when)
+        found = index.by_amount_and_date(amount, when)
+        if expected is None:
+            assert found is None
+            continue
+        # Ties on distance may pick either invoice; the distance must be the best one
+        assert found is not None and not index.consumed[found]
+        assert abs((when - index.due[found]).days) == expected[0][1]
+        index.consume(found)
+
+
+def test_reconcile_is_one_to_one_and_prefers_reference_matches():
+    service = TIService({"mock_mode": True})
+    invoices = [invoice("INV-1", 250, DAY), invoice("INV-2", 250, DAY)]
+    transactions = [
+        {"amount": 250, "date": "2026-03-10", "reference": "EFT PAYMENT"},
+        {"amount": 250, "date": "2026-03-10", "reference": "inv-2 ref"},
+        {"amount": 250, "date": "2026-03-10", "reference": "EFT PAYMENT"},
+        {"amount": 250, "date": "2026-03-10", "reference": "INV-2", "is_debit": True},
+    ]
+
+    result = service.reconcile_transactions(transactions, invoices)
+
+    matched = {m["invoice"]["id"]: (m["transaction"]["reference"], m["match_confidence"]) for m in result["matched"]}
+    assert matched == {"INV-2": ("inv-2 ref", "high"), "INV-1": ("EFT PAYMENT", "medium")}
+    assert len(result["unmatched"]) == 1
+    assert result["summary"]["total_transactions"] == 3
@@ -0,0 +1,63 @@
+import asyncio
+import io
+
+from services.member_import import MemberImporter
+
+MAPPING = {"first_name": "Name", "email": "Email", "phone": "Phone"}
+
+
+def blocked_attempt(member_data, keys, duplicate, field):
+    return {"attempted_email": member_data.get("email"), "duplicate_id": duplicate["id"], "field": field}
+
+
+def csv_file(*rows):
+    lines = ["Name,Email,Phone"] + [",".join(row) for row in rows]
+    return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+
+def start_import(db, file, duplicate_action="skip", chunk_size=2):
+    db.import_logs.docs.append({"id": "log-1", "status": "processing"})
+    importer = MemberImporter(db, blocked_attempt, chunk_size=chunk_size)
+
+    async def run():
+        return await importer.start(file, MAPPING, duplicate_action, "log-1")
+
+    return asyncio.run(run())
+
+
+def test_duplicates_in_earlier_chunks_are_found_in_the_database(db):
+    result = start_import(db, csv_file(
+        ("Ann Smith", "ann@example.com", ""),
+        ("Bob Jones", "bob@example.com", ""),
+        ("Cat Brown", "cat@example.com", ""),
+        # Third chunk: duplicates of members inserted by the first two
+        ("Annie Smith", "ANN@example.com", ""),
+        ("Cat Brown", "", ""),
+    ))
+
+    assert (result["successful"], result["skipped"], result["total_rows"]) == (3, 2, 5)
+    assert sorted(m["email"] for m in db.members.docs) == ["ann@example.com", "bob@example.com", "cat@example.com"]
+    assert sorted(b["field"] for b in db.blocked_member_attempts.docs) == ["email", "name"]
+
+    log, = db.import_logs.docs
+    assert log["status"] == "completed"
+    assert (log["total_rows"], log["successful_rows"], log["skipped_rows"]) == (5, 3, 2)
+
+
+def test_updates_within_a_chunk_go_into_the_pending_insert(db):
+    start_import(db, csv_file(
+        ("Ann Smith", "ann@example.com", ""),
+        ("Ann Smith", "ann@example.com", "0821234567"),
+    ), duplicate_action="update")
+
+    member, = db.members.docs
+    assert member["phone"] == "0821234567"
+
+
+def test_failed_import_is_recorded_on_the_log(db):
+    result = start_import(db, io.BytesIO(b"Name,Email\n\xff\xfe broken\n"))
+
+    assert result is None
+    log, = db.import_logs.docs
+    assert log["status"] == "failed"
+    assert "decode" in log["error"]
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import paginate
+
+
+def test_pages_follow_the_cursor_without_gaps_or_repeats(db):
+    db.invoices.docs.extend(
+        {"id": f"inv-{i:02d}", "created_at": f"2026-01-{i % 5 + 1:02d}T00:00:00"} for i in range(12)
+    )
+    seen, cursor = [], None
+    while True:
+        page, cursor = asyncio.run(paginate(db.invoices, {}, "created_at", 5, cursor))
+        seen.extend(doc["id"] for doc in page)
+        if cursor is None:
+            break
+
+    expected = sorted(db.invoices.docs, key=lambda d: (d["created_at"], d["id"]), reverse=True)
+    assert seen == [doc["id"] for doc in expected]
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_limit_below_one_is_rejected(db, limit):
+    db.invoices.docs.append({"id": "inv-1", "created_at": "2026-01-01T00:00:00"})
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(paginate(db.invoices, {}, "created_at", limit))
+    assert exc.value.status_code == 400
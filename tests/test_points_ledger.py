@@ -0,0 +1,50 @@
+import asyncio
+
+from services import points_ledger as ledger_module
+from services.points_ledger import PointsLedger
+
+
+def balances(db):
+    return {b["member_id"]: b["total_points"] for b in db.points_balances.docs}
+
+
+def test_retried_batch_does_not_award_twice(db):
+    ledger = PointsLedger(db)
+    batch = [
+        ledger.transaction("m1", 5, "Check-in reward", transaction_id="t1"),
+        ledger.transaction("m1", 5, "Check-in reward", transaction_id="t2"),
+        ledger.transaction("m2", 5, "Check-in reward", transaction_id="t3"),
+    ]
+
+    asyncio.run(ledger.award_many(batch))
+    # Written again, e.g. after a cancelled flush, together with a new transaction
+    asyncio.run(ledger.award_many(batch + [ledger.transaction("m2", 5, "Check-in reward", transaction_id="t4")]))
+
+    assert balances(db) == {"m1": 10, "m2": 10}
+    assert sorted(t["id"] for t in db.points_transactions.docs) == ["t1", "t2", "t3", "t4"]
+
+
+def test_balance_written_but_history_missing_is_completed_on_retry(db):
+    ledger = PointsLedger(db)
+    batch = [ledger.transaction("m1", 5, "Check-in reward", transaction_id="t1")]
+    asyncio.run(ledger.award_many(batch))
+    db.points_transactions.docs.clear()
+
+    asyncio.run(ledger.award_many(batch))
+
+    assert balances(db) == {"m1": 5}
+    assert [t["id"] for t in db.points_transactions.docs] == ["t1"]
+
+
+def test_recent_ids_are_bounded_and_hidden_from_balance_reads(db, monkeypatch):
+    monkeypatch.setattr(ledger_module, "RECENT_TRANSACTION_IDS", 2)
+    ledger = PointsLedger(db)
+    asyncio.run(ledger.award_many([
+        ledger.transaction("m1", 1, "Check-in reward", transaction_id=f"t{n}") for n in range(4)
+    ]))
+
+    assert db.points_balances.docs[0]["recent_transaction_ids"] == ["t2", "t3"]
+    balance = asyncio.run(ledger.get_balance("m1"))
+    assert balance["total_points"] == 4
+    assert "recent_transaction_ids" not in balance
+    assert "recent_transaction_ids" not in asyncio.run(ledger.leaderboard())[0]
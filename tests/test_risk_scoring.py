@@ -0,0 +1,72 @@
+import asyncio
+
+from services.access_control import AccessEventWriter
+from services.points_ledger import PointsLedger
+from services.risk_scoring import MemberRiskEngine
+from services.rollups import RollupService
+
+
+def counting_loads(engine):
+    """Wrap engine._load to count how often the scored table is rebuilt"""
+    loads = []
+    load = engine._load
+
+    async def counted(now):
+        loads.append(now)
+        return await load(now)
+
+    engine._load = counted
+    return loads
+
+
+def test_scored_table_is_cached_until_invalidated(db):
+    db.members.docs.append({"id": "m1", "first_name": "Ann", "membership_status": "active"})
+    engine = MemberRiskEngine(db)
+    loads = counting_loads(engine)
+
+    async def run():
+        await engine.scored_table()
+        await engine.scored_table()
+        engine.invalidate()
+        await engine.scored_table()
+
+    asyncio.run(run())
+    assert len(loads) == 2
+
+
+def test_table_loaded_across_an_invalidation_is_not_cached(db):
+    engine = MemberRiskEngine(db)
+    loads = counting_loads(engine)
+    load = engine._load
+
+    async def invalidated_mid_load(now):
+        table = await load(now)
+        engine.invalidate()
+        return table
+
+    engine._load = invalidated_mid_load
+
+    async def run():
+        await engine.scored_table()
+        engine._load = load
+        await engine.scored_table()
+
+    asyncio.run(run())
+    assert len(loads) == 2
+
+
+def test_access_event_batches_invalidate_the_scores(db):
+    engine = MemberRiskEngine(db)
+    writer = AccessEventWriter(db, RollupService(db), PointsLedger(db), risk_engine=engine)
+    loads = counting_loads(engine)
+
+    async def run():
+        await engine.scored_table()
+        await writer.submit({"access_log": {
+            "id": "a1", "member_id": "m1", "timestamp": "2026-10-01T06:00:00+00:00", "status": "granted"
+        }})
+        await engine.scored_table()
+
+    asyncio.run(run())
+    assert len(loads) == 2
+    assert [log["id"] for log in db.access_logs.docs] == ["a1"]
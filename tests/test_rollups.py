@@ -0,0 +1,31 @@
+import asyncio
+
+from services.rollups import CHECKIN_ROLLUP, REVENUE_ROLLUP, RollupService
+
+
+def test_checkins_are_counted_by_day_hour_location_and_status(db):
+    rollups = RollupService(db)
+
+    asyncio.run(rollups.record_checkins([
+        ("2026-10-01T06:15:00+00:00", "Main entrance", "granted"),
+        ("2026-10-01T06:40:00+00:00", "Main entrance", "granted"),
+        ("2026-10-01T18:05:00+00:00", None, "denied"),
+    ]))
+    asyncio.run(rollups.record_checkin("2026-10-02T06:00:00+00:00", "Main entrance", "granted"))
+
+    rows = asyncio.run(rollups.rows(CHECKIN_ROLLUP, "2026-10-01", "2026-10-01", {"status": "granted"}))
+    assert rows == [{"date": "2026-10-01", "hour": 6, "location": "Main entrance", "status": "granted", "count": 2}]
+    assert len(asyncio.run(rollups.rows(CHECKIN_ROLLUP, "2026-10-01", "2026-10-02"))) == 3
+
+
+def test_totals_sum_rows_in_an_open_or_closed_date_range(db):
+    rollups = RollupService(db)
+    for day, amount in (("2026-09-01", 100.0), ("2026-10-01", 250.0), ("2026-10-15", 50.0)):
+        asyncio.run(rollups.record_payment(amount, f"{day}T10:00:00+00:00", "mt1", "debit_order", "walk_in"))
+
+    assert asyncio.run(rollups.totals(REVENUE_ROLLUP, ["amount", "payments"])) == {"amount": 400.0, "payments": 3}
+    assert asyncio.run(rollups.totals(REVENUE_ROLLUP, ["amount"], start_date="2026-10-01")) == {"amount": 300.0}
+    assert asyncio.run(rollups.totals(
+        REVENUE_ROLLUP, ["amount"], start_date="2026-09-01", end_date="2026-09-30"
+    )) == {"amount": 100.0}
+    assert asyncio.run(rollups.totals(CHECKIN_ROLLUP, ["count"], filters={"status": "granted"})) == {"count": 0}
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from services.sales_performance import comparison_periods, parse_period_date
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+
+def test_date_only_start_is_compared_with_the_period_before_it():
+    current_start, current_end, previous_start, previous_end = comparison_periods("2026-10-01", None, NOW)
+
+    assert current_start == datetime(2026, 10, 1, tzinfo=timezone.utc)
+    assert current_end == NOW
+    assert previous_end == current_start
+    assert previous_start == datetime(2026, 9, 14, 12, 0, tzinfo=timezone.utc)
+    # The bounds are compared with stored ISO strings such as join_date
+    assert current_start.isoformat() == "2026-10-01T00:00:00+00:00"
+
+
+def test_explicit_end_and_offsets_are_kept():
+    current_start, current_end, previous_start, _ = comparison_periods(
+        "2026-10-01T00:00:00Z", "2026-10-08", NOW
+    )
+
+    assert current_end == datetime(2026, 10, 8, tzinfo=timezone.utc)
+    assert previous_start == datetime(2026, 9, 24, tzinfo=timezone.utc)
+    assert parse_period_date("2026-10-01T02:00:00+02:00") == current_start
+
+
+def test_malformed_dates_raise_value_error():
+    with pytest.raises(ValueError):
+        comparison_periods("01/10/2026", None, NOW)
+    with pytest.raises(ValueError):
+        comparison_periods("2026-10-01", "next week", NOW)